@@ -0,0 +1,102 @@
+"""
+Controle de admissão dos turnos da API.
+
+No máximo `max_active` turnos do grafo rodam ao mesmo tempo; os seguintes
+esperam numa fila limitada (`max_queue`) por até `max_wait` segundos. Fila
+cheia ou espera estourada não viram timeout nem HTTP 500: o chamador recebe
+`False` e responde na hora com a mensagem degradada.
+
+Torcedores com intenção de compra (`intent_is_sale`) têm prioridade: passam
+na frente na fila e, com a fila cheia, tomam o lugar do último torcedor sem
+prioridade que está esperando.
+"""
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from typing import List, Tuple
+
+
+class AdmissionController:
+    def __init__(self, max_active: int = 32, max_queue: int = 64, max_wait: float = 8.0):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        # (0 = prioridade / 1 = normal, ordem de chegada, future)
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.stats = {"admitidos": 0, "admitidos_prioridade": 0, "enfileirados": 0, "recusados_fila_cheia": 0,
+                      "recusados_espera": 0, "desalojados": 0}
+
+    @property
+    def busy(self) -> bool:
+        """Sem vaga livre: o próximo turno vai para a fila (vale a pena checar a prioridade)."""
+        return self.active >= self.max_active or bool(self._waiting())
+
+    def _waiting(self) -> List[Tuple[int, int, asyncio.Future]]:
+        return [w for w in self._queue if not w[2].done()]
+
+    def _evict_last_normal(self) -> bool:
+        """Fila cheia e chegou prioridade: o último sem prioridade sai (resposta degradada)."""
+        normal = [w for w in self._waiting() if w[0] == 1]
+        if not normal:
+            return False
+        victim = max(normal, key=lambda w: w[1])
+        victim[2].set_result(False)
+        self.stats["desalojados"] += 1
+        return True
+
+    def _wake_next(self):
+        """Passa a vaga liberada para o próximo da fila (prioridade primeiro)."""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active -= 1
+
+    async def _admit(self, priority: bool) -> bool:
+        if self.active < self.max_active and not self._waiting():
+            self.active += 1
+            return True
+        if len(self._waiting()) >= self.max_queue and not (priority and self._evict_last_normal()):
+            self.stats["recusados_fila_cheia"] += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (0 if priority else 1, next(self._seq), future))
+        self.stats["enfileirados"] += 1
+        try:
+            admitted = await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and future.result():
+                # A vaga chegou junto com o timeout: aproveita
+                return True
+            future.cancel()
+            self.stats["recusados_espera"] += 1
+            return False
+        except asyncio.CancelledError:
+            if future.done() and future.result():
+                self._wake_next()
+            else:
+                future.cancel()
+            raise
+        return admitted
+
+    @asynccontextmanager
+    async def slot(self, priority: bool = False):
+        """`async with admission.slot(prioridade) as admitido:` (admitido=False: responder degradado)."""
+        admitted = await self._admit(priority)
+        if not admitted:
+            yield False
+            return
+        self.stats["admitidos"] += 1
+        if priority:
+            self.stats["admitidos_prioridade"] += 1
+        try:
+            yield True
+        finally:
+            self._wake_next()
+
+    def metrics(self):
+        return {**self.stats, "ativos": self.active, "na_fila": len(self._waiting())}
@@ -1,27 +1,203 @@
+import asyncio
 import os
 import operator
-from typing import Annotated, List, TypedDict, Union, Optional
+import time
+from typing import TYPE_CHECKING, Annotated, List, Literal, TypedDict, Union, Optional
 from dotenv import load_dotenv
 
 # LangChain / LangGraph imports
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import SupabaseVectorStore
-from supabase.client import create_client
+# (langchain_openai e supabase são importados só quando o cliente é criado)
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage, RemoveMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, END, START
-from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt import InjectedState, ToolNode
 from langgraph.graph.message import add_messages
-from langchain_community.tools.tavily_search import TavilySearchResults
+from src.answer_cache import SemanticAnswerCache, chunk_hash, is_self_contained
+from src.checkpoint import build_checkpointer
+from src.club_facts import ClubFactsTable, build_club_facts, format_facts
+from src.context_builder import build_context_builder
+from src.embedding_cache import build_cached_embeddings
+from src.grader import build_grader
+from src.instrumentation import setup_instrumentation
+from src.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from src.shared_state import MemorySharedState, build_shared_state
+from src.store_search import StoreSearchCache, TavilySearchClient
+from src.summarizer import ConversationSummarizer
+from src.lead_tracker import LeadOutbox, LeadTracker
+from src.models import ModelRegistry, load_specs
+from src.rate_limiter import RateLimitCallback, TokenBucketLimiter
+from src.speculative import SpeculativeRetrieval
+from src.vector_index import LocalVectorIndex
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+    from supabase import AsyncClient
 
 load_dotenv()
 
 # --- 1. Configuração de Clientes ---
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-llm = ChatOpenAI(model="gpt-4o", temperature=0.7)
+# Todos criados na primeira chamada: importar o módulo não exige credenciais
+# nem paga o import do SDK da OpenAI (visualize_graph, testes, boot dos workers).
+# Os clientes HTTP de OpenAI, Supabase e Tavily saem do pool do processo (src/http_pool.py).
+
+# Workers da API (processos): cada um tem seus clientes e fica com uma fração dos limites da conta
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# Caches e locks que valem entre os workers (src/shared_state.py). Com o backend
+# memory (um worker só) os caches e locks locais já bastam: nada é duplicado.
+# Criar o backend não abre conexão nem arquivo: isso fica para o primeiro uso
+shared_state = build_shared_state()
+cross_worker_state = None if isinstance(shared_state, MemorySharedState) else shared_state
+
+# Lock do turno por whatsapp_id (vale entre workers com o backend sqlite/redis); expira
+# sozinho se o worker morrer no meio do turno
+SESSION_LOCK_TTL_SECONDS = float(os.getenv("SESSION_LOCK_TTL_SECONDS", "120"))
+
+def turn_lock(whatsapp_id: str):
+    """
+    Um turno por conversa por vez. O que lê e regrava o checkpoint da conversa
+    fora do turno (lead tracker, resumo em segundo plano) também passa por aqui,
+    senão o snapshot salvo no fim do turno e a escrita em segundo plano se sobrescrevem.
+    """
+    return shared_state.lock(f"turno:{whatsapp_id}", SESSION_LOCK_TTL_SECONDS)
+
+# Limites da conta na OpenAI (RPM/TPM por minuto; 0 desliga), compartilhados por
+# todas as chamadas de LLM e embeddings deste processo
+openai_limiter = TokenBucketLimiter(
+    rpm=float(os.getenv("OPENAI_RPM", "3000")) / WEB_CONCURRENCY,
+    tpm=float(os.getenv("OPENAI_TPM", "250000")) / WEB_CONCURRENCY,
+    backoff=float(os.getenv("OPENAI_RATE_LIMIT_BACKOFF", "2")),
+)
+
+_embeddings: Optional["Embeddings"] = None
+
+def get_embeddings() -> "Embeddings":
+    """Embeddings com cache (mesmo cache em disco usado pela ingestão)."""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = build_cached_embeddings("text-embedding-3-small", rate_limiter=openai_limiter)
+    return _embeddings
+
+# Modelos por papel (src/models.py): GPT-4o só no que o torcedor lê, modelo pequeno no resto
+models = ModelRegistry(load_specs(), callbacks=[RateLimitCallback(openai_limiter)])
+
+# Cliente assíncrono do Supabase: criado na primeira chamada, dentro do event loop
+_supabase: Optional["AsyncClient"] = None
+
+async def get_supabase() -> "AsyncClient":
+    """Retorna o cliente assíncrono do Supabase, criando-o na primeira chamada."""
+    global _supabase
+    if _supabase is None:
+        from supabase import AsyncClientOptions, acreate_client
+        from src.http_pool import get_http_client
+        _supabase = await acreate_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"),
+                                         options=AsyncClientOptions(httpx_client=get_http_client("supabase")))
+    return _supabase
+
+# --- Configuração da Busca Vetorial ---
+# RETRIEVAL_BACKEND: "supabase" (RPC match_documents) ou "local" (índice em processo, com RPC de fallback)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "supabase").lower()
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "0.5"))
+MATCH_COUNT = int(os.getenv("MATCH_COUNT", "3"))
+VECTOR_INDEX_REFRESH_SECONDS = float(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "300"))
+# Busca híbrida: BM25 local fundido com o vetor por Reciprocal Rank Fusion
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Montagem do contexto (src/context_builder.py): candidatos da busca antes da mescla/MMR
+# e orçamento de tokens de contexto por nó (0 = sem limite)
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "6"))
+GRADER_CONTEXT_TOKENS = int(os.getenv("GRADER_CONTEXT_TOKENS", "200"))
+ANSWER_CONTEXT_TOKENS = int(os.getenv("ANSWER_CONTEXT_TOKENS", "400"))
+context_builder = build_context_builder()
+
+_vector_index: Optional[LocalVectorIndex] = None
+
+def get_vector_index() -> LocalVectorIndex:
+    """Índice vetorial local, carregado do disco na primeira chamada."""
+    global _vector_index
+    if _vector_index is None:
+        _vector_index = LocalVectorIndex(os.getenv("VECTOR_INDEX_DIR", ".cache/vector_index"))
+    return _vector_index
+
+_lexical_index: Optional[LexicalIndex] = None
+
+def get_lexical_index() -> LexicalIndex:
+    """Índice BM25 local, carregado do disco na primeira chamada."""
+    global _lexical_index
+    if _lexical_index is None:
+        _lexical_index = LexicalIndex(os.getenv("LEXICAL_INDEX_DIR", ".cache/lexical_index"))
+    return _lexical_index
+
+async def vector_search(query_embedding: List[float], match_count: int = MATCH_COUNT,
+                        match_threshold: float = MATCH_THRESHOLD) -> List[dict]:
+    """Top-k documentos por similaridade, no índice local ou via RPC no Supabase."""
+    if RETRIEVAL_BACKEND == "local":
+        index = get_vector_index()
+        index.schedule_refresh(get_supabase, VECTOR_INDEX_REFRESH_SECONDS)
+        # Índice ainda vazio (primeiro snapshot em andamento): cai no RPC
+        if len(index):
+            return index.search(query_embedding, match_count, match_threshold)
+
+    supabase = await get_supabase()
+    rpc_res = await supabase.rpc("match_documents", {
+        "query_embedding": query_embedding,
+        "match_threshold": match_threshold,
+        "match_count": match_count
+    }).execute()
+    return rpc_res.data or []
+
+async def match_documents(query_embedding: List[float], match_count: int = MATCH_COUNT,
+                          match_threshold: float = MATCH_THRESHOLD, query_text: Optional[str] = None) -> List[dict]:
+    """Busca vetorial, fundida com o BM25 local (RRF) quando há texto da query e o índice lexical não está vazio."""
+    if HYBRID_RETRIEVAL and query_text:
+        lexical = get_lexical_index()
+        lexical.schedule_refresh(get_supabase, VECTOR_INDEX_REFRESH_SECONDS)
+        if len(lexical):
+            candidates = max(match_count, HYBRID_CANDIDATES)
+            vector_docs = await vector_search(query_embedding, candidates, match_threshold)
+            lexical_docs = lexical.search(query_text, candidates)
+            return reciprocal_rank_fusion([vector_docs, lexical_docs], RRF_K)[:match_count]
+    return await vector_search(query_embedding, match_count, match_threshold)
+
+# --- Fatos Estruturados (planos e jogos extraídos pela ingestão) ---
+CLUB_FACTS_ENABLED = os.getenv("CLUB_FACTS_ENABLED", "true").lower() == "true"
+# A ingestão publica no Supabase; cada worker puxa de novo quando o snapshot passa desta idade
+CLUB_FACTS_REFRESH_SECONDS = float(os.getenv("CLUB_FACTS_REFRESH_SECONDS", "300"))
+
+_club_facts: Optional[ClubFactsTable] = None
+
+def get_club_facts() -> ClubFactsTable:
+    """Snapshot local da tabela de fatos do clube (puxado do Supabase), aberto na primeira chamada."""
+    global _club_facts
+    if _club_facts is None:
+        _club_facts = build_club_facts()
+    return _club_facts
+
+# --- Cache Semântico de Respostas ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+answer_cache = SemanticAnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+    shared=cross_worker_state,
+)
+# Perguntas com menos palavras que isso ("quanto custa?") dependem da conversa: fora do cache
+ANSWER_CACHE_MIN_WORDS = int(os.getenv("ANSWER_CACHE_MIN_WORDS", "4"))
+
+async def chunks_unchanged(hashes: List[str]) -> bool:
+    """True se todos os trechos usados numa resposta ainda estão no conhecimento_clube."""
+    if not hashes:
+        return False
+    try:
+        supabase = await get_supabase()
+        res = await supabase.table("conhecimento_clube").select("chunk_hash").in_("chunk_hash", hashes).execute()
+        return {row["chunk_hash"] for row in res.data or []} >= set(hashes)
+    except Exception as e:
+        print(f"Erro ao validar cache de resposta: {e}")
+        return False
 
 # --- 2. Definição do Estado ---
 class AgentState(TypedDict):
@@ -31,53 +207,152 @@ class AgentState(TypedDict):
     intent_is_sale: bool
     nome_torcedor: Optional[str]
     plano_interesse: Optional[str]
+    pergunta: str  # mensagem do torcedor neste turno (chave do cache de respostas)
+    resumo: str  # resumo rolante das mensagens que já saíram do histórico
+    inicio_turno: float  # perf_counter do início do turno (latência que um acerto no cache economiza)
     # Estado interno para controle de fluxo
     loop_step: Annotated[int, operator.add] 
 
 # --- 3. Ferramentas (Tools) ---
-@tool("retrieve_docs")
-def retrieve_docs(query: str):
+# As tools pedidas juntas pelo agent rodam em paralelo no ToolNode; cada uma tem
+# seu limite de tempo para uma busca lenta não segurar a resposta inteira
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "10"))
+# Busca no conhecimento_clube começando junto com o router (src/speculative.py)
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+# Mensagens curtas ("Oi", "Valeu") quase nunca viram busca: não especula
+SPECULATIVE_MIN_WORDS = int(os.getenv("SPECULATIVE_MIN_WORDS", "3"))
+
+async def retrieve_context(query: str):
+    """(contexto concatenado, documentos) da busca híbrida para a query."""
+    # Gera embedding da query
+    query_embedding = await get_embeddings().aembed_query(query)
+    
+    # Busca híbrida (vetor + BM25 local), com folga de candidatos para a mescla e o MMR
+    candidates = await match_documents(query_embedding, max(MATCH_COUNT, CONTEXT_CANDIDATES), query_text=query)
+    docs = context_builder.build(candidates, MATCH_COUNT)
+    
+    if not docs:
+        return "Nenhuma informação relevante encontrada no banco de dados.", []
+        
+    # Trechos mesclados, dentro do orçamento da resposta (os documentos vão como artifact
+    # para o grader e o cache de respostas)
+    passages = context_builder.fit([item['conteudo'] for item in docs], ANSWER_CONTEXT_TOKENS)
+    return "\n\n".join(passages), docs
+
+speculative = SpeculativeRetrieval(retrieve_context)
+
+async def _retrieve(query: str, whatsapp_id: str):
+    result = await speculative.take(whatsapp_id, query) if whatsapp_id else None
+    return result if result is not None else await retrieve_context(query)
+
+async def search_knowledge(query: str, whatsapp_id: str, tool_name: str = "retrieve_docs"):
+    """Busca no conhecimento_clube com o limite de tempo das tools: (contexto, documentos)."""
+    try:
+        # Reaproveita a busca especulativa iniciada junto com o router, se for a mesma query
+        return await asyncio.wait_for(_retrieve(query, whatsapp_id), TOOL_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"⏱️ {tool_name} passou de {TOOL_TIMEOUT_SECONDS}s: '{query}'")
+        return "Erro ao acessar banco de dados: tempo esgotado.", []
+    except Exception as e:
+        return f"Erro ao acessar banco de dados: {str(e)}", []
+
+@tool("retrieve_docs", response_format="content_and_artifact")
+async def retrieve_docs(query: str, whatsapp_id: Annotated[str, InjectedState("whatsapp_id")] = ""):
     """
     Busca documentos relevantes sobre o Maringá FC, planos de sócio (Maringá Paixão) e jogos.
     Use esta ferramenta para responder perguntas sobre valores, benefícios, datas de jogos e informações institucionais.
     """
+    return await search_knowledge(query, whatsapp_id)
+
+@tool("lookup_club_facts", response_format="content_and_artifact")
+async def lookup_club_facts(query: str, kind: Optional[Literal["plano", "jogo"]] = None,
+                            whatsapp_id: Annotated[str, InjectedState("whatsapp_id")] = ""):
+    """
+    Consulta rápida na tabela de fatos do clube: planos de sócio (nome, preço e benefícios, ex.: Maringá Paixão)
+    e próximos jogos (data, horário, adversário e local).
+    Use esta ferramenta (em vez de 'retrieve_docs') para preço/benefícios do sócio e para o próximo jogo.
+    `kind`: "plano" ou "jogo".
+    """
     try:
-        # Gera embedding da query
-        query_embedding = embeddings.embed_query(query)
-        
-        # Chama RPC no Supabase
-        rpc_res = supabase.rpc("match_documents", {
-            "query_embedding": query_embedding,
-            "match_threshold": 0.5,
-            "match_count": 3
-        }).execute()
-        
-        if not rpc_res.data:
-            return "Nenhuma informação relevante encontrada no banco de dados."
-            
-        # Concatena os resultados
-        context = "\n\n".join([item['conteudo'] for item in rpc_res.data])
-        return context
+        table = get_club_facts()
+        table.schedule_refresh(get_supabase, CLUB_FACTS_REFRESH_SECONDS)
+        facts = table.lookup(query, kind)
     except Exception as e:
-        return f"Erro ao acessar banco de dados: {str(e)}"
+        print(f"Erro na tabela de fatos: {e}")
+        facts = []
+    if facts:
+        return format_facts(facts), facts
+    # A tabela não tem o fato: mesma busca do retrieve_docs (reaproveita a especulativa)
+    return await search_knowledge(query, whatsapp_id, "lookup_club_facts")
+
+def is_fact_result(message: ToolMessage) -> bool:
+    """ToolMessage respondida pela tabela de fatos (não pela busca de fallback)."""
+    return (message.name == "lookup_club_facts" and bool(message.artifact)
+            and all("tipo" in record and "conteudo" not in record for record in message.artifact))
 
 # --- Nova Ferramenta de Busca na Loja ---
+STORE_DOMAIN = "store.maringafc.com"
+# Páginas da loja indexadas na base local (python -m src.ingestion_web --url https://store.maringafc.com/)
+STORE_LOCAL_FIRST = os.getenv("STORE_LOCAL_FIRST", "true").lower() == "true"
+
+_tavily = None
+
+async def tavily_store_search(query: str):
+    """Busca ao vivo na loja (cliente Tavily criado uma vez e reaproveitado)."""
+    global _tavily
+    if _tavily is None:
+        from src.http_pool import get_http_client
+        _tavily = TavilySearchClient(
+            lambda: get_http_client("tavily"),
+            max_results=3,
+            search_depth="advanced",
+            include_domains=[STORE_DOMAIN] # Restringe a busca apenas à loja oficial
+        )
+    return await _tavily.ainvoke(query)
+
+store_search_cache = StoreSearchCache(
+    tavily_store_search,
+    ttl=float(os.getenv("STORE_SEARCH_TTL", "21600")),
+    stale_ttl=float(os.getenv("STORE_SEARCH_STALE_TTL", "86400")),
+    max_entries=int(os.getenv("STORE_SEARCH_CACHE_SIZE", "500")),
+    shared=cross_worker_state,
+)
+
+async def local_store_docs(query: str) -> List[dict]:
+    """Páginas de produto da loja que já estão na base de conhecimento."""
+    query_embedding = await get_embeddings().aembed_query(query)
+    docs = await match_documents(query_embedding, max(MATCH_COUNT, HYBRID_CANDIDATES), query_text=query)
+    store_docs = [d for d in docs if STORE_DOMAIN in (d.get("fonte_url") or "")]
+    return [{"url": d["fonte_url"], "content": d["conteudo"]} for d in store_docs[:3]]
+
+async def store_results(query: str):
+    if STORE_LOCAL_FIRST:
+        try:
+            local = await local_store_docs(query)
+            if local:
+                return local
+        except Exception as e:
+            print(f"Erro na busca local da loja: {e}")
+    # Busca ao vivo, com cache TTL + stale-while-revalidate e requisições coalescidas
+    return await store_search_cache.get(query)
+
 @tool("search_store")
-def search_store(query: str):
+async def search_store(query: str):
     """
     Busca produtos, preços e disponibilidade diretamente na loja oficial do Maringá FC.
     Use esta ferramenta SEMPRE que o usuário perguntar sobre camisas, acessórios ou produtos físicos.
     URL Base: https://store.maringafc.com/
     """
-    search = TavilySearchResults(
-        max_results=3,
-        search_depth="advanced",
-        include_domains=["store.maringafc.com"] # Restringe a busca apenas à loja oficial
-    )
-    return search.invoke(query)
+    try:
+        return await asyncio.wait_for(store_results(query), TOOL_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"⏱️ search_store passou de {TOOL_TIMEOUT_SECONDS}s: '{query}'")
+        return "Não consegui consultar a loja agora (tempo esgotado)."
 
 # Lista de ferramentas disponíveis para o agente
-tools = [retrieve_docs, search_store]
+tools = [retrieve_docs, search_store] + ([lookup_club_facts] if CLUB_FACTS_ENABLED else [])
+# Tools que buscam no conhecimento_clube (aproveitam a busca especulativa)
+KNOWLEDGE_TOOLS = ("retrieve_docs", "lookup_club_facts")
 tool_node = ToolNode(tools)
 
 # --- 4. Funções de Apoio (Nodes) ---
@@ -86,33 +361,123 @@ def parse_messages(messages):
     """Formata mensagens para string (uso em prompts)."""
     return "\n".join([f"{m.type}: {m.content}" for m in messages])
 
+# --- Resumo da Conversa (orçamento de tokens) ---
+async def summarize_history(previous: str, transcript: str) -> str:
+    """Resumo rolante: resumo anterior + só as mensagens que saíram do histórico."""
+    prompt = f"""Atualize o resumo da conversa entre Torcedor e Dogão (SDR Maringá FC).
+    Mantenha nome, plano de interesse, dúvidas já respondidas e objeções. Até 120 palavras, só o resumo.
+
+    RESUMO ATUAL:
+    {previous or "(sem resumo)"}
+
+    NOVAS MENSAGENS:
+    {transcript}
+    """
+    response = await models.chain("summary").ainvoke(prompt)
+    return response.content
+
+async def apply_summary(whatsapp_id: str, previous: str, summary: str, removed_ids: List[str]) -> bool:
+    """Grava o resumo feito em segundo plano, se a conversa não foi resumida de novo nesse meio tempo."""
+    config = {"configurable": {"thread_id": whatsapp_id}}
+    agent = get_dogao_agent()
+    # Leitura e escrita dentro do lock do turno: nenhum turno salva o checkpoint no meio
+    async with turn_lock(whatsapp_id):
+        current = (await agent.aget_state(config)).values
+        present = {m.id for m in current.get("messages", [])}
+        removed_ids = [i for i in removed_ids if i in present]
+        if current.get("resumo", "") != previous or not removed_ids:
+            return False
+        update = {"resumo": summary, "messages": [RemoveMessage(id=i) for i in removed_ids]}
+        await agent.aupdate_state(config, update, as_node="tracker")
+    return True
+
+summarizer = ConversationSummarizer(
+    summarize=summarize_history,
+    apply=apply_summary,
+    budget=int(os.getenv("SUMMARY_TOKEN_BUDGET", "2000")),
+    keep=int(os.getenv("SUMMARY_KEEP_TOKENS", "800")),
+    hard_limit=int(os.getenv("SUMMARY_HARD_LIMIT", "0")) or None,
+)
+
 # --- NÓ: Summarizer ---
-def summarize_conversation(state: AgentState):
-    """Resume a conversa se ficar muito longa."""
-    stored_messages = state['messages']
-    
-    # Exemplo: mantermos apenas ~6 mensagens recentes sem resumir
-    if len(stored_messages) <= 6:
-        return {}
-    
-    # Resume tudo exceto as últimas 4
-    to_summarize = stored_messages[:-4]
-    if not to_summarize:
-        return {}
-        
-    summary_message = parse_messages(to_summarize)
-    prompt = f"Resuma a conversa entre Torcedor e Dogão (SDR Maringá FC). Mantenha nome e plano de interesse.\n\n{summary_message}"
-    
-    response = llm.invoke(prompt)
-    summary = response.content
-    
-    delete_messages = [RemoveMessage(id=m.id) for m in to_summarize]
-    summary_msg = SystemMessage(content=f"RESUMO ANTERIOR: {summary}")
-    
-    return {"messages": delete_messages + [summary_msg]}
+async def summarize_conversation(state: AgentState):
+    """
+    Prepara o turno. O resumo normalmente roda em segundo plano no fim do turno
+    anterior; aqui só resume (com o modelo barato) se o histórico passou do limite.
+    """
+    # O estado vem do checkpointer: zera o controle de fluxo do turno anterior
+    # (loop_step é acumulativo, então somamos o negativo do valor atual)
+    turn_reset = {"context": "", "loop_step": -state.get("loop_step", 0)}
+    
+    if not summarizer.over_hard_limit(state['messages']):
+        return turn_reset
+    
+    result = await summarizer.compact(state.get("resumo", ""), state['messages'])
+    if result is None:
+        return turn_reset
+    summary, evicted = result
+    summarizer.stats["resumos_no_turno"] += 1
+    return {**turn_reset, "resumo": summary, "messages": [RemoveMessage(id=m.id) for m in evicted]}
+
+# --- NÓ: Cache de Respostas ---
+async def answer_from_cache(state: AgentState):
+    """
+    Responde direto do cache semântico quando a pergunta já foi respondida
+    e os trechos usados na resposta não mudaram desde então.
+    """
+    human_msgs = [m for m in state['messages'] if isinstance(m, HumanMessage)]
+    pergunta = human_msgs[-1].content if human_msgs else ""
+    update = {"pergunta": pergunta, "inicio_turno": time.perf_counter()}
+    if not ANSWER_CACHE_ENABLED or not pergunta:
+        return update
+    if not is_self_contained(pergunta, ANSWER_CACHE_MIN_WORDS):
+        # "quanto custa?" depende do assunto anterior: nem consulta nem guarda
+        answer_cache.stats["dependentes_da_conversa"] += 1
+        return update
+    
+    query_embedding = await get_embeddings().aembed_query(pergunta)
+    match = await answer_cache.alookup(pergunta, query_embedding)
+    if match is None:
+        return update
+    
+    entry_id, entry, similarity = match
+    if not await chunks_unchanged(entry.chunk_hashes):
+        # A ingestão trocou os trechos de origem: resposta velha
+        await answer_cache.adiscard(entry_id, entry.question)
+        return update
+    
+    answer_cache.record_hit(entry)
+    print(f"⚡ Cache de resposta ({similarity:.2f}): '{pergunta}' ~ '{entry.question}'")
+    return {**update, "messages": [AIMessage(content=entry.answer)]}
+
+def cacheable_sources(state: AgentState, answer: str):
+    """(chunk_hashes, latência) se a resposta pode ir para o cache: RAG aprovado de primeira pelo grader."""
+    pergunta = state.get("pergunta")
+    if not ANSWER_CACHE_ENABLED or not pergunta or state.get("loop_step", 0) != 0:
+        return None
+    if not is_self_contained(pergunta, ANSWER_CACHE_MIN_WORDS):
+        return None
+    # Não guarda resposta personalizada (com o nome do torcedor) para outros torcedores
+    nome = state.get("nome_torcedor")
+    if nome and nome in answer:
+        return None
+    
+    # Trechos recuperados pelo retrieve_docs neste turno
+    hashes = []
+    for m in reversed(state['messages']):
+        if isinstance(m, HumanMessage) and m.content == pergunta:
+            break
+        # Respostas da tabela de fatos não entram (sem chunk_hash; a consulta já é barata)
+        if isinstance(m, ToolMessage) and m.name in KNOWLEDGE_TOOLS and m.artifact and not is_fact_result(m):
+            hashes.extend(chunk_hash(text) for doc in m.artifact for text in doc.get('trechos', [doc['conteudo']]))
+    if not hashes:
+        return None
+    started = state.get("inicio_turno")
+    latency = time.perf_counter() - started if started else 0.0
+    return hashes, latency
 
 # --- NÓ: Agent (Router) ---
-def agent_node(state: AgentState):
+async def agent_node(state: AgentState):
     """
     Analisa a última mensagem e decide se chama a ferramenta de busca ou responde direto.
     """
@@ -127,6 +492,7 @@ def agent_node(state: AgentState):
     3. 📝 QUALIFICAR LEAD: Extrair Nome e Interesse para o time de vendas.
     
     DIRETRIZES DE FERRAMENTAS:
+    - Preço/benefícios do sócio e próximos jogos: USE 'lookup_club_facts'.
     - Sócio/Ingressos/Clube: USE 'retrieve_docs'.
     - Camisas/Produtos/Loja: USE 'search_store' para dar preços e opções da loja oficial.
     - Conversa fiada: Responda diretamente.
@@ -136,16 +502,35 @@ def agent_node(state: AgentState):
     - NÃO seja passivo. Tire a dúvida e IMEDIATAMENTE faça uma pergunta de fechamento ou convite (ex: "Bora garantir o Sócio hoje?").
     """)
     
-    # Filtra system messages antigos para evitar duplicação no contexto da LLM, mantendo o resumo se houver
+    # Filtra system messages antigos para evitar duplicação no contexto da LLM
     filtered_msgs = [m for m in messages if not isinstance(m, SystemMessage)]
-    # Procura se tem algum resumo (SystemMessage criada pelo summarizer) e mantém
-    resumos = [m for m in messages if isinstance(m, SystemMessage) and "RESUMO" in str(m.content)]
+    # Só o resumo mais recente (conversas antigas ainda podem ter o resumo como SystemMessage)
+    if state.get("resumo"):
+        resumos = [SystemMessage(content=f"RESUMO DA CONVERSA: {state['resumo']}")]
+    else:
+        resumos = [m for m in messages if isinstance(m, SystemMessage) and "RESUMO" in str(m.content)][-1:]
     
     final_msgs = [system_prompt] + resumos + filtered_msgs
     
+    # Mensagem nova do torcedor (não a busca reescrita): a busca começa junto com o router,
+    # a não ser que a tabela de fatos já responda (aí a busca seria desperdiçada)
+    last = messages[-1]
+    if (SPECULATIVE_RETRIEVAL and state.get("loop_step", 0) == 0 and isinstance(last, HumanMessage)
+            and len(str(last.content).split()) >= SPECULATIVE_MIN_WORDS
+            and not (CLUB_FACTS_ENABLED and get_club_facts().answerable(str(last.content)))):
+        speculative.start(state['whatsapp_id'], str(last.content))
+    
     # Bind tools
-    model = llm.bind_tools(tools)
-    response = model.invoke(final_msgs)
+    model = models.chain("router", lambda m: m.bind_tools(tools))
+    try:
+        response = await model.ainvoke(final_msgs)
+    except BaseException:
+        speculative.discard(state['whatsapp_id'])
+        raise
+    
+    # Router pediu outra query (ou nenhuma busca): descarta a especulativa
+    queries = [c["args"].get("query", "") for c in response.tool_calls if c["name"] in KNOWLEDGE_TOOLS]
+    speculative.keep_if_requested(state['whatsapp_id'], queries)
     
     return {"messages": [response]}
 
@@ -153,44 +538,79 @@ def agent_node(state: AgentState):
 class GradeResult(BaseModel):
     relevant: bool = Field(description="True se os documentos contêm a resposta, False caso contrário")
 
-def grade_documents(state: AgentState):
+async def llm_grade(question: str, docs_content: str) -> bool:
+    """Grader antigo com LLM (opt-in: GRADER_LLM_ENABLED=true)."""
+    prompt = f"""Pergunta: {question}
+    Documentos Recuperados: {docs_content}
+    
+    Os documentos contêm a informação para responder a pergunta? Responda Sim ou Não."""
+    
+    structured = models.chain("grader", lambda m: m.with_structured_output(GradeResult))
+    result = await structured.ainvoke(prompt)
+    return result.relevant
+
+# Similaridade -> cross-encoder local -> LLM (opcional)
+grader = build_grader(llm_grade)
+
+async def grade_documents(state: AgentState):
     """
     Avalia se os documentos trazidos pela ferramenta são suficientes.
     """
     messages = state['messages']
-    last_tool_msg = messages[-1]
+    
+    # Resultados de todas as tools pedidas pelo agent neste passo (rodaram em paralelo)
+    tool_msgs = []
+    for m in reversed(messages):
+        if not isinstance(m, ToolMessage):
+            break
+        tool_msgs.insert(0, m)
     
     # Defesa: se não for ToolMessage, segue o fluxo
-    if not isinstance(last_tool_msg, ToolMessage):
+    if not tool_msgs:
         return {"context": "", "loop_step": 0}
 
-    docs_content = last_tool_msg.content
+    found = [m for m in tool_msgs if "Nenhuma informação" not in str(m.content)]
     
     # Se a busca não retornou nada útil
-    if "Nenhuma informação" in docs_content:
-        return {"context": docs_content, "loop_step": 1} # Incrementa loop para controle
+    if not found:
+        return {"context": str(tool_msgs[-1].content), "loop_step": 1} # Incrementa loop para controle
+    # Contexto só com as tools que trouxeram algo (route_grade reescreve se vir "Nenhuma informação"),
+    # dentro do orçamento do generate_answer
+    docs_content = "\n\n".join(context_builder.fit([str(m.content) for m in found], ANSWER_CONTEXT_TOKENS))
 
-    # Avaliação com LLM
     # Pegamos a última pergunta do usuário
     human_msgs = [m for m in messages if isinstance(m, HumanMessage)]
     last_question = human_msgs[-1].content if human_msgs else ""
     
-    prompt = f"""Pergunta: {last_question}
-    Documentos Recuperados: {docs_content}
-    
-    Os documentos contêm a informação para responder a pergunta? Responda Sim ou Não."""
-    
-    structured = llm.with_structured_output(GradeResult)
-    result = structured.invoke(prompt)
+    # Fatos da tabela estruturada já respondem: só o resto passa pelo grader
+    graded = [m for m in found if not is_fact_result(m)]
+    if not graded:
+        return {"context": docs_content, "loop_step": 0}
+    
+    # retrieve_docs devolve os trechos (com similaridade) como artifact; a loja não
+    passages, similarities = [], []
+    for m in graded:
+        docs = m.artifact if isinstance(m.artifact, list) else []
+        docs = [d for d in docs if d.get('conteudo')]
+        if docs:
+            passages.extend(d['conteudo'] for d in docs)
+            # Trechos vindos só do BM25 não têm similaridade vetorial (None)
+            similarities.extend(d.get('similarity') for d in docs)
+        else:
+            passages.append(str(m.content))
+            similarities.append(None)
+    # O grader só precisa dos trechos do topo para decidir
+    passages = context_builder.fit(passages, GRADER_CONTEXT_TOKENS)
+    relevant, _ = await grader.grade(last_question, passages, similarities[:len(passages)])
     
     # Se relevante, zera o loop. Se não, incrementa.
-    step_inc = 0 if result.relevant else 1
+    step_inc = 0 if relevant else 1
     
     #hack: salvamos 'context' explicitamente para o generate_answer usar
     return {"context": docs_content, "loop_step": step_inc}
 
 # --- NÓ: Rewrite Question ---
-def rewrite_question(state: AgentState):
+async def rewrite_question(state: AgentState):
     """
     Reescreve a query para tentar melhorar a busca.
     """
@@ -208,7 +628,7 @@ def rewrite_question(state: AgentState):
         "Retorne APENAS a nova frase de busca, sem explicações adicionais."
     )
     
-    response = llm.invoke(prompt)
+    response = await models.chain("rewrite").ainvoke(prompt)
     new_query = response.content
     
     print(f"🔄 Reescrevendo: '{original_query}' -> '{new_query}'")
@@ -220,14 +640,16 @@ def rewrite_question(state: AgentState):
     return {"messages": [msg]}
 
 # --- NÓ: Generate Answer (RAG) ---
-def generate_answer(state: AgentState):
+async def generate_answer(state: AgentState):
     """
     Gera a resposta final usando o contexto validado.
     """
     context = state['context']
     messages = state['messages']
     
-    current_messages = [m for m in messages if not isinstance(m, SystemMessage)]
+    # O resultado das tools já está no CONTEXTO: as chamadas e ToolMessages não vão de novo no prompt
+    current_messages = [m for m in messages if not isinstance(m, (SystemMessage, ToolMessage))
+                        and not (isinstance(m, AIMessage) and m.tool_calls)]
     
     prompt = ChatPromptTemplate.from_messages([
         ("system", """Você é o Dogão, mascote e SDR do Maringá FC.
@@ -241,9 +663,17 @@ def generate_answer(state: AgentState):
         MessagesPlaceholder(variable_name="messages"),
     ])
     
-    chain = prompt | llm
+    chain = prompt | models.chain("answer")
     # Passamos as mensagens para manter o fluxo da conversa
-    response = chain.invoke({"messages": current_messages, "context": context})
+    response = await chain.ainvoke({"messages": current_messages, "context": context})
+    
+    sources = cacheable_sources(state, response.content)
+    if sources:
+        hashes, latency = sources
+        # Embedding da pergunta já está no cache de embeddings (calculado no nó de cache)
+        query_embedding = await get_embeddings().aembed_query(state["pergunta"])
+        answer_cache.store(state["pergunta"], query_embedding, response.content, hashes, latency)
+        await answer_cache.publish(state["pergunta"], response.content, hashes, latency)
     
     return {"messages": [response]}
 
@@ -253,11 +683,14 @@ class LeadInfo(BaseModel):
     nome: Optional[str]
     plano: Optional[str]
 
-def classify_and_track(state: AgentState):
-    """Extrai intenções e salva dados do lead."""
-    messages = state['messages']
+async def classify_and_track(job: dict) -> Optional[dict]:
+    """
+    Extrai intenções e dados do lead (roda em segundo plano, depois da resposta).
+    Devolve a linha para `leads_sdr`, gravada em lote pelo lead_tracker.
+    """
+    messages = job['messages']
     if len(messages) < 2:
-        return {"intent_is_sale": False}
+        return None
         
     history = parse_messages(messages[-6:]) # Analisa últimas mensagens
     
@@ -268,53 +701,96 @@ def classify_and_track(state: AgentState):
     {history}
     """
     
-    try:
-        structured = llm.with_structured_output(LeadInfo)
-        res = structured.invoke(prompt)
-        
-        updates = {}
-        if res.nome and res.nome not in ["Torcedor", "Não informado"]:
-            updates["nome_torcedor"] = res.nome
-        if res.plano and res.plano not in ["A definir", "Não informado"]:
-            updates["plano_interesse"] = res.plano
-            
-        # Persistência
-        nome = updates.get("nome_torcedor") or state.get("nome_torcedor") or "Torcedor"
-        plano = updates.get("plano_interesse") or state.get("plano_interesse") or "A definir"
-        intent = res.venda
-        
-        if intent or updates:
-            print(f"🎯 Atualizando Lead: {nome} | {plano}")
-            supabase.table("leads_sdr").upsert({
-                "whatsapp_id": state['whatsapp_id'],
-                "nome_torcedor": nome,
-                "plano_interesse": plano,
-                "convertido": False
-            }, on_conflict="whatsapp_id").execute()
-            
-        return {**updates, "intent_is_sale": intent}
+    structured = models.chain("extraction", lambda m: m.with_structured_output(LeadInfo))
+    res = await structured.ainvoke(prompt)
+    
+    updates = {}
+    if res.nome and res.nome not in ["Torcedor", "Não informado"]:
+        updates["nome_torcedor"] = res.nome
+    if res.plano and res.plano not in ["A definir", "Não informado"]:
+        updates["plano_interesse"] = res.plano
         
-    except Exception as e:
-        print(f"Erro tracking: {e}")
-        return {"intent_is_sale": False}
+    nome = updates.get("nome_torcedor") or job.get("nome_torcedor") or "Torcedor"
+    plano = updates.get("plano_interesse") or job.get("plano_interesse") or "A definir"
+    intent = res.venda
+    
+    # Devolve nome/plano/intenção para o estado da conversa (próximo turno já enxerga).
+    # Só a escrita fica no lock do turno (a extração com LLM roda fora dele)
+    config = {"configurable": {"thread_id": job['whatsapp_id']}}
+    async with turn_lock(job['whatsapp_id']):
+        await get_dogao_agent().aupdate_state(config, {**updates, "intent_is_sale": intent}, as_node="tracker")
+    
+    if not (intent or updates):
+        return None
+    print(f"🎯 Atualizando Lead: {nome} | {plano}")
+    return {
+        "whatsapp_id": job['whatsapp_id'],
+        "nome_torcedor": nome,
+        "plano_interesse": plano,
+        "convertido": False
+    }
+
+# Fila + escrita em lote com outbox local (não perde lead se o Supabase cair)
+_lead_tracker: Optional[LeadTracker] = None
+
+def get_lead_tracker() -> LeadTracker:
+    """Lead tracker do processo; o arquivo do outbox só é aberto na primeira chamada."""
+    global _lead_tracker
+    if _lead_tracker is None:
+        _lead_tracker = LeadTracker(
+            process=classify_and_track,
+            get_client=get_supabase,
+            outbox=LeadOutbox(os.getenv("LEAD_OUTBOX_PATH", "leads_outbox.sqlite"),
+                              orphan_after=float(os.getenv("LEAD_OUTBOX_ORPHAN_SECONDS", "600"))),
+            workers=int(os.getenv("LEAD_WORKERS", "2")),
+            flush_interval=float(os.getenv("LEAD_FLUSH_SECONDS", "5")),
+            flush_size=int(os.getenv("LEAD_FLUSH_SIZE", "50")),
+        )
+    return _lead_tracker
+
+async def enqueue_lead_tracking(state: AgentState):
+    """Nó final: só enfileira o rastreamento do lead (e o resumo), sem esperar LLM nem Supabase."""
+    get_lead_tracker().submit({
+        "whatsapp_id": state['whatsapp_id'],
+        "messages": list(state['messages'][-6:]),
+        "nome_torcedor": state.get("nome_torcedor"),
+        "plano_interesse": state.get("plano_interesse"),
+    })
+    if summarizer.over_budget(state['messages']):
+        summarizer.schedule(state['whatsapp_id'], state.get("resumo", ""), state['messages'])
+    # Busca especulativa que sobrou (ex.: turno que saiu sem passar pela tool)
+    speculative.discard(state['whatsapp_id'])
+    return {}
 
 # --- 5. Montagem do Grafo ---
 workflow = StateGraph(AgentState)
 
 # Adiciona nós
 workflow.add_node("summarizer", summarize_conversation)
+workflow.add_node("answer_cache", answer_from_cache)
 workflow.add_node("agent", agent_node)
 workflow.add_node("tools", tool_node)
 workflow.add_node("grade_documents", grade_documents)
 workflow.add_node("rewrite", rewrite_question)
 workflow.add_node("generate", generate_answer)
-workflow.add_node("tracker", classify_and_track)
+workflow.add_node("tracker", enqueue_lead_tracking)
 
 # Define Entry Point
 workflow.set_entry_point("summarizer")
 
 # Arestas
-workflow.add_edge("summarizer", "agent")
+workflow.add_edge("summarizer", "answer_cache")
+
+# Acerto no cache de respostas: pula agent/tools/grade/generate
+def route_cache(state):
+    if isinstance(state["messages"][-1], AIMessage):
+        return "tracker"
+    return "agent"
+
+workflow.add_conditional_edges("answer_cache", route_cache, {
+    "agent": "agent",
+    "tracker": "tracker"
+})
 
 # Decisão do Agent: Tool ou Resposta Direta?
 def route_agent(state):
@@ -365,5 +841,62 @@ workflow.add_edge("rewrite", "agent")
 workflow.add_edge("generate", "tracker")
 workflow.add_edge("tracker", END)
 
-# Compilação
-dogao_agent = workflow.compile()
\ No newline at end of file
+# Compilação (estado da conversa persistido por whatsapp_id = thread_id):
+# feita uma vez por processo, na primeira chamada (ou no warmup da API)
+_dogao_agent = None
+
+def get_dogao_agent():
+    """Grafo compilado com o checkpointer, criado na primeira chamada e reaproveitado."""
+    global _dogao_agent
+    if _dogao_agent is None:
+        # Métricas por nó/tool/LLM e trace por requisição (não depende do LangSmith)
+        setup_instrumentation()
+        _dogao_agent = workflow.compile(checkpointer=build_checkpointer(get_supabase, versions=cross_worker_state))
+    return _dogao_agent
+
+def __getattr__(name):
+    # Compatibilidade: `from src.agent import dogao_agent` compila sob demanda
+    if name == "dogao_agent":
+        return get_dogao_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def is_sale_conversation(whatsapp_id: str) -> bool:
+    """Torcedor já demonstrou intenção de compra (prioridade na fila da API)."""
+    config = {"configurable": {"thread_id": whatsapp_id}}
+    try:
+        state = (await get_dogao_agent().aget_state(config)).values
+    except Exception as e:
+        print(f"Erro ao ler estado de {whatsapp_id}: {e}")
+        return False
+    return bool(state.get("intent_is_sale"))
+
+async def remember_unanswered(whatsapp_id: str, message: str):
+    """
+    Guarda a mensagem que ficou sem resposta (API sobrecarregada) no histórico,
+    sem chamar LLM: o próximo turno do torcedor já a enxerga e responde.
+    """
+    config = {"configurable": {"thread_id": whatsapp_id}}
+    try:
+        await get_dogao_agent().aupdate_state(
+            config, {"messages": [HumanMessage(content=message)], "whatsapp_id": whatsapp_id}, as_node="tracker"
+        )
+    except Exception as e:
+        print(f"Erro ao guardar mensagem não respondida de {whatsapp_id}: {e}")
+
+async def warmup():
+    """
+    Cria clientes e compila o grafo antes do primeiro turno (startup da API),
+    para a instância nova do scale-out não pagar isso na primeira requisição.
+    """
+    models.warmup()
+    get_embeddings()
+    get_dogao_agent()
+    # Cross-encoder do grader carrega em segundo plano; até lá o grader decide pela similaridade
+    grader.preload()
+    try:
+        supabase = await get_supabase()
+        if CLUB_FACTS_ENABLED:
+            # Fatos publicados pela ingestão: a primeira pergunta de plano/jogo já acha a tabela cheia
+            print(f"📋 Tabela de fatos: {await get_club_facts().arefresh(supabase)} fatos")
+    except Exception as e:
+        print(f"⚠️ Supabase indisponível no warmup (tenta de novo no primeiro uso): {e}")
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""
+Cache semântico de respostas para perguntas de FAQ (preço do Sócio, benefícios, jogos).
+
+- A pergunta é comparada por cosseno com as perguntas já respondidas; acima de
+  `threshold` a resposta guardada é candidata a reuso.
+- Cada entrada guarda o `chunk_hash` dos trechos de `conhecimento_clube` usados
+  na resposta. Antes de reutilizar, o agente confere se esses trechos ainda
+  existem (a ingestão troca o hash quando o conteúdo muda); se não, a entrada cai.
+- Despejo por LRU (`max_entries`) e TTL.
+- Métricas: consultas, acertos, entradas velhas descartadas e latência economizada.
+- Só entram perguntas que valem por si só: "quanto custa?" ou "e o Ouro?" dependem
+  do assunto anterior da conversa e a mesma frase pede respostas diferentes em
+  conversas diferentes (`is_self_contained`).
+- Com vários workers (`shared`, src/shared_state.py), cada resposta guardada
+  também é publicada pela pergunta normalizada: um worker sem acerto local
+  reaproveita a mesma pergunta respondida por outro.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.embedding_cache import normalize_text
+
+
+def chunk_hash(conteudo: str) -> str:
+    """Mesmo hash usado pela ingestão na coluna `chunk_hash`."""
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+# Palavras que apontam para algo dito antes na conversa
+CONTEXT_WORDS = {
+    "isso", "isto", "esse", "essa", "esses", "essas", "este", "esta", "estes", "estas",
+    "aquele", "aquela", "aquilo", "ele", "ela", "eles", "elas", "dele", "dela", "deles", "delas",
+    "nele", "nela", "mesmo", "mesma", "outro", "outra", "outros", "outras", "também", "tambem",
+    "anterior", "acima",
+}
+# Começo típico de continuação: "E o plano Ouro?", "Mas e para menores?"
+FOLLOW_UP_STARTS = {"e", "mas", "então", "entao"}
+
+
+def is_self_contained(question: str, min_words: int = 4) -> bool:
+    """False para perguntas curtas ou que dependem do contexto da conversa (fora do cache)."""
+    words = re.findall(r"\w+", normalize_text(question))
+    if len(words) < min_words or words[0] in FOLLOW_UP_STARTS:
+        return False
+    return not CONTEXT_WORDS.intersection(words)
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    chunk_hashes: List[str]
+    created_at: float
+    latency: float  # duração do turno que gerou a resposta (o que um acerto economiza)
+
+
+class SemanticAnswerCache:
+    """Perguntas respondidas indexadas pelo embedding normalizado."""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600, threshold: float = 0.92, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Tuple[np.ndarray, CachedAnswer]]" = OrderedDict()
+        self._next_id = 0
+        # Matriz das perguntas (reconstruída só quando as entradas mudam)
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: List[int] = []
+        self.stats = {"consultas": 0, "acertos": 0, "descartes_velhos": 0, "latencia_economizada": 0.0,
+                      "compartilhadas": 0, "dependentes_da_conversa": 0}
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        return array / (np.linalg.norm(array) or 1.0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _purge_expired(self, now: float):
+        expired = [i for i, (_, entry) in self._entries.items() if now - entry.created_at > self.ttl]
+        for i in expired:
+            del self._entries[i]
+        if expired:
+            self._matrix = None
+
+    def _best_match(self, query: np.ndarray) -> Optional[Tuple[int, float]]:
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._ids = list(self._entries)
+            self._matrix = np.stack([self._entries[i][0] for i in self._ids])
+        sims = self._matrix @ query
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        return self._ids[best], float(sims[best])
+
+    # --- Consulta ---
+
+    def lookup(self, vector) -> Optional[Tuple[int, CachedAnswer, float]]:
+        """Melhor entrada acima do limiar: (id, resposta, similaridade). Não conta acerto ainda."""
+        query = self._normalize(vector)
+        with self._lock:
+            self.stats["consultas"] += 1
+            self._purge_expired(time.time())
+            match = self._best_match(query)
+            if match is None:
+                return None
+            entry_id, similarity = match
+            self._entries.move_to_end(entry_id)
+            return entry_id, self._entries[entry_id][1], similarity
+
+    def record_hit(self, entry: CachedAnswer):
+        with self._lock:
+            self.stats["acertos"] += 1
+            self.stats["latencia_economizada"] += entry.latency
+
+    def discard(self, entry_id: int):
+        """Remove uma entrada cujos trechos de origem mudaram."""
+        with self._lock:
+            if self._entries.pop(entry_id, None) is not None:
+                self.stats["descartes_velhos"] += 1
+                self._matrix = None
+
+    # --- Escrita ---
+
+    def store(self, question: str, vector, answer: str, chunk_hashes: Iterable[str], latency: float = 0.0,
+              created_at: Optional[float] = None):
+        query = self._normalize(vector)
+        entry = CachedAnswer(question, answer, sorted(set(chunk_hashes)), created_at or time.time(), latency)
+        with self._lock:
+            # Pergunta equivalente já guardada: substitui pela resposta mais nova
+            match = self._best_match(query)
+            if match is not None:
+                del self._entries[match[0]]
+            self._next_id += 1
+            self._entries[self._next_id] = (query, entry)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    # --- Entre workers ---
+
+    @staticmethod
+    def _shared_key(question: str) -> str:
+        return f"resposta:{normalize_text(question)}"
+
+    async def alookup(self, question: str, vector) -> Optional[Tuple[int, CachedAnswer, float]]:
+        """`lookup`; sem acerto local, traz a mesma pergunta respondida por outro worker."""
+        match = self.lookup(vector)
+        if match is not None or self.shared is None:
+            return match
+        try:
+            raw = await self.shared.get(self._shared_key(question))
+        except Exception as e:
+            print(f"Erro ao ler cache de respostas compartilhado: {e}")
+            return None
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        self.store(question, vector, data["answer"], data["chunk_hashes"], data["latency"], data["created_at"])
+        with self._lock:
+            self.stats["compartilhadas"] += 1
+            match = self._best_match(self._normalize(vector))
+            if match is None:
+                return None
+            return match[0], self._entries[match[0]][1], match[1]
+
+    async def publish(self, question: str, answer: str, chunk_hashes: Iterable[str], latency: float = 0.0):
+        """Deixa a resposta visível para os outros workers."""
+        if self.shared is None:
+            return
+        data = {"answer": answer, "chunk_hashes": sorted(set(chunk_hashes)), "latency": latency,
+                "created_at": time.time()}
+        try:
+            await self.shared.set(self._shared_key(question), json.dumps(data, ensure_ascii=False), ttl=self.ttl)
+        except Exception as e:
+            print(f"Erro ao publicar resposta no cache compartilhado: {e}")
+
+    async def adiscard(self, entry_id: int, question: str):
+        """`discard` aqui e no estado compartilhado."""
+        self.discard(entry_id)
+        if self.shared is not None:
+            try:
+                await self.shared.delete(self._shared_key(question))
+            except Exception as e:
+                print(f"Erro ao descartar resposta compartilhada: {e}")
+
+    def metrics(self) -> Dict[str, float]:
+        consultas = self.stats["consultas"]
+        return {
+            **self.stats,
+            "entradas": len(self._entries),
+            "taxa_acerto": self.stats["acertos"] / consultas if consultas else 0.0,
+        }
@@ -0,0 +1,214 @@
+"""
+Conversas em lote: campanhas ativas e reprocessamento do backlog depois de
+uma queda.
+
+Entrada em NDJSON, um item por linha: {"whatsapp_id": ..., "message": ...}
+(opcional "id"; sem ele vale o número da linha). Saída em NDJSON, um
+resultado por item, na ordem em que terminam.
+
+- Ordem por conversa: a k-ésima mensagem de cada whatsapp_id vai na onda k,
+  então um mesmo torcedor nunca tem dois turnos ao mesmo tempo e as
+  mensagens dele seguem a ordem do arquivo.
+- Cada onda roda em blocos de `chunk_size` itens (no máximo `concurrency`
+  turnos simultâneos). Antes de cada bloco, os
+  embeddings de todas as mensagens saem numa única chamada
+  (`aembed_documents`) e ficam no cache de embeddings: o cache de respostas
+  e o retrieve_docs de cada item não chamam a OpenAI de novo.
+- Com `lock` e `admission` (a API passa os mesmos do /chat), cada item pega
+  o lock do turno do whatsapp_id (não cruza com uma conversa ao vivo) e
+  ocupa uma vaga na admissão. Sem vaga, o item volta com erro e é tentado de
+  novo na retomada.
+- Por isso cada item roda no próprio `ainvoke` (sob um semáforo de
+  `concurrency`) e não num `abatch` do grafo: o `abatch` não deixa segurar
+  lock e vaga por item, e um erro num item não derruba os outros do bloco.
+- Progresso retomável: cada resultado é gravado no arquivo de progresso
+  (NDJSON) assim que o bloco termina. Rodando de novo com o mesmo arquivo,
+  itens já respondidos são pulados; itens com erro são tentados de novo.
+
+Uso:
+    python -m src.batch campanha.ndjson --saida campanha.resultados.ndjson --concorrencia 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from contextlib import nullcontext
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "50"))
+
+
+def parse_items(lines: Iterable[str]) -> List[dict]:
+    """Itens do NDJSON de entrada (ValueError com o número da linha se algo estiver errado)."""
+    items, seen = [], set()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"linha {number}: JSON inválido ({e})")
+        if not isinstance(data, dict) or not data.get("whatsapp_id") or not data.get("message"):
+            raise ValueError(f"linha {number}: item precisa de whatsapp_id e message")
+        item_id = str(data.get("id", number))
+        if item_id in seen:
+            raise ValueError(f"linha {number}: id repetido ({item_id})")
+        seen.add(item_id)
+        items.append({"id": item_id, "whatsapp_id": str(data["whatsapp_id"]), "message": str(data["message"])})
+    return items
+
+
+def load_progress(path: Optional[str]) -> Dict[str, dict]:
+    """Resultados sem erro de uma rodada anterior, por id (linha cortada no meio é ignorada)."""
+    done: Dict[str, dict] = {}
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "erro" in result:
+                done.pop(result.get("id"), None)
+            else:
+                done[result["id"]] = result
+    return done
+
+
+def waves(items: List[dict]) -> List[List[dict]]:
+    """Onda k = k-ésima mensagem de cada whatsapp_id."""
+    result: List[List[dict]] = []
+    position: Dict[str, int] = {}
+    for item in items:
+        k = position.get(item["whatsapp_id"], 0)
+        position[item["whatsapp_id"]] = k + 1
+        if k == len(result):
+            result.append([])
+        result[k].append(item)
+    return result
+
+
+class BatchRunner:
+    def __init__(self, get_graph: Callable, get_embeddings: Callable,
+                 concurrency: int = BATCH_CONCURRENCY, chunk_size: int = BATCH_CHUNK_SIZE,
+                 lock: Optional[Callable] = None, admission=None):
+        self.get_graph = get_graph
+        self.get_embeddings = get_embeddings
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        # lock(whatsapp_id) -> context manager assíncrono (turn_lock do agente)
+        self.lock = lock
+        # AdmissionController da API: os turnos do lote disputam as mesmas vagas do /chat
+        self.admission = admission
+        self.stats = {"itens": 0, "respondidos": 0, "erros": 0, "retomados": 0, "blocos": 0, "sem_vaga": 0}
+
+    async def _prefetch_embeddings(self, chunk: List[dict]):
+        """Um único aembed_documents para o bloco (o cache de embeddings deduplica)."""
+        messages = list(dict.fromkeys(item["message"] for item in chunk))
+        try:
+            await self.get_embeddings().aembed_documents(messages)
+        except Exception as e:
+            # Sem o lote, cada item calcula o próprio embedding
+            print(f"⚠️ Falha ao pré-calcular embeddings do bloco: {e}", file=sys.stderr)
+
+    async def _run_item(self, item: dict, semaphore: asyncio.Semaphore) -> dict:
+        inputs = {"messages": [("user", item["message"])], "whatsapp_id": item["whatsapp_id"]}
+        config = {"configurable": {"thread_id": item["whatsapp_id"]}}
+        async with semaphore:
+            try:
+                # Lock antes da vaga, como no /chat: esperar o lock não ocupa a admissão
+                async with self.lock(item["whatsapp_id"]) if self.lock else nullcontext():
+                    async with self.admission.slot() if self.admission else nullcontext(True) as admitted:
+                        if not admitted:
+                            self.stats["sem_vaga"] += 1
+                            raise RuntimeError("API sem vaga para o turno do lote")
+                        output = await self.get_graph().ainvoke(inputs, config, durability="exit")
+            except Exception as e:
+                self.stats["erros"] += 1
+                return {**item, "erro": str(e) or type(e).__name__}
+        self.stats["respondidos"] += 1
+        return {
+            **item,
+            "response": output["messages"][-1].content,
+            "nome_identificado": output.get("nome_torcedor"),
+            "plano": output.get("plano_interesse"),
+        }
+
+    async def _run_chunk(self, chunk: List[dict]) -> List[dict]:
+        await self._prefetch_embeddings(chunk)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._run_item(item, semaphore) for item in chunk))
+        self.stats["blocos"] += 1
+        return list(results)
+
+    async def run(self, items: List[dict], progress_path: Optional[str] = None,
+                  replay: bool = False) -> AsyncIterator[dict]:
+        """
+        Resultados conforme cada bloco termina. Com `progress_path`, pula o que
+        já foi respondido (e devolve esses resultados antes, com `replay`).
+        """
+        done = load_progress(progress_path)
+        pending = [item for item in items if item["id"] not in done]
+        self.stats["itens"] += len(items)
+        self.stats["retomados"] += len(items) - len(pending)
+        if replay:
+            for item in items:
+                if item["id"] in done:
+                    yield {**done[item["id"]], "retomado": True}
+
+        if progress_path and os.path.dirname(progress_path):
+            os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+        with open(progress_path, "a", encoding="utf-8") if progress_path else nullcontext() as progress:
+            for wave in waves(pending):
+                for start in range(0, len(wave), self.chunk_size):
+                    results = await self._run_chunk(wave[start:start + self.chunk_size])
+                    if progress is not None:
+                        for result in results:
+                            progress.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        progress.flush()
+                        os.fsync(progress.fileno())
+                    for result in results:
+                        yield result
+
+
+def build_runner(concurrency: int = BATCH_CONCURRENCY, chunk_size: int = BATCH_CHUNK_SIZE) -> BatchRunner:
+    """Runner ligado ao grafo, aos embeddings e ao lock de turno do agente."""
+    from src.agent import get_dogao_agent, get_embeddings, turn_lock
+    return BatchRunner(get_dogao_agent, get_embeddings, concurrency, chunk_size, lock=turn_lock)
+
+
+async def main(input_path: str, output_path: str, concurrency: int, chunk_size: int):
+    from src.agent import get_lead_tracker, summarizer
+
+    with open(input_path, encoding="utf-8") as f:
+        items = parse_items(f)
+    runner = build_runner(concurrency, chunk_size)
+    count = 0
+    async for result in runner.run(items, progress_path=output_path):
+        count += 1
+        if count % 50 == 0:
+            print(f"⏳ {count} itens processados nesta rodada", file=sys.stderr)
+    # Leads e resumos agendados pelos turnos do lote
+    await summarizer.close()
+    await get_lead_tracker().close()
+    stats = runner.stats
+    print(f"✅ Lote concluído: {stats['respondidos']} respondidos, {stats['erros']} com erro, "
+          f"{stats['retomados']} já feitos em rodada anterior -> {output_path}", file=sys.stderr)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conversas em lote (campanhas e reprocessamento de backlog)")
+    parser.add_argument("entrada", help="NDJSON com {whatsapp_id, message} por linha")
+    parser.add_argument("--saida", help="NDJSON de resultados e progresso (padrão: <entrada>.resultados.ndjson)")
+    parser.add_argument("--concorrencia", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--bloco", type=int, default=BATCH_CHUNK_SIZE, help="Itens por bloco")
+    args = parser.parse_args()
+
+    output = args.saida or f"{os.path.splitext(args.entrada)[0]}.resultados.ndjson"
+    stats = asyncio.run(main(args.entrada, output, args.concorrencia, args.bloco))
+    sys.exit(1 if stats["erros"] else 0)
@@ -0,0 +1,391 @@
+"""
+Checkpointer da conversa por whatsapp_id (thread_id do LangGraph).
+
+Guarda apenas o ÚLTIMO checkpoint de cada conversa (o estado já resumido pelo
+summarizer), em duas camadas:
+- Camada quente: LRU em memória com TTL, evita ir ao banco a cada turno.
+- Camada durável (plugável): SQLite local ou tabela no Supabase em produção.
+
+Com vários workers, a camada quente de um worker pode ficar para trás quando
+o turno seguinte da conversa roda em outro. Com `versions` (estado
+compartilhado, src/shared_state.py), cada gravação publica o id do último
+checkpoint da conversa e a leitura assíncrona só usa a camada quente se o id
+bater; senão relê da camada durável.
+
+Tabela esperada no Supabase:
+    create table conversas_checkpoint (
+        thread_id text not null,
+        checkpoint_ns text not null default '',
+        tipo text not null,
+        payload text not null,
+        atualizado_em timestamptz default now(),
+        primary key (thread_id, checkpoint_ns)
+    );
+"""
+import asyncio
+import base64
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+# Registro serializado: (tipo, bytes) vindo de serde.dumps_typed
+Typed = Tuple[str, bytes]
+
+
+# --- Camada durável ---
+
+class SQLiteCheckpointStore:
+    """Persistência local em SQLite (um registro por conversa)."""
+
+    def __init__(self, path: str = "checkpoints.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversas_checkpoint (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                tipo TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                atualizado_em REAL NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns)
+            )
+        """)
+        self._conn.commit()
+
+    def load(self, thread_id: str, checkpoint_ns: str) -> Optional[Typed]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tipo, payload FROM conversas_checkpoint WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns),
+            ).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def save(self, thread_id: str, checkpoint_ns: str, record: Typed) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversas_checkpoint VALUES (?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, record[0], record[1], time.time()),
+            )
+            self._conn.commit()
+
+    def delete(self, thread_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM conversas_checkpoint WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
+
+    async def aload(self, thread_id: str, checkpoint_ns: str) -> Optional[Typed]:
+        return await asyncio.to_thread(self.load, thread_id, checkpoint_ns)
+
+    async def asave(self, thread_id: str, checkpoint_ns: str, record: Typed) -> None:
+        await asyncio.to_thread(self.save, thread_id, checkpoint_ns, record)
+
+    async def adelete(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete, thread_id)
+
+
+class SupabaseCheckpointStore:
+    """
+    Persistência na tabela `conversas_checkpoint` do Supabase (produção).
+
+    Só tem a API assíncrona (o cliente do Supabase é o AsyncClient e o grafo roda
+    com ainvoke/astream); a API síncrona do checkpointer recusa este store.
+    """
+
+    def __init__(self, get_client: Callable[[], Awaitable[Any]], table: str = "conversas_checkpoint"):
+        self.get_client = get_client
+        self.table = table
+
+    async def aload(self, thread_id: str, checkpoint_ns: str) -> Optional[Typed]:
+        client = await self.get_client()
+        res = await client.table(self.table).select("tipo, payload") \
+            .eq("thread_id", thread_id).eq("checkpoint_ns", checkpoint_ns).limit(1).execute()
+        if not res.data:
+            return None
+        row = res.data[0]
+        return row["tipo"], base64.b64decode(row["payload"])
+
+    async def asave(self, thread_id: str, checkpoint_ns: str, record: Typed) -> None:
+        client = await self.get_client()
+        await client.table(self.table).upsert({
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "tipo": record[0],
+            "payload": base64.b64encode(record[1]).decode("ascii"),
+        }, on_conflict="thread_id,checkpoint_ns").execute()
+
+    async def adelete(self, thread_id: str) -> None:
+        client = await self.get_client()
+        await client.table(self.table).delete().eq("thread_id", thread_id).execute()
+
+
+# --- Checkpointer ---
+
+class ConversationCheckpointer(BaseCheckpointSaver):
+    """
+    Checkpointer que mantém só o estado mais recente de cada conversa.
+
+    Não guarda histórico de checkpoints (sem time-travel): o que interessa ao
+    SDR é retomar o estado compacto (resumo, nome, plano) no próximo turno.
+    """
+
+    def __init__(self, store=None, max_entries: int = 10_000, ttl: float = 1800, *, serde=None, versions=None):
+        super().__init__(serde=serde)
+        self.store = store
+        self.versions = versions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # (thread_id, checkpoint_ns) -> (expira_em, registro)
+        self._hot: "OrderedDict[Tuple[str, str], Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # --- Camada quente (LRU + TTL) ---
+
+    def _hot_get(self, key) -> Optional[dict]:
+        with self._lock:
+            entry = self._hot.get(key)
+            if entry is None:
+                return None
+            expires_at, record = entry
+            if expires_at < time.monotonic():
+                del self._hot[key]
+                return None
+            self._hot.move_to_end(key)
+            return record
+
+    def _hot_set(self, key, record: dict) -> None:
+        with self._lock:
+            self._hot[key] = (time.monotonic() + self.ttl, record)
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.max_entries:
+                self._hot.popitem(last=False)
+
+    def _hot_drop(self, thread_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._hot if k[0] == thread_id]:
+                del self._hot[key]
+
+    # --- Versão entre workers ---
+
+    @staticmethod
+    def _version_key(thread_id: str) -> str:
+        return f"checkpoint:{thread_id}"
+
+    async def _publish_version(self, thread_id: str, version: str) -> None:
+        if self.versions is not None:
+            await self.versions.set(self._version_key(thread_id), version, ttl=self.ttl)
+
+    async def _hot_is_current(self, key, record: dict) -> bool:
+        if self.versions is None:
+            return True
+        current = await self.versions.get(self._version_key(key[0]))
+        return current is None or current == record["checkpoint_id"]
+
+    # --- Conversão registro <-> CheckpointTuple ---
+
+    @staticmethod
+    def _key(config: RunnableConfig) -> Tuple[str, str]:
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+    def _to_tuple(self, key, record: dict) -> CheckpointTuple:
+        thread_id, checkpoint_ns = key
+        checkpoint = self.serde.loads_typed(record["checkpoint"])
+        parent_id = record["parent_id"]
+        writes = sorted(record["writes"].values(), key=lambda w: (w[3], w[0], w[4]))
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }},
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed(record["metadata"]),
+            parent_config=(
+                {"configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": parent_id,
+                }}
+                if parent_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed(value))
+                            for task_id, channel, value, _path, _idx in writes],
+        )
+
+    def _pack(self, record: dict) -> Typed:
+        return self.serde.dumps_typed(record)
+
+    def _unpack(self, data: Typed) -> dict:
+        return self.serde.loads_typed(data)
+
+    def _matches(self, config: RunnableConfig, record: dict) -> bool:
+        wanted = get_checkpoint_id(config)
+        return not wanted or wanted == record["checkpoint_id"]
+
+    def _new_record(self, config, checkpoint, metadata) -> dict:
+        return {
+            "checkpoint_id": checkpoint["id"],
+            "checkpoint": self.serde.dumps_typed(checkpoint),
+            "metadata": self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)),
+            "parent_id": config["configurable"].get("checkpoint_id"),
+            "writes": {},
+        }
+
+    def _add_writes(self, record: dict, writes, task_id: str, task_path: str) -> None:
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            inner_key = f"{task_id}:{write_idx}"
+            if write_idx >= 0 and inner_key in record["writes"]:
+                continue
+            record["writes"][inner_key] = (task_id, channel, self.serde.dumps_typed(value), task_path, write_idx)
+
+    # --- API síncrona ---
+
+    def _sync_store(self):
+        """Camada durável para a API síncrona (None sem store)."""
+        if self.store is not None and not hasattr(self.store, "load"):
+            raise NotImplementedError(f"{type(self.store).__name__} só suporta a API assíncrona do checkpointer")
+        return self.store
+
+    def _load(self, key) -> Optional[dict]:
+        record = self._hot_get(key)
+        store = self._sync_store()
+        if record is None and store is not None:
+            data = store.load(*key)
+            if data is not None:
+                record = self._unpack(data)
+                self._hot_set(key, record)
+        return record
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        key = self._key(config)
+        record = self._load(key)
+        if record is None or not self._matches(config, record):
+            return None
+        return self._to_tuple(key, record)
+
+    def list(self, config: Optional[RunnableConfig], *, filter=None, before=None, limit=None) -> Iterator[CheckpointTuple]:
+        if config is None:
+            return
+        checkpoint_tuple = self.get_tuple(config)
+        if checkpoint_tuple is not None and before is None:
+            yield checkpoint_tuple
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        key = self._key(config)
+        record = self._new_record(config, checkpoint, metadata)
+        store = self._sync_store()
+        self._hot_set(key, record)
+        if store is not None:
+            store.save(*key, self._pack(record))
+        return {"configurable": {
+            "thread_id": key[0],
+            "checkpoint_ns": key[1],
+            "checkpoint_id": checkpoint["id"],
+        }}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        # Writes pendentes ficam só na camada quente: servem para retomar um
+        # passo interrompido dentro do mesmo processo, não entre turnos.
+        record = self._hot_get(self._key(config))
+        if record is not None and self._matches(config, record):
+            self._add_writes(record, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        store = self._sync_store()
+        self._hot_drop(thread_id)
+        if store is not None:
+            store.delete(thread_id)
+
+    # --- API assíncrona ---
+
+    async def _aload(self, key) -> Optional[dict]:
+        record = self._hot_get(key)
+        if record is not None and not await self._hot_is_current(key, record):
+            # Outro worker gravou um checkpoint mais novo desta conversa
+            self._hot_drop(key[0])
+            record = None
+        if record is None and self.store is not None:
+            data = await self.store.aload(*key)
+            if data is not None:
+                record = self._unpack(data)
+                self._hot_set(key, record)
+        return record
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        key = self._key(config)
+        record = await self._aload(key)
+        if record is None or not self._matches(config, record):
+            return None
+        return self._to_tuple(key, record)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter=None, before=None,
+                    limit=None) -> AsyncIterator[CheckpointTuple]:
+        if config is None:
+            return
+        checkpoint_tuple = await self.aget_tuple(config)
+        if checkpoint_tuple is not None and before is None:
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        key = self._key(config)
+        record = self._new_record(config, checkpoint, metadata)
+        self._hot_set(key, record)
+        if self.store is not None:
+            await self.store.asave(*key, self._pack(record))
+        await self._publish_version(key[0], checkpoint["id"])
+        return {"configurable": {
+            "thread_id": key[0],
+            "checkpoint_ns": key[1],
+            "checkpoint_id": checkpoint["id"],
+        }}
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self._hot_drop(thread_id)
+        if self.store is not None:
+            await self.store.adelete(thread_id)
+        await self._publish_version(thread_id, "apagado")
+
+
+def build_checkpointer(get_supabase: Callable[[], Awaitable[Any]], versions=None) -> ConversationCheckpointer:
+    """Monta o checkpointer conforme CHECKPOINT_BACKEND (memory, sqlite ou supabase)."""
+    backend = os.getenv("CHECKPOINT_BACKEND", "sqlite").lower()
+    if backend == "supabase":
+        store = SupabaseCheckpointStore(get_supabase)
+    elif backend == "sqlite":
+        store = SQLiteCheckpointStore(os.getenv("CHECKPOINT_SQLITE_PATH", "checkpoints.sqlite"))
+    elif backend == "memory":
+        store = None
+    else:
+        # Erro de digitação não pode virar, calado, conversa que some no restart
+        raise ValueError(f"CHECKPOINT_BACKEND inválido: {backend!r} (use memory, sqlite ou supabase)")
+    return ConversationCheckpointer(
+        store,
+        max_entries=int(os.getenv("CHECKPOINT_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("CHECKPOINT_CACHE_TTL", "1800")),
+        versions=versions,
+    )
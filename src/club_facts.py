@@ -0,0 +1,472 @@
+"""
+Tabela de fatos estruturados do clube: planos de sócio e próximos jogos.
+
+A maior parte do tráfego de vendas pergunta preço e benefícios do Maringá
+Paixão e quando é o próximo jogo. Em vez de busca vetorial + grader em cima
+dos chunks do `conhecimento_clube`, a ingestão extrai desses textos registros
+compactos e o agente consulta a tabela com a tool `lookup_club_facts`:
+- plano: nome, preço, período e benefícios;
+- jogo: adversário, data, horário e local.
+
+A extração é por regras (frases com "plano X" + "R$", frases de benefício,
+frases de jogo com data), sem LLM: roda em cada página alterada sem custo.
+Incremental: cada página guarda o hash do conteúdo de onde os fatos saíram e
+só é reextraída quando o texto muda.
+
+Jogos: a data do texto vira uma data de calendário (`quando`) no momento da
+extração ("domingo" = o próximo domingo; numa agenda, cada dia da semana vem
+depois do jogo anterior). Frases com placar ou verbo de resultado ("venceu",
+"2 x 1") são notícia de jogo passado, não agenda. Na consulta só entram jogos
+de hoje em diante, ordenados pela data.
+
+Distribuição: a ingestão extrai para um SQLite local (com o hash de cada
+página) e publica os fatos de cada página alterada na tabela `fatos_clube` do
+Supabase. A API não depende do arquivo da ingestão: cada worker puxa a tabela
+inteira do Supabase no warmup e de novo quando o snapshot fica velho (mesmo
+padrão dos índices locais), para o SQLite do próprio host. A tabela é pequena
+(dezenas de linhas), então o refresh troca tudo e já leva as remoções.
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from src.lexical_index import fold
+
+# --- Extração ---
+
+_NOME = r"[A-ZÀ-Ý][\wÀ-ÿ]*(?:\s+[A-ZÀ-Ý][\wÀ-ÿ]*)*"
+PRICE_RE = re.compile(r"R\$\s*(\d{1,3}(?:\.\d{3})*(?:,\d{2})?)")
+PLAN_NAME_RE = re.compile(rf"\b(?i:plano)\s+(?!de\b|do\b|da\b)({_NOME})")
+OPPONENT_RE = re.compile(rf"\b(?:contra|x|vs\.?|visita|recebe|enfrenta)\s+(?:o\s+|a\s+)?({_NOME})")
+DATE_RE = re.compile(r"\b(\d{1,2}/\d{1,2}(?:/\d{2,4})?|(?:domingo|segunda|terça|quarta|quinta|sexta|sábado)(?:-feira)?)\b",
+                     re.IGNORECASE)
+TIME_RE = re.compile(r"\b(\d{1,2}h(?:\d{2})?|\d{1,2}:\d{2})\b")
+VENUE_RE = re.compile(rf"\b(?:no|na)\s+(?:estádio\s+|arena\s+)?({_NOME})|\bem\s+({_NOME})")
+GAME_WORDS_RE = re.compile(r"\b(jogo|partida|rodada|enfrenta)\b", re.IGNORECASE)
+# Placar ou verbo de resultado: relato de jogo que já aconteceu
+RESULT_RE = re.compile(r"\b\d{1,2}\s*[x×]\s*\d{1,2}\b|\b(?:venceu|empatou|perdeu|goleou|derrotou|bateu|ganhou|"
+                       r"superou|foi derrotado|placar)\b", re.IGNORECASE)
+WEEKDAYS = {"segunda": 0, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6}
+
+BENEFIT_TERMS = ("desconto", "prioridade", "inclui", "acesso", "grátis", "gratuit", "cadeira", "carteirinha",
+                 "experiência", "concorre", "entram", "brinde", "benefício", "vantage", "estacionamento")
+
+# Termos da pergunta (sem acento) que indicam cada tipo de fato
+PLAN_TERMS = ("plano", "socio", "mensalidade", "assinatura", "beneficio", "vantage")
+GAME_TERMS = ("jogo", "partida", "joga", "adversario", "rodada", "estadio", "confronto")
+
+MAX_BENEFITS = 6
+MAX_GAMES = 3
+
+# Tabela no Supabase com os fatos publicados pela ingestão
+FACTS_TABLE = "fatos_clube"
+
+
+def _sentences(texto: str) -> List[str]:
+    parts = re.split(r"(?<=[.!?])\s+|\n+", texto)
+    return [p.strip() for p in parts if len(p.strip()) > 10]
+
+
+def _period(sentence: str) -> Optional[str]:
+    text = fold(sentence)
+    if re.search(r"por mes|/mes|mensa", text):
+        return "mês"
+    if re.search(r"por ano|/ano|anua", text):
+        return "ano"
+    return None
+
+
+def _plan_names(sentences: List[str], known: List[str]) -> List[str]:
+    names = list(known)
+    for sentence in sentences:
+        for name in PLAN_NAME_RE.findall(sentence):
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def _named(sentence: str, names: List[str]) -> List[str]:
+    """Planos citados na frase (o nome mais longo ganha: "Maringá Paixão Ouro" não conta "Maringá Paixão")."""
+    found = [n for n in sorted(names, key=len, reverse=True) if fold(n) in fold(sentence)]
+    return [n for n in found if not any(n != other and fold(n) in fold(other) for other in found)]
+
+
+def _opponent(sentence: str) -> Optional[str]:
+    for name in OPPONENT_RE.findall(sentence):
+        if not fold(name).startswith("maringa"):
+            return name
+    # "Londrina x Maringá FC": o adversário vem antes do x
+    match = re.search(rf"({_NOME})\s+x\s+Maringá", sentence)
+    return match.group(1) if match else None
+
+
+def _venue(sentence: str, opponent: Optional[str]) -> Optional[str]:
+    for home, away in VENUE_RE.findall(sentence):
+        name = home or away
+        if name and name != opponent and not fold(name).startswith("maringa fc"):
+            return name
+    return None
+
+
+def _match_date(text: str, reference: date) -> Optional[date]:
+    """
+    Data de calendário de "18/10", "18/10/2026" ou "domingo", vista de `reference`.
+    Sem ano: o ano que deixa a data mais perto da referência. Dia da semana: o próximo
+    (ou a própria referência).
+    """
+    folded = fold(text).replace("-feira", "")
+    if folded in WEEKDAYS:
+        return reference + timedelta(days=(WEEKDAYS[folded] - reference.weekday()) % 7)
+    parts = [int(p) for p in folded.split("/")]
+    try:
+        if len(parts) == 3:
+            year = parts[2] + 2000 if parts[2] < 100 else parts[2]
+            return date(year, parts[1], parts[0])
+        candidates = []
+        for year in (reference.year - 1, reference.year, reference.year + 1):
+            try:
+                candidates.append(date(year, parts[1], parts[0]))
+            except ValueError:
+                continue
+        return min(candidates, key=lambda d: abs(d - reference)) if candidates else None
+    except ValueError:
+        return None
+
+
+def _hour_key(hour: Optional[str]) -> int:
+    """Minutos desde a meia-noite ("16h", "16h30", "16:30"); sem horário vai para o fim do dia."""
+    if not hour:
+        return 24 * 60
+    h, _, m = hour.replace("h", ":").partition(":")
+    return int(h) * 60 + int(m or 0)
+
+
+def extract_facts(url: str, texto: str, known_plans: Optional[List[str]] = None,
+                  today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Registros de plano e de jogo de uma página limpa.
+    `known_plans`: nomes já conhecidos (de outras páginas), para reconhecer o
+    plano em frases que não dizem "plano X". `today`: data da extração (referência
+    para "domingo", "18/10").
+    """
+    reference = today or date.today()
+    sentences = _sentences(texto)
+    names = _plan_names(sentences, known_plans or [])
+    plans: Dict[str, Dict[str, Any]] = {}
+    page_plans: List[str] = []
+    generic_benefits: List[str] = []
+    games: List[Dict[str, Any]] = []
+
+    for sentence in sentences:
+        lowered = sentence.lower()
+        named = _named(sentence, names)
+        price = PRICE_RE.search(sentence)
+        about_plans = named or "sócio" in lowered or "plano" in lowered
+
+        # Preço de plano: frase com R$ que cita o plano
+        if price and named:
+            for name in named:
+                plan = plans.setdefault(name, {"nome": name, "preco": None, "periodo": None, "beneficios": []})
+                if plan["preco"] is None:
+                    plan["preco"] = f"R$ {price.group(1)}"
+                    plan["periodo"] = _period(sentence)
+                if name not in page_plans:
+                    page_plans.append(name)
+
+        if about_plans and any(term in lowered for term in BENEFIT_TERMS):
+            if named:
+                for name in named:
+                    plan = plans.setdefault(name, {"nome": name, "preco": None, "periodo": None, "beneficios": []})
+                    plan["beneficios"].append(sentence)
+            elif "sócio" in lowered:
+                generic_benefits.append(sentence)
+
+        opponent = _opponent(sentence)
+        # "sábado, 24/10": a data numérica vale mais que o dia da semana
+        days = DATE_RE.findall(sentence)
+        day = next((d for d in days if "/" in d), days[0] if days else None)
+        hour = TIME_RE.search(sentence)
+        when = _match_date(day, reference) if day else None
+        if (opponent or GAME_WORDS_RE.search(sentence)) and when and not price and not RESULT_RE.search(sentence):
+            if games and "/" not in day:
+                # Agenda em ordem: "na rodada seguinte ... no sábado" é o sábado depois do jogo anterior
+                previous = date.fromisoformat(games[-1]["quando"]) + timedelta(days=1)
+                when = _match_date(day, max(reference, previous))
+            games.append({
+                "adversario": opponent,
+                "data": day,
+                "hora": hour.group(1) if hour else None,
+                "local": _venue(sentence, opponent),
+                "quando": when.isoformat(),
+            })
+            games[-1]["trecho"] = sentence
+
+    # Benefícios "dos sócios" valem para os planos com preço nesta página
+    for name in page_plans:
+        plans[name]["beneficios"].extend(b for b in generic_benefits if b not in plans[name]["beneficios"])
+
+    facts = []
+    for position, plan in enumerate(plans.values()):
+        facts.append({"tipo": "plano", "chave": fold(plan["nome"]), "posicao": position, "fonte_url": url,
+                      "dados": plan})
+    for position, game in enumerate(games):
+        key = "|".join(fold(game[k] or "") for k in ("adversario", "data", "hora"))
+        facts.append({"tipo": "jogo", "chave": key, "posicao": position, "fonte_url": url,
+                      "dados": {k: v for k, v in game.items() if k != "trecho"}, "trecho": game["trecho"]})
+    return facts
+
+
+def to_row(url: str, fact: Dict[str, Any]) -> Dict[str, Any]:
+    """Linha de `fatos_clube` (SQLite local e Supabase): `dados` leva o trecho de origem do jogo."""
+    dados = {**fact["dados"], **({"trecho": fact["trecho"]} if fact.get("trecho") else {})}
+    return {"fonte_url": url, "tipo": fact["tipo"], "chave": fact["chave"], "posicao": fact["posicao"],
+            "dados": dados}
+
+
+def detect_kind(question: str) -> Optional[str]:
+    """"jogo", "plano" ou None (pergunta que a tabela não responde)."""
+    text = fold(question)
+    if any(term in text for term in GAME_TERMS):
+        return "jogo"
+    if any(term in text for term in PLAN_TERMS):
+        return "plano"
+    return None
+
+
+# --- Tabela ---
+
+class ClubFactsTable:
+    """
+    Fatos por página em SQLite; leitura juntando as páginas (planos pelo nome, jogos pela data).
+    As consultas do turno leem um snapshot em memória, refeito só depois de uma escrita
+    desta instância (replace_page, refresh): nada de SQLite no event loop a cada mensagem.
+    """
+
+    def __init__(self, path: str = ".cache/club_facts.sqlite"):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fatos_clube (
+                fonte_url TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                chave TEXT NOT NULL,
+                posicao INTEGER NOT NULL,
+                dados TEXT NOT NULL,
+                atualizado_em REAL NOT NULL,
+                PRIMARY KEY (fonte_url, tipo, chave)
+            );
+            CREATE TABLE IF NOT EXISTS fatos_paginas (
+                fonte_url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+        self.last_refresh = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        # (linhas por tipo, nomes dos planos, nomes sem acento) ou None depois de uma escrita
+        self._snapshot: Optional[Tuple[Dict[str, List[Tuple[str, Dict[str, Any]]]], List[str], List[str]]] = None
+        self.stats = {"consultas": 0, "acertos": 0, "sem_fato": 0}
+
+    # --- Escrita (ingestão) ---
+
+    def page_hash(self, url: str) -> Optional[str]:
+        """Hash do conteúdo de onde saíram os fatos da página (None: nunca extraída)."""
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM fatos_paginas WHERE fonte_url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def replace_page(self, url: str, content_hash: str, facts: List[Dict[str, Any]]) -> int:
+        """Troca os fatos da página pelos extraídos agora (em uma transação). Devolve quantos gravou."""
+        rows = {(f["tipo"], f["chave"]): to_row(url, f) for f in facts}
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM fatos_clube WHERE fonte_url = ?", (url,))
+            self._insert(rows.values())
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fatos_paginas (fonte_url, content_hash) VALUES (?, ?)", (url, content_hash))
+            self._snapshot = None
+        return len(rows)
+
+    def _insert(self, rows) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO fatos_clube (fonte_url, tipo, chave, posicao, dados, atualizado_em) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(r["fonte_url"], r["tipo"], r["chave"], r["posicao"],
+              r["dados"] if isinstance(r["dados"], str) else json.dumps(r["dados"], ensure_ascii=False), now)
+             for r in rows],
+        )
+
+    def replace_all(self, rows: List[Dict[str, Any]]) -> int:
+        """Troca a tabela inteira pelas linhas publicadas no Supabase (refresh da API)."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM fatos_clube")
+            self._insert(rows)
+            self._snapshot = None
+        return len(rows)
+
+    def prune(self, domain: str, seen) -> List[str]:
+        """
+        Apaga os fatos das páginas de `domain` que não estão em `seen` (sumiram do site).
+        Devolve as URLs removidas.
+        """
+        with self._lock, self._conn:
+            urls = {row[0] for row in self._conn.execute(
+                "SELECT fonte_url FROM fatos_paginas UNION SELECT fonte_url FROM fatos_clube")}
+            gone = sorted(u for u in urls if urlparse(u).netloc == domain and u not in seen)
+            self._conn.executemany("DELETE FROM fatos_clube WHERE fonte_url = ?", [(u,) for u in gone])
+            self._conn.executemany("DELETE FROM fatos_paginas WHERE fonte_url = ?", [(u,) for u in gone])
+            if gone:
+                self._snapshot = None
+        return gone
+
+    def plan_names(self) -> List[str]:
+        return list(self._load()[1])
+
+    # --- Leitura (agente) ---
+
+    def _load(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            # Dentro do lock: uma escrita no meio não deixa um snapshot velho para trás
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT tipo, fonte_url, dados FROM fatos_clube ORDER BY atualizado_em DESC, fonte_url, posicao"
+                ).fetchall()
+                by_kind: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+                for kind, url, dados in rows:
+                    by_kind.setdefault(kind, []).append((url, json.loads(dados)))
+                names = list(dict.fromkeys(data["nome"] for _, data in by_kind.get("plano", [])))
+                snapshot = self._snapshot = (by_kind, names, [fold(n) for n in names])
+        return snapshot
+
+    def _rows(self, kind: str) -> List[Tuple[str, Dict[str, Any]]]:
+        return self._load()[0].get(kind, [])
+
+    def _plans(self) -> List[Dict[str, Any]]:
+        plans: Dict[str, Dict[str, Any]] = {}
+        for url, data in self._rows("plano"):
+            key = fold(data["nome"])
+            plan = plans.setdefault(key, {"nome": data["nome"], "preco": None, "periodo": None, "beneficios": [],
+                                          "fontes": []})
+            if plan["preco"] is None and data.get("preco"):
+                plan["preco"], plan["periodo"] = data["preco"], data.get("periodo")
+            plan["beneficios"].extend(b for b in data.get("beneficios", []) if b not in plan["beneficios"])
+            plan["fontes"].append(url)
+        # Planos com preço primeiro (os que só aparecem citados em benefícios vêm depois)
+        return sorted(plans.values(), key=lambda p: p["preco"] is None)
+
+    def _kind(self, question: str) -> Optional[str]:
+        kind = detect_kind(question)
+        if kind is None and any(name in fold(question) for name in self._load()[2]):
+            # "Quanto custa o Maringá Paixão?": o nome do plano já diz o tipo
+            return "plano"
+        return kind
+
+    def _games(self, today: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Jogos de hoje em diante, pela data (mesmo jogo em duas páginas conta uma vez)."""
+        today_iso = (today or date.today()).isoformat()
+        games: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for url, data in self._rows("jogo"):
+            if data.get("quando", "") < today_iso:
+                continue
+            games.setdefault((data["quando"], fold(data.get("adversario") or "")), {**data, "fonte_url": url})
+        return sorted(games.values(), key=lambda g: (g["quando"], _hour_key(g.get("hora"))))
+
+    def lookup(self, question: str, kind: Optional[str] = None, today: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Fatos que respondem a pergunta ([] = a tabela não sabe: use a busca normal)."""
+        self.stats["consultas"] += 1
+        kind = kind or self._kind(question)
+        records: List[Dict[str, Any]] = []
+        text = fold(question)
+        if kind == "plano":
+            plans = self._plans()
+            named = [p for p in plans if fold(p["nome"]) in text]
+            records = [{"tipo": "plano", **p} for p in (named or plans) if p["preco"] or p["beneficios"]]
+        elif kind == "jogo":
+            games = [{"tipo": "jogo", **game} for game in self._games(today)]
+            named = [g for g in games if g.get("adversario") and fold(g["adversario"]) in text]
+            records = (named or games)[:MAX_GAMES]
+        self.stats["acertos" if records else "sem_fato"] += 1
+        return records
+
+    def answerable(self, question: str) -> bool:
+        """A pergunta é de plano/jogo e a tabela tem fatos desse tipo (sem contar como consulta)."""
+        kind = self._kind(question)
+        if kind is None:
+            return False
+        if kind == "jogo":
+            return bool(self._games())
+        return bool(self._rows(kind))
+
+    # --- Sincronização com o Supabase (API) ---
+
+    async def arefresh(self, client, table: str = FACTS_TABLE) -> int:
+        """Puxa todos os fatos publicados pela ingestão. Devolve quantas linhas a tabela local ficou."""
+        res = await client.table(table).select("fonte_url, tipo, chave, posicao, dados").execute()
+        count = await asyncio.to_thread(self.replace_all, res.data or [])
+        self.last_refresh = time.monotonic()
+        return count
+
+    def schedule_refresh(self, get_client, max_age: float) -> None:
+        """Dispara um refresh em background se o snapshot estiver velho (não bloqueia a consulta)."""
+        if time.monotonic() - self.last_refresh < max_age:
+            return
+        if self._refreshing is not None and not self._refreshing.done():
+            return
+
+        async def run():
+            try:
+                await self.arefresh(await get_client())
+            except Exception as e:
+                # Mantém o snapshot atual e não tenta de novo a cada turno enquanto o Supabase estiver fora
+                self.last_refresh = time.monotonic()
+                print(f"Erro ao atualizar tabela de fatos: {e}")
+
+        self._refreshing = asyncio.create_task(run())
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self._load()[0].values())
+
+    def metrics(self) -> Dict[str, float]:
+        return {**self.stats, "fatos": len(self)}
+
+
+def format_facts(records: List[Dict[str, Any]]) -> str:
+    """Texto compacto para o contexto da resposta."""
+    lines = []
+    plans = [r for r in records if r["tipo"] == "plano"]
+    games = [r for r in records if r["tipo"] == "jogo"]
+    if plans:
+        lines.append("PLANOS DE SÓCIO:")
+        for plan in plans:
+            price = plan["preco"] + (f" por {plan['periodo']}" if plan.get("periodo") else "") if plan["preco"] else \
+                "preço não informado"
+            lines.append(f"- {plan['nome']}: {price}.")
+            lines.extend(f"  • {b}" for b in plan["beneficios"][:MAX_BENEFITS])
+    if games:
+        lines.append("PRÓXIMOS JOGOS (por data):")
+        for game in games:
+            day = game.get("data")
+            if day and "/" not in day and game.get("quando"):
+                # "domingo (18/10)": o dia da semana sozinho é ambíguo
+                day = f"{day} ({date.fromisoformat(game['quando']).strftime('%d/%m')})"
+            when = " às ".join(v for v in (day, game.get("hora")) if v)
+            where = f", {game['local']}" if game.get("local") else ""
+            against = f"Maringá FC x {game['adversario']}" if game.get("adversario") else "Maringá FC"
+            lines.append(f"- {against}: {when}{where}.")
+    return "\n".join(lines)
+
+
+def build_club_facts() -> ClubFactsTable:
+    return ClubFactsTable(os.getenv("CLUB_FACTS_PATH", ".cache/club_facts.sqlite"))
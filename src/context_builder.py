@@ -0,0 +1,178 @@
+"""
+Montagem do contexto do RAG a partir dos trechos recuperados.
+
+A ingestão corta as páginas em chunks de 600 caracteres com 100 de overlap,
+então trechos vizinhos da mesma página repetem texto. Antes de virar contexto:
+1. Mescla: trechos da mesma `fonte_url` contidos um no outro viram um só, e
+   trechos vizinhos (fim de um = começo do outro) são emendados sem repetir o
+   overlap.
+2. Diversidade (MMR): dos candidatos, escolhe até `k` trechos equilibrando a
+   posição no ranking da busca com a redundância em relação aos já escolhidos
+   (Jaccard dos termos do BM25: a busca não devolve os vetores). Quase
+   duplicatas (ex.: a mesma notícia em duas URLs) saem.
+3. Orçamento: cada nó recebe no máximo N tokens de contexto (grader e
+   resposta têm orçamentos próprios); o último trecho que não cabe inteiro é
+   cortado no fim de uma frase.
+
+Cada trecho montado guarda os chunks originais em `trechos` (o cache de
+respostas valida pelo hash deles).
+"""
+import os
+from typing import Any, Dict, List, Optional, Set
+
+from src.lexical_index import tokenize
+from src.summarizer import count_tokens
+
+
+def _overlap(left: str, right: str, min_overlap: int) -> int:
+    """Tamanho do maior sufixo de `left` que é prefixo de `right` (0 se menor que `min_overlap`)."""
+    for size in range(min(len(left), len(right)) - 1, min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _join(left: Dict[str, Any], right: Dict[str, Any], text: str) -> Dict[str, Any]:
+    similarities = [s for s in (left.get("similarity"), right.get("similarity")) if s is not None]
+    return {
+        **right, **left,
+        "conteudo": text,
+        "similarity": max(similarities) if similarities else None,
+        "trechos": left["trechos"] + right["trechos"],
+        "_posicao": min(left["_posicao"], right["_posicao"]),
+    }
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Corta no fim da última frase que cabe em `max_tokens` (ou no limite, se não houver frase)."""
+    limit = max(0, (max_tokens - 1) * 3)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    end = max(cut.rfind(". "), cut.rfind("\n"), cut.rfind("! "), cut.rfind("? "))
+    return cut[:end + 1].rstrip() if end > limit // 2 else cut.rstrip()
+
+
+class ContextBuilder:
+    def __init__(self, min_overlap: int = 20, mmr_lambda: float = 0.7, duplicate_threshold: float = 0.85,
+                 min_passage_tokens: int = 30):
+        self.min_overlap = min_overlap
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.min_passage_tokens = min_passage_tokens
+        self.stats = {"montagens": 0, "trechos_recebidos": 0, "trechos_mesclados": 0,
+                      "trechos_redundantes": 0, "trechos_usados": 0, "tokens_cortados": 0}
+
+    # --- 1. Mescla por página ---
+
+    def merge(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Junta trechos da mesma fonte_url que se sobrepõem, mantendo a ordem do ranking."""
+        merged: List[Dict[str, Any]] = []
+        for position, doc in enumerate(docs):
+            current = {**doc, "conteudo": doc["conteudo"].strip(), "trechos": [doc["conteudo"]], "_posicao": position}
+            changed = True
+            while changed:
+                changed = False
+                for i, other in enumerate(merged):
+                    if not current.get("fonte_url") or other.get("fonte_url") != current["fonte_url"]:
+                        continue
+                    text = self._merge_text(other["conteudo"], current["conteudo"])
+                    if text is None:
+                        continue
+                    # O trecho emendado fica na posição do mais bem ranqueado e ainda pode emendar com outro
+                    current = _join(other, current, text)
+                    del merged[i]
+                    self.stats["trechos_mesclados"] += 1
+                    changed = True
+                    break
+            merged.append(current)
+        # Posição de cada trecho = a do seu chunk mais bem ranqueado
+        merged.sort(key=lambda d: d["_posicao"])
+        return [{k: v for k, v in d.items() if k != "_posicao"} for d in merged]
+
+    def _merge_text(self, first: str, second: str) -> Optional[str]:
+        if second in first:
+            return first
+        if first in second:
+            return second
+        size = _overlap(first, second, self.min_overlap)
+        if size:
+            return first + second[size:]
+        size = _overlap(second, first, self.min_overlap)
+        if size:
+            return second + first[size:]
+        return None
+
+    # --- 2. Diversidade ---
+
+    def diversify(self, docs: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        """MMR sobre a ordem do ranking: relevância pela posição, redundância por Jaccard."""
+        terms: List[Set[str]] = [set(tokenize(d["conteudo"])) for d in docs]
+        relevance = [1.0 - i / len(docs) for i in range(len(docs))]
+        selected: List[int] = []
+        candidates = list(range(len(docs)))
+        while candidates and len(selected) < k:
+            best, best_score = None, None
+            for i in list(candidates):
+                redundancy = max((self._jaccard(terms[i], terms[j]) for j in selected), default=0.0)
+                if redundancy >= self.duplicate_threshold:
+                    candidates.remove(i)
+                    self.stats["trechos_redundantes"] += 1
+                    continue
+                score = self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * redundancy
+                if best_score is None or score > best_score:
+                    best, best_score = i, score
+            if best is None:
+                break
+            selected.append(best)
+            candidates.remove(best)
+        return [docs[i] for i in selected]
+
+    @staticmethod
+    def _jaccard(a: Set[str], b: Set[str]) -> float:
+        return len(a & b) / len(a | b) if a and b else 0.0
+
+    # --- 3. Orçamento ---
+
+    def fit(self, passages: List[str], max_tokens: int) -> List[str]:
+        """Trechos em ordem até `max_tokens` (0 = sem limite); o primeiro sempre entra, mesmo cortado."""
+        if max_tokens <= 0:
+            return list(passages)
+        result, used = [], 0
+        for i, passage in enumerate(passages):
+            tokens = count_tokens(passage)
+            left = max_tokens - used
+            if tokens <= left:
+                result.append(passage)
+                used += tokens
+                continue
+            # Não cabe inteiro: corta numa frase se sobrar espaço útil, e para
+            if not result or left >= self.min_passage_tokens:
+                result.append(_truncate(passage, left))
+            self.stats["tokens_cortados"] += sum(count_tokens(p) for p in passages[i:]) - (
+                count_tokens(result[-1]) if len(result) > i else 0)
+            break
+        return result
+
+    def build(self, docs: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        """Mescla, deduplica e escolhe até `k` trechos (mais relevante primeiro)."""
+        self.stats["montagens"] += 1
+        self.stats["trechos_recebidos"] += len(docs)
+        docs = [d for d in docs if d.get("conteudo")]
+        if not docs:
+            return []
+        selected = self.diversify(self.merge(docs), k)
+        self.stats["trechos_usados"] += len(selected)
+        return selected
+
+    def metrics(self) -> Dict[str, float]:
+        return dict(self.stats)
+
+
+def build_context_builder() -> ContextBuilder:
+    """Montagem configurada por CONTEXT_* (mesmo padrão do build_grader)."""
+    return ContextBuilder(
+        min_overlap=int(os.getenv("CONTEXT_MIN_OVERLAP", "20")),
+        mmr_lambda=float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7")),
+        duplicate_threshold=float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.85")),
+    )
@@ -0,0 +1,220 @@
+"""
+Crawler assíncrono (BFS) do site do Maringá FC.
+
+- Cliente HTTP único (pool de conexões com keep-alive) para todo o crawl.
+- Limite de requisições simultâneas por host e respeito ao robots.txt
+  (Disallow e Crawl-delay).
+- Sementes: URL base + URLs do sitemap.xml (e sitemaps declarados no robots).
+- URLs normalizadas (esquema/host em minúsculas, sem fragmento, sem parâmetros
+  de rastreamento, query ordenada) para não baixar a mesma página duas vezes.
+- As páginas saem por um iterador assíncrono com fila limitada: o consumidor
+  (chunking/embeddings) dita o ritmo e nada fica acumulado em memória.
+- Um erro numa página (link malformado, HTML quebrado) só perde aquela página:
+  ela vai para `failed` e o worker segue com a fila.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+from urllib.robotparser import RobotFileParser
+from xml.etree import ElementTree
+
+import httpx
+from bs4 import BeautifulSoup
+
+USER_AGENT = "DogaoSDRBot/1.0 (+https://maringafc.com.br)"
+
+# Parâmetros que não mudam o conteúdo da página
+TRACKING_PARAMS = {"fbclid", "gclid", "ref", "share", "amp"}
+SKIP_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".zip", ".mp4", ".mp3", ".css", ".js")
+
+
+def normalize_url(url: str) -> str:
+    """Forma canônica da URL usada para deduplicação."""
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parsed.path or "/"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    )
+    return urlunparse((scheme, netloc, path, "", urlencode(query), ""))
+
+
+@dataclass
+class FetchedPage:
+    url: str
+    depth: int
+    status: int
+    html: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    links: List[str] = field(default_factory=list)
+
+
+class Crawler:
+    """BFS até `max_depth` dentro do domínio da URL base."""
+
+    def __init__(self, base_url: str, max_depth: int = 3, max_pages: int = 2000,
+                 concurrency: int = 8, per_host_limit: int = 4, timeout: float = 10,
+                 conditional_headers: Optional[Callable[[str], Dict[str, str]]] = None,
+                 known_links: Optional[Callable[[str], List[str]]] = None,
+                 use_sitemap: bool = True):
+        self.base_url = normalize_url(base_url)
+        self.domain = urlparse(self.base_url).netloc
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.conditional_headers = conditional_headers
+        # Em 304 não há corpo: os links vêm do que foi salvo na última ingestão
+        self.known_links = known_links
+        self.use_sitemap = use_sitemap
+        self.robots: Optional[RobotFileParser] = None
+        self.crawl_delay = 0.0
+        self.seen = set()
+        self.failed: List[str] = []
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._host_next_request: Dict[str, float] = {}
+
+    # --- Regras ---
+
+    def is_allowed(self, url: str) -> bool:
+        parsed = urlparse(url)
+        if parsed.netloc != self.domain or parsed.scheme not in ("http", "https"):
+            return False
+        if parsed.path.lower().endswith(SKIP_EXTENSIONS):
+            return False
+        return self.robots is None or self.robots.can_fetch(USER_AGENT, url)
+
+    def extract_links(self, page_url: str, html: str):
+        soup = BeautifulSoup(html, "html.parser")
+        for a in soup.find_all("a", href=True):
+            try:
+                yield normalize_url(urljoin(page_url, a["href"]))
+            except ValueError:
+                # Ex.: "http://[quebrado" (IPv6 inválido) no HTML do site
+                continue
+
+    # --- Sementes: robots.txt e sitemap.xml ---
+
+    async def _load_robots(self, client: httpx.AsyncClient):
+        robots_url = urljoin(self.base_url, "/robots.txt")
+        self.robots = RobotFileParser(robots_url)
+        try:
+            res = await client.get(robots_url)
+            lines = res.text.splitlines() if res.status_code == 200 else []
+        except httpx.HTTPError:
+            lines = []
+        self.robots.parse(lines)
+        self.crawl_delay = float(self.robots.crawl_delay(USER_AGENT) or 0)
+        return self.robots.site_maps() or []
+
+    async def _sitemap_urls(self, client: httpx.AsyncClient, sitemap_url: str, depth: int = 0):
+        """URLs de um sitemap (segue índices de sitemap até 2 níveis)."""
+        try:
+            res = await client.get(sitemap_url)
+            if res.status_code != 200:
+                return []
+            root = ElementTree.fromstring(res.content)
+        except (httpx.HTTPError, ElementTree.ParseError):
+            return []
+        locs = [el.text.strip() for el in root.iter() if el.tag.endswith("loc") and el.text]
+        if root.tag.endswith("sitemapindex") and depth < 2:
+            urls = []
+            for loc in locs:
+                urls.extend(await self._sitemap_urls(client, loc, depth + 1))
+            return urls
+        return [normalize_url(u) for u in locs]
+
+    # --- Fetch com politeness ---
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str, depth: int) -> Optional[FetchedPage]:
+        host = urlparse(url).netloc
+        limit = self._host_limits.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+        async with limit:
+            if self.crawl_delay:
+                # Espaça as requisições ao host conforme o Crawl-delay do robots.txt
+                now = time.monotonic()
+                start = max(now, self._host_next_request.get(host, now))
+                self._host_next_request[host] = start + self.crawl_delay
+                await asyncio.sleep(start - now)
+            headers = self.conditional_headers(url) if self.conditional_headers else {}
+            try:
+                res = await client.get(url, headers=headers)
+            except httpx.HTTPError as e:
+                print(f"Erro ao baixar {url}: {e}")
+                return None
+        if res.status_code == 304:
+            return FetchedPage(url, depth, 304)
+        if res.status_code != 200 or "html" not in res.headers.get("content-type", "html"):
+            return None
+        return FetchedPage(url, depth, 200, res.text, res.headers.get("ETag"), res.headers.get("Last-Modified"))
+
+    # --- BFS ---
+
+    async def crawl(self) -> AsyncIterator[FetchedPage]:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits, follow_redirects=True,
+                                     headers={"User-Agent": USER_AGENT}) as client:
+            sitemaps = await self._load_robots(client)
+            seeds = [self.base_url]
+            if self.use_sitemap:
+                for sitemap_url in sitemaps or [urljoin(self.base_url, "/sitemap.xml")]:
+                    seeds.extend(await self._sitemap_urls(client, sitemap_url))
+
+            frontier: asyncio.Queue = asyncio.Queue()
+            output: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+            for seed in seeds:
+                self._enqueue(frontier, seed, 0)
+
+            async def worker():
+                while True:
+                    url, depth = await frontier.get()
+                    try:
+                        page = await self._fetch(client, url, depth)
+                        if page is None:
+                            continue
+                        if page.html:
+                            page.links = await asyncio.to_thread(lambda: list(dict.fromkeys(self.extract_links(url, page.html))))
+                        elif page.status == 304 and self.known_links:
+                            page.links = list(self.known_links(url) or [])
+                        if depth < self.max_depth:
+                            for link in page.links:
+                                self._enqueue(frontier, link, depth + 1)
+                        await output.put(page)
+                    except Exception as e:
+                        # Sem isso o worker morre e frontier.join() nunca termina
+                        print(f"Erro ao processar {url}: {type(e).__name__}: {e}")
+                        self.failed.append(url)
+                    finally:
+                        frontier.task_done()
+
+            workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+
+            async def close_when_done():
+                await frontier.join()
+                await output.put(None)
+
+            closer = asyncio.create_task(close_when_done())
+            try:
+                while True:
+                    page = await output.get()
+                    if page is None:
+                        break
+                    yield page
+            finally:
+                for task in workers + [closer]:
+                    task.cancel()
+                await asyncio.gather(*workers, closer, return_exceptions=True)
+
+    def _enqueue(self, frontier: asyncio.Queue, url: str, depth: int):
+        if url in self.seen or len(self.seen) >= self.max_pages or not self.is_allowed(url):
+            return
+        self.seen.add(url)
+        frontier.put_nowait((url, depth))
@@ -0,0 +1,243 @@
+"""
+Cache de embeddings endereçado por conteúdo (texto normalizado + modelo).
+
+- Camada 1: LRU em memória, limitada por número de vetores.
+- Camada 2 (opcional): arquivo em disco com uma matriz float32 memory-mapped.
+  Cada registro tem tamanho fixo (chave sha256 de 32 bytes + vetor), é só
+  append e o índice chave -> linha é reconstruído a partir da coluna de chaves.
+  Assim o agente (retrieve_docs) e a ingestão compartilham o mesmo arquivo.
+"""
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_HEADER_MAGIC = b"EMBC"
+_HEADER_SIZE = 16
+
+
+def normalize_text(text: str) -> str:
+    """Normalização usada na chave: unicode NFKC, caixa e espaços."""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def cache_key(text: str, model: str) -> bytes:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class DiskEmbeddingStore:
+    """Matriz float32 memory-mapped com índice chave -> linha."""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype([("key", "S32"), ("vec", "<f4", (dim,))])
+        self._lock = threading.Lock()
+        self._index: Dict[bytes, int] = {}
+        self._matrix = None
+        self._size = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(_HEADER_MAGIC + np.uint32(dim).tobytes() + b"\x00" * 8)
+        else:
+            self._check_header()
+            self._truncate_partial_record()
+        self._refresh()
+
+    @classmethod
+    def open_existing(cls, path: str) -> Optional["DiskEmbeddingStore"]:
+        """Abre um arquivo já existente (descobre a dimensão pelo cabeçalho)."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+        return cls(path, int(np.frombuffer(header[4:8], dtype=np.uint32)[0]))
+
+    def _check_header(self):
+        with open(self.path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+        if header[:4] != _HEADER_MAGIC or int(np.frombuffer(header[4:8], dtype=np.uint32)[0]) != self.dim:
+            raise ValueError(f"Arquivo de cache de embeddings inválido: {self.path}")
+
+    def _truncate_partial_record(self):
+        # Descarta um registro incompleto no final (processo interrompido no meio da escrita)
+        size = os.path.getsize(self.path) - _HEADER_SIZE
+        extra = size % self.dtype.itemsize
+        if extra:
+            with open(self.path, "r+b") as f:
+                f.truncate(os.path.getsize(self.path) - extra)
+
+    def _refresh(self):
+        """Remapeia o arquivo se outro processo (ou nós) acrescentou registros."""
+        rows = (os.path.getsize(self.path) - _HEADER_SIZE) // self.dtype.itemsize
+        if rows == self._size:
+            return
+        self._matrix = np.memmap(self.path, dtype=self.dtype, mode="r", offset=_HEADER_SIZE, shape=(rows,))
+        for row, key in enumerate(self._matrix["key"][self._size:rows], start=self._size):
+            self._index[bytes(key)] = row
+        self._size = rows
+
+    def __len__(self):
+        return self._size
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                self._refresh()
+                row = self._index.get(key)
+            if row is None:
+                return None
+            return np.array(self._matrix["vec"][row])
+
+    def put(self, key: bytes, vector) -> None:
+        record = np.zeros(1, dtype=self.dtype)
+        record["key"] = key
+        record["vec"] = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if key in self._index:
+                return
+            # Uma única escrita em modo append por registro
+            with open(self.path, "ab") as f:
+                f.write(record.tobytes())
+            self._refresh()
+
+
+class CachedEmbeddings(Embeddings):
+    """Envolve um modelo de embeddings com cache LRU + disco opcional."""
+
+    def __init__(self, underlying: Embeddings, model: str, max_entries: int = 5000,
+                 cache_dir: Optional[str] = None, rate_limiter=None):
+        self.underlying = underlying
+        # Limitador compartilhado com o LLM (src/rate_limiter.py); só nas chamadas assíncronas
+        self.rate_limiter = rate_limiter
+        self.model = model
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self._lru: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[DiskEmbeddingStore] = None
+        if cache_dir:
+            self._disk = DiskEmbeddingStore.open_existing(self._disk_path())
+
+    def _disk_path(self) -> str:
+        safe_model = re.sub(r"[^A-Za-z0-9_.-]", "_", self.model)
+        return os.path.join(self.cache_dir, f"{safe_model}.vec")
+
+    # --- Cache ---
+
+    def _lookup(self, key: bytes) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                return vector
+        if self._disk is None and self.cache_dir:
+            # O arquivo pode ter sido criado por outro processo (ex.: a ingestão)
+            self._disk = DiskEmbeddingStore.open_existing(self._disk_path())
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+            return vector
+        return None
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _store(self, key: bytes, vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        self._remember(key, array)
+        if self.cache_dir:
+            if self._disk is None:
+                self._disk = DiskEmbeddingStore(self._disk_path(), len(array))
+            self._disk.put(key, array)
+        return array
+
+    def _split(self, texts: List[str]):
+        """Separa acertos do cache e textos (únicos) que precisam ir para a API."""
+        keys = [cache_key(t, self.model) for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        pending: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in pending:
+                continue
+            vector = self._lookup(key)
+            if vector is None:
+                pending[key] = text
+            else:
+                found[key] = vector
+        self.hits += len(texts) - len(pending)
+        self.misses += len(pending)
+        return keys, found, pending
+
+    # --- Interface Embeddings ---
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, pending = self._split(texts)
+        if pending:
+            self.api_calls += 1
+            vectors = self.underlying.embed_documents(list(pending.values()))
+            for key, vector in zip(pending, vectors):
+                found[key] = self._store(key, vector)
+        return [found[k].tolist() for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found, pending = self._split([text])
+        if pending:
+            self.api_calls += 1
+            found[keys[0]] = self._store(keys[0], self.underlying.embed_query(text))
+        return found[keys[0]].tolist()
+
+    async def _acquire(self, texts):
+        if self.rate_limiter is not None:
+            tokens = sum(len(t) // 3 + 1 for t in texts)
+            await self.rate_limiter.acquire(tokens)
+            self.rate_limiter.settle(tokens, tokens)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, pending = self._split(texts)
+        if pending:
+            self.api_calls += 1
+            await self._acquire(pending.values())
+            vectors = await self.underlying.aembed_documents(list(pending.values()))
+            for key, vector in zip(pending, vectors):
+                found[key] = self._store(key, vector)
+        return [found[k].tolist() for k in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, found, pending = self._split([text])
+        if pending:
+            self.api_calls += 1
+            await self._acquire([text])
+            found[keys[0]] = self._store(keys[0], await self.underlying.aembed_query(text))
+        return found[keys[0]].tolist()
+
+
+def build_cached_embeddings(model: str = "text-embedding-3-small", rate_limiter=None) -> CachedEmbeddings:
+    """Embeddings da OpenAI com cache, configurado por EMBEDDING_CACHE_SIZE / EMBEDDING_CACHE_DIR."""
+    from langchain_openai import OpenAIEmbeddings
+    from src.http_pool import get_http_client
+    return CachedEmbeddings(
+        OpenAIEmbeddings(model=model, http_async_client=get_http_client("openai")),
+        model=model,
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "5000")),
+        cache_dir=os.getenv("EMBEDDING_CACHE_DIR") or None,
+        rate_limiter=rate_limiter,
+    )
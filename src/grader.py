@@ -0,0 +1,128 @@
+"""
+Grader em camadas para o `grade_documents`.
+
+1. Similaridade: a busca vetorial já devolve a similaridade de cada trecho.
+   Top >= `accept` aprova na hora; todos < `reject` reprovam na hora.
+2. Cross-encoder local (sentence-transformers) para a faixa ambígua: pontua
+   os pares (pergunta, trecho) na CPU, sem ida à OpenAI.
+3. LLM (opcional, `GRADER_LLM_ENABLED=true`): o grader antigo com GPT, usado
+   só quando o cross-encoder não está disponível.
+Sem cross-encoder nem LLM, a faixa ambígua é decidida pelo meio da faixa.
+
+O cross-encoder é carregado em segundo plano (`preload()`, no warmup da API).
+Enquanto carrega, a faixa ambígua também vai pelo meio da faixa: nenhum turno
+espera o modelo.
+
+Cada camada conta decisões, aprovações e latência (`metrics()`).
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+TIERS = ("similaridade", "cross_encoder", "llm", "fallback")
+
+
+class TieredGrader:
+    def __init__(self, accept: float = 0.80, reject: float = 0.55,
+                 cross_encoder_model: Optional[str] = None, cross_encoder_threshold: float = 0.5,
+                 llm_grader: Optional[Callable[[str, str], Awaitable[bool]]] = None):
+        self.accept = accept
+        self.reject = reject
+        self.cross_encoder_model = cross_encoder_model
+        self.cross_encoder_threshold = cross_encoder_threshold
+        self.llm_grader = llm_grader
+        self._cross_encoder = None
+        self._cross_encoder_failed = False
+        self._loading: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Dict[str, float]] = {
+            tier: {"decisoes": 0, "relevantes": 0, "latencia_total": 0.0} for tier in TIERS
+        }
+
+    # --- Cross-encoder (carregado em segundo plano, uma vez por processo) ---
+
+    def _load_cross_encoder(self):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            print("⚠️ sentence-transformers não instalado: grader sem cross-encoder")
+            return None
+        return CrossEncoder(self.cross_encoder_model)
+
+    async def _load(self):
+        try:
+            self._cross_encoder = await asyncio.to_thread(self._load_cross_encoder)
+        except Exception as e:
+            print(f"⚠️ Falha ao carregar cross-encoder {self.cross_encoder_model}: {e}")
+        self._cross_encoder_failed = self._cross_encoder is None
+
+    def preload(self) -> Optional[asyncio.Task]:
+        """Começa a carregar o cross-encoder sem esperar (idempotente). Devolve a task do carregamento."""
+        # Task de outro event loop (já fechado) não terminou o carregamento: começa de novo
+        if self._cross_encoder_loading() and (self._loading is None or self._loading.done()):
+            self._loading = asyncio.create_task(self._load())
+        return self._loading
+
+    def _cross_encoder_loading(self) -> bool:
+        return bool(self.cross_encoder_model) and self._cross_encoder is None and not self._cross_encoder_failed
+
+    async def _cross_encoder_relevant(self, model, question: str, passages: List[str]) -> bool:
+        scores = await asyncio.to_thread(model.predict, [(question, p) for p in passages])
+        return float(max(scores)) >= self.cross_encoder_threshold
+
+    # --- Avaliação ---
+
+    async def _decide(self, question: str, passages: List[str],
+                      similarities: List[Optional[float]]) -> Tuple[bool, str]:
+        known = [s for s in similarities if s is not None]
+        if known:
+            top = max(known)
+            if top >= self.accept:
+                return True, "similaridade"
+            # Trecho só do BM25 (similaridade None) impede a reprovação direta
+            if top < self.reject and len(known) == len(similarities):
+                return False, "similaridade"
+
+        model = self._cross_encoder
+        if model is not None and passages:
+            return await self._cross_encoder_relevant(model, question, passages), "cross_encoder"
+
+        if self._cross_encoder_loading():
+            # Modelo ainda carregando: decide pela similaridade em vez de esperar
+            self.preload()
+        elif self.llm_grader is not None:
+            return await self.llm_grader(question, "\n\n".join(passages)), "llm"
+
+        # Faixa ambígua sem modelo: meio da faixa (sem similaridade, ex.: loja ou BM25, aprova)
+        if known and len(known) == len(similarities):
+            return max(known) >= (self.accept + self.reject) / 2, "fallback"
+        return True, "fallback"
+
+    async def grade(self, question: str, passages: List[str],
+                    similarities: Optional[List[Optional[float]]] = None) -> Tuple[bool, str]:
+        """(relevante, camada que decidiu). Similaridade None = trecho sem score vetorial."""
+        start = time.perf_counter()
+        relevant, tier = await self._decide(question, passages, similarities or [])
+        stats = self.stats[tier]
+        stats["decisoes"] += 1
+        stats["relevantes"] += int(relevant)
+        stats["latencia_total"] += time.perf_counter() - start
+        return relevant, tier
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        return {
+            tier: {**s, "latencia_media": s["latencia_total"] / s["decisoes"] if s["decisoes"] else 0.0}
+            for tier, s in self.stats.items()
+        }
+
+
+def build_grader(llm_grader: Optional[Callable[[str, str], Awaitable[bool]]] = None) -> TieredGrader:
+    """Grader configurado por GRADER_* (o LLM só entra com GRADER_LLM_ENABLED=true)."""
+    llm_enabled = os.getenv("GRADER_LLM_ENABLED", "false").lower() == "true"
+    return TieredGrader(
+        accept=float(os.getenv("GRADER_ACCEPT_SIMILARITY", "0.80")),
+        reject=float(os.getenv("GRADER_REJECT_SIMILARITY", "0.55")),
+        cross_encoder_model=os.getenv("GRADER_CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1") or None,
+        cross_encoder_threshold=float(os.getenv("GRADER_CROSS_ENCODER_THRESHOLD", "0.5")),
+        llm_grader=llm_grader if llm_enabled else None,
+    )
@@ -0,0 +1,57 @@
+"""
+Pool de conexões HTTP do processo, um cliente por serviço (OpenAI, Supabase, Tavily).
+
+Cada worker da API é um processo com os seus clientes. Sem um cliente
+compartilhado, o SDK de cada serviço decidia sozinho (o wrapper do Tavily
+abria uma sessão nova por busca: DNS + TLS a cada chamada). Aqui cada serviço
+tem um `httpx.AsyncClient` criado na primeira chamada, reaproveitado por
+todos os turnos do worker, com limites e keep-alive configuráveis:
+
+    HTTP_MAX_CONNECTIONS / HTTP_MAX_KEEPALIVE / HTTP_KEEPALIVE_SECONDS / HTTP_TIMEOUT_SECONDS
+
+e por serviço com o prefixo do serviço (ex.: OPENAI_HTTP_MAX_KEEPALIVE=50).
+"""
+import os
+from typing import Dict
+
+import httpx
+
+SERVICES = ("openai", "supabase", "tavily")
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _setting(service: str, name: str, default: str) -> float:
+    return float(os.getenv(f"{service.upper()}_HTTP_{name}", os.getenv(f"HTTP_{name}", default)))
+
+
+def pool_settings(service: str) -> Dict[str, float]:
+    return {
+        "max_connections": int(_setting(service, "MAX_CONNECTIONS", "100")),
+        "max_keepalive": int(_setting(service, "MAX_KEEPALIVE", "20")),
+        "keepalive_seconds": _setting(service, "KEEPALIVE_SECONDS", "60"),
+        "timeout": _setting(service, "TIMEOUT_SECONDS", "60"),
+    }
+
+
+def get_http_client(service: str) -> httpx.AsyncClient:
+    """Cliente HTTP do serviço neste processo (criado na primeira chamada)."""
+    client = _clients.get(service)
+    if client is None or client.is_closed:
+        settings = pool_settings(service)
+        client = _clients[service] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_keepalive"],
+                keepalive_expiry=settings["keepalive_seconds"],
+            ),
+            timeout=httpx.Timeout(settings["timeout"], connect=10.0),
+        )
+    return client
+
+
+async def close_http_clients():
+    """Fecha as conexões abertas (shutdown do worker)."""
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
@@ -1,103 +1,420 @@
 import os
-import requests
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from supabase import create_client
-from langchain_openai import OpenAIEmbeddings
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from supabase import acreate_client
+from src.club_facts import FACTS_TABLE, build_club_facts, extract_facts, to_row
+from src.crawler import Crawler
+from src.embedding_cache import build_cached_embeddings
+from src.lexical_index import LexicalIndex
+from src.vector_index import LocalVectorIndex
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from urllib.parse import urljoin, urlparse
 
 load_dotenv()
 
 # Configurações
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
-embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
-
-def is_valid_url(url, base_domain):
-    """Garante que ficaremos apenas dentro do site do Maringá FC."""
-    parsed = urlparse(url)
-    return parsed.netloc == base_domain and not parsed.fragment
-
-def get_all_links(base_url):
-    """Crawler simples para mapear as páginas do site."""
-    domain = urlparse(base_url).netloc
-    links = {base_url}
-    try:
-        response = requests.get(base_url, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for a in soup.find_all('a', href=True):
-            full_url = urljoin(base_url, a['href'])
-            if is_valid_url(full_url, domain):
-                links.add(full_url)
-    except Exception as e:
-        print(f"Erro ao mapear links: {e}")
-    return links
-
-def scrape_and_process(url):
+# Compartilha o cache de embeddings com o agente: chunks inalterados não geram chamadas à OpenAI
+embeddings_model = build_cached_embeddings("text-embedding-3-small")
+
+# Pipeline de embeddings em lote
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "96"))         # chunks por chamada
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "40000"))  # tokens por chamada
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))        # lotes simultâneos
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "200"))      # linhas por insert
+
+# Crawler
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "3"))
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "2000"))
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "8"))
+CRAWL_PER_HOST_LIMIT = int(os.getenv("CRAWL_PER_HOST_LIMIT", "4"))
+
+# Ingestão incremental: estado por URL e hash por chunk
+PAGES_TABLE = "paginas_ingeridas"
+KNOWLEDGE_TABLE = "conhecimento_clube"
+# Linhas por página ao procurar (e apagar) chunks de páginas que sumiram do site
+PRUNE_PAGE_SIZE = 1000
+
+# Tabela de fatos estruturados (planos e jogos) consultada pelo agente
+CLUB_FACTS_ENABLED = os.getenv("CLUB_FACTS_ENABLED", "true").lower() == "true"
+
+# Erros transitórios da OpenAI que valem retry com backoff
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+def clean_html(html):
     """Extrai e limpa o conteúdo textual de uma página."""
-    try:
-        res = requests.get(url, timeout=10)
-        soup = BeautifulSoup(res.text, 'html.parser')
-        
-        # Remove ruídos comuns de sites e elementos de navegação
-        for script_or_style in soup(["script", "style", "nav", "footer", "header", "aside", "form", "button", "iframe"]):
-            script_or_style.decompose()
-        
-        # Remove elementos com classes suspeitas de serem ruído
-        for tag in soup.find_all(class_=lambda x: x and any(cls in x.lower() for cls in ['voltar', 'back', 'menu', 'share', 'print', 'hidden'])):
-            tag.decompose()
-
-        texto = soup.get_text(separator=' ')
-        
-        # Limpeza de espaços extras e linhas inúteis
-        linhas = (line.strip() for line in texto.splitlines())
-        
-        # Filtra linhas muito curtas ou irrelevantes que sobraram
-        keywords_ignore = {"voltar", "imprimir", "compartilhar", "menu", "topo", "anterior", "próxima"}
-        
-        def is_useful(line):
-            if not line: return False
-            if line.lower() in keywords_ignore: return False
-            if len(line.split()) < 2 and len(line) < 15: # Linhas muito curtas (ex: datas soltas, labels menu)
-                return False
-            return True
-
-        chunks_texto = (phrase.strip() for line in linhas for phrase in line.split("  "))
-        texto_limpo = '\n'.join(chunk for chunk in chunks_texto if is_useful(chunk))
-
-        # Splitter adaptado
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=600,
-            chunk_overlap=100,
-            separators=["\n\n", "\n", ".", " "]
-        )
-        return splitter.split_text(texto_limpo)
-    except Exception as e:
-        print(f"Erro no scraping da URL {url}: {e}")
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    # Remove ruídos comuns de sites e elementos de navegação
+    for script_or_style in soup(["script", "style", "nav", "footer", "header", "aside", "form", "button", "iframe"]):
+        script_or_style.decompose()
+    
+    # Remove elementos com classes suspeitas de serem ruído
+    for tag in soup.find_all(class_=lambda x: x and any(cls in x.lower() for cls in ['voltar', 'back', 'menu', 'share', 'print', 'hidden'])):
+        tag.decompose()
+
+    texto = soup.get_text(separator=' ')
+    
+    # Limpeza de espaços extras e linhas inúteis
+    linhas = (line.strip() for line in texto.splitlines())
+    
+    # Filtra linhas muito curtas ou irrelevantes que sobraram
+    keywords_ignore = {"voltar", "imprimir", "compartilhar", "menu", "topo", "anterior", "próxima"}
+    
+    def is_useful(line):
+        if not line: return False
+        if line.lower() in keywords_ignore: return False
+        if len(line.split()) < 2 and len(line) < 15: # Linhas muito curtas (ex: datas soltas, labels menu)
+            return False
+        return True
+
+    chunks_texto = (phrase.strip() for line in linhas for phrase in line.split("  "))
+    return '\n'.join(chunk for chunk in chunks_texto if is_useful(chunk))
+
+def split_text(texto_limpo):
+    # Splitter adaptado
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=600,
+        chunk_overlap=100,
+        separators=["\n\n", "\n", ".", " "]
+    )
+    return splitter.split_text(texto_limpo)
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def conditional_headers(page_state):
+    """Cabeçalhos de GET condicional a partir do estado da última ingestão."""
+    headers = {}
+    if page_state:
+        if page_state.get("etag"):
+            headers["If-None-Match"] = page_state["etag"]
+        if page_state.get("last_modified"):
+            headers["If-Modified-Since"] = page_state["last_modified"]
+    return headers
+
+def count_tokens(text):
+    """Estimativa conservadora de tokens (~3 caracteres por token em português)."""
+    return len(text) // 3 + 1
+
+async def batch_chunks(pages):
+    """
+    Agrupa chunks de várias páginas em lotes limitados por quantidade e por tokens.
+    Recebe (url, [(chunk_hash, chunk)]) de um iterador assíncrono e gera listas de (url, chunk_hash, chunk).
+    """
+    batch, batch_tokens = [], 0
+    async for url, chunks in pages:
+        for chunk_hash, chunk in chunks:
+            tokens = count_tokens(chunk)
+            if batch and (len(batch) >= EMBED_BATCH_SIZE or batch_tokens + tokens > EMBED_BATCH_TOKENS):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append((url, chunk_hash, chunk))
+            batch_tokens += tokens
+    if batch:
+        yield batch
+
+async def embed_with_retry(texts):
+    """embed_documents com backoff exponencial (com jitter) em rate limit e falhas transitórias."""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            return await embeddings_model.aembed_documents(texts)
+        except RETRYABLE_ERRORS as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+            print(f"⏳ {type(e).__name__} ao gerar embeddings, nova tentativa em {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def load_page_states(supabase):
+    """Estado da última ingestão de cada URL (ETag, Last-Modified, hash do conteúdo)."""
+    res = await supabase.table(PAGES_TABLE).select("fonte_url, etag, last_modified, content_hash, links").execute()
+    return {row["fonte_url"]: row for row in res.data or []}
+
+def refresh_facts(facts, url, texto, content_hash, stats, full=False):
+    """
+    Reextrai os fatos da página se o texto mudou desde a última extração (ou no modo --full).
+    Devolve os fatos novos da página (None: nada mudou).
+    """
+    if facts is None or (not full and facts.page_hash(url) == content_hash):
+        return None
+    extracted = extract_facts(url, texto, facts.plan_names())
+    stats["fatos"] += facts.replace_page(url, content_hash, extracted)
+    return extracted
+
+async def publish_facts(supabase, url, extracted):
+    """Troca os fatos da página no Supabase (de onde os workers da API puxam a tabela)."""
+    await supabase.table(FACTS_TABLE).delete().eq("fonte_url", url).execute()
+    rows = list({(r["tipo"], r["chave"]): r for r in (to_row(url, f) for f in extracted)}.values())
+    if rows:
+        await supabase.table(FACTS_TABLE).upsert(rows, on_conflict="fonte_url,tipo,chave").execute()
+
+async def prune_facts(facts, supabase, crawler):
+    """
+    Tira da tabela de fatos (local e Supabase) as páginas do site que o crawl não encontrou mais.
+    Só com o crawl completo: parado no CRAWL_MAX_PAGES, o que faltou pode só não ter sido visitado.
+    """
+    if facts is None or len(crawler.seen) >= crawler.max_pages:
+        return []
+    gone = await asyncio.to_thread(facts.prune, crawler.domain, crawler.seen)
+    if gone:
+        await supabase.table(FACTS_TABLE).delete().in_("fonte_url", gone).execute()
+    return gone
+
+async def prune_pages(supabase, crawler, page_states, stats):
+    """
+    Apaga os chunks e o estado das páginas de `crawler.domain` que o crawl não encontrou
+    mais (sumiram do site). Mesma regra do `prune_facts`: só com o crawl completo.
+    Os ids apagados entram em `stats["ids_apagados"]` (tombstones dos índices locais).
+    Devolve as URLs removidas.
+    """
+    if len(crawler.seen) >= crawler.max_pages:
         return []
 
-def main():
-    base_url = "https://maringafc.com.br/"
-    paginas = get_all_links(base_url)
-    print(f"🕸️ {len(paginas)} páginas encontradas para processamento.")
-
-    for url in paginas:
-        chunks = scrape_and_process(url)
-        if not chunks: continue
-
-        records = []
-        for chunk in chunks:
-            vector = embeddings_model.embed_query(chunk)
-            records.append({
-                "categoria": "web_scraping",
-                "conteudo": chunk,
-                "embedding": vector,
-                "fonte_url": url
-            })
-
-        # Upsert no Supabase
-        supabase.table("conhecimento_clube").insert(records).execute()
-        print(f"✅ URL Processada: {url} ({len(chunks)} chunks)")
+    def vanished(url):
+        return url and urlparse(url).netloc == crawler.domain and url not in crawler.seen
+
+    # Chunks de páginas que sumiram (também os gravados antes do estado por página existir)
+    gone_ids, gone_urls, last = [], {url for url in page_states if vanished(url)}, 0
+    while True:
+        res = await supabase.table(KNOWLEDGE_TABLE).select("id, fonte_url") \
+            .gt("id", last).order("id").limit(PRUNE_PAGE_SIZE).execute()
+        rows = res.data or []
+        for row in rows:
+            if vanished(row["fonte_url"]):
+                gone_ids.append(row["id"])
+                gone_urls.add(row["fonte_url"])
+        if len(rows) < PRUNE_PAGE_SIZE:
+            break
+        last = rows[-1]["id"]
+
+    for start in range(0, len(gone_ids), PRUNE_PAGE_SIZE):
+        await supabase.table(KNOWLEDGE_TABLE).delete().in_("id", gone_ids[start:start + PRUNE_PAGE_SIZE]).execute()
+    if gone_urls:
+        await supabase.table(PAGES_TABLE).delete().in_("fonte_url", sorted(gone_urls)).execute()
+    for url in gone_urls:
+        page_states.pop(url, None)
+    stats["ids_apagados"].extend(gone_ids)
+    return sorted(gone_urls)
+
+async def changed_pages(crawled, supabase, page_states, stats, full=False, facts=None):
+    """
+    Consome as páginas do crawler e gera só o que mudou: (url, chunks novos).
+    - 304 ou mesmo hash de conteúdo: página pulada.
+    - Chunks cujo hash já está no banco são mantidos sem re-embedding.
+    - Chunks que sumiram da página são apagados.
+    - Fatos estruturados (`facts`) da página são reextraídos quando o texto muda.
+    Atualiza `page_states` com o estado novo das páginas baixadas.
+    """
+    async for page in crawled:
+        url = page.url
+        if page.status == 304:
+            stats["paginas_puladas"] += 1
+            continue
+        texto = await asyncio.to_thread(clean_html, page.html)
+        content_hash = text_hash(texto)
+        previous = None if full else page_states.get(url)
+        page_states[url] = {
+            "fonte_url": url,
+            "etag": page.etag,
+            "last_modified": page.last_modified,
+            "content_hash": content_hash,
+            "links": page.links,
+        }
+        stats["paginas_baixadas"].append(url)
+        # Pelo hash da própria tabela: também preenche a tabela na primeira vez
+        extracted = await asyncio.to_thread(refresh_facts, facts, url, texto, content_hash, stats, full)
+        if extracted is not None:
+            await publish_facts(supabase, url, extracted)
+        if previous and previous.get("content_hash") == content_hash:
+            stats["paginas_puladas"] += 1
+            continue
+
+        chunks = split_text(texto)
+        hashes = {text_hash(chunk): chunk for chunk in chunks}
+
+        existing = await supabase.table(KNOWLEDGE_TABLE).select("id, chunk_hash").eq("fonte_url", url).execute()
+        existing_hashes = {row["chunk_hash"] for row in existing.data or []}
+        vanished = [row["id"] for row in existing.data or [] if row["chunk_hash"] not in hashes]
+        if vanished:
+            await supabase.table(KNOWLEDGE_TABLE).delete().in_("id", vanished).execute()
+            stats["ids_apagados"].extend(vanished)
+
+        new_chunks = [(h, chunk) for h, chunk in hashes.items() if h not in existing_hashes]
+        stats["chunks_mantidos"] += len(hashes) - len(new_chunks)
+        stats["paginas_alteradas"] += 1
+        print(f"✅ URL Processada: {url} ({len(new_chunks)} chunks novos, {len(vanished)} removidos)")
+        if new_chunks:
+            yield url, new_chunks
+
+async def ingest(pages, supabase):
+    """
+    Pipeline: páginas -> lotes de chunks -> embeddings concorrentes -> upserts em lote.
+    Retorna o total de chunks gravados.
+    """
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    # Fila limitada: se os upserts ficam para trás, os lotes prontos esperam
+    # (com a vaga do semáforo) em vez de acumular embeddings na memória
+    records_queue = asyncio.Queue(maxsize=EMBED_CONCURRENCY * 2)
+    total = 0
+
+    async def embed_batch(batch):
+        try:
+            vectors = await embed_with_retry([chunk for _, _, chunk in batch])
+            await records_queue.put([
+                {
+                    "categoria": "web_scraping",
+                    "conteudo": chunk,
+                    "embedding": vector,
+                    "fonte_url": url,
+                    "chunk_hash": chunk_hash
+                }
+                for (url, chunk_hash, chunk), vector in zip(batch, vectors)
+            ])
+        finally:
+            semaphore.release()
+
+    async def write(records):
+        # Upsert por (fonte_url, chunk_hash): reprocessar uma página é idempotente
+        await supabase.table(KNOWLEDGE_TABLE).upsert(records, on_conflict="fonte_url,chunk_hash").execute()
+
+    async def writer():
+        nonlocal total
+        pending = []
+        while True:
+            records = await records_queue.get()
+            if records is None:
+                break
+            pending.extend(records)
+            while len(pending) >= INSERT_BATCH_SIZE:
+                await write(pending[:INSERT_BATCH_SIZE])
+                total += INSERT_BATCH_SIZE
+                pending = pending[INSERT_BATCH_SIZE:]
+        if pending:
+            await write(pending)
+            total += len(pending)
+
+    async def produce():
+        tasks = []
+        try:
+            async for batch in batch_chunks(pages):
+                # Só dispara um novo lote quando há vaga (limita lotes em voo e memória)
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(embed_batch(batch)))
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    writer_task = asyncio.create_task(writer())
+    producer_task = asyncio.create_task(produce())
+    try:
+        await asyncio.wait({producer_task, writer_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not producer_task.done():
+            # O writer só termina antes se falhou: ninguém mais esvazia a fila
+            producer_task.cancel()
+            await asyncio.gather(producer_task, return_exceptions=True)
+        producer_task.result()
+    except BaseException:
+        producer_task.cancel()
+        raise
+    finally:
+        # Grava o que já foi gerado (mesmo se um lote falhou) e fecha o writer;
+        # se foi o writer que falhou, o erro dele é o que sobe
+        if not writer_task.done():
+            await records_queue.put(None)
+        await writer_task
+    return total
+
+async def main(full=False, base_url="https://maringafc.com.br/"):
+    supabase = await acreate_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+    page_states = await load_page_states(supabase)
+    stats = {"paginas_puladas": 0, "paginas_alteradas": 0, "paginas_baixadas": [],
+             "chunks_mantidos": 0, "ids_apagados": [], "fatos": 0}
+    facts = build_club_facts() if CLUB_FACTS_ENABLED else None
+
+    def page_headers(url):
+        # Página ainda sem fatos extraídos: baixa inteira (um 304 não traria o texto)
+        if facts is not None and facts.page_hash(url) is None:
+            return {}
+        return conditional_headers(page_states.get(url))
+
+    # No modo incremental o crawler já faz GET condicional (304 não traz corpo)
+    crawler = Crawler(
+        base_url,
+        max_depth=CRAWL_MAX_DEPTH,
+        max_pages=CRAWL_MAX_PAGES,
+        concurrency=CRAWL_CONCURRENCY,
+        per_host_limit=CRAWL_PER_HOST_LIMIT,
+        conditional_headers=None if full else page_headers,
+        known_links=lambda url: (page_states.get(url) or {}).get("links"),
+    )
+
+    inicio = time.perf_counter()
+    total = await ingest(changed_pages(crawler.crawl(), supabase, page_states, stats, full, facts), supabase)
+    duracao = time.perf_counter() - inicio
+    print(f"🕸️ {len(crawler.seen)} páginas encontradas pelo crawler"
+          f"{f' ({len(crawler.failed)} com erro)' if crawler.failed else ''}.")
+
+    # Só grava o estado das páginas depois que os chunks delas foram gravados
+    baixadas = [page_states[url] for url in stats["paginas_baixadas"]]
+    if baixadas:
+        await supabase.table(PAGES_TABLE).upsert(baixadas, on_conflict="fonte_url").execute()
+
+    # Páginas que sumiram do site: chunks e estado saem antes de atualizar os índices locais
+    removidas = await prune_pages(supabase, crawler, page_states, stats)
+    if removidas:
+        print(f"🧹 {len(removidas)} páginas que sumiram do site removidas da base")
+
+    # Atualiza o snapshot do índice vetorial local (linhas novas e apagadas)
+    if os.getenv("RETRIEVAL_BACKEND", "supabase").lower() == "local":
+        index = LocalVectorIndex(os.getenv("VECTOR_INDEX_DIR", ".cache/vector_index"))
+        index.remove(stats["ids_apagados"])
+        print(f"🧭 Índice vetorial local: +{await index.arefresh(supabase)} linhas ({len(index)} no total)")
+
+    if os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true":
+        # Índice BM25 da busca híbrida: só as linhas novas e os tombstones
+        lexical = LexicalIndex(os.getenv("LEXICAL_INDEX_DIR", ".cache/lexical_index"))
+        lexical.remove(stats["ids_apagados"])
+        added = await lexical.arefresh(supabase)
+        compacted = lexical.compact()
+        print(f"🔤 Índice lexical (BM25): +{added} linhas ({len(lexical)} no total){' | compactado' if compacted else ''}")
+
+    if facts is not None:
+        gone = await prune_facts(facts, supabase, crawler)
+        print(f"📋 Fatos do clube: {stats['fatos']} registros reextraídos, {len(gone)} páginas que sumiram do site "
+              f"removidas ({len(facts)} na tabela)")
+
+    print(f"📊 Resumo: {total} chunks em {duracao:.1f}s ({total / duracao if duracao else 0:.1f} chunks/s) | "
+          f"{embeddings_model.api_calls} chamadas à API de embeddings | "
+          f"{embeddings_model.hits} chunks vindos do cache")
+    print(f"♻️ Incremental: {stats['paginas_puladas']} páginas sem mudança, "
+          f"{stats['paginas_alteradas']} alteradas, {stats['chunks_mantidos']} chunks mantidos, "
+          f"{len(stats['ids_apagados'])} chunks removidos")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ingestão do site oficial do Maringá FC")
+    parser.add_argument("--full", action="store_true", help="Ignora ETag/hash e reprocessa todas as páginas")
+    parser.add_argument("--url", default="https://maringafc.com.br/",
+                        help="Site a ingerir (ex.: https://store.maringafc.com/ para indexar os produtos da loja)")
+    parser.add_argument("--intervalo", type=float, default=0,
+                        help="Repete a ingestão a cada N segundos (job em background); 0 roda uma vez")
+    args = parser.parse_args()
+
+    async def run():
+        while True:
+            await main(full=args.full, base_url=args.url)
+            if not args.intervalo:
+                break
+            print(f"⏳ Próxima ingestão de {args.url} em {args.intervalo:.0f}s")
+            await asyncio.sleep(args.intervalo)
+
+    asyncio.run(run())
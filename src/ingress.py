@@ -0,0 +1,137 @@
+"""
+Camada de entrada por whatsapp_id: serializa os turnos e agrupa rajadas.
+
+Torcedor no WhatsApp costuma mandar 3-4 mensagens curtas seguidas; cada uma
+vira um POST /chat. Sem esta camada, cada POST rodava o grafo inteiro em
+paralelo (LLM em dobro e corrida no estado da conversa e no leads_sdr).
+
+- Serialização: um turno por whatsapp_id por vez; o lote seguinte espera o
+  anterior terminar (conversas diferentes continuam em paralelo).
+- Debounce só quando já há turno: sem turno da conversa em andamento, a
+  mensagem vira turno na hora (nenhuma latência a mais). Com turno em
+  andamento, as mensagens que chegam viram um único lote, que fica aberto
+  até o turno anterior terminar e, além disso, até passar `window` segundos
+  sem mensagem nova (no máximo `max_wait` segundos depois da primeira).
+- Memória: a sessão só existe enquanto há requisição em andamento para o
+  whatsapp_id; quando a última termina, a sessão ociosa é descartada.
+- Vários workers: com `lock` (lock do estado compartilhado por whatsapp_id),
+  o turno também espera turnos da mesma conversa em outros workers. O
+  agrupamento continua por worker.
+"""
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class _Batch:
+    def __init__(self):
+        now = time.monotonic()
+        self.messages: List[str] = []
+        self.first_at = now
+        self.last_at = now
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class _Session:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.batch: Optional[_Batch] = None
+        self.users = 0
+
+
+class ConversationIngress:
+    def __init__(self, run_turn: Callable[[str, List[str]], Awaitable[Any]],
+                 window: float = 1.0, max_wait: float = 3.0,
+                 lock: Optional[Callable[[str], AsyncContextManager]] = None):
+        self.run_turn = run_turn
+        self.window = window
+        self.max_wait = max_wait
+        self.lock = lock
+        self._sessions: Dict[str, _Session] = {}
+        self.stats = {"mensagens": 0, "turnos": 0, "mensagens_agrupadas": 0, "turnos_em_espera": 0}
+
+    # --- Sessões (só enquanto houver requisição em andamento) ---
+
+    def _acquire(self, whatsapp_id: str) -> _Session:
+        session = self._sessions.get(whatsapp_id)
+        if session is None:
+            session = self._sessions[whatsapp_id] = _Session()
+        session.users += 1
+        return session
+
+    def _release(self, whatsapp_id: str, session: _Session):
+        session.users -= 1
+        if session.users == 0 and session.batch is None and not session.lock.locked():
+            self._sessions.pop(whatsapp_id, None)
+
+    def _turn_lock(self, whatsapp_id: str) -> AsyncContextManager:
+        return self.lock(whatsapp_id) if self.lock is not None else nullcontext()
+
+    # --- Entrada ---
+
+    async def submit(self, whatsapp_id: str, message: str) -> Tuple[Any, bool]:
+        """
+        Entrega a mensagem e espera o turno do lote em que ela entrou.
+        Retorna (resultado do turno, True se esta foi a última mensagem do lote).
+        """
+        self.stats["mensagens"] += 1
+        session = self._acquire(whatsapp_id)
+        try:
+            batch = session.batch
+            if batch is None:
+                batch = session.batch = _Batch()
+                # Contexto vazio: o turno é do lote, não da requisição que abriu o lote
+                contextvars.Context().run(asyncio.create_task, self._flush(whatsapp_id, session, batch))
+            else:
+                self.stats["mensagens_agrupadas"] += 1
+            batch.messages.append(message)
+            batch.last_at = time.monotonic()
+            position = len(batch.messages) - 1
+            # shield: requisição cancelada (cliente caiu) não cancela o turno do lote
+            result = await asyncio.shield(batch.future)
+            return result, position == len(batch.messages) - 1
+        finally:
+            self._release(whatsapp_id, session)
+
+    async def _flush(self, whatsapp_id: str, session: _Session, batch: _Batch):
+        try:
+            if session.lock.locked():
+                # Turno desta conversa em andamento: janela deslizante, espera `window`
+                # sem mensagem nova, até `max_wait` no total
+                self.stats["turnos_em_espera"] += 1
+                while True:
+                    deadline = min(batch.last_at + self.window, batch.first_at + self.max_wait)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(remaining)
+            async with session.lock:
+                # Lote fechado: o que chegar agora vai para o próximo
+                session.batch = None
+                async with self._turn_lock(whatsapp_id):
+                    self.stats["turnos"] += 1
+                    result = await self.run_turn(whatsapp_id, list(batch.messages))
+            batch.future.set_result(result)
+        except BaseException as e:
+            if session.batch is batch:
+                session.batch = None
+            batch.future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+
+    @asynccontextmanager
+    async def serialized(self, whatsapp_id: str):
+        """Só a serialização (sem debounce), para o /chat/stream."""
+        session = self._acquire(whatsapp_id)
+        try:
+            async with session.lock, self._turn_lock(whatsapp_id):
+                self.stats["mensagens"] += 1
+                self.stats["turnos"] += 1
+                yield
+        finally:
+            self._release(whatsapp_id, session)
+
+    def metrics(self) -> Dict[str, float]:
+        return {**self.stats, "sessoes_ativas": len(self._sessions)}
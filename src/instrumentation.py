@@ -0,0 +1,530 @@
+"""
+Instrumentação do grafo sem LangSmith: métricas Prometheus + trace por requisição.
+
+Um callback handler global (registrado como configure hook do LangChain, do
+mesmo jeito que o tracer do LangSmith) recebe os eventos de todos os nós,
+tools e chamadas de LLM e registra:
+- tempo de parede por nó e por tool (histogramas);
+- chamadas, tokens (entrada/saída) e custo estimado de LLM por nó e modelo;
+- quantidade de documentos devolvidos pelas buscas;
+- caminho do turno no grafo e o loop_step alcançado.
+
+`trace_request` abre o trace de uma requisição (contextvar); ao final ele vira
+uma linha JSON em `TRACE_LOG_PATH` e alimenta os contadores por turno.
+`render_metrics` gera o texto no formato de exposição do Prometheus.
+
+Com vários workers (WEB_CONCURRENCY > 1) cada scrape do /metrics cai num
+worker só. `WorkerMetricsExchange` publica periodicamente o snapshot de cada
+worker no estado compartilhado (src/shared_state.py); o worker que atende o
+scrape soma os contadores e histogramas dos outros aos seus, e os gauges dos
+caches/filas saem com o label `worker`.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import ToolMessage
+from langchain_core.tracers.context import register_configure_hook
+
+# Preço em US$ por 1M de tokens (entrada, saída)
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DOCS_BUCKETS = (0, 1, 2, 3, 5, 10)
+OUTSIDE_GRAPH = "fora_do_grafo"
+NO_ROLE = "sem_papel"
+
+
+# --- Métricas (formato de exposição do Prometheus) ---
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = ['%s="%s"' % (n, v) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name, self.description, self.labels = name, description, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels):
+        key = tuple(str(labels[n]) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def export(self) -> List[list]:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merged(self, entries: Iterable[list]) -> "Counter":
+        """Cópia somando valores exportados por outros workers."""
+        copy = Counter(self.name, self.description, self.labels)
+        with self._lock:
+            copy._values = dict(self._values)
+        for key, value in entries:
+            key = tuple(key)
+            copy._values[key] = copy._values.get(key, 0.0) + value
+        return copy
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.description, self.labels = name, description, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[n]) for n in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def export(self) -> List[list]:
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    def merged(self, entries: Iterable[list]) -> "Histogram":
+        """Cópia somando buckets, soma e contagem exportados por outros workers."""
+        copy = Histogram(self.name, self.description, self.labels, self.buckets)
+        with self._lock:
+            copy._values = {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in entries:
+            entry = copy._values.setdefault(tuple(key), [[0] * len(self.buckets), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+        return copy
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+REQUEST_DURATION = Histogram("dogao_request_duration_seconds", "Duração das requisições de chat", ["endpoint"])
+REQUEST_ERRORS = Counter("dogao_request_errors_total", "Requisições de chat com erro", ["endpoint"])
+NODE_DURATION = Histogram("dogao_node_duration_seconds", "Tempo de parede por nó do grafo", ["node"])
+TOOL_DURATION = Histogram("dogao_tool_duration_seconds", "Tempo de parede por tool", ["tool"])
+LLM_DURATION = Histogram("dogao_llm_duration_seconds", "Latência das chamadas de LLM", ["node", "role", "model"])
+LLM_CALLS = Counter("dogao_llm_calls_total", "Chamadas de LLM", ["node", "role", "model"])
+LLM_TOKENS = Counter("dogao_llm_tokens_total", "Tokens de LLM", ["node", "role", "model", "tipo"])
+LLM_COST = Counter("dogao_llm_cost_usd_total", "Custo estimado de LLM em US$", ["node", "role", "model"])
+LLM_ERRORS = Counter("dogao_llm_errors_total", "Chamadas de LLM com erro (timeout etc.; o fallback assume)",
+                     ["node", "role", "model"])
+RETRIEVAL_DOCS = Histogram("dogao_retrieval_docs", "Documentos devolvidos por busca", ["tool"], DOCS_BUCKETS)
+TURNS = Counter("dogao_turns_total", "Turnos por loop_step alcançado e uso do cache de respostas",
+                ["loop_step", "cache"])
+
+METRICS = [REQUEST_DURATION, REQUEST_ERRORS, NODE_DURATION, TOOL_DURATION, LLM_DURATION,
+           LLM_CALLS, LLM_TOKENS, LLM_COST, LLM_ERRORS, RETRIEVAL_DOCS, TURNS]
+
+
+def render_stats(prefix: str, stats: Dict[str, Any], label: Optional[str] = None) -> List[str]:
+    """Dicionários de estatísticas (caches, grader, tracker) como gauges; um nível de aninhamento vira label."""
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, dict) and label:
+            for sub_key, sub_value in value.items():
+                if isinstance(sub_value, (int, float)):
+                    lines.append('%s_%s{%s="%s"} %s' % (prefix, sub_key, label, key, float(sub_value)))
+        elif isinstance(value, (int, float)):
+            lines.append(f"{prefix}_{key} {float(value)}")
+    return lines
+
+
+def llm_by_role() -> Dict[str, Dict[str, float]]:
+    """Totais de LLM por papel (chamadas, latência, tokens, custo), somando nós e modelos."""
+    roles: Dict[str, Dict[str, float]] = {}
+
+    def entry(role):
+        return roles.setdefault(role, {"chamadas": 0, "latencia_total": 0.0, "tokens_entrada": 0,
+                                       "tokens_saida": 0, "custo_usd": 0.0, "erros": 0})
+
+    with LLM_DURATION._lock:
+        for (_, role, _), (_, total, count) in LLM_DURATION._values.items():
+            entry(role)["chamadas"] += count
+            entry(role)["latencia_total"] += total
+    with LLM_TOKENS._lock:
+        for (_, role, _, tipo), value in LLM_TOKENS._values.items():
+            entry(role)["tokens_" + tipo] += value
+    with LLM_COST._lock:
+        for (_, role, _), value in LLM_COST._values.items():
+            entry(role)["custo_usd"] += value
+    with LLM_ERRORS._lock:
+        for (_, role, _), value in LLM_ERRORS._values.items():
+            entry(role)["erros"] += value
+    return roles
+
+
+def snapshot() -> Dict[str, List[list]]:
+    """Valores das métricas deste processo (JSON), para somar com os dos outros workers."""
+    return {metric.name: metric.export() for metric in METRICS}
+
+
+def render_metrics(extra: Sequence[str] = (), workers: Sequence[Dict[str, List[list]]] = ()) -> str:
+    """Texto do Prometheus; `workers` são snapshots de outros workers somados aos deste."""
+    lines = []
+    for metric in METRICS:
+        if workers:
+            metric = metric.merged(entry for data in workers for entry in data.get(metric.name, []))
+        lines.extend(metric.render())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
+
+
+def with_label(line: str, name: str, value: str) -> str:
+    """Acrescenta um label a uma linha `serie{labels} valor`."""
+    series, sample = line.rsplit(" ", 1)
+    label = '%s="%s"' % (name, value)
+    series = series[:-1] + "," + label + "}" if series.endswith("}") else series + "{" + label + "}"
+    return f"{series} {sample}"
+
+
+class WorkerMetricsExchange:
+    """
+    Métricas de todos os workers num scrape só, via estado compartilhado.
+
+    Cada worker grava `metricas:<worker>` (snapshot + gauges de `extra()`) a
+    cada `interval` segundos, com TTL de alguns intervalos: worker que morreu
+    some sozinho. A lista dos workers fica em `metricas:workers`. Os números
+    dos outros workers chegam com até `interval` segundos de atraso.
+    """
+
+    REGISTRY_KEY = "metricas:workers"
+
+    def __init__(self, shared, extra: Callable[[], List[str]] = list, interval: float = 5.0,
+                 worker_id: Optional[str] = None):
+        self.shared = shared
+        self.extra = extra
+        self.interval = interval
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(worker_id: str) -> str:
+        return f"metricas:{worker_id}"
+
+    async def _workers(self) -> List[str]:
+        return json.loads(await self.shared.get(self.REGISTRY_KEY) or "[]")
+
+    async def _update_registry(self, add: Sequence[str] = (), remove: Sequence[str] = ()):
+        async with self.shared.lock(self.REGISTRY_KEY, ttl=10):
+            workers = (set(await self._workers()) | set(add)) - set(remove)
+            await self.shared.set(self.REGISTRY_KEY, json.dumps(sorted(workers)))
+
+    def _payload(self) -> Dict[str, Any]:
+        return {"metricas": snapshot(), "extra": list(self.extra())}
+
+    async def publish(self, payload: Optional[Dict[str, Any]] = None) -> None:
+        payload = payload or self._payload()
+        await self.shared.set(self._key(self.worker_id), json.dumps(payload), ttl=self.interval * 3)
+        if self.worker_id not in await self._workers():
+            await self._update_registry(add=[self.worker_id])
+
+    async def _others(self) -> List[Tuple[str, Dict[str, Any]]]:
+        others, gone = [], []
+        for worker_id in await self._workers():
+            if worker_id == self.worker_id:
+                continue
+            raw = await self.shared.get(self._key(worker_id))
+            if raw is None:
+                gone.append(worker_id)
+            else:
+                others.append((worker_id, json.loads(raw)))
+        if gone:
+            await self._update_registry(remove=gone)
+        return others
+
+    async def render(self) -> str:
+        """Scrape: publica o próprio snapshot (fresco) e soma os dos outros workers."""
+        own = self._payload()
+        try:
+            await self.publish(own)
+            others = await self._others()
+        except Exception as e:
+            print(f"Erro ao juntar métricas dos workers: {e}")
+            others = []
+        extra = [with_label(line, "worker", self.worker_id) for line in own["extra"]]
+        for worker_id, data in others:
+            extra.extend(with_label(line, "worker", worker_id) for line in data["extra"])
+        return render_metrics(extra, [data["metricas"] for _, data in others])
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.publish()
+            except Exception as e:
+                print(f"Erro ao publicar métricas do worker: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# --- Trace por requisição ---
+
+@dataclass
+class Trace:
+    endpoint: str
+    whatsapp_id: str
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started_at: float = field(default_factory=time.time)
+    duration: float = 0.0
+    path: List[str] = field(default_factory=list)
+    nodes: List[Dict[str, Any]] = field(default_factory=list)
+    tools: List[Dict[str, Any]] = field(default_factory=list)
+    llm: List[Dict[str, Any]] = field(default_factory=list)
+    loop_step: int = 0
+    error: Optional[str] = None
+    finished: bool = False
+
+    @property
+    def cache_hit(self) -> bool:
+        return "answer_cache" in self.path and "agent" not in self.path
+
+    def summary(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.pop("finished")
+        data["cache_hit"] = self.cache_hit
+        data["llm_calls"] = len(self.llm)
+        data["tokens_entrada"] = sum(c["tokens_entrada"] for c in self.llm)
+        data["tokens_saida"] = sum(c["tokens_saida"] for c in self.llm)
+        data["custo_usd"] = round(sum(c["custo_usd"] for c in self.llm), 6)
+        return data
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("dogao_trace", default=None)
+_trace_logger = logging.getLogger("dogao.trace")
+_trace_logger.propagate = False
+
+
+def _configure_trace_log():
+    path = os.getenv("TRACE_LOG_PATH", "traces.jsonl")
+    if path and not _trace_logger.handlers:
+        handler = logging.FileHandler(path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _trace_logger.addHandler(handler)
+        _trace_logger.setLevel(logging.INFO)
+
+
+def current_trace() -> Optional[Trace]:
+    trace = _current_trace.get()
+    return trace if trace is not None and not trace.finished else None
+
+
+@asynccontextmanager
+async def trace_request(endpoint: str, whatsapp_id: str):
+    """Abre o trace de uma requisição; fecha, mede e grava a linha JSON no final."""
+    trace = Trace(endpoint, whatsapp_id)
+    token = _current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = repr(e)
+        REQUEST_ERRORS.inc(endpoint=endpoint)
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.duration = time.perf_counter() - start
+        trace.finished = True
+        REQUEST_DURATION.observe(trace.duration, endpoint=endpoint)
+        TURNS.inc(loop_step=min(trace.loop_step, 2), cache="hit" if trace.cache_hit else "miss")
+        if _trace_logger.handlers:
+            _trace_logger.info(json.dumps(trace.summary(), ensure_ascii=False, default=str))
+
+
+# --- Callback handler global ---
+
+def _token_usage(response) -> Tuple[int, int]:
+    """(entrada, saída) a partir do usage_metadata das mensagens ou do llm_output."""
+    prompt = completion = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt += usage.get("input_tokens", 0)
+                completion += usage.get("output_tokens", 0)
+    if not (prompt or completion) and response.llm_output:
+        usage = response.llm_output.get("token_usage") or {}
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return prompt, completion
+
+
+def _cost(model: str, prompt: int, completion: int) -> float:
+    # Nomes com data (ex.: gpt-4o-2024-08-06) usam o preço do modelo base mais específico
+    base = max((m for m in PRICES if model.startswith(m)), key=len, default=None)
+    if base is None:
+        return 0.0
+    price_in, price_out = PRICES[base]
+    return (prompt * price_in + completion * price_out) / 1_000_000
+
+
+def _count_docs(output) -> Optional[int]:
+    if isinstance(output, ToolMessage):
+        if isinstance(output.artifact, list):
+            return len(output.artifact)
+        output = output.content
+    if isinstance(output, list):
+        return len(output)
+    return None
+
+
+class InstrumentationHandler(BaseCallbackHandler):
+    """Recebe os eventos de nós, tools e LLMs de qualquer execução no processo."""
+
+    run_inline = True
+
+    def __init__(self):
+        self._runs: Dict[Any, tuple] = {}
+
+    # Nós do grafo: o run do nó tem nome igual ao metadata langgraph_node
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._runs[run_id] = ("node", node, time.perf_counter())
+
+    def _end_node(self, run_id, outputs=None, error=None):
+        run = self._runs.pop(run_id, None)
+        if run is None or run[0] != "node":
+            return
+        _, node, start = run
+        duration = time.perf_counter() - start
+        NODE_DURATION.observe(duration, node=node)
+        trace = current_trace()
+        if trace is not None:
+            trace.path.append(node)
+            trace.nodes.append({"node": node, "duracao": round(duration, 4), **({"erro": error} if error else {})})
+            if node == "grade_documents" and isinstance(outputs, dict):
+                trace.loop_step += max(0, outputs.get("loop_step", 0))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_node(run_id, outputs)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_node(run_id, error=repr(error))
+
+    # LLMs
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or metadata.get("ls_model_name") or "desconhecido"
+        node = metadata.get("langgraph_node", OUTSIDE_GRAPH)
+        role = metadata.get("model_role", NO_ROLE)
+        self._runs[run_id] = ("llm", (node, role, model), time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, metadata=metadata, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        _, (node, role, model), start = run
+        duration = time.perf_counter() - start
+        prompt, completion = _token_usage(response)
+        cost = _cost(model, prompt, completion)
+        labels = {"node": node, "role": role, "model": model}
+        LLM_DURATION.observe(duration, **labels)
+        LLM_CALLS.inc(**labels)
+        LLM_TOKENS.inc(prompt, tipo="entrada", **labels)
+        LLM_TOKENS.inc(completion, tipo="saida", **labels)
+        LLM_COST.inc(cost, **labels)
+        trace = current_trace()
+        if trace is not None:
+            trace.llm.append({**labels, "duracao": round(duration, 4),
+                              "tokens_entrada": prompt, "tokens_saida": completion, "custo_usd": cost})
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            node, role, model = run[1]
+            LLM_ERRORS.inc(node=node, role=role, model=model)
+
+    # Tools
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        self._runs[run_id] = ("tool", name, time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        _, name, start = run
+        duration = time.perf_counter() - start
+        TOOL_DURATION.observe(duration, tool=name)
+        docs = _count_docs(output)
+        if docs is not None:
+            RETRIEVAL_DOCS.observe(docs, tool=name)
+        trace = current_trace()
+        if trace is not None:
+            trace.tools.append({"tool": name, "duracao": round(duration, 4), "docs": docs})
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            TOOL_DURATION.observe(time.perf_counter() - run[2], tool=run[1])
+
+
+handler = InstrumentationHandler()
+_handler_var: ContextVar[Optional[BaseCallbackHandler]] = ContextVar("dogao_instrumentation", default=handler)
+
+
+def setup_instrumentation():
+    """Registra o handler em toda execução do LangChain/LangGraph (idempotente)."""
+    global _registered
+    if not _registered:
+        register_configure_hook(_handler_var, inheritable=True)
+        _registered = True
+    _configure_trace_log()
+
+
+_registered = False
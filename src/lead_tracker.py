@@ -0,0 +1,273 @@
+"""
+Rastreamento de leads em segundo plano (fora do caminho crítico da resposta).
+
+Fluxo:
+1. O grafo só enfileira um job por turno (`submit`) e segue para o END.
+2. Workers processam os jobs (extração com LLM) depois que a resposta já saiu.
+   Jobs do mesmo whatsapp_id ainda na fila são coalescidos: só o mais recente roda.
+3. As linhas de `leads_sdr` resultantes são coalescidas por whatsapp_id e
+   gravadas num outbox SQLite local antes de qualquer envio.
+4. Um flusher manda o outbox para o Supabase em upserts em lote, por tempo ou
+   por tamanho, com retry e backoff exponencial. Só apaga do outbox o que o
+   Supabase confirmou, então uma queda do Supabase ou do processo não perde leads.
+
+O outbox é um arquivo só para todos os workers do uvicorn. Cada linha tem
+dono (o processo que a gravou) e uma versão única entre processos (relógio
+em ns + sufixo aleatório): uma linha só é substituída por uma versão mais
+nova, e o DELETE de um worker nunca apaga a linha mais nova de outro. As
+linhas de um dono que some (shutdown ou queda) são adotadas pelos outros.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def new_version() -> str:
+    """Versão única entre processos e crescente no tempo (compara como texto)."""
+    return f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+
+
+class LeadOutbox:
+    """Outbox durável (SQLite) com uma linha pendente por whatsapp_id, com dono por processo."""
+
+    def __init__(self, path: str = "leads_outbox.sqlite", orphan_after: float = 600.0):
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # Linha de outro dono sem sinal de vida há mais que isso é adotada
+        self.orphan_after = orphan_after
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS leads_pendentes (
+                whatsapp_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                versao TEXT NOT NULL,
+                dono TEXT NOT NULL DEFAULT '',
+                atualizado_em REAL NOT NULL DEFAULT 0
+            )
+        """)
+        # Outbox de antes do dono por processo: as linhas antigas viram órfãs e são adotadas
+        columns = {c[1] for c in self._conn.execute("PRAGMA table_info(leads_pendentes)")}
+        if "dono" not in columns:
+            self._conn.execute("ALTER TABLE leads_pendentes ADD COLUMN dono TEXT NOT NULL DEFAULT ''")
+            self._conn.execute("ALTER TABLE leads_pendentes ADD COLUMN atualizado_em REAL NOT NULL DEFAULT 0")
+        self._conn.commit()
+
+    def claim(self) -> Dict[str, tuple]:
+        """Adota as linhas órfãs e devolve todas as deste processo: {whatsapp_id: (linha, versão)}."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE leads_pendentes SET dono = ?, atualizado_em = ? WHERE dono != ? AND atualizado_em < ?",
+                (self.owner, now, self.owner, now - self.orphan_after),
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT whatsapp_id, payload, versao FROM leads_pendentes WHERE dono = ?", (self.owner,)
+            ).fetchall()
+        return {wid: (json.loads(payload), str(versao)) for wid, payload, versao in rows}
+
+    def load(self) -> Dict[str, tuple]:
+        """Todas as linhas pendentes, de qualquer dono."""
+        with self._lock:
+            rows = self._conn.execute("SELECT whatsapp_id, payload, versao FROM leads_pendentes").fetchall()
+        return {wid: (json.loads(payload), str(versao)) for wid, payload, versao in rows}
+
+    def save(self, whatsapp_id: str, row: dict, version: str) -> bool:
+        """Grava a linha se a versão for mais nova que a do outbox. Retorna False se não for."""
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                INSERT INTO leads_pendentes VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(whatsapp_id) DO UPDATE SET payload = excluded.payload, versao = excluded.versao,
+                    dono = excluded.dono, atualizado_em = excluded.atualizado_em
+                WHERE excluded.versao > leads_pendentes.versao
+                """,
+                (whatsapp_id, json.dumps(row, ensure_ascii=False), version, self.owner, time.time()),
+            )
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def current(self, versions: Dict[str, str]) -> Dict[str, str]:
+        """Das versões dadas, as que ainda são as do outbox (nenhum worker gravou uma mais nova)."""
+        with self._lock:
+            self._conn.execute("UPDATE leads_pendentes SET atualizado_em = ? WHERE dono = ?",
+                               (time.time(), self.owner))
+            self._conn.commit()
+            rows = self._conn.execute(
+                f"SELECT whatsapp_id, versao FROM leads_pendentes WHERE whatsapp_id IN ({','.join('?' * len(versions))})",
+                list(versions),
+            ).fetchall()
+        stored = {wid: str(versao) for wid, versao in rows}
+        return {wid: version for wid, version in versions.items() if stored.get(wid) == version}
+
+    def release(self) -> None:
+        """Solta as linhas deste processo para outro worker adotar já (shutdown)."""
+        with self._lock:
+            self._conn.execute("UPDATE leads_pendentes SET atualizado_em = 0 WHERE dono = ?", (self.owner,))
+            self._conn.commit()
+
+    def delete(self, confirmed: Dict[str, str]) -> None:
+        """Apaga só as linhas cuja versão foi a enviada (não as atualizadas no meio do flush)."""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM leads_pendentes WHERE whatsapp_id = ? AND versao = ?",
+                list(confirmed.items()),
+            )
+            self._conn.commit()
+
+
+class LeadTracker:
+    """Fila de jobs de lead + buffer coalescido + flush em lote com retry."""
+
+    def __init__(self, process: Callable[[dict], Awaitable[Optional[dict]]],
+                 get_client: Callable[[], Awaitable[Any]], outbox: LeadOutbox,
+                 table: str = "leads_sdr", workers: int = 2,
+                 flush_interval: float = 5.0, flush_size: int = 50, max_backoff: float = 300.0):
+        self.process = process
+        self.get_client = get_client
+        self.outbox = outbox
+        self.table = table
+        self.workers = workers
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_backoff = max_backoff
+
+        # Jobs: fila de whatsapp_ids + último job de cada um (coalescência)
+        self._queue: Optional[asyncio.Queue] = None
+        self._jobs: Dict[str, dict] = {}
+        # Linhas pendentes deste processo: whatsapp_id -> (linha, versão)
+        self._pending: Dict[str, tuple] = outbox.claim()
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._failures = 0
+        self.stats = {"jobs": 0, "jobs_coalescidos": 0, "upserts": 0, "linhas_gravadas": 0, "falhas_flush": 0}
+
+    # --- Ciclo de vida ---
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._flush_requested = asyncio.Event()
+        # Contexto vazio: os workers não herdam o config/callbacks do turno que os criou
+        spawn = lambda coro: contextvars.Context().run(asyncio.create_task, coro)
+        self._tasks = [spawn(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(spawn(self._flusher()))
+
+    async def close(self, timeout: float = 10.0):
+        """Processa o que está na fila e tenta um último flush (chamado no shutdown)."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Lead tracker: {self._queue.qsize()} jobs não processados no shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+        # O que não subiu fica para os outros workers (ou o próximo processo)
+        await asyncio.to_thread(self.outbox.release)
+
+    # --- Entrada ---
+
+    def submit(self, job: dict) -> None:
+        """Enfileira um job (não bloqueia). Job precisa de `whatsapp_id`."""
+        self._ensure_started()
+        whatsapp_id = job["whatsapp_id"]
+        self.stats["jobs"] += 1
+        if whatsapp_id in self._jobs:
+            # Ainda na fila: troca pelo snapshot mais novo da conversa
+            self._jobs[whatsapp_id] = job
+            self.stats["jobs_coalescidos"] += 1
+            return
+        self._jobs[whatsapp_id] = job
+        self._queue.put_nowait(whatsapp_id)
+
+    async def _worker(self):
+        while True:
+            whatsapp_id = await self._queue.get()
+            try:
+                job = self._jobs.pop(whatsapp_id, None)
+                if job is None:
+                    continue
+                row = await self.process(job)
+                if row:
+                    await self._buffer(whatsapp_id, row)
+            except Exception as e:
+                print(f"Erro tracking: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _buffer(self, whatsapp_id: str, row: dict):
+        version = new_version()
+        # Grava no outbox antes de qualquer envio ao Supabase
+        if not await asyncio.to_thread(self.outbox.save, whatsapp_id, row, version):
+            # Outro worker já gravou uma versão mais nova deste lead
+            self._pending.pop(whatsapp_id, None)
+            return
+        self._pending[whatsapp_id] = (row, version)
+        if len(self._pending) >= self.flush_size:
+            self._flush_requested.set()
+
+    # --- Flush em lote ---
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            if not await self.flush():
+                # Backoff exponencial enquanto o Supabase estiver com problema
+                delay = min(self.max_backoff, self.flush_interval * 2 ** self._failures)
+                await asyncio.sleep(delay)
+
+    async def flush(self) -> bool:
+        """Envia todas as linhas pendentes num único upsert. Retorna False se falhar."""
+        # Órfãs de workers que caíram entram no lote deste (o outbox sempre tem a versão mais nova)
+        for wid, pending in (await asyncio.to_thread(self.outbox.claim)).items():
+            if self._pending.get(wid, (None, None))[1] != pending[1]:
+                self._pending[wid] = pending
+        if not self._pending:
+            return True
+        batch = dict(self._pending)
+        # Linhas que outro worker já substituiu por uma versão mais nova não sobem
+        current = await asyncio.to_thread(
+            self.outbox.current, {wid: version for wid, (_, version) in batch.items()})
+        for wid, (_, version) in list(batch.items()):
+            if wid not in current:
+                del batch[wid]
+                if self._pending.get(wid, (None, None))[1] == version:
+                    del self._pending[wid]
+        if not batch:
+            return True
+        try:
+            client = await self.get_client()
+            await client.table(self.table).upsert(
+                [row for row, _ in batch.values()], on_conflict="whatsapp_id"
+            ).execute()
+        except Exception as e:
+            self._failures += 1
+            self.stats["falhas_flush"] += 1
+            print(f"⚠️ Falha ao gravar {len(batch)} leads (tentativa {self._failures}): {e}")
+            return False
+
+        self._failures = 0
+        self.stats["upserts"] += 1
+        self.stats["linhas_gravadas"] += len(batch)
+        confirmed = {wid: version for wid, (_, version) in batch.items()}
+        for wid, version in confirmed.items():
+            if self._pending.get(wid, (None, None))[1] == version:
+                del self._pending[wid]
+        await asyncio.to_thread(self.outbox.delete, confirmed)
+        return True
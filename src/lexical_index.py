@@ -0,0 +1,312 @@
+"""
+Índice lexical (BM25) em processo da tabela `conhecimento_clube`.
+
+Complementa a busca vetorial em termos exatos (nomes de planos, adversários,
+datas), que o embedding costuma errar. A busca híbrida do agente funde as duas
+listas por Reciprocal Rank Fusion (`reciprocal_rank_fusion`).
+
+- Texto normalizado para português: sem acentos, minúsculo, sem stopwords e
+  com um stemmer leve (plural, gênero e -mente).
+- Persistência compacta, no mesmo esquema do índice vetorial: só o texto de
+  cada chunk (docs.jsonl, append-only) e os ids apagados (deleted.txt). As
+  listas invertidas são montadas em memória na carga.
+- Incremental: a ingestão acrescenta as linhas novas (id > max_id) e marca as
+  apagadas; o agente recarrega quando os arquivos crescem. O refresh também
+  confere os ids vivos no Supabase (remoções feitas pela ingestão em outro host).
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.vector_index import fetch_live_ids
+
+SNAPSHOT_PAGE_SIZE = 1000
+
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "do", "da", "dos", "das",
+    "em", "no", "na", "nos", "nas", "por", "pelo", "pela", "para", "pra", "com", "sem",
+    "e", "ou", "que", "se", "ao", "aos", "eu", "voce", "ele", "ela", "eles", "elas",
+    "meu", "minha", "seu", "sua", "isso", "isto", "esse", "essa", "este", "esta",
+    "qual", "quais", "como", "onde", "quando", "quanto", "ja", "mais", "muito", "tem",
+    "ser", "sao", "foi", "ter", "vai", "mas", "nao", "sim", "me", "te", "lhe",
+}
+
+# Plurais irregulares mais comuns (forma sem acento)
+PLURAL_SUFFIXES = (("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ois", "ol"), ("ns", "m"), ("res", "r"))
+
+
+def fold(text: str) -> str:
+    """Minúsculo e sem acentos ("Sócio Maringá" -> "socio maringa")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem(token: str) -> str:
+    """Stemmer leve para português: plural, -mente e vogal temática final."""
+    if len(token) <= 3 or not token.isalpha():
+        return token
+    for suffix, replacement in PLURAL_SUFFIXES:
+        if token.endswith(suffix):
+            token = token[:-len(suffix)] + replacement
+            break
+    else:
+        if token.endswith("s") and not token.endswith(("ss", "us", "is")):
+            token = token[:-1]
+    if token.endswith("mente") and len(token) > 7:
+        token = token[:-5]
+    if len(token) > 4 and token[-1] in "aoe":
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(t) for t in re.findall(r"[a-z0-9]+", fold(text)) if t not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    """
+    Funde listas ranqueadas (melhor primeiro) por 1 / (k + posição).
+    Documentos são identificados pelo conteúdo (o RPC nem sempre devolve `id`);
+    os campos das várias listas são mesclados (ex.: `similarity` do vetor e `bm25`).
+    """
+    scores: Dict[Any, float] = defaultdict(float)
+    docs: Dict[Any, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc["conteudo"]
+            scores[key] += 1.0 / (k + rank + 1)
+            docs[key] = {**doc, **docs.get(key, {})}
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [{**docs[key], "rrf": scores[key]} for key in ordered]
+
+
+class LexicalIndex:
+    """BM25 sobre os chunks do `conhecimento_clube`."""
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self.rows: List[Dict[str, Any]] = []
+        self.max_id = 0
+        self.last_refresh = 0.0
+        self.deleted = set()
+        self._rows_size = 0
+        self._deleted_size = 0
+        self._postings: Dict[str, List[tuple]] = defaultdict(list)
+        self._lengths: List[int] = []
+        # Arrays derivados (normalização de tamanho e máscara de apagados), refeitos quando o índice muda
+        self._arrays_key = None
+        self._arrays = None
+        self._refreshing: Optional[asyncio.Task] = None
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # --- Persistência ---
+
+    @property
+    def _rows_path(self):
+        return os.path.join(self.path, "docs.jsonl")
+
+    @property
+    def _deleted_path(self):
+        return os.path.join(self.path, "deleted.txt")
+
+    def _load(self):
+        self.rows, self._lengths = [], []
+        self._postings = defaultdict(list)
+        self._rows_size = 0
+        if os.path.exists(self._rows_path):
+            with open(self._rows_path, "rb") as f:
+                data = f.read()
+            # Ignora uma última linha incompleta (escrita interrompida)
+            complete = data[:data.rfind(b"\n") + 1]
+            self._rows_size = len(complete)
+            for line in complete.decode("utf-8").splitlines():
+                if line.strip():
+                    self._index_row(json.loads(line))
+        self.max_id = max((r["id"] for r in self.rows), default=0)
+        self._load_deleted()
+
+    def _load_deleted(self):
+        self.deleted = set()
+        self._deleted_size = 0
+        if os.path.exists(self._deleted_path):
+            with open(self._deleted_path, encoding="utf-8") as f:
+                self.deleted = {int(line) for line in f if line.strip()}
+            self._deleted_size = os.path.getsize(self._deleted_path)
+
+    def _index_row(self, row: Dict[str, Any]):
+        position = len(self.rows)
+        terms = Counter(tokenize(row["conteudo"]))
+        for term, tf in terms.items():
+            self._postings[term].append((position, tf))
+        self.rows.append(row)
+        self._lengths.append(sum(terms.values()))
+
+    def _sync_from_disk(self):
+        """Recarrega se outro processo (ex.: a ingestão) mexeu nos arquivos."""
+        rows_size = os.path.getsize(self._rows_path) if os.path.exists(self._rows_path) else 0
+        if rows_size < self._rows_size:
+            self._load()  # compactado por outro processo
+        elif rows_size > self._rows_size:
+            with open(self._rows_path, "rb") as f:
+                f.seek(self._rows_size)
+                data = f.read()
+            complete = data[:data.rfind(b"\n") + 1]
+            self._rows_size += len(complete)
+            for line in complete.decode("utf-8").splitlines():
+                if line.strip():
+                    row = json.loads(line)
+                    if row["id"] > self.max_id:
+                        self._index_row(row)
+                        self.max_id = row["id"]
+        if os.path.exists(self._deleted_path) and os.path.getsize(self._deleted_path) != self._deleted_size:
+            self._load_deleted()
+
+    def __len__(self):
+        return len(self.rows) - len(self.deleted)
+
+    def add(self, records: List[Dict[str, Any]]) -> int:
+        """Acrescenta linhas já gravadas no Supabase (id, conteudo, fonte_url); ids antigos são ignorados."""
+        with self._lock:
+            self._sync_from_disk()
+            new = sorted((r for r in records if r.get("id") is not None and r["id"] > self.max_id),
+                         key=lambda r: r["id"])
+            if not new:
+                return 0
+            rows = [{"id": r["id"], "conteudo": r["conteudo"], "fonte_url": r.get("fonte_url")} for r in new]
+            payload = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+            with open(self._rows_path, "ab") as f:
+                f.write(payload)
+            self._rows_size += len(payload)
+            for row in rows:
+                self._index_row(row)
+            self.max_id = rows[-1]["id"]
+            return len(rows)
+
+    def remove(self, ids) -> int:
+        """Marca linhas apagadas no Supabase (tombstones)."""
+        with self._lock:
+            self._sync_from_disk()
+            new = [int(i) for i in ids if int(i) not in self.deleted]
+            if not new:
+                return 0
+            with open(self._deleted_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{i}\n" for i in new))
+            self._deleted_size = os.path.getsize(self._deleted_path)
+            self.deleted.update(new)
+            return len(new)
+
+    def reconcile(self, live_ids) -> int:
+        """Tombstone para as linhas do índice que não existem mais no Supabase."""
+        with self._lock:
+            self._sync_from_disk()
+            gone = [r["id"] for r in self.rows if r["id"] not in live_ids and r["id"] not in self.deleted]
+        return self.remove(gone) if gone else 0
+
+    def compact(self, min_deleted_ratio: float = 0.25) -> bool:
+        """Reescreve os arquivos sem as linhas apagadas quando elas passam de `min_deleted_ratio`."""
+        with self._lock:
+            self._sync_from_disk()
+            if not self.rows or len(self.deleted) / len(self.rows) < min_deleted_ratio:
+                return False
+            alive = [r for r in self.rows if r["id"] not in self.deleted]
+            tmp_path = self._rows_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for row in alive:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self._rows_path)
+            if os.path.exists(self._deleted_path):
+                os.remove(self._deleted_path)
+            self._load()
+            return True
+
+    # --- Busca ---
+
+    def _derived_arrays(self):
+        key = (len(self.rows), len(self.deleted))
+        if self._arrays_key != key:
+            lengths = np.asarray(self._lengths, dtype=np.float32)
+            avg_length = float(lengths.mean()) or 1.0
+            length_norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+            dead = np.array([r["id"] in self.deleted for r in self.rows], dtype=bool) if self.deleted else None
+            self._arrays_key, self._arrays = key, (length_norm, dead)
+        return self._arrays
+
+    def search(self, query: str, match_count: int = 10) -> List[Dict[str, Any]]:
+        """Top-k por BM25: lista de {id, conteudo, fonte_url, bm25}."""
+        with self._lock:
+            self._sync_from_disk()
+            rows = self.rows
+            n = len(rows)
+            if not n:
+                return []
+            alive = n - len(self.deleted)
+            length_norm, dead = self._derived_arrays()
+            scores = np.zeros(n, dtype=np.float32)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                positions = np.fromiter((p for p, _ in postings), dtype=np.int64, count=len(postings))
+                tfs = np.fromiter((tf for _, tf in postings), dtype=np.float32, count=len(postings))
+                df = len(postings)
+                idf = math.log(1 + (alive - df + 0.5) / (df + 0.5))
+                scores[positions] += idf * tfs * (self.k1 + 1) / (tfs + length_norm[positions])
+            if dead is not None:
+                scores[dead] = 0.0
+
+        k = min(match_count, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{**rows[i], "bm25": float(scores[i])} for i in top if scores[i] > 0]
+
+    # --- Sincronização com o Supabase ---
+
+    async def arefresh(self, client, table: str = "conhecimento_clube") -> int:
+        """
+        Busca no Supabase só as linhas com id maior que o último indexado e marca as
+        que sumiram de lá. Devolve quantas linhas entraram.
+        """
+        with self._lock:
+            self._sync_from_disk()
+        added = 0
+        while True:
+            res = await client.table(table).select("id, conteudo, fonte_url") \
+                .gt("id", self.max_id).order("id").limit(SNAPSHOT_PAGE_SIZE).execute()
+            if not res.data:
+                break
+            added += await asyncio.to_thread(self.add, res.data)
+            if len(res.data) < SNAPSHOT_PAGE_SIZE:
+                break
+        if self.rows:
+            await asyncio.to_thread(self.reconcile, await fetch_live_ids(client, table))
+        self.last_refresh = time.monotonic()
+        return added
+
+    def schedule_refresh(self, get_client, max_age: float) -> None:
+        """Dispara um refresh em background se o índice estiver velho (não bloqueia a busca)."""
+        if time.monotonic() - self.last_refresh < max_age:
+            return
+        if self._refreshing is not None and not self._refreshing.done():
+            return
+
+        async def run():
+            try:
+                await self.arefresh(await get_client())
+            except Exception as e:
+                self.last_refresh = time.monotonic()
+                print(f"Erro ao atualizar índice lexical: {e}")
+
+        self._refreshing = asyncio.create_task(run())
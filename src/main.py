@@ -1,10 +1,58 @@
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from src.agent import dogao_agent
+from src.admission import AdmissionController
+from src.agent import (CLUB_FACTS_ENABLED, WEB_CONCURRENCY, answer_cache, context_builder, cross_worker_state,
+                       get_club_facts, get_dogao_agent, get_embeddings, get_lead_tracker, grader, is_sale_conversation,
+                       openai_limiter, remember_unanswered, store_search_cache, summarizer, turn_lock, warmup)
+from src.batch import BatchRunner, parse_items
+from src.http_pool import close_http_clients
+from src.ingress import ConversationIngress
+from src.instrumentation import WorkerMetricsExchange, render_metrics, render_stats, trace_request
+from src.rate_limiter import is_rate_limit_error
 import uvicorn
 
-app = FastAPI(title="Agente SDR Maringá FC - API")
+# Rajadas de mensagens do mesmo torcedor que chegam durante um turno viram um único
+# turno seguinte (0 desliga o agrupamento; a serialização por whatsapp_id continua).
+# Sem turno em andamento, a mensagem não espera a janela
+INGRESS_DEBOUNCE_SECONDS = float(os.getenv("INGRESS_DEBOUNCE_SECONDS", "1.0"))
+INGRESS_MAX_WAIT_SECONDS = float(os.getenv("INGRESS_MAX_WAIT_SECONDS", "3.0"))
+# Keep-alive das conexões dos clientes (WhatsApp gateway / load balancer) com a API
+SERVER_KEEPALIVE_SECONDS = int(os.getenv("SERVER_KEEPALIVE_SECONDS", "75"))
+
+# Admissão: turnos simultâneos, fila de espera limitada e resposta degradada quando lota
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "8"))
+# Métricas dos outros workers somadas no /metrics (publicadas no estado compartilhado)
+METRICS_PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", "5"))
+# Lotes (/chat/batch): progresso por job_id para retomar depois de uma queda
+BATCH_PROGRESS_DIR = os.getenv("BATCH_PROGRESS_DIR", ".cache/batch")
+DEGRADED_RESPONSE = os.getenv(
+    "DEGRADED_RESPONSE", "Opa, recebi sua mensagem! Tá bem movimentado por aqui agora, já te respondo! ⚽"
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: clientes e grafo prontos antes de a instância receber tráfego
+    await warmup()
+    if metrics_exchange is not None:
+        metrics_exchange.start()
+    yield
+    # Shutdown: termina os resumos em andamento, processa os leads ainda na fila
+    # e grava o que estiver pendente
+    if metrics_exchange is not None:
+        await metrics_exchange.close()
+    await summarizer.close()
+    await get_lead_tracker().close()
+    await close_http_clients()
+
+app = FastAPI(title="Agente SDR Maringá FC - API", lifespan=lifespan)
 
 class ChatRequest(BaseModel):
     message: str
@@ -14,31 +62,230 @@ class ChatRequest(BaseModel):
 async def health_check():
     return {"status": "online", "agente": "Dogão SDR"}
 
+admission = AdmissionController(ADMISSION_MAX_ACTIVE, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_SECONDS)
+
+async def degraded_response(whatsapp_id: str, message: str) -> dict:
+    """Sobrecarga: responde na hora e guarda a mensagem para o próximo turno responder."""
+    await remember_unanswered(whatsapp_id, message)
+    return {"response": DEGRADED_RESPONSE, "nome_identificado": None, "plano": None, "degradada": True}
+
+async def run_turn(whatsapp_id: str, messages: list) -> dict:
+    """Um turno do grafo para um lote de mensagens do mesmo torcedor."""
+    message = "\n".join(messages)
+    # Só as mensagens novas: o histórico resumido, nome e plano vêm do checkpointer
+    # O LangGraph cuidará do roteamento entre retriever e chat; o tracker só enfileira
+    # (nome/plano extraídos neste turno aparecem no estado a partir do próximo)
+    inputs = {
+        "messages": [("user", message)],
+        "whatsapp_id": whatsapp_id
+    }
+    config = {"configurable": {"thread_id": whatsapp_id}}
+
+    # Só consulta a intenção de compra quando vai disputar lugar na fila
+    priority = admission.busy and await is_sale_conversation(whatsapp_id)
+    async with admission.slot(priority) as admitted:
+        if not admitted:
+            return await degraded_response(whatsapp_id, message)
+        try:
+            # Execução assíncrona do Grafo (persiste só o checkpoint final do turno)
+            async with trace_request("/chat", whatsapp_id):
+                result = await get_dogao_agent().ainvoke(inputs, config, durability="exit")
+        except Exception as e:
+            # 429 mesmo com o limitador (limites da conta abaixo de OPENAI_RPM/OPENAI_TPM)
+            if not is_rate_limit_error(e):
+                raise
+            return await degraded_response(whatsapp_id, message)
+
+    return {
+        # Extrai a última mensagem da lista (a resposta da IA)
+        "response": result["messages"][-1].content,
+        "nome_identificado": result.get("nome_torcedor"),
+        "plano": result.get("plano_interesse"),
+        "degradada": False
+    }
+
+ingress = ConversationIngress(
+    run_turn, window=INGRESS_DEBOUNCE_SECONDS, max_wait=INGRESS_MAX_WAIT_SECONDS,
+    # Mesmo lock do lead tracker e do resumo em segundo plano (src/agent.py)
+    lock=turn_lock,
+)
+
 @app.post("/chat")
 async def chat_endpoint(req: ChatRequest):
+    """
+    Mensagens do mesmo whatsapp_id que chegam em rajada viram um único turno:
+    só a última requisição do lote recebe a resposta; as anteriores voltam
+    com `response: null` e `agrupada: true` (nada a enviar ao torcedor).
+    Com a API lotada (ou 429 da OpenAI) a resposta sai na hora com a mensagem
+    degradada e `degradada: true`.
+    """
     try:
-        # Inicializa o estado com a mensagem do usuário
-        # O LangGraph cuidará do roteamento entre retriever, chat e tracker
-        inputs = {
-            "messages": [("user", req.message)],
-            "whatsapp_id": req.whatsapp_id
-        }
-        
-        # Execução assíncrona do Grafo
-        result = await dogao_agent.ainvoke(inputs)
-        
-        # Extrai a última mensagem da lista (a resposta da IA)
-        final_message = result["messages"][-1].content
-        
-        return {
-            "response": final_message,
-            "nome_identificado": result.get("nome_torcedor"),
-            "plano": result.get("plano_interesse")
-        }
+        result, last = await ingress.submit(req.whatsapp_id, req.message)
+        if not last:
+            return {**result, "response": None, "agrupada": True}
+        return {**result, "agrupada": False}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-if __name__ == "__main__":
+batch_stats = {"lotes": 0, "itens": 0, "respondidos": 0, "erros": 0, "retomados": 0, "sem_vaga": 0}
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: Request, job_id: Optional[str] = None, concorrencia: Optional[int] = None):
+    """
+    Lote de conversas (campanha ou backlog) em NDJSON: corpo com um
+    {whatsapp_id, message} por linha, resposta com um resultado por linha
+    conforme os blocos terminam. Com `job_id`, o progresso fica em
+    BATCH_PROGRESS_DIR: reenviar o mesmo lote devolve primeiro o que já foi
+    respondido (`retomado: true`) e só processa o resto. Cada item passa pelo
+    lock de turno do whatsapp_id e ocupa uma vaga da admissão; item sem vaga
+    volta com `erro` e é refeito na retomada.
+    """
+    try:
+        items = parse_items((await request.body()).decode("utf-8").splitlines())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    progress_path = None
+    if job_id:
+        if not re.fullmatch(r"[A-Za-z0-9_.-]{1,100}", job_id):
+            raise HTTPException(status_code=400, detail="job_id inválido")
+        progress_path = os.path.join(BATCH_PROGRESS_DIR, f"{job_id}.ndjson")
+    # Mesmo lock de turno e mesma admissão do /chat: o lote não cruza com conversas ao vivo
+    runner = BatchRunner(get_dogao_agent, get_embeddings, lock=turn_lock, admission=admission,
+                         **({"concurrency": concorrencia} if concorrencia else {}))
+
+    async def results():
+        try:
+            async for result in runner.run(items, progress_path, replay=True):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            batch_stats["lotes"] += 1
+            for key in ("itens", "respondidos", "erros", "retomados", "sem_vaga"):
+                batch_stats[key] += runner.stats[key]
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def metrics_extra() -> list:
+    """Contadores dos caches, filas e limitadores deste processo (gauges)."""
+    return (
+        render_stats("dogao_answer_cache", answer_cache.metrics())
+        + render_stats("dogao_grader", grader.metrics(), label="camada")
+        + render_stats("dogao_context", context_builder.metrics())
+        + (render_stats("dogao_club_facts", get_club_facts().metrics()) if CLUB_FACTS_ENABLED else [])
+        + render_stats("dogao_store_search", store_search_cache.metrics())
+        + render_stats("dogao_lead_tracker", get_lead_tracker().stats)
+        + render_stats("dogao_summarizer", summarizer.stats)
+        + render_stats("dogao_ingress", ingress.metrics())
+        + render_stats("dogao_admission", admission.metrics())
+        + render_stats("dogao_batch", batch_stats)
+        + render_stats("dogao_openai_limiter", openai_limiter.stats)
+    )
+
+# Com estado compartilhado (sqlite/redis), qualquer worker responde pelo conjunto
+metrics_exchange = (
+    WorkerMetricsExchange(cross_worker_state, metrics_extra, interval=METRICS_PUBLISH_SECONDS)
+    if cross_worker_state is not None else None
+)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Métricas no formato do Prometheus: nós, tools, LLM (tokens/custo), turnos e caches.
+    Com vários workers, contadores e histogramas somam todos os workers e os
+    gauges saem com o label `worker`.
+    """
+    if metrics_exchange is None:
+        return render_metrics(metrics_extra())
+    return await metrics_exchange.render()
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """Taxa de acerto e latência economizada pelo cache semântico de respostas."""
+    return answer_cache.metrics()
+
+@app.get("/metrics/grader")
+async def grader_metrics():
+    """Decisões, aprovações e latência por camada do grade_documents."""
+    return grader.metrics()
+
+@app.get("/metrics/store")
+async def store_metrics():
+    """Acertos (frescos e velhos), faltas e requisições coalescidas da busca na loja."""
+    return store_search_cache.metrics()
+
+# Nós cujos tokens vão para o torcedor (resposta direta do router ou RAG)
+STREAM_NODES = {"agent", "generate"}
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """
+    Mesma conversa do /chat, mas em Server-Sent Events:
+    - `token`: pedaços da resposta assim que o LLM gera (nós agent/generate)
+    - `metadata`: frame final com a resposta completa, nome e plano
+    - `error`: falha durante a execução
+    Serializado por whatsapp_id como o /chat, mas sem agrupar mensagens; com a
+    API lotada sai só a mensagem degradada (`token` + `metadata` com `degradada`).
+    """
+    inputs = {
+        "messages": [("user", req.message)],
+        "whatsapp_id": req.whatsapp_id
+    }
+    config = {"configurable": {"thread_id": req.whatsapp_id}}
+    dogao_agent = get_dogao_agent()
+
+    async def event_stream():
+        try:
+            # O estado final é lido ainda dentro da vez deste torcedor
+            async with ingress.serialized(req.whatsapp_id):
+                priority = admission.busy and await is_sale_conversation(req.whatsapp_id)
+                async with admission.slot(priority) as admitted:
+                    if not admitted:
+                        degraded = await degraded_response(req.whatsapp_id, req.message)
+                        yield sse("token", {"content": degraded["response"]})
+                        yield sse("metadata", degraded)
+                        return
+                    async with trace_request("/chat/stream", req.whatsapp_id):
+                        async for event in dogao_agent.astream_events(inputs, config, version="v2", durability="exit"):
+                            if event["event"] == "on_chain_end" and event["name"] == "answer_cache":
+                                # Acerto no cache de respostas: a resposta inteira sai num único token
+                                output = event["data"].get("output") or {}
+                                for message in output.get("messages", []) if isinstance(output, dict) else []:
+                                    yield sse("token", {"content": message.content})
+                                continue
+                            if event["event"] != "on_chat_model_stream":
+                                continue
+                            if event["metadata"].get("langgraph_node") not in STREAM_NODES:
+                                continue
+                            content = event["data"]["chunk"].content
+                            if content:
+                                yield sse("token", {"content": content})
+
+                    state = (await dogao_agent.aget_state(config)).values
+                    yield sse("metadata", {
+                        "response": state["messages"][-1].content,
+                        "nome_identificado": state.get("nome_torcedor"),
+                        "plano": state.get("plano_interesse"),
+                        "degradada": False
+                    })
+        except Exception as e:
+            yield sse("error", {"detail": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def serve():
+    """Modo produção: WEB_CONCURRENCY workers (processos) na mesma porta."""
     # Porta 80 é o padrão para o Azure App Service
     port = int(os.environ.get("PORT", 80))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    if WEB_CONCURRENCY > 1:
+        if os.getenv("SHARED_STATE_BACKEND", "memory").lower() == "memory":
+            print("⚠️ Vários workers com SHARED_STATE_BACKEND=memory: locks, caches e /metrics não valem entre eles")
+        if os.getenv("CHECKPOINT_BACKEND", "sqlite").lower() == "memory":
+            print("⚠️ Vários workers com CHECKPOINT_BACKEND=memory: cada worker teria a própria conversa")
+    uvicorn.run("src.main:app", host="0.0.0.0", port=port, workers=WEB_CONCURRENCY,
+                timeout_keep_alive=SERVER_KEEPALIVE_SECONDS)
+
+if __name__ == "__main__":
+    serve()
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Registro de modelos por papel (role) do agente.
+
+Cada nó declara o papel da chamada e recebe o modelo configurado para ele:
+só as respostas que o torcedor lê (router e generate) usam o GPT-4o; as
+chamadas utilitárias (grader, rewrite, extração do lead, resumo) usam um
+modelo pequeno com temperatura 0.
+
+Configuração por variável de ambiente (ROLE em maiúsculas, ex.: GRADER):
+- MODEL_<ROLE>: modelo principal
+- MODEL_<ROLE>_TEMPERATURE, MODEL_<ROLE>_TIMEOUT (s), MODEL_<ROLE>_MAX_TOKENS
+- MODEL_<ROLE>_FALLBACKS: modelos separados por vírgula, tentados em ordem
+  quando o principal falha (timeout, rate limit, erro da API)
+
+Os clientes são criados na primeira chamada e reaproveitados. Toda chamada
+leva `model_role` no metadata, para a instrumentação separar latência e
+custo por papel, e passa pelos `callbacks` do registro (ex.: o limitador de
+RPM/TPM da OpenAI em src/rate_limiter.py).
+"""
+import os
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    model: str
+    temperature: float = 0.0
+    timeout: Optional[float] = None
+    max_tokens: Optional[int] = None
+    max_retries: int = 1
+    fallbacks: Tuple[str, ...] = ()
+
+
+DEFAULT_SPECS: Dict[str, ModelSpec] = {
+    # Falam com o torcedor
+    "router": ModelSpec("gpt-4o", temperature=0.7, timeout=20, fallbacks=("gpt-4o-mini",)),
+    "answer": ModelSpec("gpt-4o", temperature=0.7, timeout=30, max_tokens=600, fallbacks=("gpt-4o-mini",)),
+    # Utilitários
+    "grader": ModelSpec("gpt-4o-mini", timeout=10, fallbacks=("gpt-4o",)),
+    "rewrite": ModelSpec("gpt-4o-mini", timeout=10, max_tokens=100, fallbacks=("gpt-4o",)),
+    "extraction": ModelSpec("gpt-4o-mini", timeout=15, fallbacks=("gpt-4o",)),
+    "summary": ModelSpec("gpt-4o-mini", timeout=20, max_tokens=300, fallbacks=("gpt-4o",)),
+}
+
+
+def load_specs(defaults: Dict[str, ModelSpec] = DEFAULT_SPECS) -> Dict[str, ModelSpec]:
+    """Aplica as variáveis MODEL_<ROLE>* sobre os padrões."""
+    specs = {}
+    for role, spec in defaults.items():
+        prefix = f"MODEL_{role.upper()}"
+        changes: Dict[str, Any] = {}
+        if os.getenv(prefix):
+            changes["model"] = os.getenv(prefix)
+        if os.getenv(f"{prefix}_TEMPERATURE"):
+            changes["temperature"] = float(os.getenv(f"{prefix}_TEMPERATURE"))
+        if os.getenv(f"{prefix}_TIMEOUT"):
+            changes["timeout"] = float(os.getenv(f"{prefix}_TIMEOUT"))
+        if os.getenv(f"{prefix}_MAX_TOKENS"):
+            changes["max_tokens"] = int(os.getenv(f"{prefix}_MAX_TOKENS"))
+        if os.getenv(f"{prefix}_FALLBACKS") is not None:
+            changes["fallbacks"] = tuple(m.strip() for m in os.getenv(f"{prefix}_FALLBACKS").split(",") if m.strip())
+        specs[role] = replace(spec, **changes)
+    return specs
+
+
+def openai_chat_model(spec: ModelSpec, model: str):
+    from langchain_openai import ChatOpenAI
+    from src.http_pool import get_http_client
+    return ChatOpenAI(model=model, temperature=spec.temperature, timeout=spec.timeout,
+                      max_tokens=spec.max_tokens, max_retries=spec.max_retries,
+                      http_async_client=get_http_client("openai"))
+
+
+class ModelRegistry:
+    """Modelos por papel, com cadeia de fallback e clientes criados sob demanda."""
+
+    def __init__(self, specs: Dict[str, ModelSpec], factory: Callable[[ModelSpec, str], Any] = openai_chat_model,
+                 callbacks: Sequence[Any] = ()):
+        self.specs = specs
+        self.factory = factory
+        self.callbacks = list(callbacks)
+        self._clients: Dict[Tuple[str, str], Any] = {}
+
+    def use_factory(self, factory: Callable[[ModelSpec, str], Any]):
+        """Troca a fábrica de clientes (ex.: modelos falsos nos testes) e descarta os criados."""
+        self.factory = factory
+        self._clients.clear()
+
+    def _client(self, role: str, model: str):
+        key = (role, model)
+        if key not in self._clients:
+            client = self.factory(self.specs[role], model)
+            if self.callbacks:
+                # Callbacks locais do modelo: somam aos do grafo sem trocar o run pai
+                # (com `with_config(callbacks=...)` o LLM perderia o langgraph_node)
+                client.callbacks = [*self.callbacks, *(client.callbacks or [])]
+            self._clients[key] = client
+        return self._clients[key]
+
+    def model(self, role: str):
+        """Modelo principal do papel (sem fallback)."""
+        return self._client(role, self.specs[role].model)
+
+    def clients(self):
+        return list(self._clients.values())
+
+    def chain(self, role: str, prepare: Optional[Callable[[Any], Any]] = None):
+        """
+        Runnable do papel: principal + fallbacks, cada um passando por `prepare`
+        (ex.: `lambda m: m.bind_tools(tools)` ou `with_structured_output`).
+        """
+        spec = self.specs[role]
+        prepare = prepare or (lambda m: m)
+        primary = prepare(self._client(role, spec.model))
+        fallbacks = [prepare(self._client(role, m)) for m in spec.fallbacks if m != spec.model]
+        runnable = primary.with_fallbacks(fallbacks) if fallbacks else primary
+        return runnable.with_config(metadata={"model_role": role})
+
+    def warmup(self):
+        """Cria os clientes de todos os papéis (principal e fallbacks)."""
+        for role, spec in self.specs.items():
+            for model in (spec.model, *spec.fallbacks):
+                self._client(role, model)
@@ -0,0 +1,148 @@
+"""
+Limitador compartilhado das chamadas à OpenAI (LLM e embeddings).
+
+Dois baldes de fichas (token bucket) reabastecidos continuamente, com os
+limites da conta por minuto:
+- RPM: uma ficha por requisição;
+- TPM: tokens estimados do prompt (~3 caracteres por token), acertados com o
+  `usage` real quando a resposta chega.
+
+Uma chamada só sai quando há requisição disponível e o saldo de tokens está
+positivo; o saldo pode ficar negativo (uma resposta grande "pega emprestado"
+do próximo minuto), e quem vem depois espera o balde voltar. Assim um pico de
+tráfego vira fila curta aqui, não uma tempestade de 429 na OpenAI. Um 429 que
+passar mesmo assim pausa todas as chamadas por `backoff` segundos.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+
+def estimate_tokens(text: str) -> int:
+    """Mesma estimativa da ingestão e do resumo (~3 caracteres por token)."""
+    return len(text) // 3 + 1
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, level: float) -> float:
+        """Segundos até o balde chegar a `level`."""
+        return max(0.0, (level - self.level) / self.rate)
+
+
+class TokenBucketLimiter:
+    def __init__(self, rpm: float = 0, tpm: float = 0, backoff: float = 2.0):
+        # 0 desliga a dimensão correspondente
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.backoff = backoff
+        self._paused_until = 0.0
+        self.stats = {"chamadas": 0, "esperas": 0, "segundos_esperando": 0.0, "tokens": 0, "rate_limit_429": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _wait_time(self, now: float) -> float:
+        wait = max(0.0, self._paused_until - now)
+        if self.requests:
+            self.requests.refill(now)
+            wait = max(wait, self.requests.wait_for(1))
+        if self.tokens:
+            self.tokens.refill(now)
+            # Saldo > 0 basta: a chamada pode deixar o balde negativo
+            if self.tokens.level <= 0:
+                wait = max(wait, self.tokens.wait_for(1))
+        return wait
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Espera a vez da chamada e reserva 1 requisição + `tokens`. Retorna a espera (s)."""
+        self.stats["chamadas"] += 1
+        started = time.monotonic()
+        waited = False
+        while True:
+            wait = self._wait_time(time.monotonic())
+            if wait <= 0:
+                break
+            waited = True
+            await asyncio.sleep(wait)
+        if self.requests:
+            self.requests.level -= 1
+        if self.tokens:
+            self.tokens.level -= tokens
+        elapsed = time.monotonic() - started
+        if waited:
+            self.stats["esperas"] += 1
+            self.stats["segundos_esperando"] += elapsed
+        return elapsed
+
+    def settle(self, reserved: int, actual: int):
+        """Acerta o saldo de tokens com o consumo real da resposta."""
+        self.stats["tokens"] += actual
+        if self.tokens:
+            self.tokens.refill(time.monotonic())
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved - actual)
+
+    def rate_limited(self):
+        """429 da OpenAI: pausa todas as chamadas por `backoff` segundos."""
+        self.stats["rate_limit_429"] += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + self.backoff)
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """RateLimitError da OpenAI (sem importar o SDK)."""
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _total_tokens(response) -> Optional[int]:
+    total = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                total += usage.get("total_tokens") or usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    if not total and response.llm_output:
+        total = (response.llm_output.get("token_usage") or {}).get("total_tokens", 0)
+    return total or None
+
+
+class RateLimitCallback(AsyncCallbackHandler):
+    """
+    Passa cada chamada de chat model pelo limitador. Callback assíncrono: o
+    LangChain espera o `on_chat_model_start` antes de enviar a requisição
+    (vale para invoke, stream e cada tentativa dos fallbacks).
+    """
+
+    def __init__(self, limiter: TokenBucketLimiter):
+        self.limiter = limiter
+        self._reserved: Dict[UUID, int] = {}
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, invocation_params=None, **kwargs: Any):
+        prompt = sum(estimate_tokens(str(m.content)) for batch in messages for m in batch)
+        # Reserva também a saída máxima configurada (max_tokens) quando houver
+        reserved = prompt + int((invocation_params or {}).get("max_tokens") or 0)
+        self._reserved[run_id] = reserved
+        await self.limiter.acquire(reserved)
+
+    async def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        reserved = self._reserved.pop(run_id, 0)
+        actual = _total_tokens(response)
+        self.limiter.settle(reserved, reserved if actual is None else actual)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        # Requisição que falhou não consome tokens
+        self.limiter.settle(self._reserved.pop(run_id, 0), 0)
+        if is_rate_limit_error(error):
+            self.limiter.rate_limited()
@@ -0,0 +1,234 @@
+"""
+Estado compartilhado entre os workers da API (chave/valor com TTL + locks).
+
+Com `WEB_CONCURRENCY` > 1 cada worker é um processo: os caches e os locks em
+memória de um não valem para o outro. O que precisa valer entre workers
+passa por aqui:
+- locks de sessão: um turno por whatsapp_id por vez, em qualquer worker;
+- versão do checkpoint de cada conversa (a camada quente do checkpointer
+  confere antes de usar o estado em memória);
+- cache de respostas por pergunta e cache da busca na loja.
+
+Backends (SHARED_STATE_BACKEND):
+- memory: dicionário do processo (um worker só, e os testes);
+- sqlite: arquivo compartilhado pelos workers da mesma máquina (padrão com
+  vários workers, sem dependência nova);
+- redis: vários hosts (`SHARED_STATE_URL`, pacote `redis`).
+
+Os locks são leases: expiram sozinhos depois de `ttl` segundos, então um
+worker que morre segurando o lock não trava a conversa para sempre. Enquanto
+o dono está vivo, um heartbeat renova o lease a cada `ttl / 3`: um turno mais
+longo que o `ttl` não perde o lock para outro worker no meio.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# Espera entre tentativas de pegar um lock ocupado (s)
+LOCK_POLL_SECONDS = 0.02
+
+
+@asynccontextmanager
+async def _renewing(name: str, ttl: float, renew: Callable[[], Awaitable[bool]]):
+    """Renova o lease em segundo plano enquanto o bloco roda; `renew` devolve False se o lease foi perdido."""
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if not await renew():
+                    print(f"⚠️ Lease {name} expirou antes da renovação: outro worker pode ter pego o lock")
+                    return
+            except Exception as e:
+                print(f"⚠️ Falha ao renovar o lease {name}: {e}")
+
+    task = asyncio.create_task(heartbeat())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+class MemorySharedState:
+    """Estado do próprio processo (mesma interface dos backends compartilhados)."""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        self._values.pop(key, None)
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float = 120):
+        # Um processo só: o lock some com ele, então não precisa de lease nem de renovação
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        self._users[name] = self._users.get(name, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[name] -= 1
+            if not self._users[name]:
+                del self._users[name]
+                self._locks.pop(name, None)
+
+
+class SQLiteSharedState:
+    """Chave/valor e leases numa tabela SQLite (WAL) compartilhada pelos workers."""
+
+    def __init__(self, path: str = ".cache/shared_state.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        """Conexão aberta no primeiro uso (chamar com `self._lock`), como o cliente do Redis."""
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS estado_compartilhado (
+                    chave TEXT PRIMARY KEY,
+                    valor TEXT NOT NULL,
+                    expira_em REAL
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT valor FROM estado_compartilhado WHERE chave = ? AND (expira_em IS NULL OR expira_em > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ttl: Optional[float]) -> None:
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO estado_compartilhado (chave, valor, expira_em) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl if ttl else None),
+            )
+
+    def _delete(self, key: str, value: Optional[str] = None) -> None:
+        with self._lock:
+            if value is None:
+                self._db().execute("DELETE FROM estado_compartilhado WHERE chave = ?", (key,))
+            else:
+                self._db().execute("DELETE FROM estado_compartilhado WHERE chave = ? AND valor = ?", (key, value))
+
+    def _try_lock(self, key: str, token: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            # Pega o lease se ninguém tem ou se o do dono anterior expirou
+            cursor = self._db().execute("""
+                INSERT INTO estado_compartilhado (chave, valor, expira_em) VALUES (?, ?, ?)
+                ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor, expira_em = excluded.expira_em
+                WHERE estado_compartilhado.expira_em <= ?
+            """, (key, token, now + ttl, now))
+            return cursor.rowcount == 1
+
+    def _renew(self, key: str, token: str, ttl: float) -> bool:
+        with self._lock:
+            cursor = self._db().execute(
+                "UPDATE estado_compartilhado SET expira_em = ? WHERE chave = ? AND valor = ? AND expira_em > ?",
+                (time.time() + ttl, key, token, time.time()),
+            )
+            return cursor.rowcount == 1
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float = 120):
+        key, token = f"lock:{name}", uuid.uuid4().hex
+        while not await asyncio.to_thread(self._try_lock, key, token, ttl):
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+        try:
+            async with _renewing(name, ttl, lambda: asyncio.to_thread(self._renew, key, token, ttl)):
+                yield
+        finally:
+            # Só apaga o próprio lease (se expirou e outro pegou, não mexe)
+            await asyncio.to_thread(self._delete, key, token)
+
+
+class RedisSharedState:
+    """Chave/valor e leases no Redis (SET NX PX), para workers em vários hosts."""
+
+    # Libera o lock só se ainda for do mesmo dono
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+    # Renova o lock só se ainda for do mesmo dono
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+
+    def __init__(self, url: str):
+        self.url = url
+        self._client = None
+
+    def _redis(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis().get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        await self._redis().set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        await self._redis().delete(key)
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float = 120):
+        client, key, token = self._redis(), f"lock:{name}", uuid.uuid4().hex
+        while not await client.set(key, token, nx=True, px=int(ttl * 1000)):
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+
+        async def renew() -> bool:
+            return bool(await client.eval(self._RENEW, 1, key, token, int(ttl * 1000)))
+
+        try:
+            async with _renewing(name, ttl, renew):
+                yield
+        finally:
+            await client.eval(self._RELEASE, 1, key, token)
+
+
+def build_shared_state():
+    """Backend conforme SHARED_STATE_BACKEND (memory, sqlite ou redis)."""
+    backend = os.getenv("SHARED_STATE_BACKEND", "memory").lower()
+    if backend == "redis":
+        return RedisSharedState(os.getenv("SHARED_STATE_URL", "redis://localhost:6379/0"))
+    if backend == "sqlite":
+        return SQLiteSharedState(os.getenv("SHARED_STATE_PATH", ".cache/shared_state.sqlite"))
+    return MemorySharedState()
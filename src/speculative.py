@@ -0,0 +1,58 @@
+"""
+Busca especulativa no conhecimento_clube.
+
+O router (GPT-4o) leva uma ida e volta inteira só para decidir chamar o
+`retrieve_docs`, e na maioria das perguntas de sócio/jogos ele chama com a
+própria mensagem do torcedor. Então a busca (embedding + match_documents)
+começa junto com o router, uma por conversa:
+- o router pediu `retrieve_docs` com a mesma query (normalizada): a tool usa
+  o resultado (ou espera a busca que já está andando);
+- pediu outra query, outra tool ou respondeu direto: a busca é cancelada.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from src.embedding_cache import normalize_text
+
+
+class SpeculativeRetrieval:
+    def __init__(self, retrieve: Callable[[str], Awaitable[Any]]):
+        self.retrieve = retrieve
+        # whatsapp_id -> (query normalizada, busca em andamento)
+        self._pending: Dict[str, Tuple[str, asyncio.Task]] = {}
+        self.stats = {"iniciadas": 0, "reaproveitadas": 0, "descartadas": 0, "falhas": 0}
+
+    def start(self, scope: str, query: str):
+        self.discard(scope)
+        task = asyncio.create_task(self.retrieve(query))
+        # Falha numa busca descartada não vira "Task exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._pending[scope] = (normalize_text(query), task)
+        self.stats["iniciadas"] += 1
+
+    def keep_if_requested(self, scope: str, queries: Iterable[str]):
+        """Depois do router: mantém a busca só se ele pediu a mesma query."""
+        pending = self._pending.get(scope)
+        if pending and pending[0] not in {normalize_text(q) for q in queries}:
+            self.discard(scope)
+
+    def discard(self, scope: str):
+        pending = self._pending.pop(scope, None)
+        if pending is not None:
+            pending[1].cancel()
+            self.stats["descartadas"] += 1
+
+    async def take(self, scope: str, query: str) -> Optional[Any]:
+        """Resultado da busca especulativa para esta query (None: buscar normalmente)."""
+        pending = self._pending.get(scope)
+        if pending is None or pending[0] != normalize_text(query):
+            return None
+        del self._pending[scope]
+        try:
+            result = await pending[1]
+        except Exception as e:
+            self.stats["falhas"] += 1
+            print(f"Erro na busca especulativa: {e}")
+            return None
+        self.stats["reaproveitadas"] += 1
+        return result
@@ -0,0 +1,153 @@
+"""
+Cache das buscas na loja oficial (Tavily) usadas pelo `search_store`.
+
+Catálogo e preços da loja mudam no máximo uma vez por dia, então:
+- Chave: query normalizada (mesma normalização do cache de embeddings).
+- Dentro do TTL: responde do cache.
+- Depois do TTL e dentro de `stale_ttl`: responde o valor velho na hora e
+  revalida em background (stale-while-revalidate).
+- Queries iguais simultâneas viram uma única requisição em voo.
+- Se a revalidação falhar, o valor velho continua valendo até expirar.
+- Com vários workers, cada busca feita vai também para o estado compartilhado
+  (src/shared_state.py): o worker que ainda não tem a query local usa o
+  resultado do outro em vez de chamar o Tavily de novo.
+
+`TavilySearchClient` faz a busca pelo pool HTTP do processo (src/http_pool.py).
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.embedding_cache import normalize_text
+
+
+class StoreSearchCache:
+    def __init__(self, fetch: Callable[[str], Awaitable[Any]], ttl: float = 21600,
+                 stale_ttl: float = 86400, max_entries: int = 500, shared=None):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"acertos": 0, "acertos_velhos": 0, "faltas": 0, "coalescidas": 0,
+                      "requisicoes": 0, "erros": 0, "compartilhados": 0}
+
+    def _remember(self, key: str, entry: Tuple[Any, float]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load_shared(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Resultado que outro worker já buscou (idade convertida para o relógio deste processo)."""
+        try:
+            raw = await self.shared.get(f"loja:{key}")
+        except Exception as e:
+            print(f"Erro ao ler busca na loja compartilhada: {e}")
+            return None
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        entry = (data["valor"], time.monotonic() - max(0.0, time.time() - data["em"]))
+        self._remember(key, entry)
+        self.stats["compartilhados"] += 1
+        return entry
+
+    async def _publish(self, key: str, value: Any):
+        try:
+            await self.shared.set(f"loja:{key}", json.dumps({"valor": value, "em": time.time()}, ensure_ascii=False),
+                                  ttl=self.ttl + self.stale_ttl)
+        except Exception as e:
+            print(f"Erro ao gravar busca na loja compartilhada: {e}")
+
+    async def _fetch_and_store(self, key: str, query: str) -> Any:
+        try:
+            self.stats["requisicoes"] += 1
+            value = await self.fetch(query)
+            self._remember(key, (value, time.monotonic()))
+            if self.shared is not None:
+                await self._publish(key, value)
+            return value
+        except Exception:
+            self.stats["erros"] += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _start_fetch(self, key: str, query: str) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            # Requisição compartilhada entre turnos: roda fora do contexto (callbacks) de quem chamou
+            task = contextvars.Context().run(asyncio.create_task, self._fetch_and_store(key, query))
+            self._inflight[key] = task
+        return task
+
+    def _revalidate(self, key: str, query: str):
+        task = self._start_fetch(key, query)
+
+        def log_error(t: asyncio.Task):
+            if not t.cancelled() and t.exception() is not None:
+                print(f"Erro ao revalidar busca na loja '{query}': {t.exception()}")
+
+        task.add_done_callback(log_error)
+
+    async def get(self, query: str) -> Any:
+        key = normalize_text(query)
+        entry = self._entries.get(key)
+        if entry is None and self.shared is not None and key not in self._inflight:
+            entry = await self._load_shared(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                self.stats["acertos"] += 1
+                self._entries.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stats["acertos_velhos"] += 1
+                self._revalidate(key, query)
+                return value
+
+        self.stats["faltas"] += 1
+        if key in self._inflight:
+            self.stats["coalescidas"] += 1
+        # shield: um chamador cancelado não cancela a requisição dos outros
+        return await asyncio.shield(self._start_fetch(key, query))
+
+    def metrics(self) -> Dict[str, float]:
+        consultas = self.stats["acertos"] + self.stats["acertos_velhos"] + self.stats["faltas"]
+        return {
+            **self.stats,
+            "entradas": len(self._entries),
+            "taxa_acerto": (self.stats["acertos"] + self.stats["acertos_velhos"]) / consultas if consultas else 0.0,
+        }
+
+
+class TavilySearchClient:
+    """Busca no Tavily pelo cliente HTTP do processo (mesmo retorno do TavilySearchResults: url + content)."""
+
+    API_URL = "https://api.tavily.com/search"
+
+    def __init__(self, get_client: Callable[[], Any], api_key: Optional[str] = None, max_results: int = 3,
+                 search_depth: str = "advanced", include_domains: Sequence[str] = ()):
+        self.get_client = get_client
+        self.api_key = api_key or os.getenv("TAVILY_API_KEY")
+        self.max_results = max_results
+        self.search_depth = search_depth
+        self.include_domains = list(include_domains)
+
+    async def ainvoke(self, query: str) -> List[Dict[str, str]]:
+        response = await self.get_client().post(
+            self.API_URL,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json={"query": query, "max_results": self.max_results, "search_depth": self.search_depth,
+                  "include_domains": self.include_domains},
+        )
+        response.raise_for_status()
+        return [{"url": r["url"], "content": r["content"]} for r in response.json().get("results", [])]
@@ -0,0 +1,134 @@
+"""
+Resumo incremental da conversa, limitado por tokens.
+
+- O histórico de mensagens é medido em tokens (estimativa de ~3 caracteres por
+  token, a mesma da ingestão), não em quantidade de mensagens.
+- Passou de `budget`: as mensagens mais antigas saem do histórico até sobrar no
+  máximo `keep` tokens, sempre cortando no início de um turno (HumanMessage),
+  para nunca separar uma chamada de tool da sua ToolMessage.
+- O resumo é rolante: o novo resumo sai do resumo anterior + só as mensagens
+  que acabaram de sair. Existe um único resumo por conversa.
+- Normalmente roda em segundo plano, depois da resposta (`schedule`); só roda
+  no caminho crítico (`compact`) se o histórico passar de `hard_limit`.
+"""
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+
+def count_tokens(text: str) -> int:
+    """Estimativa conservadora de tokens (~3 caracteres por token em português)."""
+    return len(text) // 3 + 1
+
+
+def message_tokens(message: BaseMessage) -> int:
+    tokens = count_tokens(str(message.content))
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(f"{call['name']}{call['args']}")
+    return tokens
+
+
+def history_tokens(messages: Sequence[BaseMessage]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def split_history(messages: Sequence[BaseMessage], keep_tokens: int) -> int:
+    """
+    Índice de corte: `messages[:i]` vai para o resumo, `messages[i:]` fica.
+    Corta no início do turno mais antigo que ainda cabe em `keep_tokens`
+    (o último turno sempre fica, mesmo se sozinho passar do limite).
+    """
+    boundaries = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if not boundaries:
+        return 0
+    remaining = history_tokens(messages)
+    start = 0
+    for boundary in boundaries:
+        remaining -= history_tokens(messages[start:boundary])
+        start = boundary
+        if remaining <= keep_tokens:
+            return boundary
+    return boundaries[-1]
+
+
+def format_transcript(messages: Sequence[BaseMessage]) -> str:
+    """Transcrição para o prompt do resumo (sem trechos de tools nem chamadas vazias)."""
+    lines = []
+    for m in messages:
+        if isinstance(m, ToolMessage):
+            continue
+        if isinstance(m, AIMessage) and not m.content:
+            continue
+        if isinstance(m, SystemMessage):
+            # Resumo no formato antigo (SystemMessage no histórico)
+            lines.append(str(m.content))
+            continue
+        role = "Torcedor" if isinstance(m, HumanMessage) else "Dogão"
+        lines.append(f"{role}: {m.content}")
+    return "\n".join(lines)
+
+
+class ConversationSummarizer:
+    """Decide quando resumir, o que sai do histórico e roda o resumo em segundo plano."""
+
+    def __init__(self, summarize: Callable[[str, str], Awaitable[str]],
+                 apply: Callable[[str, str, str, List[str]], Awaitable[bool]],
+                 budget: int = 2000, keep: int = 800, hard_limit: Optional[int] = None):
+        self.summarize = summarize
+        self.apply = apply
+        self.budget = budget
+        self.keep = keep
+        self.hard_limit = hard_limit or 2 * budget
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"resumos_segundo_plano": 0, "resumos_no_turno": 0, "mensagens_resumidas": 0,
+                      "descartados": 0, "falhas": 0}
+
+    def over_budget(self, messages: Sequence[BaseMessage]) -> bool:
+        return history_tokens(messages) > self.budget
+
+    def over_hard_limit(self, messages: Sequence[BaseMessage]) -> bool:
+        return history_tokens(messages) > self.hard_limit
+
+    async def compact(self, previous: str, messages: Sequence[BaseMessage]) -> Optional[Tuple[str, List[BaseMessage]]]:
+        """(novo resumo, mensagens que saem do histórico) ou None se não há o que tirar."""
+        cut = split_history(messages, self.keep)
+        evicted = list(messages[:cut])
+        if not evicted:
+            return None
+        summary = await self.summarize(previous, format_transcript(evicted))
+        self.stats["mensagens_resumidas"] += len(evicted)
+        return summary, evicted
+
+    def schedule(self, whatsapp_id: str, previous: str, messages: Sequence[BaseMessage]) -> None:
+        """Resume em segundo plano (um por conversa por vez) e aplica no estado salvo."""
+        if whatsapp_id in self._inflight:
+            return
+        # Contexto vazio: não herda o config/callbacks do turno que agendou
+        task = contextvars.Context().run(
+            asyncio.create_task, self._run(whatsapp_id, previous, list(messages))
+        )
+        self._inflight[whatsapp_id] = task
+
+    async def _run(self, whatsapp_id: str, previous: str, messages: List[BaseMessage]):
+        try:
+            result = await self.compact(previous, messages)
+            if result is None:
+                return
+            summary, evicted = result
+            if await self.apply(whatsapp_id, previous, summary, [m.id for m in evicted]):
+                self.stats["resumos_segundo_plano"] += 1
+            else:
+                # Outro resumo chegou antes: este ficou velho
+                self.stats["descartados"] += 1
+        except Exception as e:
+            self.stats["falhas"] += 1
+            print(f"Erro ao resumir conversa {whatsapp_id}: {e}")
+        finally:
+            self._inflight.pop(whatsapp_id, None)
+
+    async def close(self):
+        """Espera os resumos em andamento (chamado no shutdown)."""
+        if self._inflight:
+            await asyncio.gather(*self._inflight.values(), return_exceptions=True)
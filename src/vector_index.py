@@ -0,0 +1,239 @@
+"""
+Índice vetorial local (em processo) da tabela `conhecimento_clube`.
+
+A base de conhecimento tem poucos milhares de chunks, então cabe numa matriz
+float32 normalizada, memory-mapped do disco. A busca top-k por cosseno vira um
+único produto matriz-vetor, sem ida e volta de rede ao RPC `match_documents`.
+
+Arquivos no diretório do índice:
+- vectors.f32: matriz (N, dim) float32, linhas já normalizadas (append-only)
+- rows.jsonl: metadados de cada linha (id, conteudo, fonte_url), mesma ordem
+- deleted.txt: ids removidos do Supabase (tombstones, append-only)
+- meta.json: dimensão dos vetores
+
+O refresh puxa as linhas novas (id > max_id) e confere o conjunto de ids vivos
+no Supabase: chunks apagados pela ingestão em outro host também viram tombstone.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+SNAPSHOT_PAGE_SIZE = 1000
+
+
+def parse_embedding(value) -> np.ndarray:
+    """O PostgREST devolve colunas `vector` como texto ("[0.1,0.2,...]")."""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+async def fetch_live_ids(client, table: str = "conhecimento_clube") -> set:
+    """Ids que ainda existem na tabela (só a coluna id, paginada)."""
+    live, last = set(), 0
+    while True:
+        res = await client.table(table).select("id").gt("id", last).order("id").limit(SNAPSHOT_PAGE_SIZE).execute()
+        live.update(row["id"] for row in res.data or [])
+        if not res.data or len(res.data) < SNAPSHOT_PAGE_SIZE:
+            return live
+        last = res.data[-1]["id"]
+
+
+class LocalVectorIndex:
+    """Snapshot local do `conhecimento_clube` com busca top-k por cosseno."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.dim: Optional[int] = None
+        self.rows: List[Dict[str, Any]] = []
+        self.max_id = 0
+        self.last_refresh = 0.0
+        self.deleted = set()
+        self._deleted_size = 0
+        self._alive: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # --- Persistência ---
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _rows_path(self):
+        return os.path.join(self.path, "rows.jsonl")
+
+    @property
+    def _deleted_path(self):
+        return os.path.join(self.path, "deleted.txt")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _load(self):
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, encoding="utf-8") as f:
+            self.dim = json.load(f)["dim"]
+        rows = []
+        if os.path.exists(self._rows_path):
+            with open(self._rows_path, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+        # Mantém só as linhas que têm vetor completo gravado (escrita interrompida)
+        n_vectors = os.path.getsize(self._vectors_path) // (4 * self.dim) if os.path.exists(self._vectors_path) else 0
+        self.rows = rows[:n_vectors]
+        self.max_id = max((r["id"] for r in self.rows), default=0)
+        self._load_deleted()
+        self._remap()
+
+    def _load_deleted(self):
+        self.deleted = set()
+        self._deleted_size = 0
+        if os.path.exists(self._deleted_path):
+            with open(self._deleted_path, encoding="utf-8") as f:
+                self.deleted = {int(line) for line in f if line.strip()}
+            self._deleted_size = os.path.getsize(self._deleted_path)
+
+    def _remap(self):
+        n = len(self.rows)
+        self._matrix = (
+            np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+            if n else None
+        )
+        self._alive = np.array([r["id"] not in self.deleted for r in self.rows], dtype=bool) if self.deleted else None
+
+    def _sync_from_disk(self):
+        """Recarrega se outro processo (ex.: a ingestão) acrescentou linhas aos arquivos."""
+        if self.dim is None and os.path.exists(self._meta_path):
+            self._load()
+        elif self.dim and os.path.exists(self._vectors_path):
+            if os.path.getsize(self._vectors_path) // (4 * self.dim) != len(self.rows):
+                self._load()
+            elif os.path.exists(self._deleted_path) and os.path.getsize(self._deleted_path) != self._deleted_size:
+                self._load_deleted()
+                self._remap()
+
+    def __len__(self):
+        return len(self.rows) - len(self.deleted)
+
+    def remove(self, ids) -> int:
+        """Marca linhas apagadas no Supabase (ex.: chunks que sumiram de uma página)."""
+        with self._lock:
+            self._sync_from_disk()
+            new = sorted({int(i) for i in ids} - self.deleted)
+            if not new:
+                return 0
+            with open(self._deleted_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{i}\n" for i in new))
+            self._deleted_size = os.path.getsize(self._deleted_path)
+            self.deleted.update(new)
+            self._remap()
+            return len(new)
+
+    def reconcile(self, live_ids) -> int:
+        """Tombstone para as linhas do índice que não existem mais no Supabase."""
+        with self._lock:
+            self._sync_from_disk()
+            gone = [r["id"] for r in self.rows if r["id"] not in live_ids and r["id"] not in self.deleted]
+        return self.remove(gone) if gone else 0
+
+    def add(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Acrescenta linhas já gravadas no Supabase (precisam de `id` e `embedding`).
+        Linhas com id já presente no índice são ignoradas.
+        """
+        with self._lock:
+            self._sync_from_disk()
+            new = [r for r in records if r.get("id") is not None and r["id"] > self.max_id]
+            if not new:
+                return 0
+            vectors = np.stack([parse_embedding(r["embedding"]) for r in new])
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            metas = [{"id": r["id"], "conteudo": r["conteudo"], "fonte_url": r.get("fonte_url")} for r in new]
+
+            # Vetores primeiro: no _load só contam linhas com vetor completo
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.astype(np.float32).tobytes())
+            with open(self._rows_path, "a", encoding="utf-8") as f:
+                for meta in metas:
+                    f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+
+            self.rows.extend(metas)
+            self.max_id = max(self.max_id, max(m["id"] for m in metas))
+            self._remap()
+            return len(new)
+
+    # --- Busca ---
+
+    def search(self, query_embedding, match_count: int = 3, match_threshold: float = 0.5) -> List[Dict[str, Any]]:
+        """Mesmo contrato do RPC `match_documents`: lista de {id, conteudo, fonte_url, similarity}."""
+        matrix, rows, alive = self._matrix, self.rows, self._alive
+        if matrix is None:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        sims = matrix @ query
+        if alive is not None:
+            sims = np.where(alive, sims, -np.inf)
+        k = min(match_count, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [
+            {**rows[i], "similarity": float(sims[i])}
+            for i in top if sims[i] > match_threshold
+        ]
+
+    # --- Sincronização com o Supabase ---
+
+    async def arefresh(self, client, table: str = "conhecimento_clube") -> int:
+        """
+        Busca no Supabase só as linhas com id maior que o último indexado e marca as
+        que sumiram de lá. Devolve quantas linhas entraram.
+        """
+        with self._lock:
+            self._sync_from_disk()
+        added = 0
+        while True:
+            res = await client.table(table).select("id, conteudo, fonte_url, embedding") \
+                .gt("id", self.max_id).order("id").limit(SNAPSHOT_PAGE_SIZE).execute()
+            if not res.data:
+                break
+            added += await asyncio.to_thread(self.add, res.data)
+            if len(res.data) < SNAPSHOT_PAGE_SIZE:
+                break
+        if self.rows:
+            await asyncio.to_thread(self.reconcile, await fetch_live_ids(client, table))
+        self.last_refresh = time.monotonic()
+        return added
+
+    def schedule_refresh(self, get_client, max_age: float) -> None:
+        """Dispara um refresh em background se o snapshot estiver velho (não bloqueia a busca)."""
+        if time.monotonic() - self.last_refresh < max_age:
+            return
+        if self._refreshing is not None and not self._refreshing.done():
+            return
+
+        async def run():
+            try:
+                await self.arefresh(await get_client())
+            except Exception as e:
+                # Evita tentar de novo a cada busca enquanto o Supabase estiver fora
+                self.last_refresh = time.monotonic()
+                print(f"Erro ao atualizar índice vetorial local: {e}")
+
+        self._refreshing = asyncio.create_task(run())
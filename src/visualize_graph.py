@@ -1,11 +1,11 @@
-from src.agent import dogao_agent
+from src.agent import get_dogao_agent
 import sys
 
 def generate_graph_image():
     try:
         print("Gerando imagem da arquitetura do agente...")
         # Obtém a representação binária do PNG
-        png_data = dogao_agent.get_graph().draw_mermaid_png()
+        png_data = get_dogao_agent().get_graph().draw_mermaid_png()
         
         output_file = "agent_architecture.png"
         with open(output_file, "wb") as f:
@@ -17,7 +17,7 @@ def generate_graph_image():
         # Tenta imprimir o mermaid text caso falhe a geração da imagem (ex: falta de dependências)
         try:
             print("Tentando exibir o código Mermaid:")
-            print(dogao_agent.get_graph().draw_mermaid())
+            print(get_dogao_agent().get_graph().draw_mermaid())
         except:
             pass
 
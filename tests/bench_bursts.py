@@ -0,0 +1,141 @@
+"""
+Teste de carga com rajadas: cada torcedor manda cada pergunta em 2-3 mensagens
+curtas seguidas (como no WhatsApp), contra a API via ASGI com backends falsos.
+
+Roda a mesma carga duas vezes e compara:
+- sem camada de entrada (cada POST roda o grafo em paralelo, como antes);
+- com a camada de entrada (serialização por whatsapp_id + debounce).
+
+Reporta turnos do grafo e chamadas de LLM por sessão, latência da resposta
+(última mensagem de cada rajada) e sessões que ficaram na memória no fim.
+
+Uso:
+    python tests/bench_bursts.py --sessoes 50 --concorrencia 20 --janela 0.3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from tests.bench_offline import instalar_fakes, percentil
+
+import httpx
+
+from src import agent
+from src import main as api
+
+# Cada pergunta do roteiro chega quebrada em mensagens curtas
+RAJADAS = [
+    [["Oi", "tudo bem?"], ["Quanto custa", "o Maringá Paixão?"], ["Quero assinar", "meu nome é Ana"]],
+    [["Bom dia"], ["Quando é o próximo jogo?", "e sócio tem prioridade no ingresso?"]],
+    [["Oi"], ["Tem camisa oficial nova", "na loja?", "tamanho G"], ["E o plano de sócio", "quanto é?"]],
+]
+
+
+class SemCamada:
+    """Comportamento antigo: cada POST roda o grafo direto, sem fila por whatsapp_id."""
+
+    def __init__(self, run_turn):
+        self.run_turn = run_turn
+        self.stats = {"turnos": 0}
+
+    async def submit(self, whatsapp_id: str, message: str):
+        self.stats["turnos"] += 1
+        return await self.run_turn(whatsapp_id, [message]), True
+
+    def metrics(self) -> Dict[str, float]:
+        return {**self.stats, "sessoes_ativas": 0}
+
+
+async def rodar(sessoes: int, concorrencia: int, intervalo: float, prefixo: str) -> Dict:
+    latencias: List[float] = []
+    erros = 0
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    async def enviar(client, whatsapp_id: str, mensagem: str, atraso: float):
+        nonlocal erros
+        await asyncio.sleep(atraso)
+        inicio = time.perf_counter()
+        try:
+            response = await client.post("/chat", json={"message": mensagem, "whatsapp_id": whatsapp_id})
+            response.raise_for_status()
+        except Exception as e:
+            erros += 1
+            print(f"⚠️ Erro em '{mensagem}' ({whatsapp_id}): {e}")
+            return
+        if response.json()["response"] is not None:
+            latencias.append(time.perf_counter() - inicio)
+
+    async def sessao(client, i: int):
+        whatsapp_id = f"{prefixo}{i:06d}"
+        async with semaforo:
+            for rajada in RAJADAS[i % len(RAJADAS)]:
+                # Mensagens da rajada saem com `intervalo` entre si, sem esperar a resposta
+                await asyncio.gather(*(enviar(client, whatsapp_id, m, j * intervalo) for j, m in enumerate(rajada)))
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        inicio = time.perf_counter()
+        await asyncio.gather(*(sessao(client, i) for i in range(sessoes)))
+        duracao = time.perf_counter() - inicio
+    await agent.summarizer.close()
+    await agent.get_lead_tracker().close()
+    return {"latencias": latencias, "duracao": duracao, "erros": erros}
+
+
+def cenario(nome: str, camada, sessoes: int, concorrencia: int, intervalo: float, latencia: float) -> Dict:
+    instalar_fakes(latencia)
+    original = api.ingress
+    api.ingress = camada
+    try:
+        resultado = asyncio.run(rodar(sessoes, concorrencia, intervalo, prefixo=f"5546{len(nome)}"))
+    finally:
+        api.ingress = original
+    metricas = camada.metrics()
+    return {
+        "nome": nome,
+        "erros": resultado["erros"],
+        "turnos_por_sessao": metricas["turnos"] / sessoes,
+        "llm_por_sessao": sum(c.calls for c in agent.models.clients()) / sessoes,
+        "p50": percentil(resultado["latencias"], 50),
+        "p95": percentil(resultado["latencias"], 95),
+        "sessoes_na_memoria": metricas["sessoes_ativas"],
+    }
+
+
+def imprimir(relatorio: Dict):
+    print(f"{relatorio['nome']:>14}: {relatorio['turnos_por_sessao']:.2f} turnos/sessão | "
+          f"LLM {relatorio['llm_por_sessao']:.2f}/sessão | p50 {relatorio['p50'] * 1000:.0f}ms | "
+          f"p95 {relatorio['p95'] * 1000:.0f}ms | {relatorio['erros']} erros | "
+          f"{relatorio['sessoes_na_memoria']} sessões na memória")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Rajadas de mensagens com e sem a camada de entrada")
+    parser.add_argument("--sessoes", type=int, default=50)
+    parser.add_argument("--concorrencia", type=int, default=20)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência do LLM falso (s)")
+    parser.add_argument("--intervalo", type=float, default=0.1, help="Intervalo entre mensagens da rajada (s)")
+    parser.add_argument("--janela", type=float, default=0.3, help="Janela do debounce (s)")
+    args = parser.parse_args(argv)
+
+    # Sem cache de respostas: as duas rodadas fazem o mesmo trabalho por turno
+    agent.ANSWER_CACHE_ENABLED = False
+    print(f"--- Rajadas: {args.sessoes} sessões, concorrência {args.concorrencia} ---")
+    sem = cenario("sem camada", SemCamada(api.run_turn), args.sessoes, args.concorrencia,
+                  args.intervalo, args.latencia)
+    com = cenario("com camada", api.ConversationIngress(api.run_turn, window=args.janela, max_wait=args.janela * 3),
+                  args.sessoes, args.concorrencia, args.intervalo, args.latencia)
+    imprimir(sem)
+    imprimir(com)
+    if sem["llm_por_sessao"]:
+        reducao = 1 - com["llm_por_sessao"] / sem["llm_por_sessao"]
+        print(f"📉 Chamadas de LLM por sessão: -{reducao:.0%}")
+    return 1 if sem["erros"] or com["erros"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
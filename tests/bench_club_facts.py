@@ -0,0 +1,131 @@
+"""
+Benchmark da tabela de fatos: perguntas de preço/benefícios do sócio e de
+próximo jogo, com a tabela vazia (a tool cai na busca normal: embedding,
+busca, montagem do contexto e grader) e preenchida pela extração das páginas
+do bench_context (publicada no Supabase falso e puxada como no warmup da API).
+
+Grafo real com LLM, Embeddings e Supabase falsos (latência configurável),
+sem cache de respostas. Reporta por turno: latência p50, chamadas de LLM e
+de embeddings, decisões do grader e os fatos esperados presentes no contexto
+da resposta.
+
+Com a busca especulativa a busca normal já corre escondida atrás do router,
+então o ganho aparece em chamadas (embeddings, busca, grader) mais do que no
+p50. Sai com código 1 se a tabela não tirar o embedding e o grader do turno,
+se o p50 piorar além de `--tolerancia` ou se algum fato esperado faltar no
+contexto.
+
+Uso:
+    python tests/bench_club_facts.py --latencia 0.05
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+from langchain_core.messages import HumanMessage
+from src import agent
+from src.club_facts import ClubFactsTable
+from src.ingestion_web import publish_facts, refresh_facts, text_hash
+from tests.bench_context import PAGINAS
+from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+# Perguntas que a tabela responde e os fatos que o contexto precisa ter
+PERGUNTAS = [
+    ("Quanto custa o Maringá Paixão?", ["29,90"]),
+    ("Quais os benefícios do sócio?", ["prioridade", "15%"]),
+    ("Quando é o próximo jogo?", ["Londrina", "16h"]),
+]
+
+
+def instalar_fakes(latencia: float) -> FakeEmbeddings:
+    agent.models.use_factory(lambda spec, model: FakeChatModel(model_name=model, latency=latencia))
+    embeddings = FakeEmbeddings(latency=latencia / 4)
+    agent._embeddings = embeddings
+    agent._supabase = FakeSupabase(documents=list(PAGINAS.values()), latency=latencia / 4)
+    return embeddings
+
+
+async def rodar(rodadas: int, latencia: float, tabela: ClubFactsTable,
+                ingestao: Optional[ClubFactsTable] = None) -> Dict[str, float]:
+    embeddings = instalar_fakes(latencia)
+    if ingestao is not None:
+        # Mesmo caminho da ingestão: extrai no SQLite dela e publica no Supabase
+        for url, texto in PAGINAS.items():
+            await publish_facts(agent._supabase, url, refresh_facts(ingestao, url, texto, text_hash(texto), {"fatos": 0}))
+    print(f"📋 {await tabela.arefresh(agent._supabase)} fatos puxados do Supabase")
+    decisoes = sum(s["decisoes"] for s in agent.grader.stats.values())
+    latencias, cobertura = [], []
+    for _ in range(rodadas):
+        for pergunta, fatos in PERGUNTAS:
+            whatsapp_id = f"55442{uuid.uuid4().hex[:8]}"
+            inputs = {"messages": [HumanMessage(content=pergunta)], "whatsapp_id": whatsapp_id}
+            inicio = time.perf_counter()
+            state = await agent.get_dogao_agent().ainvoke(inputs, {"configurable": {"thread_id": whatsapp_id}},
+                                                          durability="exit")
+            latencias.append(time.perf_counter() - inicio)
+            cobertura.append(sum(f.lower() in state["context"].lower() for f in fatos) / len(fatos))
+    await agent.get_lead_tracker().close()
+    turnos = len(latencias)
+    return {
+        "p50": statistics.median(latencias),
+        # O lead tracker roda depois da resposta: uma chamada de extração por turno fora da conta
+        "llm_por_turno": sum(c.calls for c in agent.models.clients()) / turnos - 1,
+        "embeddings_por_turno": embeddings.calls / turnos,
+        "grader_por_turno": (sum(s["decisoes"] for s in agent.grader.stats.values()) - decisoes) / turnos,
+        "cobertura": sum(cobertura) / turnos,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Perguntas de plano/jogo: tabela de fatos x busca normal")
+    parser.add_argument("--rodadas", type=int, default=5)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência do LLM falso (s)")
+    parser.add_argument("--tolerancia", type=float, default=0.1, help="Piora aceitável no p50")
+    args = parser.parse_args()
+
+    print(f"--- Tabela de fatos: {args.rodadas * len(PERGUNTAS)} turnos por modo, latência LLM {args.latencia}s ---")
+    resultados = {}
+    with tempfile.TemporaryDirectory() as pasta:
+        tabela = ClubFactsTable(os.path.join(pasta, "fatos.sqlite"))
+        agent._club_facts = tabela
+        ingestao = ClubFactsTable(os.path.join(pasta, "ingestao.sqlite"))
+        resultados["sem tabela"] = asyncio.run(rodar(args.rodadas, args.latencia, tabela))
+        resultados["com tabela"] = asyncio.run(rodar(args.rodadas, args.latencia, tabela, ingestao))
+        print(f"Tabela: {tabela.metrics()}")
+
+    for modo, r in resultados.items():
+        print(f"{modo:>10}: p50 {r['p50'] * 1000:6.0f}ms | {r['llm_por_turno']:.1f} LLM, "
+              f"{r['embeddings_por_turno']:.1f} embeddings, {r['grader_por_turno']:.1f} grader por turno | "
+              f"cobertura {r['cobertura']:.0%}")
+    antes, depois = resultados["sem tabela"], resultados["com tabela"]
+    print(f"p50: {antes['p50'] / depois['p50']:.2f}x")
+    if (depois["embeddings_por_turno"] >= antes["embeddings_por_turno"]
+            or depois["grader_por_turno"] >= antes["grader_por_turno"]):
+        print("❌ A tabela não tirou o embedding e o grader do turno")
+        return 1
+    if depois["p50"] > antes["p50"] * (1 + args.tolerancia):
+        print(f"❌ p50 piorou mais de {args.tolerancia:.0%}")
+        return 1
+    if depois["cobertura"] < 1:
+        print("❌ Fato esperado fora do contexto da resposta")
+        return 1
+    print("✅ Perguntas de plano/jogo respondidas pela tabela")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
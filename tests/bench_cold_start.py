@@ -0,0 +1,116 @@
+"""
+Benchmark de cold start: quanto uma instância nova (scale-out no Azure App
+Service) demora para responder o primeiro turno.
+
+Cada rodada é um processo Python novo, sem credenciais:
+- import: `from src.main import app` (módulos, sem criar clientes);
+- warmup: o que o lifespan faz no startup (clientes reais da OpenAI com uma
+  chave fictícia, sem rede, + compilação do grafo; Supabase falso);
+- primeira: primeiro `/chat` (via ASGI) depois do warmup, já com LLM,
+  embeddings e Tavily falsos;
+- segunda: um turno já quente, para comparação.
+
+Sai com código 1 se a mediana estourar o orçamento de import ou de cold start
+(import + warmup + primeira requisição).
+
+Uso:
+    python tests/bench_cold_start.py --rodadas 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ETAPAS = ["import", "warmup", "primeira", "segunda"]
+
+
+def filho(latencia: float):
+    """Roda dentro do processo novo e imprime os tempos em JSON."""
+    inicio = time.perf_counter()
+    sys.path.append(RAIZ)
+    from src.main import app
+    tempos = {"import": time.perf_counter() - inicio}
+
+    import asyncio
+    import httpx
+    from src import agent
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase, FakeTavily
+
+    # Import já medido sem credenciais; a chave fictícia só deixa o warmup criar os clientes reais
+    os.environ["OPENAI_API_KEY"] = "sk-cold-start"
+    agent._supabase = FakeSupabase(latency=latencia / 4)
+
+    async def rodar():
+        marco = time.perf_counter()
+        await agent.warmup()
+        tempos["warmup"] = time.perf_counter() - marco
+        agent.models.use_factory(lambda spec, model: FakeChatModel(model_name=model, latency=latencia))
+        agent._embeddings = FakeEmbeddings(latency=latencia / 4)
+        agent._tavily = FakeTavily(latency=latencia * 4)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for etapa, mensagem in (("primeira", "Quanto custa o Maringá Paixão?"),
+                                    ("segunda", "Quando é o próximo jogo?")):
+                marco = time.perf_counter()
+                response = await client.post("/chat", json={"message": mensagem, "whatsapp_id": "5544000000000"})
+                response.raise_for_status()
+                tempos[etapa] = time.perf_counter() - marco
+        await agent.summarizer.close()
+        await agent.get_lead_tracker().close()
+
+    asyncio.run(rodar())
+    print(json.dumps(tempos))
+
+
+def rodada(latencia: float) -> dict:
+    env = {k: v for k, v in os.environ.items()
+           if k not in ("OPENAI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY", "TAVILY_API_KEY")}
+    env.update({"CHECKPOINT_BACKEND": "memory", "LEAD_OUTBOX_PATH": ":memory:", "TRACE_LOG_PATH": "",
+                "PYTHONPATH": RAIZ})
+    saida = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--filho", "--latencia", str(latencia)],
+        cwd=RAIZ, env=env, capture_output=True, text=True, check=True,
+    )
+    # Última linha é o JSON (prints do agente vêm antes)
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Cold start do Dogão (import + warmup + primeiro turno)")
+    parser.add_argument("--rodadas", type=int, default=5)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latência do LLM falso (s)")
+    parser.add_argument("--orcamento-import", type=float, default=2.0, help="Segundos")
+    parser.add_argument("--orcamento-cold-start", type=float, default=4.0, help="Segundos")
+    parser.add_argument("--filho", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.filho:
+        filho(args.latencia)
+        return 0
+
+    print(f"--- Cold start: {args.rodadas} processos novos ---")
+    rodadas = [rodada(args.latencia) for _ in range(args.rodadas)]
+    medianas = {etapa: statistics.median(r[etapa] for r in rodadas) for etapa in ETAPAS}
+    cold_start = medianas["import"] + medianas["warmup"] + medianas["primeira"]
+    for etapa in ETAPAS:
+        print(f"{etapa:>9}: {medianas[etapa] * 1000:7.0f}ms (mediana)")
+    print(f"Cold start (import + warmup + primeira): {cold_start * 1000:.0f}ms")
+
+    estouros = []
+    if medianas["import"] > args.orcamento_import:
+        estouros.append(f"import {medianas['import']:.2f}s > {args.orcamento_import:.2f}s")
+    if cold_start > args.orcamento_cold_start:
+        estouros.append(f"cold start {cold_start:.2f}s > {args.orcamento_cold_start:.2f}s")
+    if estouros:
+        print("❌ Orçamento estourado: " + "; ".join(estouros))
+        return 1
+    print("✅ Dentro do orçamento")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Benchmark da montagem do contexto: tokens de contexto por turno de RAG e
+cobertura da resposta, antes e depois da mescla/MMR/orçamento.
+
+Offline: páginas do clube cortadas pelo mesmo splitter da ingestão (600/100),
+indexadas num BM25 temporário, e as perguntas do bench_offline com os fatos
+que a resposta precisa ter. Para cada pergunta:
+- antes: top `MATCH_COUNT` concatenado, enviado ao grader e duas vezes ao
+  generate_answer (no CONTEXTO e na ToolMessage do histórico);
+- depois: `CONTEXT_CANDIDATES` candidatos -> context_builder -> orçamento do
+  grader e da resposta, com o contexto uma vez só no generate_answer.
+Cobertura = fatos esperados presentes no contexto da resposta.
+
+Sai com código 1 se a cobertura cair ou os tokens não diminuírem.
+
+Uso:
+    python tests/bench_context.py
+"""
+import os
+import sys
+import tempfile
+from typing import Dict, List
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+
+from src import agent
+from src.ingestion_web import split_text
+from src.lexical_index import LexicalIndex
+from src.summarizer import count_tokens
+
+PAGINAS = {
+    "https://maringafc.com.br/socio": "\n".join([
+        "Seja sócio do Maringá FC e apoie o Dogão em todos os jogos da temporada.",
+        "O plano Maringá Paixão custa R$ 29,90 por mês no cartão de crédito, sem taxa de adesão.",
+        "Sócios Maringá Paixão têm prioridade na compra de ingressos para todos os jogos no Willie Davids.",
+        "O desconto na loja oficial é de 15% em camisas, agasalhos e bonés do Maringá FC.",
+        "Dependentes de até 12 anos entram com a carteirinha do titular, mediante cadastro prévio.",
+        "O plano Ouro custa R$ 59,90 e inclui cadeira cativa no setor coberto e estacionamento.",
+        "O cancelamento pode ser feito a qualquer momento pela área do sócio, sem multa.",
+        "A carteirinha digital fica no aplicativo do clube e vale como ingresso na catraca.",
+        "Sócios em dia concorrem a experiências no gramado e visitas ao centro de treinamento.",
+        "A troca do cartão de pagamento é feita na área do sócio, na aba Pagamentos.",
+        "Dúvidas sobre o plano de sócio podem ser enviadas para o WhatsApp oficial do clube.",
+    ]),
+    "https://maringafc.com.br/ingressos": "\n".join([
+        "Os ingressos para os jogos do Maringá FC são vendidos no site oficial e nas bilheterias do estádio.",
+        "Sócios Maringá Paixão têm desconto de 50% em ingressos de arquibancada e compram antes da abertura geral.",
+        "A meia-entrada vale para estudantes, idosos e pessoas com deficiência, com documento na entrada.",
+        "A arquibancada descoberta custa R$ 40,00 e a cadeira coberta custa R$ 80,00.",
+        "As bilheterias abrem duas horas antes de cada partida no Willie Davids.",
+        "Crianças de até 12 anos acompanhadas de um responsável pagam meia-entrada.",
+        "Ingressos comprados pela internet são enviados por e-mail com QR Code para a catraca.",
+    ]),
+    "https://maringafc.com.br/jogos": "\n".join([
+        "Confira a agenda de jogos do Maringá FC na temporada.",
+        "O próximo jogo do Maringá FC é contra o Londrina, no domingo às 16h, no estádio Willie Davids.",
+        "O estádio Willie Davids fica na Avenida Tiradentes, no centro de Maringá.",
+        "Na rodada seguinte o Maringá FC visita o Operário em Ponta Grossa, no sábado às 18h.",
+        "Os portões do Willie Davids abrem duas horas antes do início de cada partida.",
+        "Os jogos em casa têm transmissão ao vivo pela rádio oficial do clube.",
+        "A tabela completa da Série D está disponível no site da CBF.",
+    ]),
+}
+# A mesma notícia republicada em outra URL (quase duplicata entre páginas)
+NOTICIA = ("Maringá Paixão: o plano de sócio custa R$ 29,90 por mês e dá prioridade na compra de ingressos. "
+           "Sócios também têm 15% de desconto na loja oficial.")
+PAGINAS["https://maringafc.com.br/noticias/socio-torcedor"] = NOTICIA
+PAGINAS["https://maringafc.com.br/blog/socio-torcedor"] = NOTICIA + " Confira!"
+
+# Perguntas de RAG dos roteiros do bench_offline e os fatos que a resposta precisa ter
+PERGUNTAS = [
+    ("Quanto custa o Maringá Paixão?", ["29,90"]),
+    ("Quais os benefícios do sócio?", ["prioridade", "15%"]),
+    ("Quando é o próximo jogo?", ["Londrina", "16h"]),
+    ("Sócio tem prioridade no ingresso?", ["prioridade"]),
+    ("E o plano de sócio, quanto é?", ["29,90"]),
+    ("Tem desconto em ingressos?", ["50%"]),
+    ("Onde é o jogo de domingo?", ["Willie Davids"]),
+    ("Sócio tem desconto na camisa nova?", ["15%"]),
+]
+
+
+def indexar(path: str) -> LexicalIndex:
+    index = LexicalIndex(path)
+    rows, next_id = [], 0
+    for url, texto in PAGINAS.items():
+        for chunk in split_text(texto):
+            next_id += 1
+            rows.append({"id": next_id, "conteudo": chunk, "fonte_url": url})
+    index.add(rows)
+    return index
+
+
+def cobertura(contexto: str, fatos: List[str]) -> float:
+    return sum(f.lower() in contexto.lower() for f in fatos) / len(fatos)
+
+
+def medir(index: LexicalIndex) -> Dict[str, Dict[str, float]]:
+    builder = agent.context_builder
+    candidatos_busca = max(agent.MATCH_COUNT, agent.CONTEXT_CANDIDATES)
+    totais = {nome: {"grader": 0, "resposta": 0, "cobertura": 0.0} for nome in ("antes", "depois")}
+    for pergunta, fatos in PERGUNTAS:
+        candidatos = index.search(pergunta, candidatos_busca)
+
+        contexto = "\n\n".join(d["conteudo"] for d in candidatos[:agent.MATCH_COUNT])
+        totais["antes"]["grader"] += count_tokens(contexto)
+        totais["antes"]["resposta"] += 2 * count_tokens(contexto)
+        totais["antes"]["cobertura"] += cobertura(contexto, fatos)
+
+        trechos = [d["conteudo"] for d in builder.build(candidatos, agent.MATCH_COUNT)]
+        contexto = "\n\n".join(builder.fit(trechos, agent.ANSWER_CONTEXT_TOKENS))
+        totais["depois"]["grader"] += sum(count_tokens(p) for p in builder.fit(trechos, agent.GRADER_CONTEXT_TOKENS))
+        totais["depois"]["resposta"] += count_tokens(contexto)
+        totais["depois"]["cobertura"] += cobertura(contexto, fatos)
+        print(f"  {pergunta:<38} {cobertura(contexto, fatos):.0%} dos fatos | {count_tokens(contexto)} tokens")
+    return {nome: {k: v / len(PERGUNTAS) for k, v in t.items()} for nome, t in totais.items()}
+
+
+def main() -> int:
+    print(f"--- Montagem do contexto ({agent.MATCH_COUNT} trechos de {agent.CONTEXT_CANDIDATES} candidatos, "
+          f"orçamento grader {agent.GRADER_CONTEXT_TOKENS} / resposta {agent.ANSWER_CONTEXT_TOKENS}) ---")
+    with tempfile.TemporaryDirectory() as path:
+        resultado = medir(indexar(path))
+    for nome, dados in resultado.items():
+        total = dados["grader"] + dados["resposta"]
+        print(f"{nome:>7}: {total:.0f} tokens de contexto por turno de RAG (grader {dados['grader']:.0f} + "
+              f"resposta {dados['resposta']:.0f}) | cobertura {dados['cobertura']:.0%}")
+    antes = resultado["antes"]["grader"] + resultado["antes"]["resposta"]
+    depois = resultado["depois"]["grader"] + resultado["depois"]["resposta"]
+    print(f"Redução: {1 - depois / antes:.0%}")
+    print(f"Contexto: {agent.context_builder.metrics()}")
+    if resultado["depois"]["cobertura"] < resultado["antes"]["cobertura"] or depois >= antes:
+        print("❌ Cobertura caiu ou os tokens não diminuíram")
+        return 1
+    print("✅ Menos tokens com a mesma cobertura")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
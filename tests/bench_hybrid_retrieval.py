@@ -0,0 +1,96 @@
+"""
+Benchmark: quantos loops de rewrite a busca híbrida (vetor + BM25) evita.
+
+Roda o grafo real (OpenAI + Supabase do .env) sobre um conjunto fixo de
+perguntas com termos exatos (planos, adversários, datas), com a busca só
+vetorial e depois híbrida, e conta em quantas perguntas o `loop_step`
+chegou a 1 (um rewrite) ou 2 (desistiu e gerou com o que tinha).
+
+O índice lexical precisa estar populado (rode a ingestão antes ou deixe o
+agente puxar do Supabase na primeira busca).
+
+Uso:
+    python tests/bench_hybrid_retrieval.py
+    python tests/bench_hybrid_retrieval.py --perguntas minhas_perguntas.txt
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Sem cache de respostas (toda pergunta passa pela busca) e sem memória em disco
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+
+from langchain_core.messages import HumanMessage
+from src import agent
+
+PERGUNTAS = [
+    "Quanto custa o plano Maringá Paixão?",
+    "Qual a diferença entre o plano Ouro e o Prata?",
+    "Quando é o jogo contra o Londrina?",
+    "Tem jogo contra o Operário em março?",
+    "Qual o horário do jogo no Willie Davids domingo?",
+    "Sócio tem desconto na camisa oficial?",
+    "Como faço para cancelar o sócio torcedor?",
+    "Sócio tem prioridade na compra de ingressos?",
+    "Quanto custa o ingresso de arquibancada?",
+    "Meia-entrada vale para estudante?",
+    "Qual o endereço do estádio Willie Davids?",
+    "O Maringá FC joga a Série D?",
+    "Dependente pode entrar com a carteirinha do sócio?",
+    "Como troco o cartão de pagamento do plano?",
+    "Quem é o técnico do Maringá FC?",
+]
+
+
+async def max_loop_step(pergunta: str) -> int:
+    """Roda um turno e devolve o maior loop_step visto durante a execução."""
+    whatsapp_id = f"bench-{uuid.uuid4()}"
+    inputs = {"messages": [HumanMessage(content=pergunta)], "whatsapp_id": whatsapp_id}
+    config = {"configurable": {"thread_id": whatsapp_id}}
+    maior = 0
+    async for state in agent.get_dogao_agent().astream(inputs, config, stream_mode="values"):
+        maior = max(maior, state.get("loop_step", 0))
+    return min(maior, 2)
+
+
+async def rodar(perguntas, hibrida: bool):
+    agent.HYBRID_RETRIEVAL = hibrida
+    loops = Counter()
+    inicio = time.perf_counter()
+    for pergunta in perguntas:
+        passo = await max_loop_step(pergunta)
+        loops[passo] += 1
+        print(f"  [{passo}] {pergunta}")
+    await agent.get_lead_tracker().close()
+    return loops, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--perguntas", help="Arquivo com uma pergunta por linha (padrão: conjunto fixo)")
+    args = parser.parse_args()
+
+    perguntas = PERGUNTAS
+    if args.perguntas:
+        with open(args.perguntas, encoding="utf-8") as f:
+            perguntas = [linha.strip() for linha in f if linha.strip()]
+
+    resultados = {}
+    for modo, hibrida in (("vetorial", False), ("híbrida", True)):
+        print(f"--- Busca {modo} ---")
+        resultados[modo] = asyncio.run(rodar(perguntas, hibrida))
+
+    print(f"\n--- {len(perguntas)} perguntas ---")
+    for modo, (loops, duracao) in resultados.items():
+        print(f"{modo:>9}: loop_step 0: {loops[0]:3d} | 1: {loops[1]:3d} | 2: {loops[2]:3d} | {duracao:6.1f}s")
+
+
+if __name__ == "__main__":
+    main()
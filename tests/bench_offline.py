@@ -0,0 +1,312 @@
+"""
+Benchmark offline do agente: conversas roteirizadas com vários turnos contra
+LLM, Embeddings, Supabase e Tavily falsos (sem rede, determinístico).
+
+Roda o grafo direto (`--alvo grafo`) ou a API FastAPI via ASGI (`--alvo api`,
+mesmo caminho do `/chat` em produção) com N conversas e concorrência limitada
+e reporta:
+- vazão (turnos/s) e latência por turno (p50/p95/p99);
+- chamadas de LLM e de embeddings por turno (inclui o lead tracker e o resumo);
+- por papel do registro de modelos (router, answer, grader...): chamadas por
+  turno, latência média e custo estimado (tokens estimados x preço do modelo);
+- memória retida por conversa (tracemalloc, numa segunda rodada);
+- buscas especulativas (iniciadas junto com o router) reaproveitadas e descartadas.
+  `--sem-especulacao` desliga a busca especulativa para medir o ganho.
+
+Com um baseline salvo (`tests/bench_baseline.json`, uma entrada por
+configuração) sai com código 1 se alguma métrica piorar além da tolerância.
+
+Uso:
+    python tests/bench_offline.py --conversas 100 --concorrencia 20 --latencia 0.05
+    python tests/bench_offline.py --alvo api --salvar-baseline
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("TAVILY_API_KEY", "tvly-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+# Os roteiros mandam uma mensagem por vez: o debounce só somaria espera (rajadas: bench_bursts.py)
+os.environ.setdefault("INGRESS_DEBOUNCE_SECONDS", "0")
+
+import httpx
+from langchain_core.messages import HumanMessage
+
+from src import agent
+from src.instrumentation import llm_by_role
+from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase, FakeTavily
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+
+# Conversas típicas do WhatsApp do Dogão (saudação, sócio, jogos, loja, fechamento)
+ROTEIROS = [
+    ["Oi", "Quanto custa o Maringá Paixão?", "Quais os benefícios do sócio?", "Quero assinar, meu nome é Ana"],
+    ["Quando é o próximo jogo?", "Sócio tem prioridade no ingresso?", "Quanto custa o Maringá Paixão?",
+     "Sócio tem desconto na camisa nova?"],
+    ["Bom dia", "Tem camisa oficial nova na loja?", "E o plano de sócio, quanto é?", "Valeu"],
+    ["Quais os benefícios do sócio?", "Tem desconto em ingressos?", "Onde é o jogo de domingo?",
+     "Quanto custa o Maringá Paixão?", "Fechado, pode me cadastrar"],
+]
+
+# Métricas comparadas com o baseline: (chave, maior_e_pior)
+METRICAS_BASELINE = [
+    ("turnos_por_segundo", False),
+    ("p50", True),
+    ("p95", True),
+    ("p99", True),
+    ("llm_por_turno", True),
+    ("custo_por_turno", True),
+    ("memoria_por_conversa_kb", True),
+]
+
+
+def instalar_fakes(latencia: float):
+    # Um modelo falso por papel/modelo configurado (o nome do modelo entra no custo)
+    agent.models.use_factory(lambda spec, model: FakeChatModel(model_name=model, latency=latencia))
+    agent._embeddings = FakeEmbeddings(latency=latencia / 4)
+    agent._supabase = FakeSupabase(latency=latencia / 4)
+    agent._tavily = FakeTavily(latency=latencia * 4)
+
+
+def percentil(valores: List[float], p: float) -> float:
+    """Percentil por posição mais próxima (valores em qualquer ordem)."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+class AlvoGrafo:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def turno(self, whatsapp_id: str, mensagem: str) -> str:
+        inputs = {"messages": [HumanMessage(content=mensagem, id=str(uuid.uuid4()))], "whatsapp_id": whatsapp_id}
+        config = {"configurable": {"thread_id": whatsapp_id}}
+        result = await agent.get_dogao_agent().ainvoke(inputs, config, durability="exit")
+        return result["messages"][-1].content
+
+
+class AlvoApi:
+    async def __aenter__(self):
+        from src.main import app
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        return False
+
+    async def turno(self, whatsapp_id: str, mensagem: str) -> str:
+        response = await self.client.post("/chat", json={"message": mensagem, "whatsapp_id": whatsapp_id})
+        response.raise_for_status()
+        return response.json()["response"]
+
+
+ALVOS = {"grafo": AlvoGrafo, "api": AlvoApi}
+
+
+async def rodar(alvo_nome: str, conversas: int, concorrencia: int, prefixo: str) -> Dict:
+    latencias: List[float] = []
+    erros = 0
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    async def conversa(alvo, i: int):
+        nonlocal erros
+        whatsapp_id = f"{prefixo}{i:06d}"
+        async with semaforo:
+            for mensagem in ROTEIROS[i % len(ROTEIROS)]:
+                inicio = time.perf_counter()
+                try:
+                    await alvo.turno(whatsapp_id, mensagem)
+                except Exception as e:
+                    erros += 1
+                    print(f"⚠️ Erro no turno '{mensagem}' ({whatsapp_id}): {e}")
+                    continue
+                latencias.append(time.perf_counter() - inicio)
+
+    async with ALVOS[alvo_nome]() as alvo:
+        inicio = time.perf_counter()
+        await asyncio.gather(*(conversa(alvo, i) for i in range(conversas)))
+        duracao = time.perf_counter() - inicio
+    # Lead tracking roda depois da resposta: fora da latência, mas conta nas chamadas de LLM
+    await agent.summarizer.close()
+    await agent.get_lead_tracker().close()
+    return {"latencias": latencias, "duracao": duracao, "erros": erros}
+
+
+def medir_memoria(alvo: str, conversas: int, concorrencia: int) -> float:
+    """KB retidos por conversa (estado no checkpointer, caches) medidos com tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    asyncio.run(rodar(alvo, conversas, concorrencia, prefixo="55450"))
+    gc.collect()
+    depois = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return max(0, depois - antes) / 1024 / conversas
+
+
+def por_papel(antes: Dict, depois: Dict, turnos: int) -> Dict[str, Dict[str, float]]:
+    """Diferença dos totais de LLM por papel entre duas leituras da instrumentação."""
+    papeis = {}
+    for papel, total in depois.items():
+        base = antes.get(papel, {})
+        chamadas = total["chamadas"] - base.get("chamadas", 0)
+        if not chamadas:
+            continue
+        latencia = total["latencia_total"] - base.get("latencia_total", 0.0)
+        papeis[papel] = {
+            "chamadas_por_turno": chamadas / turnos if turnos else 0.0,
+            "latencia_media": latencia / chamadas,
+            "custo_por_turno": (total["custo_usd"] - base.get("custo_usd", 0.0)) / turnos if turnos else 0.0,
+        }
+    return papeis
+
+
+def benchmark(alvo: str, conversas: int, concorrencia: int, latencia: float, memoria: bool = True,
+              especulacao: bool = True) -> Dict:
+    instalar_fakes(latencia)
+    agent.SPECULATIVE_RETRIEVAL = especulacao
+    agent.speculative.stats = {k: 0 for k in agent.speculative.stats}
+    antes = llm_by_role()
+    resultado = asyncio.run(rodar(alvo, conversas, concorrencia, prefixo="55449"))
+    turnos = len(resultado["latencias"])
+    papeis = por_papel(antes, llm_by_role(), turnos)
+    relatorio = {
+        "turnos": turnos,
+        "erros": resultado["erros"],
+        "turnos_por_segundo": turnos / resultado["duracao"] if resultado["duracao"] else 0.0,
+        "p50": percentil(resultado["latencias"], 50),
+        "p95": percentil(resultado["latencias"], 95),
+        "p99": percentil(resultado["latencias"], 99),
+        "llm_por_turno": sum(c.calls for c in agent.models.clients()) / turnos if turnos else 0.0,
+        "embeddings_por_turno": agent.get_embeddings().calls / turnos if turnos else 0.0,
+        "custo_por_turno": sum(p["custo_por_turno"] for p in papeis.values()),
+        "papeis": papeis,
+        "especulacao": dict(agent.speculative.stats),
+    }
+    if memoria:
+        # Rodada separada: o tracemalloc deixa tudo mais lento e distorceria as latências
+        relatorio["memoria_por_conversa_kb"] = medir_memoria(alvo, conversas, concorrencia)
+    return relatorio
+
+
+def chave_configuracao(alvo: str, conversas: int, concorrencia: int, latencia: float) -> str:
+    return f"{alvo}:{conversas}x{concorrencia}@{latencia}"
+
+
+def comparar_com_baseline(relatorio: Dict, baseline: Dict, tolerancia: float) -> List[str]:
+    """Lista de regressões (vazia se estiver tudo dentro da tolerância)."""
+    regressoes = []
+    for chave, maior_e_pior in METRICAS_BASELINE:
+        if chave not in relatorio or chave not in baseline:
+            continue
+        atual, referencia = relatorio[chave], baseline[chave]
+        if chave == "llm_por_turno":
+            # Quase determinístico com os fakes (só a coalescência do lead tracker varia)
+            piorou = atual > referencia + 0.1
+        elif maior_e_pior:
+            piorou = atual > referencia * (1 + tolerancia)
+        else:
+            piorou = atual < referencia * (1 - tolerancia)
+        if piorou:
+            regressoes.append(f"{chave}: {atual:.4f} (baseline {referencia:.4f})")
+    if relatorio.get("erros"):
+        regressoes.append(f"erros: {relatorio['erros']}")
+    return regressoes
+
+
+def carregar_baselines(path: str = BASELINE_PATH) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def salvar_baseline(chave: str, relatorio: Dict, path: str = BASELINE_PATH):
+    baselines = carregar_baselines(path)
+    baselines[chave] = {k: round(v, 6) for k, v in relatorio.items() if isinstance(v, (int, float))}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def imprimir(relatorio: Dict):
+    print(f"Turnos: {relatorio['turnos']} ({relatorio['erros']} erros) | "
+          f"{relatorio['turnos_por_segundo']:.1f} turnos/s")
+    print(f"Latência por turno: p50 {relatorio['p50'] * 1000:.0f}ms | "
+          f"p95 {relatorio['p95'] * 1000:.0f}ms | p99 {relatorio['p99'] * 1000:.0f}ms")
+    print(f"Chamadas por turno: LLM {relatorio['llm_por_turno']:.2f} | "
+          f"embeddings {relatorio['embeddings_por_turno']:.2f}")
+    print(f"Custo estimado por turno: US$ {relatorio['custo_por_turno']:.5f}")
+    for papel, dados in sorted(relatorio["papeis"].items()):
+        print(f"   {papel:>10}: {dados['chamadas_por_turno']:.2f} chamadas/turno | "
+              f"{dados['latencia_media'] * 1000:.0f}ms | US$ {dados['custo_por_turno']:.5f}/turno")
+    especulacao = relatorio["especulacao"]
+    print(f"Busca especulativa: {especulacao['iniciadas']} iniciadas | {especulacao['reaproveitadas']} "
+          f"reaproveitadas | {especulacao['descartadas']} descartadas")
+    if "memoria_por_conversa_kb" in relatorio:
+        print(f"Memória retida por conversa: {relatorio['memoria_por_conversa_kb']:.1f} KB")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline do Dogão com backends falsos")
+    parser.add_argument("--alvo", choices=sorted(ALVOS), default="grafo")
+    parser.add_argument("--conversas", type=int, default=100)
+    parser.add_argument("--concorrencia", type=int, default=20)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência do LLM falso (s)")
+    parser.add_argument("--tolerancia", type=float, default=0.4, help="Piora relativa aceita em relação ao baseline")
+    parser.add_argument("--sem-memoria", action="store_true", help="Pula a rodada com tracemalloc")
+    parser.add_argument("--sem-especulacao", action="store_true", help="Desliga a busca especulativa")
+    parser.add_argument("--salvar-baseline", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    chave = chave_configuracao(args.alvo, args.conversas, args.concorrencia, args.latencia)
+    if args.sem_especulacao:
+        chave += ":sem-especulacao"
+    print(f"--- Benchmark offline ({chave}) ---")
+    relatorio = benchmark(args.alvo, args.conversas, args.concorrencia, args.latencia,
+                          memoria=not args.sem_memoria, especulacao=not args.sem_especulacao)
+    imprimir(relatorio)
+
+    if args.salvar_baseline:
+        salvar_baseline(chave, relatorio, args.baseline)
+        print(f"💾 Baseline salvo em {args.baseline}")
+        return 0
+
+    baseline = carregar_baselines(args.baseline).get(chave)
+    if baseline is None:
+        print("Sem baseline para esta configuração (use --salvar-baseline).")
+        return 0
+    regressoes = comparar_com_baseline(relatorio, baseline, args.tolerancia)
+    if regressoes:
+        print("❌ Regressão em relação ao baseline:")
+        for regressao in regressoes:
+            print(f"   - {regressao}")
+        return 1
+    print("✅ Dentro do baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Benchmark de escala com vários workers: turnos/s da API com 1, 2, 4...
+processos do uvicorn, com o estado compartilhado e o checkpointer em SQLite
+(o que o docker-compose usa).
+
+Para cada quantidade de workers sobe `uvicorn tests.bench_workers_app:app
+--workers N` (API real com backends falsos, src/shared_state.py de verdade),
+aquece e mede por `--duracao` segundos com `--concorrencia` conversas por
+worker, cada uma mandando turnos em sequência para o mesmo whatsapp_id.
+Com LLM falso de latência baixa o turno é dominado pela CPU do grafo: é isso
+que mais workers dividem entre os núcleos.
+
+Eficiência = turnos/s com N workers / (N x turnos/s com 1 worker). Sai com
+código 1 se ficar abaixo de `--eficiencia-minima` em alguma rodada com N
+menor ou igual ao número de núcleos (rodadas com mais workers que núcleos só
+aparecem no relatório).
+
+Uso:
+    python tests/bench_workers.py --workers 1,2,4 --duracao 10
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import httpx
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PERGUNTAS = [
+    "Quanto custa o Maringá Paixão?",
+    "Quando é o próximo jogo?",
+    "Quais os benefícios do sócio?",
+    "Oi, tudo bem?",
+]
+
+
+def porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def subir(workers: int, porta: int, pasta: str, latencia: float) -> subprocess.Popen:
+    env = {k: v for k, v in os.environ.items()
+           if k not in ("SUPABASE_URL", "SUPABASE_KEY", "TAVILY_API_KEY")}
+    env.update({
+        "OPENAI_API_KEY": "sk-bench", "PYTHONPATH": RAIZ, "WEB_CONCURRENCY": str(workers),
+        "BENCH_LATENCIA": str(latencia),
+        "SHARED_STATE_BACKEND": "sqlite", "SHARED_STATE_PATH": os.path.join(pasta, "estado.sqlite"),
+        "CHECKPOINT_BACKEND": "sqlite", "CHECKPOINT_SQLITE_PATH": os.path.join(pasta, "checkpoints.sqlite"),
+        "LEXICAL_INDEX_DIR": os.path.join(pasta, "lexical"), "CLUB_FACTS_PATH": os.path.join(pasta, "fatos.sqlite"),
+        "LEAD_OUTBOX_PATH": os.path.join(pasta, "leads.sqlite"),
+        "TRACE_LOG_PATH": "", "ANSWER_CACHE_ENABLED": "false",
+        "INGRESS_DEBOUNCE_SECONDS": "0", "INGRESS_MAX_WAIT_SECONDS": "0",
+        "ADMISSION_MAX_ACTIVE": "1000", "ADMISSION_MAX_QUEUE": "1000",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "tests.bench_workers_app:app", "--host", "127.0.0.1",
+         "--port", str(porta), "--workers", str(workers), "--log-level", "warning"],
+        cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def esperar(client: httpx.AsyncClient, timeout: float = 60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API não subiu a tempo")
+
+
+async def carga(client: httpx.AsyncClient, conversas: int, duracao: float, rodada: str) -> Dict[str, float]:
+    turnos, erros, fim = [0], [0], time.monotonic() + duracao
+
+    async def conversa(i: int):
+        whatsapp_id, n = f"55447{rodada}{i:06d}", 0
+        while time.monotonic() < fim:
+            response = await client.post("/chat", json={"message": PERGUNTAS[n % len(PERGUNTAS)],
+                                                        "whatsapp_id": whatsapp_id})
+            n += 1
+            if response.status_code == 200 and not response.json().get("degradada"):
+                turnos[0] += 1
+            else:
+                erros[0] += 1
+
+    inicio = time.monotonic()
+    await asyncio.gather(*(conversa(i) for i in range(conversas)))
+    return {"turnos": turnos[0], "erros": erros[0], "turnos_s": turnos[0] / (time.monotonic() - inicio)}
+
+
+def medir(workers: int, args) -> Dict[str, float]:
+    porta = porta_livre()
+    with tempfile.TemporaryDirectory() as pasta:
+        processo = subir(workers, porta, pasta, args.latencia)
+        try:
+            async def rodar():
+                limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta}", limits=limits,
+                                             timeout=60) as client:
+                    await esperar(client)
+                    conversas = args.concorrencia * workers
+                    # Aquecimento: todos os workers com grafo compilado e conexões abertas
+                    await carga(client, conversas, args.aquecimento, "a")
+                    return await carga(client, conversas, args.duracao, "m")
+
+            return asyncio.run(rodar())
+        finally:
+            processo.terminate()
+            processo.wait(timeout=30)
+
+
+def main() -> int:
+    nucleos = os.cpu_count() or 1
+    padrao = ",".join(str(n) for n in (1, 2, 4, 8) if n <= max(nucleos, 1))
+    parser = argparse.ArgumentParser(description="Escala da API com vários workers do uvicorn")
+    parser.add_argument("--workers", default=padrao, help="Ex.: 1,2,4 (padrão: até o número de núcleos)")
+    parser.add_argument("--duracao", type=float, default=10, help="Segundos medidos por rodada")
+    parser.add_argument("--aquecimento", type=float, default=3, help="Segundos de aquecimento por rodada")
+    parser.add_argument("--concorrencia", type=int, default=16, help="Conversas simultâneas por worker")
+    parser.add_argument("--latencia", type=float, default=0.005, help="Latência do LLM falso (s)")
+    parser.add_argument("--eficiencia-minima", type=float, default=0.8)
+    args = parser.parse_args()
+    contagens = sorted({int(n) for n in args.workers.split(",")} | {1})
+
+    print(f"--- Escala com vários workers ({nucleos} núcleos, {args.concorrencia} conversas por worker, "
+          f"{args.duracao:.0f}s por rodada) ---")
+    if nucleos == 1:
+        print("⚠️ Máquina com 1 núcleo: mais workers só dividem a mesma CPU, a escala não aparece aqui")
+    resultados = {}
+    for workers in contagens:
+        resultados[workers] = medir(workers, args)
+        base = resultados[1]["turnos_s"]
+        eficiencia = resultados[workers]["turnos_s"] / (workers * base) if base else 0.0
+        resultados[workers]["eficiencia"] = eficiencia
+        print(f"{workers:>2} worker(s): {resultados[workers]['turnos_s']:7.1f} turnos/s | "
+              f"{resultados[workers]['turnos']} turnos, {resultados[workers]['erros']} erros | "
+              f"eficiência {eficiencia:.0%}" + ("" if workers <= nucleos else " (mais workers que núcleos)"))
+
+    abaixo = [w for w, r in resultados.items() if w <= nucleos and r["eficiencia"] < args.eficiencia_minima]
+    if any(r["erros"] for r in resultados.values()):
+        print("❌ Turnos com erro ou degradados")
+        return 1
+    if abaixo:
+        print(f"❌ Eficiência abaixo de {args.eficiencia_minima:.0%} com {abaixo} worker(s)")
+        return 1
+    print("✅ Escala quase linear até o número de núcleos")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+"""
+App do bench_workers: a API de verdade (src.main:app) com LLM, embeddings,
+Supabase e Tavily falsos. Cada worker do uvicorn importa este módulo e
+instala os fakes no próprio processo.
+
+Latência dos fakes em BENCH_LATENCIA (s).
+"""
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import agent
+from src.main import app  # noqa: F401
+from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase, FakeTavily
+
+LATENCIA = float(os.getenv("BENCH_LATENCIA", "0.005"))
+
+agent.models.use_factory(lambda spec, model: FakeChatModel(model_name=model, latency=LATENCIA))
+agent._embeddings = FakeEmbeddings(latency=LATENCIA / 4)
+agent._supabase = FakeSupabase(latency=LATENCIA / 4)
+agent._tavily = FakeTavily(latency=LATENCIA * 4)
@@ -0,0 +1,314 @@
+"""
+Backends falsos (LLM, Embeddings e Supabase) para testes de carga offline.
+
+Todos simulam latência de rede configurável (inclusive a busca na loja, `FakeTavily`). Com `blocking=True` a latência
+é um `time.sleep` síncrono (comportamento de um cliente sync rodando em
+thread), com `blocking=False` é um `asyncio.sleep` (cliente verdadeiramente
+assíncrono).
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+def _last_human(messages) -> str:
+    human = [m for m in messages if isinstance(m, HumanMessage)]
+    return human[-1].content if human else ""
+
+
+SAUDACOES = ("oi", "olá", "ola", "bom dia", "boa tarde", "boa noite", "valeu", "obrigado")
+TERMOS_LOJA = ("camisa", "loja", "boné", "bone", "produto", "agasalho")
+TERMOS_SOCIO = ("sócio", "socio", "plano", "ingresso")
+TERMOS_FATOS = ("quanto custa", "benefício", "beneficio", "próximo jogo", "proximo jogo")
+
+
+def _route(query: str, available=()) -> List[str]:
+    """
+    Tools que o Dogão escolheria: conversa fiada responde direto, produto vai
+    para a loja e pergunta de produto + sócio chama as duas (em paralelo).
+    Preço/benefícios do sócio e próximo jogo vão para a tabela de fatos, se a tool existir.
+    """
+    text = query.lower()
+    if any(term in text for term in TERMOS_LOJA):
+        if any(term in text for term in TERMOS_SOCIO):
+            return ["retrieve_docs", "search_store"]
+        return ["search_store"]
+    if len(text.split()) <= 3 and any(text.startswith(s) for s in SAUDACOES):
+        return []
+    if "lookup_club_facts" in available and any(term in text for term in TERMOS_FATOS):
+        return ["lookup_club_facts"]
+    return ["retrieve_docs"]
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model determinístico que imita o roteamento do Dogão."""
+
+    latency: float = 0.2
+    blocking: bool = False
+    calls: int = 0
+    model_name: str = "fake-dogao"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-dogao"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        def build(_message):
+            values = {}
+            for name, field in schema.model_fields.items():
+                values[name] = True if field.annotation is bool else None
+            return schema(**values)
+
+        # Passa pelo modelo (latência, contagem e callbacks de LLM) e monta o schema
+        return self | RunnableLambda(build)
+
+    def _respond(self, messages, tools: Optional[List[dict]]) -> AIMessage:
+        message = self._route_or_answer(messages, tools)
+        # Uso estimado (~3 caracteres por token) para a instrumentação calcular custo
+        prompt = sum(len(str(m.content)) for m in messages) // 3 + 1
+        completion = len(message.content) // 3 + 1
+        message.usage_metadata = {"input_tokens": prompt, "output_tokens": completion,
+                                  "total_tokens": prompt + completion}
+        return message
+
+    def _route_or_answer(self, messages, tools: Optional[List[dict]]) -> AIMessage:
+        self.calls += 1
+        if tools and messages and not isinstance(messages[-1], ToolMessage):
+            query = _last_human(messages)
+            tool_names = _route(query, {t["function"]["name"] for t in tools})
+            if tool_names:
+                return AIMessage(
+                    content="",
+                    tool_calls=[{
+                        "name": name,
+                        "args": {"query": query},
+                        "id": f"call_{self.calls}_{i}",
+                    } for i, name in enumerate(tool_names)],
+                )
+        return AIMessage(content="Pra cima, Dogão! Bora garantir o Sócio hoje?")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.blocking:
+            # Sem implementação async: o LangChain joga o _generate para o thread pool
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        await asyncio.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        # Latência até o primeiro token, depois uma palavra por chunk
+        result = await self._agenerate(messages, stop, run_manager, **kwargs)
+        message = result.generations[0].message
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                for i, c in enumerate(message.tool_calls)
+            ]))
+            return
+        for word in message.content.split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class FakeEmbeddings(Embeddings):
+    """Embeddings determinísticos derivados do hash do texto."""
+
+    def __init__(self, latency: float = 0.05, blocking: bool = False, dim: int = 64):
+        self.latency = latency
+        self.blocking = blocking
+        self.dim = dim
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        raw = (digest * (self.dim // len(digest) + 1))[:self.dim]
+        return [(b - 128) / 128 for b in raw]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.blocking:
+            return await super().aembed_documents(texts)
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class _FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class _FakeQuery:
+    """Query builder mínimo no estilo do postgrest (select/eq/gt/in_/order/limit/upsert/delete)."""
+
+    def __init__(self, client, table=None, handler=None):
+        self.client = client
+        self.table = table
+        self.handler = handler
+        self.filters = []
+        self.action = "select"
+        self.payload = None
+        self.on_conflict = None
+        self._order = None
+        self._limit = None
+
+    # Filtros
+    def select(self, columns="*"):
+        self.action = "select"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] > value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    # Escrita
+    def insert(self, rows):
+        self.action, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.action, self.payload, self.on_conflict = "upsert", rows, on_conflict
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def _run(self):
+        if self.handler is not None:
+            return self.handler()
+        rows = self.client.tables.setdefault(self.table, [])
+        if self.action in ("insert", "upsert"):
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            keys = self.on_conflict.split(",") if self.on_conflict else None
+            written = []
+            for new in payload:
+                current = None
+                if keys:
+                    current = next((r for r in rows if all(r.get(k) == new.get(k) for k in keys)), None)
+                if current is not None:
+                    current.update(new)
+                    written.append(current)
+                else:
+                    self.client.next_id += 1
+                    row = {"id": self.client.next_id, **new}
+                    rows.append(row)
+                    written.append(row)
+            return written
+        matches = [r for r in rows if all(f(r) for f in self.filters)]
+        if self.action == "delete":
+            self.client.tables[self.table] = [r for r in rows if r not in matches]
+            return matches
+        if self._order:
+            column, desc = self._order
+            matches.sort(key=lambda r: r.get(column), reverse=desc)
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        return [dict(r) for r in matches]
+
+    async def execute(self):
+        self.client.calls += 1
+        if self.client.blocking:
+            await asyncio.to_thread(time.sleep, self.client.latency)
+        else:
+            await asyncio.sleep(self.client.latency)
+        return _FakeResponse(self._run())
+
+
+class FakeSupabase:
+    """Imita a interface do AsyncClient usada pelo agente e pela ingestão (rpc e table)."""
+
+    def __init__(self, documents: Optional[List[str]] = None, latency: float = 0.05, blocking: bool = False):
+        self.documents = documents or [
+            "O plano Maringá Paixão custa R$ 29,90 por mês e dá desconto em ingressos.",
+            "O próximo jogo do Maringá FC é no Willie Davids, domingo às 16h.",
+            "Sócios Maringá Paixão têm prioridade na compra de ingressos.",
+        ]
+        self.latency = latency
+        self.blocking = blocking
+        self.calls = 0
+        self.next_id = 0
+        # Trechos também na tabela (o cache de respostas valida pelo chunk_hash)
+        self.tables = {"conhecimento_clube": []}
+        for doc in self.documents:
+            self.next_id += 1
+            self.tables["conhecimento_clube"].append({
+                "id": self.next_id,
+                "conteudo": doc,
+                "fonte_url": "https://maringafc.com.br/",
+                "chunk_hash": hashlib.sha256(doc.encode("utf-8")).hexdigest(),
+            })
+
+    def rpc(self, name, params):
+        def handler():
+            count = params.get("match_count", 3)
+            return [{"conteudo": doc, "fonte_url": "https://maringafc.com.br/", "similarity": 0.8}
+                    for doc in self.documents[:count]]
+        return _FakeQuery(self, handler=handler)
+
+    def table(self, name):
+        return _FakeQuery(self, table=name)
+
+
+class FakeTavily:
+    """Imita o TavilySearchResults (só `ainvoke`) com resultados fixos da loja."""
+
+    def __init__(self, latency: float = 0.3):
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, query: str):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [{"url": "https://store.maringafc.com/camisa-oficial",
+                 "content": f"Camisa oficial Maringá FC 2025 por R$ 249,90 ({query})."}]
@@ -0,0 +1,81 @@
+"""
+Teste de carga do grafo com backends falsos.
+
+Compara o modo "blocking" (clientes síncronos empurrados para o thread pool,
+como era antes) com o modo "async" (ainvoke / aembed_query / AsyncClient),
+rodando N conversas simultâneas no mesmo event loop.
+
+Uso:
+    python tests/load_test_async.py --conversas 200 --latencia 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+# Mede o grafo inteiro: sem cache de respostas entre as rodadas
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+from langchain_core.messages import HumanMessage
+from src import agent
+from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+PERGUNTAS = [
+    "Quanto custa o Maringá Paixão?",
+    "Quando é o próximo jogo?",
+    "Quais os benefícios do sócio?",
+]
+
+
+def instalar_fakes(blocking: bool, latencia: float):
+    agent.models.use_factory(
+        lambda spec, model: FakeChatModel(model_name=model, latency=latencia, blocking=blocking))
+    agent._embeddings = FakeEmbeddings(latency=latencia / 4, blocking=blocking)
+    agent._supabase = FakeSupabase(latency=latencia / 4, blocking=blocking)
+
+
+async def conversa(i: int):
+    inputs = {
+        "messages": [HumanMessage(content=PERGUNTAS[i % len(PERGUNTAS)], id=str(uuid.uuid4()))],
+        "whatsapp_id": f"55449{i:08d}",
+    }
+    config = {"configurable": {"thread_id": inputs["whatsapp_id"]}}
+    await agent.get_dogao_agent().ainvoke(inputs, config)
+
+
+async def rodar(conversas: int) -> float:
+    inicio = time.perf_counter()
+    await asyncio.gather(*(conversa(i) for i in range(conversas)))
+    duracao = time.perf_counter() - inicio
+    # Lead tracking roda depois da resposta: fora da medição, mas drenado antes de trocar de loop
+    await agent.summarizer.close()
+    await agent.get_lead_tracker().close()
+    return duracao
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversas", type=int, default=200)
+    parser.add_argument("--latencia", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"--- Teste de carga: {args.conversas} conversas, latência LLM {args.latencia}s ---")
+    resultados = {}
+    for modo, blocking in (("blocking", True), ("async", False)):
+        instalar_fakes(blocking, args.latencia)
+        duracao = asyncio.run(rodar(args.conversas))
+        resultados[modo] = duracao
+        print(f"{modo:>9}: {duracao:6.2f}s | {args.conversas / duracao:7.1f} conversas/s | "
+              f"{sum(c.calls for c in agent.models.clients())} chamadas LLM")
+
+    print(f"Ganho: {resultados['blocking'] / resultados['async']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Testa o controle de admissão (fila limitada, prioridade para quem está
+comprando, resposta degradada) e o /chat sobrecarregado com backends falsos.
+
+Roda com: python -m pytest tests/test_admission.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+from src.admission import AdmissionController
+
+
+def test_priority_jumps_the_queue():
+    admission = AdmissionController(max_active=1, max_queue=5, max_wait=2)
+    order = []
+
+    async def turn(name, priority=False, hold=0.0):
+        async with admission.slot(priority) as admitted:
+            assert admitted
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def run():
+        first = asyncio.create_task(turn("primeiro", hold=0.05))
+        await asyncio.sleep(0.01)
+        waiting = [asyncio.create_task(turn("normal")), asyncio.create_task(turn("comprando", priority=True))]
+        await asyncio.gather(first, *waiting)
+
+    asyncio.run(run())
+    assert order == ["primeiro", "comprando", "normal"]
+    assert admission.metrics()["ativos"] == 0
+
+
+def test_full_queue_and_long_wait_degrade_instead_of_blocking():
+    admission = AdmissionController(max_active=1, max_queue=1, max_wait=0.1)
+    results = {}
+
+    async def turn(name, priority=False, hold=0.0):
+        async with admission.slot(priority) as admitted:
+            results[name] = admitted
+            if admitted:
+                await asyncio.sleep(hold)
+
+    async def run():
+        first = asyncio.create_task(turn("primeiro", hold=0.3))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(turn("na_fila"))
+        await asyncio.sleep(0.01)
+        # Fila cheia: sem prioridade é recusado na hora, com prioridade desaloja o da fila
+        await turn("recusado")
+        priority = asyncio.create_task(turn("comprando", priority=True))
+        await asyncio.gather(first, queued, priority)
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    assert results == {"primeiro": True, "na_fila": False, "recusado": False, "comprando": False}
+    stats = admission.metrics()
+    assert stats["desalojados"] == 1 and stats["recusados_fila_cheia"] == 1 and stats["recusados_espera"] == 1
+    assert time.perf_counter() - started < 0.5
+
+
+def test_overloaded_chat_answers_degraded_and_keeps_the_message(monkeypatch):
+    import httpx
+    from src import agent
+    from src import main as api
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: FakeChatModel(model_name=model, latency=0.2))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", FakeEmbeddings(latency=0))
+    monkeypatch.setattr(agent, "_supabase", FakeSupabase(latency=0))
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(api, "admission", AdmissionController(max_active=1, max_queue=0, max_wait=0.1))
+    monkeypatch.setattr(api, "ingress", api.ConversationIngress(api.run_turn, window=0))
+
+    ids = [f"55447{uuid.uuid4().hex[:8]}" for _ in range(3)]
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            responses = await asyncio.gather(*(
+                client.post("/chat", json={"message": "Quanto custa o Maringá Paixão?", "whatsapp_id": w})
+                for w in ids
+            ))
+        states = [(await agent.get_dogao_agent().aget_state({"configurable": {"thread_id": w}})).values for w in ids]
+        await agent.get_lead_tracker().close()
+        return responses, states
+
+    responses, states = asyncio.run(run())
+    assert all(r.status_code == 200 for r in responses)
+    bodies = [r.json() for r in responses]
+    degraded = [b for b in bodies if b["degradada"]]
+    assert len(degraded) == 2 and degraded[0]["response"] == api.DEGRADED_RESPONSE
+    # A pergunta sem resposta fica no histórico para o próximo turno
+    for body, state in zip(bodies, states):
+        if body["degradada"]:
+            assert state["messages"][-1].content == "Quanto custa o Maringá Paixão?"
@@ -6,7 +6,7 @@ from langchain_core.messages import HumanMessage
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from src.agent import dogao_agent
+from src.agent import get_dogao_agent
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -28,7 +28,8 @@ def testar_agente():
     try:
         # Invoca o agente
         print("🤖 Processando... (Aguarde a consulta ao VectorStore e LLM)")
-        result = dogao_agent.invoke(initial_state)
+        config = {"configurable": {"thread_id": initial_state["whatsapp_id"]}}
+        result = asyncio.run(get_dogao_agent().ainvoke(initial_state, config))
         
         # Extrai a resposta do agente
         mensagens = result.get("messages", [])
@@ -0,0 +1,115 @@
+"""
+Testa o cache semântico de respostas (limiar, TTL, LRU, invalidação e perguntas
+que dependem da conversa).
+
+Roda com: python -m pytest tests/test_answer_cache.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+from src.answer_cache import SemanticAnswerCache, chunk_hash, is_self_contained
+
+PRECO = [1.0, 0.0, 0.0]
+PRECO_PARECIDO = [0.98, 0.2, 0.0]
+JOGOS = [0.0, 1.0, 0.0]
+
+
+def test_lookup_respects_threshold():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("Quanto custa o sócio?", PRECO, "R$ 29,90", [chunk_hash("preço")], latency=2.0)
+
+    entry_id, entry, similarity = cache.lookup(PRECO_PARECIDO)
+    assert entry.answer == "R$ 29,90" and similarity > 0.9
+    assert cache.lookup(JOGOS) is None
+
+    cache.record_hit(entry)
+    metrics = cache.metrics()
+    assert metrics["acertos"] == 1 and metrics["consultas"] == 2
+    assert metrics["latencia_economizada"] == 2.0
+
+
+def test_equivalent_question_replaces_entry():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("Quanto custa o sócio?", PRECO, "R$ 29,90", ["a"])
+    cache.store("Qual o valor do sócio?", PRECO_PARECIDO, "R$ 34,90", ["b"])
+    assert len(cache) == 1
+    assert cache.lookup(PRECO)[1].answer == "R$ 34,90"
+
+
+def test_ttl_and_lru_eviction():
+    cache = SemanticAnswerCache(max_entries=1, ttl=0.05)
+    cache.store("preço", PRECO, "R$ 29,90", ["a"])
+    cache.store("jogos", JOGOS, "Domingo 16h", ["b"])
+    assert len(cache) == 1
+    assert cache.lookup(PRECO) is None
+    time.sleep(0.06)
+    assert cache.lookup(JOGOS) is None
+
+
+def test_discard_by_source_chunks():
+    cache = SemanticAnswerCache()
+    cache.store("preço", PRECO, "R$ 29,90", ["a", "b"])
+    cache.store("jogos", JOGOS, "Domingo 16h", ["c"])
+
+    entry_id, _, _ = cache.lookup(JOGOS)
+    cache.discard(entry_id)
+    assert len(cache) == 1 and cache.metrics()["descartes_velhos"] == 1
+    assert cache.lookup(JOGOS) is None and cache.lookup(PRECO) is not None
+
+
+def test_context_dependent_questions_are_not_cacheable():
+    assert is_self_contained("Quanto custa o Maringá Paixão?")
+    assert is_self_contained("Quando é o próximo jogo do Maringá?")
+    for pergunta in ["quanto custa?", "E o plano Ouro, quanto custa?", "Quanto custa esse plano aí?",
+                     "Ele dá desconto também na loja?", "Mas e para menores de idade?"]:
+        assert not is_self_contained(pergunta), pergunta
+
+
+def test_follow_up_in_another_conversation_skips_cache(monkeypatch):
+    from langchain_core.messages import HumanMessage
+
+    from src import agent
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: FakeChatModel(model_name=model, latency=0))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", FakeEmbeddings(latency=0))
+    monkeypatch.setattr(agent, "_supabase", FakeSupabase(latency=0))
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(agent, "answer_cache", SemanticAnswerCache())
+
+    async def ask(whatsapp_id, pergunta):
+        config = {"configurable": {"thread_id": whatsapp_id}}
+        inputs = {"messages": [HumanMessage(content=pergunta, id=str(uuid.uuid4()))], "whatsapp_id": whatsapp_id}
+        return await agent.get_dogao_agent().ainvoke(inputs, config, durability="exit")
+
+    async def run():
+        a, b = (f"55446{uuid.uuid4().hex[:8]}" for _ in range(2))
+        await ask(a, "Quanto custa o Maringá Paixão?")
+        stored = len(agent.answer_cache)
+        await ask(b, "Quanto custa o Maringá Paixão?")
+        hits = agent.answer_cache.stats["acertos"]
+        state = await ask(b, "quanto custa?")
+        await agent.get_lead_tracker().close()
+        return stored, hits, state
+
+    stored, hits, state = asyncio.run(run())
+    assert stored == 1 and hits == 1
+    # A continuação curta não consulta nem alimenta o cache
+    metrics = agent.answer_cache.metrics()
+    assert metrics["acertos"] == 1 and metrics["consultas"] == 2 and metrics["entradas"] == 1
+    assert metrics["dependentes_da_conversa"] == 1
+    # O início do turno fica no estado do grafo (nada global por conversa)
+    assert state["inicio_turno"] > 0
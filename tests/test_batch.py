@@ -0,0 +1,170 @@
+"""
+Testa o processamento em lote (ordem por conversa, embeddings compartilhados,
+retomada depois de uma queda, lock de turno e admissão compartilhados com o
+/chat e o endpoint /chat/batch) com backends falsos.
+
+Roda com: python -m pytest tests/test_batch.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+from src.batch import BatchRunner, load_progress, parse_items, waves
+
+PERGUNTAS = ["Quanto custa o Maringá Paixão?", "Quais os benefícios do sócio?", "Quando é o próximo jogo?",
+             "Sócio tem prioridade no ingresso?"]
+
+
+def campaign(fans=6, per_fan=2):
+    prefix = uuid.uuid4().hex[:6]
+    lines = []
+    for turn in range(per_fan):
+        for fan in range(fans):
+            message = f"{PERGUNTAS[(fan + turn) % len(PERGUNTAS)]} ({fan})"
+            lines.append(json.dumps({"whatsapp_id": f"55443{prefix}{fan}", "message": message}, ensure_ascii=False))
+    return lines
+
+
+def install_fakes(monkeypatch):
+    from src import agent
+    from src.embedding_cache import CachedEmbeddings
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+    underlying = FakeEmbeddings(latency=0)
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: FakeChatModel(model_name=model, latency=0))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", CachedEmbeddings(underlying, model="fake"))
+    monkeypatch.setattr(agent, "_supabase", FakeSupabase(latency=0))
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", False)
+    return agent, underlying
+
+
+def test_parse_and_waves_keep_order_per_conversation():
+    items = parse_items(['{"whatsapp_id": "1", "message": "a"}', "",
+                         '{"whatsapp_id": "2", "message": "b", "id": "x"}',
+                         '{"whatsapp_id": "1", "message": "c"}'])
+    assert [i["id"] for i in items] == ["1", "x", "4"]
+    assert [[i["message"] for i in w] for w in waves(items)] == [["a", "b"], ["c"]]
+    with pytest.raises(ValueError, match="linha 2"):
+        parse_items(['{"whatsapp_id": "1", "message": "a"}', '{"whatsapp_id": "1"}'])
+
+
+def test_embeddings_are_batched_and_a_crashed_run_resumes(monkeypatch, tmp_path):
+    agent, underlying = install_fakes(monkeypatch)
+    items = parse_items(campaign(fans=6, per_fan=2))
+    progress = str(tmp_path / "campanha.ndjson")
+    runner = BatchRunner(agent.get_dogao_agent, agent.get_embeddings, concurrency=3, chunk_size=4)
+
+    async def crash_after(n):
+        seen = 0
+        stream = runner.run(items, progress)
+        async for _ in stream:
+            seen += 1
+            if seen == n:
+                break
+        await stream.aclose()
+        await agent.get_lead_tracker().close()
+
+    async def finish():
+        results = [r async for r in runner.run(items, progress)]
+        await agent.get_lead_tracker().close()
+        return results
+
+    asyncio.run(crash_after(4))
+    assert len(load_progress(progress)) == 4
+    results = asyncio.run(finish())
+
+    assert len(results) == 8 and all("erro" not in r for r in results)
+    assert set(load_progress(progress)) == {i["id"] for i in items}
+    assert runner.stats["retomados"] == 4
+    # Um aembed_documents por bloco (1 antes da queda + 3 na retomada): os turnos
+    # acham a pergunta no cache de embeddings
+    assert underlying.calls == runner.stats["blocos"] == 4
+
+
+def test_batch_items_share_turn_lock_and_admission_with_chat(monkeypatch):
+    from src.admission import AdmissionController
+
+    agent, _ = install_fakes(monkeypatch)
+    items = parse_items(campaign(fans=2, per_fan=1))
+    live_fan = items[0]["whatsapp_id"]
+    admission = AdmissionController(max_active=1, max_queue=4, max_wait=5)
+    order, active = [], []
+
+    class TracedGraph:
+        async def ainvoke(self, inputs, config, **kwargs):
+            order.append(f"lote: {inputs['whatsapp_id']}")
+            active.append(admission.active)
+            return await agent.get_dogao_agent().ainvoke(inputs, config, **kwargs)
+
+    runner = BatchRunner(TracedGraph, agent.get_embeddings, concurrency=2, lock=agent.turn_lock, admission=admission)
+
+    async def live_turn():
+        # Turno do /chat em andamento para o primeiro torcedor
+        async with agent.turn_lock(live_fan):
+            order.append("ao vivo: início")
+            await asyncio.sleep(0.2)
+            order.append("ao vivo: fim")
+
+    async def run():
+        live = asyncio.create_task(live_turn())
+        await asyncio.sleep(0)
+        results = [r async for r in runner.run(items)]
+        await live
+        await agent.get_lead_tracker().close()
+        return results
+
+    results = asyncio.run(run())
+    assert all("erro" not in r for r in results)
+    # O item do torcedor ao vivo só rodou depois do turno dele; o outro não esperou
+    assert order == ["ao vivo: início", f"lote: {items[1]['whatsapp_id']}", "ao vivo: fim", f"lote: {live_fan}"]
+    assert admission.stats["admitidos"] == 2 and active == [1, 1] and admission.active == 0
+
+    # Admissão lotada (sem fila): o item volta com erro e é refeito na retomada
+    full = AdmissionController(max_active=0, max_queue=0)
+    refused = BatchRunner(agent.get_dogao_agent, agent.get_embeddings, admission=full)
+    results = asyncio.run(collect(refused, items[:1]))
+    assert "erro" in results[0] and refused.stats["sem_vaga"] == 1 and refused.stats["erros"] == 1
+
+
+async def collect(runner, items):
+    return [r async for r in runner.run(items)]
+
+
+def test_batch_endpoint_streams_ndjson_and_replays_done_items(monkeypatch, tmp_path):
+    import httpx
+    from src import main as api
+
+    agent, _ = install_fakes(monkeypatch)
+    monkeypatch.setattr(api, "BATCH_PROGRESS_DIR", str(tmp_path))
+    body = "\n".join(campaign(fans=3, per_fan=1))
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            first = await client.post("/chat/batch", params={"job_id": "campanha-1"}, content=body)
+            again = await client.post("/chat/batch", params={"job_id": "campanha-1"}, content=body)
+            invalid = await client.post("/chat/batch", content='{"message": "sem id"}')
+        await agent.get_lead_tracker().close()
+        return first, again, invalid
+
+    first, again, invalid = asyncio.run(run())
+    assert first.headers["content-type"].startswith("application/x-ndjson")
+    first_lines = [json.loads(line) for line in first.text.splitlines()]
+    again_lines = [json.loads(line) for line in again.text.splitlines()]
+    assert len(first_lines) == 3 and all(r["response"] for r in first_lines)
+    assert all(r.get("retomado") for r in again_lines) and len(again_lines) == 3
+    assert invalid.status_code == 400
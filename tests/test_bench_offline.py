@@ -0,0 +1,34 @@
+"""
+Testa o harness do benchmark offline (percentis, baseline e uma rodada curta).
+
+Roda com: python -m pytest tests/test_bench_offline.py
+"""
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from tests.bench_offline import ROTEIROS, benchmark, comparar_com_baseline, percentil
+
+
+def test_percentil_nearest_rank():
+    valores = [0.5, 0.1, 0.4, 0.2, 0.3]
+    assert percentil(valores, 50) == 0.3
+    assert percentil(valores, 99) == 0.5
+    assert percentil([], 95) == 0.0
+
+
+def test_baseline_comparison_flags_only_regressions():
+    baseline = {"turnos_por_segundo": 100, "p95": 0.3, "llm_por_turno": 1.2}
+    ok = {"turnos_por_segundo": 90, "p95": 0.35, "llm_por_turno": 1.25, "erros": 0}
+    assert comparar_com_baseline(ok, baseline, tolerancia=0.25) == []
+
+    pior = {"turnos_por_segundo": 60, "p95": 0.5, "llm_por_turno": 2.2, "erros": 1}
+    regressoes = comparar_com_baseline(pior, baseline, tolerancia=0.25)
+    assert [r.split(":")[0] for r in regressoes] == ["turnos_por_segundo", "p95", "llm_por_turno", "erros"]
+
+
+def test_short_offline_run_covers_every_script():
+    relatorio = benchmark("grafo", conversas=len(ROTEIROS), concorrencia=2, latencia=0, memoria=False)
+    assert relatorio["erros"] == 0
+    assert relatorio["turnos"] == sum(len(r) for r in ROTEIROS)
+    assert relatorio["llm_por_turno"] > 0 and relatorio["p99"] >= relatorio["p50"]
@@ -0,0 +1,122 @@
+"""
+Testa o enquadramento SSE do /chat/stream com backends falsos: eventos
+`token`, `metadata` e `error`, o acerto no cache de respostas (sem o nó
+agent) e a resposta degradada.
+
+Roda com: python -m pytest tests/test_chat_stream.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+import httpx
+
+from src import agent
+from src import main as api
+from src.admission import AdmissionController
+from src.answer_cache import SemanticAnswerCache
+from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+PERGUNTA = "Quanto custa o Maringá Paixão?"
+
+
+def install_fakes(monkeypatch, cache=False):
+    chat_model = FakeChatModel(latency=0)
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: chat_model)
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", FakeEmbeddings(latency=0))
+    monkeypatch.setattr(agent, "_supabase", FakeSupabase(latency=0))
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", cache)
+    monkeypatch.setattr(agent, "answer_cache", SemanticAnswerCache())
+    monkeypatch.setattr(api, "admission", AdmissionController())
+    return chat_model
+
+
+def parse_sse(body: str):
+    """[(evento, dados)] na ordem em que chegaram; cada frame termina com linha em branco."""
+    assert body.endswith("\n\n")
+    events = []
+    for frame in body.split("\n\n")[:-1]:
+        event, data = frame.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def stream(*whatsapp_ids, message=PERGUNTA):
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        bodies = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            for whatsapp_id in whatsapp_ids:
+                response = await client.post("/chat/stream", json={"message": message, "whatsapp_id": whatsapp_id})
+                assert response.status_code == 200
+                assert response.headers["content-type"].startswith("text/event-stream")
+                bodies.append(parse_sse(response.text))
+        await agent.get_lead_tracker().close()
+        return bodies
+
+    return asyncio.run(run())
+
+
+def test_tokens_then_final_metadata(monkeypatch):
+    install_fakes(monkeypatch)
+    (events,) = stream(f"55448{uuid.uuid4().hex[:8]}")
+
+    kinds = [kind for kind, _ in events]
+    assert kinds[-1] == "metadata" and set(kinds[:-1]) == {"token"} and len(kinds) > 2
+    metadata = events[-1][1]
+    # Os tokens (só dos nós agent/generate) montam exatamente a resposta final
+    assert "".join(data["content"] for kind, data in events if kind == "token") == metadata["response"]
+    assert metadata["degradada"] is False and set(metadata) == {"response", "nome_identificado", "plano", "degradada"}
+
+
+def test_cache_hit_streams_a_single_token_without_agent(monkeypatch):
+    chat_model = install_fakes(monkeypatch, cache=True)
+    # O lead tracker em segundo plano também chama o LLM: fora da conta
+    monkeypatch.setattr(agent.get_lead_tracker(), "submit", lambda *args, **kwargs: None)
+    (first,) = stream(f"55448{uuid.uuid4().hex[:8]}")
+    calls = chat_model.calls
+    (second,) = stream(f"55448{uuid.uuid4().hex[:8]}")
+
+    assert agent.answer_cache.stats["acertos"] == 1 and chat_model.calls == calls
+    answer = first[-1][1]["response"]
+    # Segunda conversa: nenhum LLM chamado, a resposta inteira num único token
+    assert second == [("token", {"content": answer}),
+                      ("metadata", {"response": answer, "nome_identificado": None, "plano": None,
+                                    "degradada": False})]
+
+
+def test_graph_failure_becomes_error_event(monkeypatch):
+    install_fakes(monkeypatch)
+
+    class BrokenGraph:
+        async def astream_events(self, *args, **kwargs):
+            yield {"event": "on_chat_model_stream", "metadata": {"langgraph_node": "agent"},
+                   "data": {"chunk": type("Chunk", (), {"content": "Pra "})()}}
+            raise RuntimeError("grafo caiu")
+
+    monkeypatch.setattr(api, "get_dogao_agent", BrokenGraph)
+    (events,) = stream(f"55448{uuid.uuid4().hex[:8]}")
+
+    assert events == [("token", {"content": "Pra "}), ("error", {"detail": "grafo caiu"})]
+
+
+def test_overloaded_stream_sends_degraded_answer(monkeypatch):
+    install_fakes(monkeypatch)
+    monkeypatch.setattr(api, "admission", AdmissionController(max_active=0, max_queue=0))
+    (events,) = stream(f"55448{uuid.uuid4().hex[:8]}")
+
+    assert [kind for kind, _ in events] == ["token", "metadata"]
+    assert events[0][1]["content"] == api.DEGRADED_RESPONSE and events[1][1]["degradada"] is True
@@ -0,0 +1,160 @@
+"""
+Testa o checkpointer da conversa: camada quente (TTL/LRU), camada durável em
+SQLite e no Supabase, versão entre workers, writes pendentes e exclusão.
+
+Roda com: python -m pytest tests/test_checkpoint.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from langgraph.checkpoint.base import empty_checkpoint
+
+from src.checkpoint import ConversationCheckpointer, SQLiteCheckpointStore, SupabaseCheckpointStore, build_checkpointer
+from src.shared_state import MemorySharedState
+from tests.fakes import FakeSupabase
+
+
+def config(thread_id, checkpoint_id=None):
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ""}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def checkpoint(nome):
+    data = empty_checkpoint()
+    data["channel_values"] = {"nome": nome}
+    return data
+
+
+def nome(checkpoint_tuple):
+    return checkpoint_tuple.checkpoint["channel_values"]["nome"] if checkpoint_tuple else None
+
+
+def test_hot_layer_lru_and_ttl():
+    saver = ConversationCheckpointer(max_entries=2, ttl=0.05)
+    for thread_id in ["5541", "5542"]:
+        saver.put(config(thread_id), checkpoint(thread_id), {}, {})
+    saver.get_tuple(config("5541"))  # 5541 vira o mais recente
+    saver.put(config("5543"), checkpoint("5543"), {}, {})
+
+    assert nome(saver.get_tuple(config("5542"))) is None
+    assert nome(saver.get_tuple(config("5541"))) == "5541"
+    time.sleep(0.06)
+    assert saver.get_tuple(config("5543")) is None
+
+
+def test_sqlite_round_trip_across_instances():
+    with tempfile.TemporaryDirectory() as path:
+        file = os.path.join(path, "checkpoints.sqlite")
+        saved = ConversationCheckpointer(SQLiteCheckpointStore(file))
+        first = checkpoint("Ana")
+        returned = saved.put(config("5544"), first, {"source": "loop", "step": 1}, {})
+        second = checkpoint("Ana Paula")
+        saved.put(returned, second, {"source": "loop", "step": 2}, {})
+
+        # Outro processo: camada quente vazia, lê do SQLite
+        fresh = ConversationCheckpointer(SQLiteCheckpointStore(file))
+        loaded = asyncio.run(fresh.aget_tuple(config("5544")))
+        assert nome(loaded) == "Ana Paula"
+        assert loaded.metadata["step"] == 2
+        assert loaded.parent_config["configurable"]["checkpoint_id"] == first["id"]
+        # Só o último checkpoint fica guardado
+        assert fresh.get_tuple(config("5544", first["id"])) is None
+        assert [nome(t) for t in fresh.list(config("5544"))] == ["Ana Paula"]
+
+
+def test_reloads_when_other_worker_saved_newer_checkpoint():
+    versions = MemorySharedState()
+    with tempfile.TemporaryDirectory() as path:
+        store = SQLiteCheckpointStore(os.path.join(path, "checkpoints.sqlite"))
+        a = ConversationCheckpointer(store, versions=versions)
+        b = ConversationCheckpointer(store, versions=versions)
+
+        async def run():
+            await a.aput(config("5544"), checkpoint("Ana"), {}, {})
+            assert nome(await b.aget_tuple(config("5544"))) == "Ana"
+            await b.aput(config("5544"), checkpoint("Ana Paula"), {}, {})
+            # A camada quente do A ainda tem "Ana"; a versão publicada manda reler
+            assert nome(a.get_tuple(config("5544"))) == "Ana"
+            return nome(await a.aget_tuple(config("5544")))
+
+        assert asyncio.run(run()) == "Ana Paula"
+
+
+def test_put_writes_are_pending_on_the_current_checkpoint():
+    saver = ConversationCheckpointer()
+
+    async def run():
+        saved = await saver.aput(config("5544"), checkpoint("Ana"), {}, {})
+        await saver.aput_writes(saved, [("messages", "oi"), ("resumo", "")], task_id="t1")
+        # Repetição do mesmo task/índice é ignorada
+        await saver.aput_writes(saved, [("messages", "repetida")], task_id="t1")
+        await saver.aput_writes(saved, [("messages", "tchau")], task_id="t2")
+        # Writes de um checkpoint que não é o atual não entram
+        await saver.aput_writes(config("5544", "outro"), [("messages", "velha")], task_id="t3")
+        return await saver.aget_tuple(config("5544"))
+
+    loaded = asyncio.run(run())
+    assert loaded.pending_writes == [("t1", "messages", "oi"), ("t1", "resumo", ""), ("t2", "messages", "tchau")]
+
+
+def test_adelete_thread_drops_every_layer():
+    versions = MemorySharedState()
+    with tempfile.TemporaryDirectory() as path:
+        store = SQLiteCheckpointStore(os.path.join(path, "checkpoints.sqlite"))
+        a = ConversationCheckpointer(store, versions=versions)
+        b = ConversationCheckpointer(store, versions=versions)
+
+        async def run():
+            await a.aput(config("5544"), checkpoint("Ana"), {}, {})
+            await a.aput(config("5545"), checkpoint("Bia"), {}, {})
+            await b.aget_tuple(config("5544"))
+            await a.adelete_thread("5544")
+            # O B tinha a conversa na camada quente e também não a enxerga mais
+            return (await a.aget_tuple(config("5544")), await b.aget_tuple(config("5544")),
+                    await b.aget_tuple(config("5545")))
+
+        deleted_a, deleted_b, other = asyncio.run(run())
+        assert deleted_a is None and deleted_b is None and nome(other) == "Bia"
+        assert store.load("5544", "") is None
+
+
+def test_supabase_store_round_trip():
+    client = FakeSupabase(latency=0)
+
+    async def get_client():
+        return client
+
+    saver = ConversationCheckpointer(SupabaseCheckpointStore(get_client))
+
+    async def run():
+        await saver.aput(config("5544"), checkpoint("Ana"), {}, {})
+        await saver.aput(config("5544"), checkpoint("Ana Paula"), {}, {})
+        fresh = ConversationCheckpointer(SupabaseCheckpointStore(get_client))
+        loaded = await fresh.aget_tuple(config("5544"))
+        await fresh.adelete_thread("5544")
+        return loaded
+
+    assert nome(asyncio.run(run())) == "Ana Paula"
+    assert client.tables["conversas_checkpoint"] == []
+    # O Supabase só tem a API assíncrona
+    with pytest.raises(NotImplementedError):
+        saver.get_tuple(config("5545"))
+
+
+def test_build_checkpointer_rejects_unknown_backend(monkeypatch):
+    async def get_client():
+        return FakeSupabase(latency=0)
+
+    monkeypatch.setenv("CHECKPOINT_BACKEND", "Memory")
+    assert build_checkpointer(get_client).store is None
+    monkeypatch.setenv("CHECKPOINT_BACKEND", "sqlite3")
+    with pytest.raises(ValueError, match="sqlite3"):
+        build_checkpointer(get_client)
@@ -0,0 +1,230 @@
+"""
+Testa a tabela de fatos do clube: extração de planos e jogos das páginas,
+atualização incremental pela ingestão e a tool `lookup_club_facts` no grafo
+(fato na tabela sem busca nem grader; sem fato, cai na busca normal).
+
+Roda com: python -m pytest tests/test_club_facts.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from datetime import date
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+from src.club_facts import ClubFactsTable, extract_facts, format_facts
+
+SOCIO = "\n".join([
+    "Seja sócio do Maringá FC e apoie o Dogão em todos os jogos da temporada.",
+    "O plano Maringá Paixão custa R$ 29,90 por mês no cartão de crédito, sem taxa de adesão.",
+    "Sócios Maringá Paixão têm prioridade na compra de ingressos para todos os jogos no Willie Davids.",
+    "O plano Ouro custa R$ 59,90 e inclui cadeira cativa no setor coberto e estacionamento.",
+    "Sócios em dia concorrem a experiências no gramado e visitas ao centro de treinamento.",
+])
+JOGOS = "\n".join([
+    "Confira a agenda de jogos do Maringá FC na temporada.",
+    "O próximo jogo do Maringá FC é contra o Londrina, no domingo às 16h, no estádio Willie Davids.",
+    "Na rodada seguinte o Maringá FC visita o Operário em Ponta Grossa, no sábado às 18h.",
+])
+
+
+def test_extracts_plans_and_fixtures():
+    plans = {f["dados"]["nome"]: f["dados"] for f in extract_facts("https://maringafc.com.br/socio", SOCIO)}
+    assert plans["Maringá Paixão"]["preco"] == "R$ 29,90" and plans["Maringá Paixão"]["periodo"] == "mês"
+    assert plans["Ouro"]["preco"] == "R$ 59,90"
+    assert any("prioridade" in b for b in plans["Maringá Paixão"]["beneficios"])
+    # Benefício "dos sócios" vale para os dois planos da página
+    assert all(any("experiências" in b for b in p["beneficios"]) for p in plans.values())
+
+    # Extraído numa segunda-feira: "domingo" é dia 18 e o sábado da rodada seguinte vem depois dele
+    games = [f["dados"] for f in extract_facts("https://maringafc.com.br/jogos", JOGOS, today=date(2026, 10, 12))]
+    assert games == [
+        {"adversario": "Londrina", "data": "domingo", "hora": "16h", "local": "Willie Davids", "quando": "2026-10-18"},
+        {"adversario": "Operário", "data": "sábado", "hora": "18h", "local": "Ponta Grossa", "quando": "2026-10-24"},
+    ]
+
+
+def test_past_games_never_show_up_as_next_fixture():
+    noticias = "\n".join([
+        "O Maringá FC venceu o Londrina por 2 x 1 no domingo, no Willie Davids.",
+        "O jogo contra o Cianorte é no dia 01/11 às 19h30, no Willie Davids.",
+        "O jogo contra o Cascavel foi no dia 10/10 no estádio Olímpico.",
+        "O Maringá FC enfrenta o Toledo no dia 25/10 às 16h.",
+    ])
+    facts = extract_facts("https://maringafc.com.br/noticias", noticias, today=date(2026, 10, 12))
+    # Relato com placar não vira jogo
+    assert [f["dados"]["adversario"] for f in facts] == ["Cianorte", "Cascavel", "Toledo"]
+
+    with tempfile.TemporaryDirectory() as path:
+        table = ClubFactsTable(os.path.join(path, "fatos.sqlite"))
+        table.replace_page("https://maringafc.com.br/noticias", "h1", facts)
+        # Jogo que já passou fica de fora; o resto sai pela data, não pela ordem da página
+        games = table.lookup("Quando é o próximo jogo?", today=date(2026, 10, 20))
+        assert [g["adversario"] for g in games] == ["Toledo", "Cianorte"]
+        assert "- Maringá FC x Toledo: 25/10 às 16h." in format_facts(games)
+        assert table.lookup("Quando é o próximo jogo?", today=date(2026, 11, 2)) == []
+
+
+def test_table_refreshes_only_changed_pages():
+    from src.ingestion_web import refresh_facts
+
+    with tempfile.TemporaryDirectory() as path:
+        table = ClubFactsTable(os.path.join(path, "fatos.sqlite"))
+        stats = {"fatos": 0}
+        refresh_facts(table, "https://maringafc.com.br/socio", SOCIO, "h1", stats)
+        refresh_facts(table, "https://maringafc.com.br/jogos", JOGOS, "h2", stats)
+        assert stats["fatos"] == 4
+        # Mesmo hash: nada reextraído (nem publicado)
+        assert refresh_facts(table, "https://maringafc.com.br/jogos", JOGOS, "h2", stats) is None
+        assert stats["fatos"] == 4
+
+        # Página mudou: o Londrina já jogou e o jogo some da tabela
+        refresh_facts(table, "https://maringafc.com.br/jogos", JOGOS.split("\n", 2)[-1], "h3", stats)
+        games = table.lookup("Quando é o próximo jogo?")
+        assert [g["adversario"] for g in games] == ["Operário"]
+
+        # O nome do plano basta para saber que é pergunta de plano; pergunta de ingresso não é da tabela
+        plans = table.lookup("Quanto custa o Maringá Paixão?")
+        assert [p["nome"] for p in plans] == ["Maringá Paixão"]
+        assert "R$ 29,90 por mês" in format_facts(plans)
+        assert table.lookup("Quanto custa o ingresso?") == []
+        assert table.metrics()["acertos"] == 2 and table.metrics()["sem_fato"] == 1
+
+
+def test_turn_reads_come_from_memory_until_the_next_write():
+    with tempfile.TemporaryDirectory() as path:
+        table = ClubFactsTable(os.path.join(path, "fatos.sqlite"))
+        table.replace_page("https://maringafc.com.br/socio", "h1", extract_facts("https://maringafc.com.br/socio", SOCIO))
+        statements = []
+        table._conn.set_trace_callback(statements.append)
+        for _ in range(5):
+            assert table.answerable("Quanto custa o Maringá Paixão?")
+            assert table.lookup("Quanto custa o Maringá Paixão?")
+        assert len([s for s in statements if s.startswith("SELECT")]) == 1
+
+        # Escrita invalida o snapshot: o plano novo já vale para a próxima pergunta
+        table.replace_page("https://maringafc.com.br/socio", "h2",
+                           extract_facts("https://maringafc.com.br/socio", SOCIO + "\nO plano Prata custa R$ 19,90."))
+        assert "Prata" in table.plan_names() and table.answerable("E o Prata?")
+
+
+def test_api_pulls_the_facts_published_by_the_ingestion():
+    from src.ingestion_web import publish_facts, refresh_facts
+    from tests.fakes import FakeSupabase
+
+    supabase = FakeSupabase(latency=0)
+    with tempfile.TemporaryDirectory() as path:
+        # Host da ingestão e host da API com arquivos diferentes: só o Supabase liga os dois
+        ingestion = ClubFactsTable(os.path.join(path, "ingestao.sqlite"))
+        api = ClubFactsTable(os.path.join(path, "api.sqlite"))
+
+        async def ingest(url, texto, content_hash):
+            extracted = refresh_facts(ingestion, url, texto, content_hash, {"fatos": 0})
+            if extracted is not None:
+                await publish_facts(supabase, url, extracted)
+            return await api.arefresh(supabase)
+
+        assert asyncio.run(ingest("https://maringafc.com.br/socio", SOCIO, "h1")) == 2
+        assert asyncio.run(ingest("https://maringafc.com.br/jogos", JOGOS, "h2")) == 4
+        assert [p["nome"] for p in api.lookup("Quanto custa o plano Ouro?")] == ["Ouro"]
+        # Página alterada: o refresh da API leva a troca (e a remoção) junto
+        assert asyncio.run(ingest("https://maringafc.com.br/jogos", JOGOS.split("\n", 2)[-1], "h3")) == 3
+        assert [g["adversario"] for g in api.lookup("Quando é o próximo jogo?")] == ["Operário"]
+
+
+def test_pages_gone_from_the_site_lose_their_facts():
+    from types import SimpleNamespace
+    from src.ingestion_web import prune_facts, publish_facts, refresh_facts
+    from tests.fakes import FakeSupabase
+
+    supabase = FakeSupabase(latency=0)
+    pages = {"https://maringafc.com.br/socio": SOCIO, "https://maringafc.com.br/jogos": JOGOS,
+             "https://store.maringafc.com/socio": SOCIO}
+    with tempfile.TemporaryDirectory() as path:
+        table = ClubFactsTable(os.path.join(path, "fatos.sqlite"))
+
+        async def run(crawler):
+            for url, texto in pages.items():
+                extracted = refresh_facts(table, url, texto, "h1", {"fatos": 0})
+                if extracted is not None:
+                    await publish_facts(supabase, url, extracted)
+            return await prune_facts(table, supabase, crawler)
+
+        # Crawl parado no limite de páginas: não dá para saber o que sumiu
+        truncated = SimpleNamespace(domain="maringafc.com.br", seen={"https://maringafc.com.br/socio"}, max_pages=1)
+        assert asyncio.run(run(truncated)) == []
+        # Crawl completo do site oficial sem a página de jogos: só ela sai (a loja é outro crawl)
+        full = SimpleNamespace(domain="maringafc.com.br", seen={"https://maringafc.com.br/socio"}, max_pages=2000)
+        assert asyncio.run(run(full)) == ["https://maringafc.com.br/jogos"]
+        assert table.lookup("Quando é o próximo jogo?") == []
+        assert table.page_hash("https://maringafc.com.br/jogos") is None
+        assert {r["fonte_url"] for r in supabase.tables["fatos_clube"]} == {
+            "https://maringafc.com.br/socio", "https://store.maringafc.com/socio"}
+
+
+def test_graph_answers_from_the_table_without_retrieval(monkeypatch):
+    from langchain_core.messages import HumanMessage, ToolMessage
+    from src import agent
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+    prompts = []
+
+    class RecordingChatModel(FakeChatModel):
+        def _respond(self, messages, tools):
+            prompts.append(messages)
+            return super()._respond(messages, tools)
+
+    from src.ingestion_web import publish_facts
+
+    embeddings = FakeEmbeddings(latency=0)
+    supabase = FakeSupabase(latency=0)
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: RecordingChatModel(model_name=model, latency=0))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", embeddings)
+    monkeypatch.setattr(agent, "_supabase", supabase)
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", False)
+
+    def ask(question):
+        async def run():
+            whatsapp_id = f"55443{uuid.uuid4().hex[:8]}"
+            inputs = {"messages": [HumanMessage(content=question)], "whatsapp_id": whatsapp_id}
+            state = await agent.get_dogao_agent().ainvoke(inputs, {"configurable": {"thread_id": whatsapp_id}},
+                                                          durability="exit")
+            await agent.get_lead_tracker().close()
+            return state
+        return asyncio.run(run())
+
+    with tempfile.TemporaryDirectory() as path:
+        table = ClubFactsTable(os.path.join(path, "fatos.sqlite"))
+        monkeypatch.setattr(agent, "_club_facts", table)
+
+        # Tabela vazia: a tool cai na busca normal (embedding + documentos)
+        state = ask("Quanto custa o Maringá Paixão?")
+        tool_msg = next(m for m in state["messages"] if isinstance(m, ToolMessage))
+        assert tool_msg.name == "lookup_club_facts" and embeddings.calls == 1
+        assert tool_msg.artifact and "conteudo" in tool_msg.artifact[0]
+
+        # Ingestão publica; o refresh do worker (aqui, como no warmup) traz os fatos
+        url = "https://maringafc.com.br/socio"
+        asyncio.run(publish_facts(supabase, url, extract_facts(url, SOCIO)))
+        asyncio.run(table.arefresh(supabase))
+        grader_decisions = sum(s["decisoes"] for s in agent.grader.stats.values())
+        prompts.clear()
+        state = ask("Quanto custa o Maringá Paixão?")
+
+    # Sem embedding, sem busca especulativa e sem grader: só router + resposta
+    assert embeddings.calls == 1
+    assert sum(s["decisoes"] for s in agent.grader.stats.values()) == grader_decisions
+    turn = [p for p in prompts if "Extraia informações do lead" not in str(p[0].content)]
+    assert len(turn) == 2
+    answer_prompt = next(p for p in turn if "CONTEXTO:" in str(p[0].content))
+    assert "R$ 29,90" in str(answer_prompt[0].content)
+    assert state["messages"][-1].content
@@ -0,0 +1,110 @@
+"""
+Testa a montagem do contexto (mescla de chunks vizinhos, MMR, orçamento de
+tokens) e que o generate_answer recebe o contexto uma vez só.
+
+Roda com: python -m pytest tests/test_context_builder.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+from src.context_builder import ContextBuilder
+from src.ingestion_web import split_text
+from src.summarizer import count_tokens
+
+PAGINA_SOCIO = "\n".join([
+    "O plano Maringá Paixão custa R$ 29,90 por mês no cartão de crédito, sem taxa de adesão.",
+    "Sócios têm prioridade na compra de ingressos para todos os jogos no Willie Davids.",
+    "O desconto na loja oficial é de 15% em camisas, agasalhos e bonés do Maringá FC.",
+    "Dependentes de até 12 anos entram com a carteirinha do titular, mediante cadastro prévio.",
+    "O plano Ouro custa R$ 59,90 e inclui cadeira cativa no setor coberto e estacionamento.",
+    "O cancelamento pode ser feito a qualquer momento pela área do sócio, sem multa.",
+    "A carteirinha digital fica no aplicativo do clube e vale como ingresso na catraca.",
+    "Sócios em dia concorrem a experiências no gramado e visitas ao centro de treinamento.",
+    "A troca do cartão de pagamento é feita na área do sócio, na aba Pagamentos.",
+])
+
+
+def test_neighbor_chunks_of_a_page_are_merged():
+    chunks = split_text(PAGINA_SOCIO)
+    assert len(chunks) >= 2
+    url = "https://maringafc.com.br/socio"
+    # Ranking da busca fora da ordem da página, com um trecho de outra página no meio
+    docs = [{"conteudo": c, "fonte_url": url, "similarity": 0.7} for c in reversed(chunks)]
+    docs.insert(1, {"conteudo": "O próximo jogo é domingo às 16h.", "fonte_url": "https://maringafc.com.br/jogos",
+                    "similarity": 0.9})
+
+    builder = ContextBuilder()
+    merged = builder.merge(docs)
+
+    assert len(merged) == 2
+    page = merged[0]
+    assert page["fonte_url"] == url and page["similarity"] == 0.7
+    assert sorted(page["trechos"]) == sorted(chunks)
+    # Texto inteiro da página uma vez só (o overlap não se repete)
+    assert page["conteudo"] == PAGINA_SOCIO.strip()
+    assert len(page["conteudo"]) < sum(len(c) for c in chunks)
+    assert builder.stats["trechos_mesclados"] == len(chunks) - 1
+
+
+def test_mmr_drops_duplicates_and_budget_cuts_at_a_sentence():
+    socio = "O plano Maringá Paixão custa R$ 29,90 por mês e dá prioridade nos ingressos."
+    docs = [
+        {"conteudo": socio, "fonte_url": "https://maringafc.com.br/socio"},
+        {"conteudo": socio + " Confira!", "fonte_url": "https://maringafc.com.br/noticias/socio"},
+        {"conteudo": "O próximo jogo é contra o Londrina, domingo às 16h.", "fonte_url": "https://maringafc.com.br/jogos"},
+    ]
+    builder = ContextBuilder()
+    selected = builder.build(docs, k=3)
+    assert [d["fonte_url"] for d in selected] == ["https://maringafc.com.br/socio", "https://maringafc.com.br/jogos"]
+    assert builder.stats["trechos_redundantes"] == 1
+
+    passages = [" ".join([socio] * 6), "Trecho que não cabe mais."]
+    fitted = builder.fit(passages, max_tokens=60)
+    assert len(fitted) == 1 and fitted[0].endswith(".") and count_tokens(fitted[0]) <= 60
+    assert builder.fit(passages, max_tokens=0) == passages
+
+
+def test_answer_prompt_carries_the_context_once(monkeypatch):
+    from langchain_core.messages import HumanMessage, ToolMessage
+    from src import agent
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+    prompts = []
+
+    class RecordingChatModel(FakeChatModel):
+        def _respond(self, messages, tools):
+            prompts.append(messages)
+            return super()._respond(messages, tools)
+
+    supabase = FakeSupabase(latency=0)
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: RecordingChatModel(model_name=model, latency=0))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", FakeEmbeddings(latency=0))
+    monkeypatch.setattr(agent, "_supabase", supabase)
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", False)
+
+    async def run():
+        whatsapp_id = f"55446{uuid.uuid4().hex[:8]}"
+        inputs = {"messages": [HumanMessage(content="Quanto custa o Maringá Paixão?")], "whatsapp_id": whatsapp_id}
+        state = await agent.get_dogao_agent().ainvoke(inputs, {"configurable": {"thread_id": whatsapp_id}},
+                                                      durability="exit")
+        await agent.get_lead_tracker().close()
+        return state
+
+    state = asyncio.run(run())
+    assert any(isinstance(m, ToolMessage) for m in state["messages"])
+    answer_prompt = next(p for p in prompts if "CONTEXTO:" in str(p[0].content))
+    prompt_text = "\n".join(str(m.content) for m in answer_prompt)
+    assert prompt_text.count(supabase.documents[0]) == 1
+    assert not any(isinstance(m, ToolMessage) for m in answer_prompt)
@@ -0,0 +1,117 @@
+"""
+Testa o crawler assíncrono contra um servidor HTTP de arquivos estáticos local.
+
+Roda com: python -m pytest tests/test_crawler_local.py
+"""
+import asyncio
+import functools
+import os
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.crawler import Crawler, normalize_url
+
+SITE = {
+    "index.html": '<a href="/socio.html">Sócio</a> <a href="/jogos.html?utm_source=insta">Jogos</a>'
+                  '<a href="/jogos.html">Jogos</a> <a href="https://externo.com/">Fora</a>'
+                  '<a href="/privado/admin.html">Admin</a> <a href="/logo.png">Logo</a>',
+    "socio.html": '<p>Maringá Paixão</p><a href="/planos/ouro.html#beneficios">Ouro</a>',
+    "jogos.html": '<p>Próximo jogo</p><a href="/index.html">Home</a>',
+    "planos/ouro.html": '<p>Plano Ouro</p><a href="/planos/fundo.html">Mais fundo</a>',
+    "planos/fundo.html": '<p>Muito fundo</p>',
+    "privado/admin.html": '<p>Não deveria ser baixada</p>',
+    "orfa.html": '<p>Só aparece no sitemap</p>',
+    "robots.txt": "User-agent: *\nDisallow: /privado/\n",
+}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site(tmp_path):
+    for name, content in SITE.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(tmp_path)))
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+    (tmp_path / "sitemap.xml").write_text(
+        '<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f'<url><loc>{base}orfa.html</loc></url></urlset>', encoding="utf-8")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield base
+    server.shutdown()
+
+
+def crawl(base, crawler_class=Crawler, **kwargs):
+    async def run():
+        crawler = crawler_class(base, **kwargs)
+        # Timeout: um worker morto deixaria o crawl pendurado no frontier.join()
+        return await asyncio.wait_for(collect(crawler), timeout=30)
+
+    async def collect(crawler):
+        return [page async for page in crawler.crawl()]
+    return asyncio.run(run())
+
+
+def paths(pages):
+    return sorted(p.url.split("/", 3)[3] for p in pages)
+
+
+def test_normalize_url_dedupes_tracking_and_fragments():
+    assert normalize_url("HTTPS://Site.com:443/a?utm_source=x&b=2&a=1#topo") == "https://site.com/a?a=1&b=2"
+    assert normalize_url("http://site.com") == "http://site.com/"
+
+
+def test_crawl_bfs_respects_robots_domain_and_sitemap(site):
+    pages = crawl(site, max_depth=3)
+    assert paths(pages) == ["", "index.html", "jogos.html", "orfa.html",
+                            "planos/fundo.html", "planos/ouro.html", "socio.html"]
+    assert all(p.status == 200 and p.html for p in pages)
+
+
+def test_crawl_depth_limit(site):
+    pages = crawl(site, max_depth=1, use_sitemap=False)
+    # "/index.html" só aparece no nível 2 (link de volta em jogos.html)
+    assert paths(pages) == ["", "jogos.html", "socio.html"]
+
+
+def test_conditional_headers_yield_not_modified(site):
+    # O servidor estático do Python responde 304 para If-Modified-Since no futuro
+    pages = crawl(site, max_depth=0, use_sitemap=False,
+                  conditional_headers=lambda url: {"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert [p.status for p in pages] == [304]
+
+
+def test_malformed_href_does_not_stop_the_crawl(site, tmp_path):
+    # Link quebrado no "cabeçalho" da home: urljoin levanta ValueError (IPv6 inválido)
+    (tmp_path / "index.html").write_text('<a href="http://[quebrado">x</a>' + SITE["index.html"], encoding="utf-8")
+    pages = crawl(site, max_depth=3, concurrency=1)
+    assert "socio.html" in paths(pages) and "orfa.html" in paths(pages)
+
+
+def test_page_error_is_counted_and_workers_keep_going(site):
+    class FlakyCrawler(Crawler):
+        def extract_links(self, page_url, html):
+            if page_url.endswith("socio.html"):
+                raise RuntimeError("HTML inesperado")
+            return super().extract_links(page_url, html)
+
+    crawlers = []
+
+    def build(*args, **kwargs):
+        crawlers.append(FlakyCrawler(*args, **kwargs))
+        return crawlers[0]
+
+    pages = crawl(site, crawler_class=build, max_depth=3, concurrency=1)
+    assert crawlers[0].failed == [site + "socio.html"]
+    # A página com erro se perde (e o que só ela linkava), o resto do site não
+    assert paths(pages) == ["", "index.html", "jogos.html", "orfa.html"]
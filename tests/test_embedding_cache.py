@@ -0,0 +1,101 @@
+"""
+Testa o cache de embeddings: chave normalizada, LRU, arquivo memory-mapped
+compartilhado entre processos, registro parcial no fim e contadores.
+
+Roda com: python -m pytest tests/test_embedding_cache.py
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+from src.embedding_cache import CachedEmbeddings, DiskEmbeddingStore, cache_key, normalize_text
+from tests.fakes import FakeEmbeddings
+
+
+def test_key_normalizes_unicode_case_and_spaces():
+    assert normalize_text("  Quanto   CUSTA\to\nsócio? ") == "quanto custa o sócio?"
+    # "ó" composto e decomposto viram a mesma chave
+    assert cache_key("Sócio", "m") == cache_key("sócio  ", "m")
+    assert cache_key("sócio", "m") != cache_key("sócio", "outro-modelo")
+
+
+def test_lru_eviction_and_counters():
+    underlying = FakeEmbeddings(latency=0, dim=8)
+    cached = CachedEmbeddings(underlying, model="m", max_entries=2)
+
+    cached.embed_documents(["a", "b", "A ", "a"])  # uma chamada, "a" repetido no mesmo lote
+    assert (cached.api_calls, cached.hits, cached.misses) == (1, 2, 2)
+    cached.embed_query("c")  # "a" é o mais antigo e sai
+    assert cached.embed_query("b") == underlying.embed_query("b")
+    assert cached.api_calls == 2
+    cached.embed_query("a")
+    assert cached.api_calls == 3 and underlying.calls == 4  # + a chamada direta acima
+
+    asyncio.run(cached.aembed_documents(["a", "novo"]))
+    assert cached.api_calls == 4 and cached.hits == 4 and cached.misses == 5
+
+
+def test_disk_store_is_shared_across_processes():
+    with tempfile.TemporaryDirectory() as path:
+        file = os.path.join(path, "m.vec")
+        store = DiskEmbeddingStore(file, dim=4)
+        store.put(cache_key("local", "m"), [1, 2, 3, 4])
+        store.put(cache_key("local", "m"), [9, 9, 9, 9])  # chave repetida não é regravada
+        assert len(store) == 1
+
+        # Outro processo reabre o arquivo (dimensão pelo cabeçalho) e acrescenta um vetor
+        script = (
+            "import sys; sys.path.append(sys.argv[1])\n"
+            "from src.embedding_cache import DiskEmbeddingStore, cache_key\n"
+            "store = DiskEmbeddingStore.open_existing(sys.argv[2])\n"
+            "assert store.get(cache_key('local', 'm')).tolist() == [1, 2, 3, 4]\n"
+            "store.put(cache_key('remoto', 'm'), [5, 6, 7, 8])\n"
+        )
+        subprocess.run([sys.executable, "-c", script, ROOT, file], check=True)
+
+        # O memmap daqui é remapeado na primeira chave desconhecida
+        assert store.get(cache_key("remoto", "m")).tolist() == [5, 6, 7, 8]
+        assert len(store) == 2
+        reopened = DiskEmbeddingStore.open_existing(file)
+        assert reopened.dim == 4 and len(reopened) == 2
+
+        with pytest.raises(ValueError):
+            DiskEmbeddingStore(file, dim=8)
+
+
+def test_partial_trailing_record_is_truncated():
+    with tempfile.TemporaryDirectory() as path:
+        file = os.path.join(path, "m.vec")
+        store = DiskEmbeddingStore(file, dim=4)
+        store.put(cache_key("inteiro", "m"), [1, 1, 1, 1])
+        size = os.path.getsize(file)
+        # Processo interrompido no meio da escrita do segundo registro
+        with open(file, "ab") as f:
+            f.write(b"\x01" * (store.dtype.itemsize // 2))
+
+        reopened = DiskEmbeddingStore(file, dim=4)
+        assert os.path.getsize(file) == size and len(reopened) == 1
+        reopened.put(cache_key("depois", "m"), [2, 2, 2, 2])
+        assert reopened.get(cache_key("depois", "m")).tolist() == [2, 2, 2, 2]
+        assert reopened.get(cache_key("inteiro", "m")).tolist() == [1, 1, 1, 1]
+
+
+def test_cached_embeddings_reuse_disk_written_by_another_instance():
+    with tempfile.TemporaryDirectory() as path:
+        ingestion = CachedEmbeddings(FakeEmbeddings(latency=0, dim=8), model="text-embedding-3-small",
+                                     cache_dir=path)
+        # O agente sobe antes do arquivo existir
+        agent = CachedEmbeddings(FakeEmbeddings(latency=0, dim=8), model="text-embedding-3-small",
+                                 cache_dir=path)
+        vectors = ingestion.embed_documents(["trecho 1", "trecho 2"])
+
+        assert agent.embed_documents(["Trecho 1", "trecho 2"]) == vectors
+        assert agent.api_calls == 0 and agent.hits == 2 and agent.underlying.calls == 0
+        assert np.allclose(vectors[0], FakeEmbeddings(dim=8)._vector("trecho 1"))
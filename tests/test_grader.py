@@ -0,0 +1,109 @@
+"""
+Testa as camadas do grader com cross-encoder e LLM falsos.
+
+Roda com: python -m pytest tests/test_grader.py
+"""
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.grader import TieredGrader
+
+PERGUNTA = "Quanto custa o Maringá Paixão?"
+TRECHOS = ["O plano Maringá Paixão custa R$ 29,90 por mês.", "O próximo jogo é domingo."]
+
+
+class FakeCrossEncoder:
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, pairs):
+        self.calls += 1
+        return [0.9 if "custa" in passage else 0.1 for _, passage in pairs]
+
+
+def grade(grader, passages=TRECHOS, similarities=None):
+    return asyncio.run(grader.grade(PERGUNTA, passages, similarities))
+
+
+def test_similarity_tier_accepts_and_rejects_without_models():
+    grader = TieredGrader(accept=0.8, reject=0.55)
+    assert grade(grader, similarities=[0.86, 0.6]) == (True, "similaridade")
+    assert grade(grader, similarities=[0.5, 0.52]) == (False, "similaridade")
+    assert grader.metrics()["similaridade"]["decisoes"] == 2
+
+
+def test_ambiguous_band_uses_cross_encoder():
+    grader = TieredGrader(accept=0.8, reject=0.55, cross_encoder_model="fake")
+    grader._cross_encoder = FakeCrossEncoder()
+    assert grade(grader, similarities=[0.7]) == (True, "cross_encoder")
+    assert grade(grader, passages=TRECHOS[1:], similarities=[0.7]) == (False, "cross_encoder")
+    assert grader._cross_encoder.calls == 2
+
+
+def test_llm_only_when_opted_in_and_no_cross_encoder():
+    calls = []
+
+    async def llm_grader(question, docs):
+        calls.append(question)
+        return False
+
+    grader = TieredGrader(accept=0.8, reject=0.55, llm_grader=llm_grader)
+    assert grade(grader, similarities=[0.7]) == (False, "llm")
+    assert calls == [PERGUNTA]
+
+    no_llm = TieredGrader(accept=0.8, reject=0.55)
+    assert grade(no_llm, similarities=[0.7]) == (True, "fallback")
+    assert grade(no_llm, similarities=[0.6]) == (False, "fallback")
+    # Resultado da loja (sem similaridade): aprova
+    assert grade(no_llm) == (True, "fallback")
+
+
+def test_missing_sentence_transformers_disables_cross_encoder(monkeypatch):
+    grader = TieredGrader(accept=0.8, reject=0.55, cross_encoder_model="fake")
+    monkeypatch.setattr(grader, "_load_cross_encoder", lambda: None)
+
+    async def run():
+        await grader.preload()
+        return await grader.grade(PERGUNTA, TRECHOS, [0.7])
+
+    assert asyncio.run(run()) == (True, "fallback")
+    assert grader._cross_encoder_failed
+
+
+def test_turn_does_not_wait_for_the_cross_encoder_to_load(monkeypatch):
+    calls = []
+
+    async def llm_grader(question, docs):
+        calls.append(question)
+        return False
+
+    grader = TieredGrader(accept=0.8, reject=0.55, cross_encoder_model="fake", llm_grader=llm_grader)
+    loaded = threading.Event()
+
+    def slow_load():
+        loaded.wait(5)
+        return FakeCrossEncoder()
+
+    monkeypatch.setattr(grader, "_load_cross_encoder", slow_load)
+
+    async def run():
+        loading = grader.preload()
+        # Carregando: a faixa ambígua vai pelo meio da faixa, sem esperar o modelo nem chamar o LLM
+        during = await grader.grade(PERGUNTA, TRECHOS, [0.7])
+        assert grader.preload() is loading
+        loaded.set()
+        await loading
+        return during, await grader.grade(PERGUNTA, TRECHOS, [0.7])
+
+    assert asyncio.run(run()) == ((True, "fallback"), (True, "cross_encoder"))
+    assert calls == []
+
+
+def test_lexical_only_passage_blocks_direct_rejection():
+    grader = TieredGrader(accept=0.8, reject=0.55)
+    # Segundo trecho veio só do BM25 (sem similaridade vetorial)
+    assert grade(grader, similarities=[0.5, None]) == (True, "fallback")
+    assert grade(grader, similarities=[0.9, None]) == (True, "similaridade")
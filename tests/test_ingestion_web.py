@@ -0,0 +1,240 @@
+"""
+Testa a ingestão incremental (`changed_pages`) com páginas prontas do crawler
+e o Supabase falso: 304 e mesmo hash pulados, chunks com hash já gravado
+mantidos sem re-embedding e chunks que sumiram da página apagados. Também o
+pipeline de embeddings (`ingest`): limites dos lotes, backoff e upserts em lote.
+
+Roda com: python -m pytest tests/test_ingestion_web.py
+"""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+from openai import APITimeoutError
+
+from src import ingestion_web
+from src.crawler import FetchedPage
+from src.ingestion_web import KNOWLEDGE_TABLE, changed_pages, clean_html, split_text, text_hash
+from tests.fakes import FakeEmbeddings, FakeSupabase
+
+URL = "https://maringafc.com.br/socio"
+PARAGRAFOS = [
+    "O plano Maringá Paixão custa R$ 29,90 por mês e dá prioridade na compra de ingressos. " * 5,
+    "Sócios em dia concorrem a experiências no gramado e visitas ao centro de treinamento. " * 5,
+    "O plano Ouro inclui cadeira cativa no setor coberto, estacionamento e brinde anual. " * 5,
+]
+
+
+def html(paragrafos):
+    return "".join(f"<p>{p}</p>\n" for p in paragrafos)
+
+
+def new_stats():
+    return {"paginas_puladas": 0, "paginas_alteradas": 0, "paginas_baixadas": [],
+            "chunks_mantidos": 0, "ids_apagados": [], "fatos": 0}
+
+
+def run(pages, supabase, page_states, stats, full=False):
+    async def crawled():
+        for page in pages:
+            yield page
+
+    async def collect():
+        return [item async for item in changed_pages(crawled(), supabase, page_states, stats, full)]
+    return asyncio.run(collect())
+
+
+def test_not_modified_and_same_hash_pages_are_skipped():
+    supabase = FakeSupabase(latency=0)
+    page = html(PARAGRAFOS)
+    page_states = {URL: {"fonte_url": URL, "content_hash": text_hash(clean_html(page))}}
+    stats = new_stats()
+
+    pages = [FetchedPage("https://maringafc.com.br/jogos", 1, 304), FetchedPage(URL, 1, 200, page, etag='"v2"')]
+    assert run(pages, supabase, page_states, stats) == []
+    assert stats["paginas_puladas"] == 2 and stats["paginas_alteradas"] == 0
+    # Mesmo hash: nem consulta os chunks, mas o estado (ETag novo) é atualizado
+    assert supabase.calls == 0
+    assert stats["paginas_baixadas"] == [URL] and page_states[URL]["etag"] == '"v2"'
+
+    # --full ignora o hash salvo
+    stats = new_stats()
+    assert [url for url, _ in run(pages, supabase, page_states, stats, full=True)] == [URL]
+
+
+def test_changed_page_keeps_known_chunks_and_deletes_vanished_ones():
+    supabase = FakeSupabase(latency=0)
+    antigos = split_text(clean_html(html(PARAGRAFOS[:2])))
+    novos = split_text(clean_html(html([PARAGRAFOS[0], PARAGRAFOS[2]])))
+    assert len(antigos) > 1 and antigos[0] == novos[0]
+    supabase.tables[KNOWLEDGE_TABLE] = [
+        {"id": 100 + i, "fonte_url": URL, "conteudo": chunk, "chunk_hash": text_hash(chunk)}
+        for i, chunk in enumerate(antigos)
+    ]
+    page_states = {URL: {"fonte_url": URL, "content_hash": text_hash(clean_html(html(PARAGRAFOS[:2])))}}
+    stats = new_stats()
+
+    result = run([FetchedPage(URL, 1, 200, html([PARAGRAFOS[0], PARAGRAFOS[2]]))], supabase, page_states, stats)
+
+    # Só os chunks novos vão para o embedding; o que continua na página fica como está
+    kept = {text_hash(c) for c in antigos} & {text_hash(c) for c in novos}
+    assert result == [(URL, [(text_hash(c), c) for c in novos if text_hash(c) not in kept])]
+    assert len(kept) == 1 and stats["chunks_mantidos"] == 1 and stats["paginas_alteradas"] == 1
+    # Chunks que saíram da página são apagados do Supabase (e entram nos tombstones dos índices)
+    remaining = {row["chunk_hash"] for row in supabase.tables[KNOWLEDGE_TABLE]}
+    assert remaining == kept
+    assert sorted(stats["ids_apagados"]) == [100 + i for i, c in enumerate(antigos) if text_hash(c) not in kept]
+
+
+async def chunk_pages(pages):
+    for url, chunks in pages:
+        yield url, [(text_hash(chunk), chunk) for chunk in chunks]
+
+
+def test_batches_respect_size_and_token_limits(monkeypatch):
+    monkeypatch.setattr(ingestion_web, "EMBED_BATCH_SIZE", 3)
+    monkeypatch.setattr(ingestion_web, "EMBED_BATCH_TOKENS", 20)
+    pages = [("a", ["x" * 15] * 4), ("b", ["y" * 45, "z" * 90, "w" * 3])]
+
+    async def collect():
+        return [batch async for batch in ingestion_web.batch_chunks(chunk_pages(pages))]
+
+    batches = asyncio.run(collect())
+    # 4 chunks de 6 tokens: 3 por lote; o de 31 tokens (maior que o limite) vai sozinho
+    assert [[chunk[0] for _, _, chunk in batch] for batch in batches] == [
+        ["x", "x", "x"], ["x"], ["y"], ["z"], ["w"]]
+    assert {url for url, _, _ in batches[0]} == {"a"} and batches[1][0][0] == "a"
+
+
+def test_embed_with_retry_backs_off_then_gives_up(monkeypatch):
+    delays = []
+
+    async def no_sleep(delay):
+        if delay:  # o sleep(0) do FakeEmbeddings não é backoff
+            delays.append(delay)
+
+    class Flaky(FakeEmbeddings):
+        def __init__(self, failures):
+            super().__init__(latency=0, dim=4)
+            self.failures = failures
+
+        async def aembed_documents(self, texts):
+            if self.failures:
+                self.failures -= 1
+                raise APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))
+            return await super().aembed_documents(texts)
+
+    monkeypatch.setattr(ingestion_web.asyncio, "sleep", no_sleep)
+    monkeypatch.setattr(ingestion_web.random, "uniform", lambda a, b: 0.5)
+    monkeypatch.setattr(ingestion_web, "EMBED_MAX_RETRIES", 3)
+
+    monkeypatch.setattr(ingestion_web, "embeddings_model", Flaky(failures=3))
+    assert len(asyncio.run(ingestion_web.embed_with_retry(["a", "b"]))) == 2
+    assert delays == [1.5, 2.5, 4.5]
+
+    monkeypatch.setattr(ingestion_web, "embeddings_model", Flaky(failures=4))
+    with pytest.raises(APITimeoutError):
+        asyncio.run(ingestion_web.embed_with_retry(["a"]))
+
+
+def recording_upserts(supabase, fail=False):
+    """Guarda o tamanho de cada upsert (ou falha nele, como um Supabase fora do ar)."""
+    upserts, table = [], supabase.table
+
+    def recorded(name):
+        query = table(name)
+        upsert = query.upsert
+
+        def record(rows, on_conflict=None):
+            if fail:
+                raise ConnectionError("Supabase fora do ar")
+            upserts.append(len(rows))
+            return upsert(rows, on_conflict)
+        query.upsert = record
+        return query
+
+    supabase.table = recorded
+    return upserts
+
+
+def test_writer_flushes_in_insert_batches(monkeypatch):
+    monkeypatch.setattr(ingestion_web, "embeddings_model", FakeEmbeddings(latency=0, dim=4))
+    monkeypatch.setattr(ingestion_web, "EMBED_BATCH_SIZE", 2)
+    monkeypatch.setattr(ingestion_web, "EMBED_CONCURRENCY", 2)
+    monkeypatch.setattr(ingestion_web, "INSERT_BATCH_SIZE", 3)
+    supabase = FakeSupabase(latency=0)
+    upserts = recording_upserts(supabase)
+    pages = [(f"{URL}/{i}", [f"trecho {i}.{j}" for j in range(3)]) for i in range(3)]
+
+    total = asyncio.run(ingestion_web.ingest(chunk_pages(pages), supabase))
+
+    assert total == 9 and upserts == [3, 3, 3]
+    rows = [r for r in supabase.tables[KNOWLEDGE_TABLE] if r.get("categoria") == "web_scraping"]
+    assert len(rows) == 9 and all(len(r["embedding"]) == 4 for r in rows)
+
+
+def test_failed_writer_stops_the_producers(monkeypatch):
+    embeddings = FakeEmbeddings(latency=0, dim=4)
+    monkeypatch.setattr(ingestion_web, "embeddings_model", embeddings)
+    monkeypatch.setattr(ingestion_web, "EMBED_BATCH_SIZE", 1)
+    monkeypatch.setattr(ingestion_web, "EMBED_CONCURRENCY", 1)
+    monkeypatch.setattr(ingestion_web, "INSERT_BATCH_SIZE", 1)
+    supabase = FakeSupabase(latency=0)
+    recording_upserts(supabase, fail=True)
+    pages = [(URL, [f"trecho {i}" for i in range(100)])]
+
+    async def run():
+        # Sem vigiar o writer, a fila cheia travaria os lotes para sempre
+        await asyncio.wait_for(ingestion_web.ingest(chunk_pages(pages), supabase), timeout=5)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    # Os produtores pararam logo depois da falha (fila de 2 lotes)
+    assert embeddings.calls < 10
+
+
+def test_page_that_vanished_from_the_site_is_pruned(monkeypatch):
+    from types import SimpleNamespace
+
+    monkeypatch.setattr(ingestion_web, "embeddings_model", FakeEmbeddings(latency=0, dim=4))
+    supabase = FakeSupabase(latency=0)
+    # Trecho de outro site (a loja, ingerida com --url) não é tocado
+    supabase.tables[KNOWLEDGE_TABLE] = [{"id": 1, "fonte_url": "https://store.maringafc.com/camisa",
+                                         "conteudo": "camisa", "chunk_hash": "x"}]
+    supabase.next_id = 1
+    jogos = "https://maringafc.com.br/jogos"
+    page_states, stats = {}, new_stats()
+
+    async def ingest_run(pages, seen):
+        crawler = SimpleNamespace(domain="maringafc.com.br", seen=set(seen), max_pages=100)
+
+        async def crawled():
+            for page in pages:
+                yield page
+
+        await ingestion_web.ingest(changed_pages(crawled(), supabase, page_states, stats), supabase)
+        await supabase.table(ingestion_web.PAGES_TABLE).upsert(
+            [page_states[url] for url in stats["paginas_baixadas"]], on_conflict="fonte_url").execute()
+        return await ingestion_web.prune_pages(supabase, crawler, page_states, stats)
+
+    first = [FetchedPage(URL, 1, 200, html(PARAGRAFOS[:1])), FetchedPage(jogos, 1, 200, html(PARAGRAFOS[1:]))]
+    assert asyncio.run(ingest_run(first, [URL, jogos])) == []
+    jogos_ids = [r["id"] for r in supabase.tables[KNOWLEDGE_TABLE] if r["fonte_url"] == jogos]
+    assert jogos_ids
+
+    # Segunda rodada: /jogos saiu do site (nem aparece no crawl)
+    stats = new_stats()
+    assert asyncio.run(ingest_run([FetchedPage(URL, 1, 304)], [URL])) == [jogos]
+    assert {r["fonte_url"] for r in supabase.tables[KNOWLEDGE_TABLE]} == {URL, "https://store.maringafc.com/camisa"}
+    assert [r["fonte_url"] for r in supabase.tables[ingestion_web.PAGES_TABLE]] == [URL]
+    assert stats["ids_apagados"] == jogos_ids and jogos not in page_states
+
+    # Crawl parado no limite de páginas: o que faltou pode só não ter sido visitado
+    crawler = SimpleNamespace(domain="maringafc.com.br", seen={jogos}, max_pages=1)
+    assert asyncio.run(ingestion_web.prune_pages(supabase, crawler, page_states, new_stats())) == []
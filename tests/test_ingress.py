@@ -0,0 +1,113 @@
+"""
+Testa a camada de entrada por whatsapp_id (debounce de rajadas, serialização
+dos turnos e descarte das sessões ociosas) com um turno falso.
+
+Roda com: python -m pytest tests/test_ingress.py
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ingress import ConversationIngress
+
+
+class FakeTurns:
+    def __init__(self, latency=0.05, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.calls = []
+        self.running = {}
+        self.max_parallel = {}
+
+    async def __call__(self, whatsapp_id, messages):
+        self.calls.append((whatsapp_id, messages))
+        self.running[whatsapp_id] = self.running.get(whatsapp_id, 0) + 1
+        self.max_parallel[whatsapp_id] = max(self.max_parallel.get(whatsapp_id, 0), self.running[whatsapp_id])
+        await asyncio.sleep(self.latency)
+        self.running[whatsapp_id] -= 1
+        if self.fail:
+            raise RuntimeError("grafo caiu")
+        return {"response": " + ".join(messages)}
+
+
+def test_burst_during_a_turn_becomes_single_turn_answered_once():
+    turns = FakeTurns(latency=0.1)
+    ingress = ConversationIngress(turns, window=0.05, max_wait=1.0)
+
+    async def run():
+        async def send(message, delay):
+            await asyncio.sleep(delay)
+            return await ingress.submit("5544", message)
+        return await asyncio.gather(send("Oi", 0), send("tudo bem?", 0.02), send("quanto custa o sócio?", 0.04))
+
+    results = asyncio.run(run())
+    # Sem turno em andamento o "Oi" sai na hora; o resto chega durante o turno e vira um lote
+    assert turns.calls == [("5544", ["Oi"]), ("5544", ["tudo bem?", "quanto custa o sócio?"])]
+    # Os dois do lote recebem o mesmo turno; só a última mensagem do lote responde
+    assert [last for _, last in results] == [True, False, True]
+    assert results[-1][0]["response"] == "tudo bem? + quanto custa o sócio?"
+    assert ingress.metrics()["mensagens_agrupadas"] == 1 and ingress.metrics()["sessoes_ativas"] == 0
+
+
+def test_message_without_running_turn_is_not_delayed():
+    turns = FakeTurns(latency=0)
+    ingress = ConversationIngress(turns, window=1.0, max_wait=3.0)
+
+    async def run():
+        start = asyncio.get_running_loop().time()
+        await ingress.submit("5544", "Quanto custa o sócio?")
+        return asyncio.get_running_loop().time() - start
+
+    assert asyncio.run(run()) < 0.5
+    assert ingress.metrics()["turnos_em_espera"] == 0
+
+
+def test_turns_are_serialized_per_whatsapp_id_only():
+    turns = FakeTurns(latency=0.05)
+    ingress = ConversationIngress(turns, window=0, max_wait=0)
+
+    async def run():
+        async def later(whatsapp_id, message, delay):
+            await asyncio.sleep(delay)
+            return await ingress.submit(whatsapp_id, message)
+        await asyncio.gather(ingress.submit("5544", "primeira"), later("5544", "segunda", 0.01),
+                             ingress.submit("5545", "outra conversa"))
+
+    asyncio.run(run())
+    assert [m for w, m in turns.calls if w == "5544"] == [["primeira"], ["segunda"]]
+    assert turns.max_parallel == {"5544": 1, "5545": 1}
+    assert ingress.metrics()["turnos_em_espera"] == 1
+
+
+def test_max_wait_caps_a_never_ending_burst():
+    turns = FakeTurns(latency=0.02)
+    ingress = ConversationIngress(turns, window=0.05, max_wait=0.1)
+
+    async def run():
+        pending = []
+        for i in range(30):
+            pending.append(asyncio.create_task(ingress.submit("5544", f"msg {i}")))
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*pending)
+
+    asyncio.run(run())
+    # A rajada de 0,3 s nunca fica 0,05 s quieta: só o max_wait fecha os lotes
+    assert len(turns.calls) >= 3
+    assert sum(len(m) for _, m in turns.calls) == 30
+
+
+def test_failure_reaches_every_message_of_the_batch():
+    ingress = ConversationIngress(FakeTurns(fail=True), window=0.02)
+
+    async def run():
+        return await asyncio.gather(ingress.submit("5544", "a"), ingress.submit("5544", "b"),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert ingress.metrics()["sessoes_ativas"] == 0
+    with pytest.raises(RuntimeError):
+        asyncio.run(ingress.submit("5544", "c"))
@@ -0,0 +1,119 @@
+"""
+Testa a instrumentação (histogramas, custo e trace por requisição) num grafo mínimo
+e a soma das métricas de vários workers pelo estado compartilhado.
+
+Roda com: python -m pytest tests/test_instrumentation.py
+"""
+import asyncio
+import os
+import sys
+from typing import TypedDict
+
+os.environ.setdefault("TRACE_LOG_PATH", "")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from langgraph.graph import END, StateGraph
+
+from src import instrumentation
+from src.instrumentation import (Counter, Histogram, WorkerMetricsExchange, _cost, render_stats,
+                                  setup_instrumentation, trace_request, with_label)
+from src.shared_state import MemorySharedState
+
+
+class State(TypedDict):
+    loop_step: int
+
+
+def test_histogram_and_counter_render_prometheus_text():
+    hist = Histogram("t_duracao", "teste", ["node"], buckets=(0.1, 1))
+    hist.observe(0.05, node="agent")
+    hist.observe(0.5, node="agent")
+    lines = hist.render()
+    assert 't_duracao_bucket{node="agent",le="0.1"} 1' in lines
+    assert 't_duracao_bucket{node="agent",le="+Inf"} 2' in lines
+    assert 't_duracao_count{node="agent"} 2' in lines
+
+    counter = Counter("t_total", "teste")
+    counter.inc()
+    counter.inc(2)
+    assert counter.render()[-1] == "t_total 3.0"
+
+
+def test_render_stats_and_cost():
+    lines = render_stats("g", {"llm": {"decisoes": 2}, "entradas": 3, "nome": "x"}, label="camada")
+    assert lines == ['g_decisoes{camada="llm"} 2.0', "g_entradas 3.0"]
+    assert _cost("gpt-4o-mini-2024-07-18", 1_000_000, 0) == 0.15
+    assert _cost("modelo-local", 10, 10) == 0.0
+
+
+def test_graph_nodes_are_traced_per_request():
+    setup_instrumentation()
+
+    async def grade(state):
+        await asyncio.sleep(0.01)
+        return {"loop_step": 1}
+
+    builder = StateGraph(State)
+    builder.add_node("grade_documents", grade)
+    builder.add_node("generate", lambda state: {})
+    builder.set_entry_point("grade_documents")
+    builder.add_edge("grade_documents", "generate")
+    builder.add_edge("generate", END)
+    graph = builder.compile()
+
+    async def run():
+        async with trace_request("/teste", "5544") as trace:
+            await graph.ainvoke({"loop_step": 0})
+        return trace
+
+    trace = asyncio.run(run())
+    assert trace.path == ["grade_documents", "generate"]
+    assert trace.loop_step == 1 and not trace.cache_hit
+    assert trace.nodes[0]["duracao"] >= 0.01
+    assert 'dogao_node_duration_seconds_count{node="grade_documents"}' in instrumentation.render_metrics()
+
+
+def test_histogram_and_counter_merge_other_workers():
+    hist = Histogram("t_duracao", "teste", ["node"], buckets=(0.1, 1))
+    hist.observe(0.05, node="agent")
+    other = Histogram("t_duracao", "teste", ["node"], buckets=(0.1, 1))
+    other.observe(0.5, node="agent")
+    other.observe(2, node="generate")
+
+    merged = hist.merged(other.export())
+    assert 't_duracao_bucket{node="agent",le="1"} 2' in merged.render()
+    assert 't_duracao_count{node="generate"} 1' in merged.render()
+    # As métricas deste processo não mudam
+    assert 't_duracao_count{node="agent"} 1' in hist.render()
+
+    counter = Counter("t_total", "teste", ["tipo"])
+    counter.inc(2, tipo="a")
+    assert counter.merged([[["a"], 3.0], [["b"], 1.0]]).render()[2:] == ['t_total{tipo="a"} 5.0', 't_total{tipo="b"} 1.0']
+    assert with_label("g_acertos 3.0", "worker", "w1") == 'g_acertos{worker="w1"} 3.0'
+    assert with_label('g_x{camada="llm"} 1.0', "worker", "w1") == 'g_x{camada="llm",worker="w1"} 1.0'
+
+
+def test_metrics_scrape_sums_every_live_worker():
+    shared = MemorySharedState()
+    metric = instrumentation.REQUEST_ERRORS
+    line = lambda text: next(l for l in text.splitlines() if l.startswith('dogao_request_errors_total{endpoint="/teste_workers"}'))
+    a = WorkerMetricsExchange(shared, lambda: ["dogao_cache_acertos 1.0"], interval=0.05, worker_id="a")
+    b = WorkerMetricsExchange(shared, lambda: ["dogao_cache_acertos 2.0"], interval=0.05, worker_id="b")
+
+    async def run():
+        metric.inc(endpoint="/teste_workers")
+        local = float(line(instrumentation.render_metrics()).split()[-1])
+        b.start()
+        await asyncio.sleep(0.01)
+        both = await a.render()
+        await b.close()
+        # B parou de publicar: o snapshot expira e ele sai da lista
+        await asyncio.sleep(0.2)
+        alone = await a.render()
+        return local, both, alone, await shared.get(WorkerMetricsExchange.REGISTRY_KEY)
+
+    local, both, alone, registry = asyncio.run(run())
+    # Os dois "workers" deste teste compartilham as métricas do processo: o scrape conta duas vezes
+    assert float(line(both).split()[-1]) == 2 * local
+    assert 'dogao_cache_acertos{worker="a"} 1.0' in both and 'dogao_cache_acertos{worker="b"} 2.0' in both
+    assert float(line(alone).split()[-1]) == local and 'worker="b"' not in alone
+    assert registry == '["a"]'
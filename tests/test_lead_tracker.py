@@ -0,0 +1,185 @@
+"""
+Testa o lead tracker em segundo plano com o Supabase falso.
+
+Roda com: python -m pytest tests/test_lead_tracker.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+from src.lead_tracker import LeadOutbox, LeadTracker
+from tests.fakes import FakeSupabase
+
+
+def lead(job):
+    return {"whatsapp_id": job["whatsapp_id"], "nome_torcedor": job["nome"],
+            "plano_interesse": "Maringá Paixão", "convertido": False}
+
+
+def make_tracker(tmp_path, supabase, process=None, flush_interval=0.05, **kwargs):
+    async def process_job(job):
+        await asyncio.sleep(0.01)
+        return lead(job)
+
+    async def get_client():
+        return supabase
+
+    return LeadTracker(process or process_job, get_client, LeadOutbox(str(tmp_path / "outbox.sqlite")),
+                       flush_interval=flush_interval, **kwargs)
+
+
+def test_jobs_and_rows_are_coalesced_into_one_bulk_upsert(tmp_path):
+    supabase = FakeSupabase(latency=0)
+    processed = []
+
+    async def process(job):
+        processed.append(job["nome"])
+        await asyncio.sleep(0.01)
+        return lead(job)
+
+    async def run():
+        tracker = make_tracker(tmp_path, supabase, process=process, workers=1, flush_interval=60)
+        for nome in ["Ana", "Ana Maria", "Ana Maria Souza"]:
+            tracker.submit({"whatsapp_id": "5544", "nome": nome})
+        tracker.submit({"whatsapp_id": "5511", "nome": "Bruno"})
+        await tracker.close()
+        return tracker
+
+    tracker = asyncio.run(run())
+    # Os três jobs do 5544 ainda estavam na fila: só o mais recente roda
+    assert processed == ["Ana Maria Souza", "Bruno"]
+    assert tracker.stats["jobs_coalescidos"] == 2
+    assert tracker.stats["upserts"] == 1
+    rows = {r["whatsapp_id"]: r["nome_torcedor"] for r in supabase.tables["leads_sdr"]}
+    assert rows == {"5544": "Ana Maria Souza", "5511": "Bruno"}
+
+
+def test_flush_by_size(tmp_path):
+    supabase = FakeSupabase(latency=0)
+
+    async def run():
+        tracker = make_tracker(tmp_path, supabase, flush_size=3, flush_interval=60)
+        for i in range(3):
+            tracker.submit({"whatsapp_id": str(i), "nome": f"Lead {i}"})
+        await tracker._queue.join()
+        await asyncio.sleep(0.05)
+        rows = len(supabase.tables.get("leads_sdr", []))
+        await tracker.close()
+        return rows
+
+    assert asyncio.run(run()) == 3
+
+
+def test_failed_flush_keeps_leads_in_outbox(tmp_path):
+    class BrokenSupabase:
+        def table(self, name):
+            raise ConnectionError("Supabase fora do ar")
+
+    async def run_broken():
+        tracker = make_tracker(tmp_path, BrokenSupabase())
+        tracker.submit({"whatsapp_id": "5544", "nome": "Ana"})
+        await tracker.close()
+        return tracker
+
+    tracker = asyncio.run(run_broken())
+    assert tracker.stats["falhas_flush"] >= 1
+
+    # Processo novo: o outbox é recarregado e o lead chega no Supabase
+    supabase = FakeSupabase(latency=0)
+    recovered = make_tracker(tmp_path, supabase)
+    assert asyncio.run(recovered.flush())
+    assert [r["nome_torcedor"] for r in supabase.tables["leads_sdr"]] == ["Ana"]
+    assert LeadOutbox(str(tmp_path / "outbox.sqlite")).load() == {}
+
+
+def test_tracker_write_is_not_lost_to_a_concurrent_turn(monkeypatch):
+    from langchain_core.messages import AIMessage, HumanMessage
+    from src import agent
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: FakeChatModel(model_name=model, latency=0.05))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", FakeEmbeddings(latency=0))
+    monkeypatch.setattr(agent, "_supabase", FakeSupabase(latency=0))
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", False)
+    # Só a extração abaixo escreve a intenção no estado (não a do próprio turno)
+    monkeypatch.setattr(agent.get_lead_tracker(), "submit", lambda job: None)
+    whatsapp_id = f"55446{uuid.uuid4().hex[:8]}"
+    config = {"configurable": {"thread_id": whatsapp_id}}
+    job = {"whatsapp_id": whatsapp_id,
+           "messages": [HumanMessage(content="Quero ser sócio"), AIMessage(content="Bora, Dogão!")]}
+
+    async def run():
+        graph = agent.get_dogao_agent()
+
+        async def turn():
+            # Como a camada de entrada: o turno inteiro no lock, checkpoint salvo só no fim
+            async with agent.turn_lock(whatsapp_id):
+                inputs = {"messages": [HumanMessage(content="Quanto custa o Maringá Paixão?")], "whatsapp_id": whatsapp_id}
+                await graph.ainvoke(inputs, config, durability="exit")
+
+        turn_task = asyncio.create_task(turn())
+        await asyncio.sleep(0)
+        # Extração do lead terminando no meio do turno (intenção de compra detectada)
+        await agent.classify_and_track(job)
+        await turn_task
+        await agent.get_lead_tracker().close()
+        return (await graph.aget_state(config)).values
+
+    state = asyncio.run(run())
+    assert state["intent_is_sale"] is True
+    assert any(m.content == "Quanto custa o Maringá Paixão?" for m in state["messages"])
+
+
+
+def test_workers_sharing_one_outbox_do_not_clobber_each_other(tmp_path):
+    supabase = FakeSupabase(latency=0)
+
+    async def get_client():
+        return supabase
+
+    async def process(job):
+        return lead(job)
+
+    path = str(tmp_path / "outbox.sqlite")
+    a = LeadTracker(process, get_client, LeadOutbox(path), flush_interval=60)
+    b = LeadTracker(process, get_client, LeadOutbox(path), flush_interval=60)
+
+    async def run():
+        # Turnos seguidos do mesmo torcedor caem em workers diferentes
+        await a._buffer("5544", lead({"whatsapp_id": "5544", "nome": "Ana"}))
+        await b._buffer("5544", lead({"whatsapp_id": "5544", "nome": "Ana Paula"}))
+        await a._buffer("5511", lead({"whatsapp_id": "5511", "nome": "Bruno"}))
+        # O A sobe primeiro: a linha velha do 5544 não vai nem apaga a do B
+        assert await a.flush()
+        assert [r["nome_torcedor"] for r in supabase.tables["leads_sdr"]] == ["Bruno"]
+        assert LeadOutbox(path).load()["5544"][0]["nome_torcedor"] == "Ana Paula"
+        assert await b.flush()
+
+    asyncio.run(run())
+    rows = {r["whatsapp_id"]: r["nome_torcedor"] for r in supabase.tables["leads_sdr"]}
+    assert rows == {"5544": "Ana Paula", "5511": "Bruno"}
+    assert LeadOutbox(path).load() == {}
+
+
+def test_rows_of_a_dead_worker_are_adopted(tmp_path):
+    path = str(tmp_path / "outbox.sqlite")
+    crashed = LeadOutbox(path)
+    crashed.save("5544", {"whatsapp_id": "5544", "nome_torcedor": "Ana"}, "00000000000000000001-aaaaaaaa")
+
+    # Um worker vivo não adota a linha de outro que ainda dá sinal de vida
+    assert LeadOutbox(path).claim() == {}
+    adopter = LeadOutbox(path, orphan_after=0)
+    assert list(adopter.claim()) == ["5544"]
+    # Nem uma gravação com versão mais velha substitui a atual
+    assert not crashed.save("5544", {"whatsapp_id": "5544"}, "00000000000000000000-bbbbbbbb")
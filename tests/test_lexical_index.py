@@ -0,0 +1,76 @@
+"""
+Testa o índice BM25 (normalização em português, persistência incremental) e o RRF.
+
+Roda com: python -m pytest tests/test_lexical_index.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+DOCS = [
+    {"id": 1, "conteudo": "O plano Maringá Paixão custa R$ 29,90 por mês.", "fonte_url": "/socio"},
+    {"id": 2, "conteudo": "Sócios têm prioridade na compra de ingressos.", "fonte_url": "/socio"},
+    {"id": 3, "conteudo": "Maringá FC x Londrina no Willie Davids, domingo às 16h.", "fonte_url": "/jogos"},
+    {"id": 4, "conteudo": "Camisas oficiais na loja com desconto para sócio.", "fonte_url": "/loja"},
+]
+
+
+def test_tokenize_folds_accents_and_stems():
+    assert tokenize("Sócios") == tokenize("socio")
+    assert tokenize("Paixão") == tokenize("paixao")
+    assert tokenize("camisas") == tokenize("Camisa")
+    assert "de" not in tokenize("compra de ingressos")
+
+
+def test_search_ranks_exact_terms(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    assert index.add(DOCS) == 4
+    assert [d["id"] for d in index.search("jogo contra o Londrina", 2)] == [3]
+    assert index.search("quanto custa o maringa paixao")[0]["id"] == 1
+    assert index.search("xyz") == []
+
+
+def test_incremental_persistence_and_tombstones(tmp_path):
+    writer = LexicalIndex(str(tmp_path))
+    writer.add(DOCS[:2])
+    reader = LexicalIndex(str(tmp_path))
+    assert len(reader) == 2
+
+    # A "ingestão" acrescenta e apaga; o leitor enxerga sem recarregar tudo
+    writer.add(DOCS)
+    writer.remove([1])
+    assert len(writer) == 3
+    assert [d["id"] for d in reader.search("Londrina")] == [3]
+    assert all(d["id"] != 1 for d in reader.search("Maringá Paixão"))
+
+    writer.remove([2])
+    assert writer.compact(min_deleted_ratio=0.25)
+    assert len(LexicalIndex(str(tmp_path)).rows) == 2
+    assert [d["id"] for d in reader.search("Londrina")] == [3]
+
+
+def test_refresh_reconciles_rows_deleted_by_another_host(tmp_path):
+    from tests.fakes import FakeSupabase
+
+    # Índice do host da API: só enxerga o Supabase (a ingestão apagou em outro host)
+    supabase = FakeSupabase(latency=0)
+    supabase.tables["conhecimento_clube"] = [dict(d) for d in DOCS]
+    index = LexicalIndex(str(tmp_path))
+    assert asyncio.run(index.arefresh(supabase)) == 4
+    supabase.tables["conhecimento_clube"] = [d for d in supabase.tables["conhecimento_clube"] if d["id"] != 3]
+    assert asyncio.run(index.arefresh(supabase)) == 0
+    assert len(index) == 3 and index.search("Londrina") == []
+    # O tombstone vai para o disco: outro processo com o mesmo diretório também enxerga
+    assert len(LexicalIndex(str(tmp_path))) == 3
+
+
+def test_reciprocal_rank_fusion_merges_fields():
+    vetor = [{"conteudo": "a", "similarity": 0.7}, {"conteudo": "b", "similarity": 0.6}]
+    bm25 = [{"id": 2, "conteudo": "b", "bm25": 3.1}, {"id": 9, "conteudo": "c", "bm25": 1.0}]
+    fused = reciprocal_rank_fusion([vetor, bm25], k=60)
+    assert [d["conteudo"] for d in fused] == ["b", "a", "c"]
+    assert fused[0]["similarity"] == 0.6 and fused[0]["bm25"] == 3.1
+    assert fused[2].get("similarity") is None
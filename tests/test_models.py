@@ -0,0 +1,58 @@
+"""
+Testa o registro de modelos por papel (configuração por env, fallback e
+métricas por papel) com modelos falsos.
+
+Roda com: python -m pytest tests/test_models.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.instrumentation import llm_by_role, setup_instrumentation
+from src.models import DEFAULT_SPECS, ModelRegistry, ModelSpec, load_specs
+from tests.fakes import FakeChatModel
+
+
+class TimingOutModel(FakeChatModel):
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        raise TimeoutError("Request timed out.")
+
+
+def test_env_overrides_defaults(monkeypatch):
+    monkeypatch.setenv("MODEL_GRADER", "gpt-4.1-mini")
+    monkeypatch.setenv("MODEL_GRADER_TIMEOUT", "3")
+    monkeypatch.setenv("MODEL_ROUTER_FALLBACKS", "")
+    specs = load_specs()
+    assert specs["grader"].model == "gpt-4.1-mini" and specs["grader"].timeout == 3
+    assert specs["router"].fallbacks == ()
+    # Só o que o torcedor lê usa o modelo grande
+    assert {r for r, s in DEFAULT_SPECS.items() if s.model == "gpt-4o"} == {"router", "answer"}
+
+
+def test_fallback_on_timeout_and_clients_are_reused():
+    def factory(spec, model):
+        if model == "lento":
+            return TimingOutModel(model_name=model, latency=0)
+        return FakeChatModel(model_name=model, latency=0)
+
+    registry = ModelRegistry({"rewrite": ModelSpec("lento", fallbacks=("rapido",))}, factory)
+    response = asyncio.run(registry.chain("rewrite").ainvoke("reescreva"))
+    assert response.content
+    primary, fallback = registry.model("rewrite"), registry._client("rewrite", "rapido")
+    assert primary.calls == 1 and fallback.calls == 1
+
+    asyncio.run(registry.chain("rewrite").ainvoke("de novo"))
+    assert len(registry.clients()) == 2 and primary.calls == 2
+
+
+def test_role_is_reported_to_instrumentation():
+    os.environ.setdefault("TRACE_LOG_PATH", "")
+    setup_instrumentation()
+    registry = ModelRegistry({"summary": ModelSpec("gpt-4o-mini")},
+                             lambda spec, model: FakeChatModel(model_name=model, latency=0))
+    before = llm_by_role().get("summary", {}).get("chamadas", 0)
+    asyncio.run(registry.chain("summary").ainvoke("resuma"))
+    after = llm_by_role()["summary"]
+    assert after["chamadas"] == before + 1 and after["custo_usd"] > 0
@@ -0,0 +1,79 @@
+"""
+Testa o limitador de RPM/TPM da OpenAI (ritmo das requisições, saldo de
+tokens acertado pelo usage, pausa após 429) com modelos falsos.
+
+Roda com: python -m pytest tests/test_rate_limiter.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.models import ModelRegistry, ModelSpec
+from src.rate_limiter import RateLimitCallback, TokenBucketLimiter
+from tests.fakes import FakeChatModel
+
+
+class RateLimitedModel(FakeChatModel):
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        error = RuntimeError("Rate limit reached for gpt-4o")
+        error.status_code = 429
+        raise error
+
+
+def test_requests_per_minute_paces_a_burst():
+    limiter = TokenBucketLimiter(rpm=600)  # 10 por segundo
+    limiter.requests.level = 2
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(*(limiter.acquire() for _ in range(4)))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    # 2 saem na hora, as outras 2 esperam ~0.1s cada
+    assert 0.15 <= elapsed < 0.6
+    assert limiter.stats["esperas"] == 2
+
+
+def test_token_debt_is_settled_with_real_usage():
+    limiter = TokenBucketLimiter(tpm=6000)  # 100 tokens por segundo
+    limiter.tokens.level = 50
+
+    async def run():
+        await limiter.acquire(30)
+        # Resposta consumiu bem mais que o estimado: o saldo fica negativo
+        limiter.settle(30, 200)
+        started = time.perf_counter()
+        await limiter.acquire(10)
+        return time.perf_counter() - started
+
+    waited = asyncio.run(run())
+    assert waited >= 1.4  # ~150 tokens de dívida a 100/s
+    assert limiter.stats["tokens"] == 200
+
+
+def test_registry_calls_go_through_the_limiter_and_429_pauses():
+    limiter = TokenBucketLimiter(rpm=6000, tpm=600000, backoff=0.3)
+
+    def factory(spec, model):
+        if model == "lotado":
+            return RateLimitedModel(model_name=model, latency=0)
+        return FakeChatModel(model_name=model, latency=0)
+
+    registry = ModelRegistry({"answer": ModelSpec("lotado", fallbacks=("reserva",))}, factory,
+                             callbacks=[RateLimitCallback(limiter)])
+
+    async def run():
+        await registry.chain("answer").ainvoke("Quanto custa o sócio?")
+        started = time.perf_counter()
+        await registry.chain("answer").ainvoke("E o ingresso?")
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    # Principal + fallback a cada turno; depois do 429 todos esperam o backoff
+    assert limiter.stats["chamadas"] == 4 and limiter.stats["rate_limit_429"] == 2
+    assert elapsed >= 0.25
+    assert limiter.stats["tokens"] > 0
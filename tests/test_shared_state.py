@@ -0,0 +1,186 @@
+"""
+Testa o estado compartilhado entre workers (TTL, leases) e quem depende dele:
+checkpointer, locks de sessão do ingress, cache da loja e o cliente do Tavily
+pelo pool HTTP. Dois "workers" = duas instâncias sobre o mesmo arquivo SQLite.
+
+Roda com: python -m pytest tests/test_shared_state.py
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+import httpx
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.checkpoint import ConversationCheckpointer, SQLiteCheckpointStore
+from src.ingress import ConversationIngress
+from src.shared_state import MemorySharedState, SQLiteSharedState
+from src.store_search import StoreSearchCache, TavilySearchClient
+
+
+def test_values_expire_in_memory_and_sqlite():
+    with tempfile.TemporaryDirectory() as path:
+        for state in (MemorySharedState(), SQLiteSharedState(os.path.join(path, "estado.sqlite"))):
+            async def run():
+                await state.set("a", "1", ttl=0.05)
+                await state.set("b", "2")
+                first = await state.get("a"), await state.get("b")
+                await asyncio.sleep(0.06)
+                await state.delete("b")
+                return first, (await state.get("a"), await state.get("b"))
+
+            assert asyncio.run(run()) == (("1", "2"), (None, None))
+
+
+def test_lease_lock_is_exclusive_across_workers_and_expires():
+    with tempfile.TemporaryDirectory() as path:
+        file = os.path.join(path, "estado.sqlite")
+        workers = [SQLiteSharedState(file), SQLiteSharedState(file)]
+        running, peak = [0], [0]
+
+        async def turn(state):
+            async with state.lock("turno:5544", ttl=5):
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                await asyncio.sleep(0.03)
+                running[0] -= 1
+
+        async def run():
+            await asyncio.gather(*(turn(workers[i % 2]) for i in range(4)))
+            # Worker que morreu segurando o lease: expira sozinho
+            assert workers[0]._try_lock("lock:turno:99", "morto", ttl=0.05)
+            await asyncio.sleep(0.06)
+            async with workers[1].lock("turno:99", ttl=5):
+                return True
+
+        assert asyncio.run(run())
+        assert peak[0] == 1
+
+
+def test_lease_is_renewed_while_the_turn_runs():
+    with tempfile.TemporaryDirectory() as path:
+        file = os.path.join(path, "estado.sqlite")
+        owner, other = SQLiteSharedState(file), SQLiteSharedState(file)
+        events = []
+
+        async def long_turn():
+            async with owner.lock("turno:5544", ttl=0.1):
+                events.append("início")
+                # Turno três vezes mais longo que o ttl do lease
+                await asyncio.sleep(0.3)
+                events.append("fim")
+
+        async def competing_turn():
+            await asyncio.sleep(0.02)
+            async with other.lock("turno:5544", ttl=0.1):
+                events.append("outro")
+
+        async def run():
+            await asyncio.gather(long_turn(), competing_turn())
+
+        asyncio.run(run())
+        assert events == ["início", "fim", "outro"]
+
+
+def test_checkpointer_hot_layer_follows_other_worker():
+    from langgraph.checkpoint.base import empty_checkpoint
+
+    with tempfile.TemporaryDirectory() as path:
+        versions = SQLiteSharedState(os.path.join(path, "estado.sqlite"))
+        store = SQLiteCheckpointStore(os.path.join(path, "checkpoints.sqlite"))
+        a = ConversationCheckpointer(store, versions=versions)
+        b = ConversationCheckpointer(store, versions=versions)
+        config = {"configurable": {"thread_id": "5544", "checkpoint_ns": ""}}
+
+        def checkpoint(nome):
+            data = empty_checkpoint()
+            data["channel_values"] = {"nome": nome}
+            return data
+
+        async def run():
+            await a.aput(config, checkpoint("Ana"), {}, {})
+            assert (await b.aget_tuple(config)).checkpoint["channel_values"]["nome"] == "Ana"
+            # Próximo turno roda no worker B; o A não pode responder com o estado velho da memória
+            await b.aput(config, checkpoint("Ana Paula"), {}, {})
+            return (await a.aget_tuple(config)).checkpoint["channel_values"]["nome"]
+
+        assert asyncio.run(run()) == "Ana Paula"
+
+
+def test_ingress_serializes_same_user_across_workers():
+    with tempfile.TemporaryDirectory() as path:
+        file = os.path.join(path, "estado.sqlite")
+        running, peak, calls = [0], [0], []
+
+        async def turn(whatsapp_id, messages):
+            calls.append(messages)
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.05)
+            running[0] -= 1
+            return {"response": "ok"}
+
+        workers = [
+            ConversationIngress(turn, window=0, max_wait=0,
+                                lock=lambda w, s=SQLiteSharedState(file): s.lock(f"turno:{w}", 5))
+            for _ in range(2)
+        ]
+
+        async def run():
+            await asyncio.gather(workers[0].submit("5544", "Oi"), workers[1].submit("5544", "Quanto custa?"))
+
+        asyncio.run(run())
+        assert len(calls) == 2 and peak[0] == 1
+
+
+def test_store_search_reuses_other_worker_result():
+    calls = []
+
+    async def fetch(query):
+        calls.append(query)
+        return [{"url": "https://store.maringafc.com/camisa", "content": query}]
+
+    shared = MemorySharedState()
+    a, b = StoreSearchCache(fetch, shared=shared), StoreSearchCache(fetch, shared=shared)
+
+    async def run():
+        return await a.get("Camisa oficial"), await b.get("camisa  oficial")
+
+    first, second = asyncio.run(run())
+    assert first == second and calls == ["Camisa oficial"]
+    assert b.stats["compartilhados"] == 1
+
+
+def test_tavily_client_uses_the_process_pool():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"results": [
+            {"url": "https://store.maringafc.com/camisa", "content": "Camisa oficial", "score": 0.9}]})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    tavily = TavilySearchClient(lambda: client, api_key="tvly-fake", include_domains=["store.maringafc.com"])
+
+    async def run():
+        try:
+            return await tavily.ainvoke("camisa"), await tavily.ainvoke("boné")
+        finally:
+            await client.aclose()
+
+    results = asyncio.run(run())
+    assert results[0] == [{"url": "https://store.maringafc.com/camisa", "content": "Camisa oficial"}]
+    assert len(requests) == 2 and requests[0].headers["authorization"] == "Bearer tvly-fake"
+
+
+def test_importing_the_api_opens_no_files():
+    # Estado compartilhado, outbox de leads e log de traces só abrem no primeiro uso
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    env = {k: v for k, v in os.environ.items() if k not in ("TRACE_LOG_PATH", "LEAD_OUTBOX_PATH")}
+    env.update({"SHARED_STATE_BACKEND": "sqlite", "CHECKPOINT_BACKEND": "memory", "OPENAI_API_KEY": "sk-fake"})
+    with tempfile.TemporaryDirectory() as path:
+        subprocess.run([sys.executable, "-c", "import sys; sys.path.append(sys.argv[1]); import src.main", root],
+                       cwd=path, env=env, check=True)
+        assert os.listdir(path) == []
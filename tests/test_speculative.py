@@ -0,0 +1,110 @@
+"""
+Testa a busca especulativa (reaproveitada quando o router pede a mesma query,
+descartada quando não pede) e as tools em paralelo com limite de tempo no
+grafo, com LLM, Embeddings, Supabase e Tavily falsos.
+
+Roda com: python -m pytest tests/test_speculative.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+from langchain_core.messages import HumanMessage, ToolMessage
+
+from src.speculative import SpeculativeRetrieval
+
+
+def test_reused_for_same_query_and_discarded_otherwise():
+    started = []
+
+    async def retrieve(query):
+        started.append(query)
+        await asyncio.sleep(0.01)
+        return f"docs de {query}", []
+
+    speculative = SpeculativeRetrieval(retrieve)
+
+    async def run():
+        speculative.start("5544", "Quanto custa o  Sócio?")
+        speculative.keep_if_requested("5544", ["quanto custa o sócio?"])
+        reused = await speculative.take("5544", "quanto custa o sócio?")
+        speculative.start("5545", "Quanto custa o sócio?")
+        speculative.keep_if_requested("5545", ["preço plano maringá paixão"])
+        missed = await speculative.take("5545", "preço plano maringá paixão")
+        return reused, missed
+
+    reused, missed = asyncio.run(run())
+    assert reused == ("docs de Quanto custa o  Sócio?", []) and missed is None
+    assert speculative.stats == {"iniciadas": 2, "reaproveitadas": 1, "descartadas": 1, "falhas": 0}
+
+
+def install_fakes(monkeypatch, latency, tavily_latency=0.0):
+    from src import agent
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase, FakeTavily
+
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: FakeChatModel(model_name=model, latency=latency))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", FakeEmbeddings(latency=latency / 2))
+    monkeypatch.setattr(agent, "_supabase", FakeSupabase(latency=latency / 2))
+    monkeypatch.setattr(agent, "_tavily", FakeTavily(latency=tavily_latency))
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(agent, "STORE_LOCAL_FIRST", False)
+    monkeypatch.setattr(agent.store_search_cache, "_entries", OrderedDict())
+    return agent
+
+
+def run_turns(agent, questions):
+    async def run():
+        latencies, states = [], []
+        for question in questions:
+            whatsapp_id = f"55448{uuid.uuid4().hex[:8]}"
+            config = {"configurable": {"thread_id": whatsapp_id}}
+            inputs = {"messages": [HumanMessage(content=question, id=str(uuid.uuid4()))], "whatsapp_id": whatsapp_id}
+            started = time.perf_counter()
+            states.append(await agent.get_dogao_agent().ainvoke(inputs, config, durability="exit"))
+            latencies.append(time.perf_counter() - started)
+        await agent.get_lead_tracker().close()
+        return latencies, states
+
+    return asyncio.run(run())
+
+
+def test_speculation_hides_retrieval_behind_the_router(monkeypatch):
+    agent = install_fakes(monkeypatch, latency=0.1)
+    questions = ["Quais os benefícios do sócio?"] * 3
+
+    monkeypatch.setattr(agent, "SPECULATIVE_RETRIEVAL", False)
+    serial, _ = run_turns(agent, questions)
+    monkeypatch.setattr(agent, "SPECULATIVE_RETRIEVAL", True)
+    before = agent.speculative.stats["reaproveitadas"]
+    speculative, states = run_turns(agent, questions)
+
+    assert agent.speculative.stats["reaproveitadas"] - before == 3
+    # Embedding + match_documents (~0.1s) rodaram durante o router
+    assert min(serial) - min(speculative) >= 0.06
+    assert states[-1]["messages"][-1].content
+
+
+def test_parallel_tools_are_graded_together_and_time_out(monkeypatch):
+    agent = install_fakes(monkeypatch, latency=0, tavily_latency=0.5)
+    monkeypatch.setattr(agent, "TOOL_TIMEOUT_SECONDS", 0.1)
+
+    latencies, states = run_turns(agent, ["Sócio tem desconto na camisa nova?"])
+    tool_msgs = [m for m in states[0]["messages"] if isinstance(m, ToolMessage)]
+    assert sorted(m.name for m in tool_msgs) == ["retrieve_docs", "search_store"]
+    # A loja estourou o tempo, mas o contexto do sócio seguiu para a resposta
+    assert "tempo esgotado" in next(m.content for m in tool_msgs if m.name == "search_store")
+    assert states[0]["context"] and "tempo esgotado" in states[0]["context"]
+    assert latencies[0] < 0.45
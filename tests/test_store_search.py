@@ -0,0 +1,78 @@
+"""
+Testa o cache da busca na loja (TTL, stale-while-revalidate e coalescência).
+
+Roda com: python -m pytest tests/test_store_search.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.store_search import StoreSearchCache
+
+
+class FakeTavily:
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.calls = 0
+        self.fail = False
+
+    async def __call__(self, query):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError("Tavily fora do ar")
+        return [{"url": "https://store.maringafc.com/camisa", "content": f"{query} v{self.calls}"}]
+
+
+def test_concurrent_identical_queries_are_coalesced():
+    tavily = FakeTavily()
+    cache = StoreSearchCache(tavily)
+
+    async def run():
+        return await asyncio.gather(*(cache.get(q) for q in
+                                      ["Camisa oficial", "camisa  OFICIAL", "camisa oficial", "boné"]))
+
+    results = asyncio.run(run())
+    assert tavily.calls == 2
+    assert results[0] == results[1] == results[2]
+    assert cache.stats["coalescidas"] == 2
+
+    asyncio.run(cache.get("CAMISA oficial"))
+    assert tavily.calls == 2 and cache.stats["acertos"] == 1
+
+
+def test_stale_while_revalidate_and_stale_on_error():
+    tavily = FakeTavily()
+    cache = StoreSearchCache(tavily, ttl=0.01, stale_ttl=60)
+
+    async def run():
+        first = await cache.get("camisa")
+        await asyncio.sleep(0.02)
+        stale = await cache.get("camisa")  # responde o velho e revalida em background
+        await asyncio.sleep(0.05)
+        fresh = await cache.get("camisa")
+
+        await asyncio.sleep(0.02)
+        tavily.fail = True
+        kept = await cache.get("camisa")
+        await asyncio.sleep(0.05)
+        return first, stale, fresh, kept
+
+    first, stale, fresh, kept = asyncio.run(run())
+    assert stale == first
+    assert fresh != first and tavily.calls == 3
+    assert kept == fresh and cache.stats["erros"] == 1
+
+
+def test_expired_entry_blocks_on_new_fetch():
+    tavily = FakeTavily()
+    cache = StoreSearchCache(tavily, ttl=0.01, stale_ttl=0.01)
+
+    async def run():
+        first = await cache.get("camisa")
+        await asyncio.sleep(0.03)
+        return first, await cache.get("camisa")
+
+    first, second = asyncio.run(run())
+    assert first != second and cache.stats["faltas"] == 2
@@ -0,0 +1,160 @@
+"""
+Testa o resumo incremental por orçamento de tokens (corte por turno, resumo
+rolante, segundo plano) e o tamanho do histórico numa conversa longa no grafo.
+
+Roda com: python -m pytest tests/test_summarizer.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LEAD_OUTBOX_PATH", ":memory:")
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("LEXICAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "dogao_bench_lexical"))
+os.environ.setdefault("CLUB_FACTS_PATH", os.path.join(tempfile.gettempdir(), "dogao_bench_club_facts.sqlite"))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from src.summarizer import ConversationSummarizer, history_tokens, split_history
+
+
+def turn(i, tool=True):
+    msgs = [HumanMessage(content=f"pergunta {i} " * 10, id=f"h{i}")]
+    if tool:
+        msgs.append(AIMessage(content="", id=f"c{i}",
+                              tool_calls=[{"name": "retrieve_docs", "args": {"query": "x"}, "id": f"t{i}"}]))
+        msgs.append(ToolMessage(content="trecho " * 60, tool_call_id=f"t{i}", id=f"r{i}"))
+    msgs.append(AIMessage(content=f"resposta {i} " * 10, id=f"a{i}"))
+    return msgs
+
+
+class FakeSummaries:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, previous, transcript):
+        self.calls.append((previous, transcript))
+        return f"{previous} | {transcript.count('Torcedor:')} turnos".strip(" |")
+
+
+def test_split_cuts_only_at_turn_boundaries():
+    messages = turn(1) + turn(2) + turn(3, tool=False)
+    cut = split_history(messages, keep_tokens=history_tokens(turn(3, tool=False)) + 5)
+    assert isinstance(messages[cut], HumanMessage) and messages[cut].id == "h3"
+    # Nada a tirar quando cabe; o último turno sempre fica
+    assert split_history(messages, keep_tokens=10_000) == 0
+    assert messages[split_history(messages, keep_tokens=1)].id == "h3"
+
+
+def test_compact_is_incremental():
+    summaries = FakeSummaries()
+    summarizer = ConversationSummarizer(summaries, apply=None, budget=100, keep=60)
+    messages = turn(1) + turn(2, tool=False)
+    summary, evicted = asyncio.run(summarizer.compact("nome: Ana", messages))
+    assert [m.id for m in evicted] == ["h1", "c1", "r1", "a1"]
+    previous, transcript = summaries.calls[0]
+    # Só as mensagens que saíram, sem o conteúdo das tools
+    assert previous == "nome: Ana" and "pergunta 1" in transcript
+    assert "pergunta 2" not in transcript and "trecho" not in transcript
+    assert summary == "nome: Ana | 1 turnos"
+
+
+def test_background_summaries_are_coalesced_and_stale_ones_dropped():
+    applied = []
+
+    async def apply(whatsapp_id, previous, summary, ids):
+        applied.append((whatsapp_id, ids))
+        return previous == ""
+
+    summarizer = ConversationSummarizer(FakeSummaries(), apply, budget=100, keep=60)
+    messages = turn(1) + turn(2)
+
+    async def run():
+        summarizer.schedule("5544", "", messages)
+        summarizer.schedule("5544", "", messages)  # já em andamento: ignorado
+        summarizer.schedule("5545", "resumo velho", messages)
+        await summarizer.close()
+
+    asyncio.run(run())
+    assert sorted(w for w, _ in applied) == ["5544", "5545"]
+    assert summarizer.stats["resumos_segundo_plano"] == 1 and summarizer.stats["descartados"] == 1
+
+
+def test_long_conversation_history_stays_bounded(monkeypatch):
+    from src import agent
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: FakeChatModel(model_name=model, latency=0))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", FakeEmbeddings(latency=0))
+    monkeypatch.setattr(agent, "_supabase", FakeSupabase(latency=0))
+    # Sem cache de respostas: todo turno passa pela busca e aumenta o histórico
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(agent.summarizer, "budget", 400)
+    monkeypatch.setattr(agent.summarizer, "keep", 200)
+    monkeypatch.setattr(agent.summarizer, "hard_limit", 800)
+
+    whatsapp_id = f"55440{uuid.uuid4().hex[:8]}"
+    config = {"configurable": {"thread_id": whatsapp_id}}
+    perguntas = ["Quanto custa o Maringá Paixão?", "Quando é o próximo jogo?", "Quais os benefícios do sócio?"]
+
+    async def run():
+        sizes = []
+        for i in range(15):
+            inputs = {"messages": [HumanMessage(content=perguntas[i % 3], id=str(uuid.uuid4()))],
+                      "whatsapp_id": whatsapp_id}
+            await agent.get_dogao_agent().ainvoke(inputs, config, durability="exit")
+            await agent.summarizer.close()
+            state = (await agent.get_dogao_agent().aget_state(config)).values
+            sizes.append(history_tokens(state["messages"]))
+        await agent.get_lead_tracker().close()
+        return sizes, state
+
+    sizes, state = asyncio.run(run())
+    assert state["resumo"]
+    assert max(sizes[5:]) <= agent.summarizer.budget
+    # Sem ToolMessage órfã no início do histórico
+    assert isinstance(state["messages"][0], HumanMessage)
+
+
+def test_background_summary_is_not_lost_to_a_concurrent_turn(monkeypatch):
+    from src import agent
+    from tests.fakes import FakeChatModel, FakeEmbeddings, FakeSupabase
+
+    monkeypatch.setattr(agent.models, "factory", lambda spec, model: FakeChatModel(model_name=model, latency=0.05))
+    monkeypatch.setattr(agent.models, "_clients", {})
+    monkeypatch.setattr(agent, "_embeddings", FakeEmbeddings(latency=0))
+    monkeypatch.setattr(agent, "_supabase", FakeSupabase(latency=0))
+    monkeypatch.setattr(agent, "ANSWER_CACHE_ENABLED", False)
+    whatsapp_id = f"55445{uuid.uuid4().hex[:8]}"
+    config = {"configurable": {"thread_id": whatsapp_id}}
+    old = turn(0) + turn(1)
+
+    async def run():
+        graph = agent.get_dogao_agent()
+        await graph.aupdate_state(config, {"messages": old, "whatsapp_id": whatsapp_id}, as_node="tracker")
+
+        async def live_turn():
+            # Como a camada de entrada: o turno inteiro no lock, checkpoint salvo só no fim
+            async with agent.turn_lock(whatsapp_id):
+                inputs = {"messages": [HumanMessage(content="Quanto custa o Maringá Paixão?", id="h9")],
+                          "whatsapp_id": whatsapp_id}
+                await graph.ainvoke(inputs, config, durability="exit")
+
+        turn_task = asyncio.create_task(live_turn())
+        await asyncio.sleep(0)
+        # Resumo em segundo plano ficando pronto no meio do turno
+        applied = await agent.apply_summary(whatsapp_id, "", "RESUMO: quer ser sócio", [m.id for m in turn(0)])
+        await turn_task
+        await agent.get_lead_tracker().close()
+        return applied, (await graph.aget_state(config)).values
+
+    applied, state = asyncio.run(run())
+    ids = [m.id for m in state["messages"]]
+    assert applied and state["resumo"] == "RESUMO: quer ser sócio"
+    assert "h0" not in ids and "h1" in ids and "h9" in ids
@@ -0,0 +1,88 @@
+"""
+Testa o índice vetorial local (memmap append-only, tombstones, top-k por cosseno)
+e o refresh a partir do Supabase sem depender de um Postgres de verdade.
+
+Roda com: python -m pytest tests/test_vector_index.py
+"""
+import asyncio
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.vector_index import LocalVectorIndex
+from tests.fakes import FakeSupabase
+
+DOCS = [
+    {"id": 1, "conteudo": "plano", "fonte_url": "/socio", "embedding": [1.0, 0.0, 0.0]},
+    {"id": 2, "conteudo": "jogo", "fonte_url": "/jogos", "embedding": [0.0, 1.0, 0.0]},
+    # Vetor como o PostgREST devolve (texto) e sem normalizar
+    {"id": 3, "conteudo": "plano e jogo", "fonte_url": "/socio", "embedding": "[3.0, 3.0, 0.0]"},
+]
+
+
+def test_refresh_reconciles_rows_deleted_by_another_host(tmp_path):
+    supabase = FakeSupabase(latency=0)
+    supabase.tables["conhecimento_clube"] = [dict(d) for d in DOCS]
+    index = LocalVectorIndex(str(tmp_path))
+    assert asyncio.run(index.arefresh(supabase)) == 3
+
+    # A ingestão (em outro host) apagou o chunk 1 do Supabase
+    supabase.tables["conhecimento_clube"] = [d for d in supabase.tables["conhecimento_clube"] if d["id"] != 1]
+    assert asyncio.run(index.arefresh(supabase)) == 0
+    assert len(index) == 2
+    assert [d["id"] for d in index.search([1.0, 0.0, 0.0], 3, 0.0)] == [3]
+    assert len(LocalVectorIndex(str(tmp_path))) == 2
+
+
+def test_append_only_memmap_survives_reopen_and_partial_write(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    assert index.add(DOCS[:2]) == 2
+    assert index.add(DOCS) == 1  # ids já indexados são ignorados
+    assert index.add([{"conteudo": "sem id", "embedding": [1.0, 0.0, 0.0]}]) == 0
+
+    # Linhas gravadas já normalizadas, na ordem dos ids
+    vectors = np.fromfile(tmp_path / "vectors.f32", dtype=np.float32).reshape(-1, 3)
+    assert vectors.shape == (3, 3) and np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert np.allclose(vectors[2], [2 ** -0.5, 2 ** -0.5, 0.0])
+
+    # Processo interrompido depois dos metadados de uma linha mas antes do vetor completo
+    with open(tmp_path / "rows.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"id": 4, "conteudo": "cortado", "fonte_url": "/x"}\n')
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.float32(1.0).tobytes())
+
+    reopened = LocalVectorIndex(str(tmp_path))
+    assert [r["id"] for r in reopened.rows] == [1, 2, 3] and reopened.max_id == 3 and reopened.dim == 3
+    assert reopened.search([0.0, 1.0, 0.0], 1, 0.0)[0]["conteudo"] == "jogo"
+
+
+def test_tombstones_hide_rows_and_are_shared_on_disk(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.add(DOCS)
+    other = LocalVectorIndex(str(tmp_path))
+
+    assert index.remove([3, "3"]) == 1 and index.remove([3]) == 0
+    assert len(index) == 2
+    # A linha mais parecida está apagada: não volta nem com match_count sobrando
+    assert [d["id"] for d in index.search([1.0, 1.0, 0.0], 3, 0.0)] == [1, 2]
+
+    # Outro processo lê os tombstones do disco antes de reconciliar
+    assert other.reconcile({1, 3}) == 1
+    assert len(other) == 1 and sorted(other.deleted) == [2, 3]
+    assert [d["id"] for d in LocalVectorIndex(str(tmp_path)).search([1.0, 1.0, 0.0], 3, 0.0)] == [1]
+
+
+def test_search_returns_top_k_by_cosine(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    assert index.search([1.0, 0.0, 0.0]) == []
+    index.add(DOCS + [{"id": 4, "conteudo": "quase plano", "fonte_url": "/socio", "embedding": [0.9, 0.1, 0.0]}])
+
+    results = index.search([2.0, 0.0, 0.0], match_count=3, match_threshold=0.0)
+    assert [d["id"] for d in results] == [1, 4, 3]
+    assert results[0]["similarity"] == 1.0 and results[2]["similarity"] > 0.7
+    assert set(results[0]) == {"id", "conteudo", "fonte_url", "similarity"}
+    # Limiar corta o que está abaixo; match_count maior que o índice não quebra
+    assert [d["id"] for d in index.search([1.0, 0.0, 0.0], match_count=10, match_threshold=0.8)] == [1, 4]
+    assert [d["id"] for d in index.search([0.0, 0.0, 1.0], match_count=10, match_threshold=0.5)] == []